@@ -78,6 +78,30 @@ log_warn()
   fi
 }
 
+run_corellium_client()
+{
+  # Query the REST API through the pooled Python client instead of the corellium CLI and jq
+  check_env_vars
+  PYTHONPATH="src/util${PYTHONPATH:+:${PYTHONPATH}}" python3 -m corellium_client "$@"
+}
+
+metrics_phase()
+{
+  # Append a phase start or end to the run_metrics.py events file, doing nothing unless RUN_METRICS_EVENTS is set
+  local EVENT="${1:?}"
+  local PHASE="${2:?}"
+  local STATUS="${3:-}"
+  [ -z "${RUN_METRICS_EVENTS:-}" ] && return 0
+  [ "${EVENT}" = 'end' ] && STATUS="${STATUS:-ok}"
+  local TIMESTAMP="${EPOCHREALTIME:-$(date +%s)}"
+  local RUN_ID="${RUN_METRICS_RUN_ID:-}"
+  if [ -z "${RUN_ID}" ]; then
+    RUN_ID="$(printf '%s\n' "${GITHUB_RUN_ID:-}" "${GITHUB_RUN_ATTEMPT:-}" "${GITHUB_JOB:-}" | sed '/^$/d' | paste -sd '-' -)"
+  fi
+  printf '%s\t%s\t%s\t%s\t%s\n' "${TIMESTAMP/,/.}" "${RUN_ID:-local}" "${PHASE}" "${EVENT}" "${STATUS}" \
+    >> "${RUN_METRICS_EVENTS}"
+}
+
 does_instance_exist()
 {
   local INSTANCE_ID="${1:?}"
@@ -128,20 +152,87 @@ wait_until_available_cores()
 {
   local PROJECT_ID="${1:?}"
   local REQUIRED_CORES="${2:-6}"
-  local WAIT_CORES_SLEEP_TIME_SECONDS='15'
   [ -z "${PROJECT_ID}" ] && {
     log_error 'Project ID must be set.'
     exit 1
   }
   log_info "Waiting until ${REQUIRED_CORES} CPU cores are available."
-  local AVAILABLE_CORES
-  AVAILABLE_CORES="$(get_available_cores "${PROJECT_ID}")"
-  while [ "${AVAILABLE_CORES:-0}" -lt "${REQUIRED_CORES}" ]; do
-    log_warn "Only ${AVAILABLE_CORES} CPU cores are available."
-    sleep "${WAIT_CORES_SLEEP_TIME_SECONDS}"
-    AVAILABLE_CORES="$(get_available_cores "${PROJECT_ID}")"
-  done
-  log_info "${AVAILABLE_CORES} CPU cores are available."
+  metrics_phase start core_wait
+  # A per-runner quota poll that checks at least every 15 seconds and sooner after capacity changes
+  run_corellium_client admit "${PROJECT_ID}" --cores "${REQUIRED_CORES}" || {
+    log_error "Failed to wait for ${REQUIRED_CORES} CPU cores in project ${PROJECT_ID}."
+    exit 1
+  }
+  metrics_phase end core_wait
+}
+
+run_warm_pool_command()
+{
+  local POOL_COMMAND="${1:?}"
+  local HARDWARE_FLAVOR="${2:?}"
+  local FIRMWARE_VERSION="${3:?}"
+  local FIRMWARE_BUILD="${4:?}"
+  local PROJECT_ID="${5:?}"
+  local APP_URL="${6:-}"
+  shift 6
+  local POOL_ARGS=(--project "${PROJECT_ID}" --flavor "${HARDWARE_FLAVOR}" --os "${FIRMWARE_VERSION}" --osbuild "${FIRMWARE_BUILD}")
+  [ "${HARDWARE_FLAVOR}" = 'ranchu' ] && POOL_ARGS+=(--cores 4 --ram 4096)
+  # New pool instances get the app installed before they are snapshotted, so leased instances already have it
+  # The URL goes in as a positional parameter so no character in it can change the command
+  # shellcheck disable=SC2016
+  [ -n "${APP_URL}" ] && POOL_ARGS+=(--prepare-command 'source ./src/functions.sh && install_app_from_url "$1" "$2"' --prepare-arg "${APP_URL}")
+  run_corellium_client "${POOL_COMMAND}" "$@" "${POOL_ARGS[@]}"
+}
+
+lease_warm_instance()
+{
+  local HARDWARE_FLAVOR="${1:?}"
+  local FIRMWARE_VERSION="${2:?}"
+  local FIRMWARE_BUILD="${3:?}"
+  local PROJECT_ID="${4:?}"
+  local RUN_ID="${5:?}"
+  local APP_URL="${6:-}"
+  log_info "Leasing a warm ${HARDWARE_FLAVOR} ${FIRMWARE_VERSION} instance for run ${RUN_ID}." >&2
+  run_warm_pool_command pool-lease "${HARDWARE_FLAVOR}" "${FIRMWARE_VERSION}" "${FIRMWARE_BUILD}" "${PROJECT_ID}" "${APP_URL}" \
+    "${RUN_ID}" || {
+    log_error "Failed to lease a warm ${HARDWARE_FLAVOR} ${FIRMWARE_VERSION} instance."
+    exit 1
+  }
+}
+
+return_warm_instance()
+{
+  local INSTANCE_ID="${1:?}"
+  local RUN_ID="${2:?}"
+  local HARDWARE_FLAVOR="${3:?}"
+  local FIRMWARE_VERSION="${4:?}"
+  local FIRMWARE_BUILD="${5:?}"
+  local PROJECT_ID="${6:?}"
+  log_info "Restoring warm instance ${INSTANCE_ID} to its snapshot."
+  # Only restores the instance while it is still leased to RUN_ID, so a late return cannot wipe another run's device
+  run_warm_pool_command pool-return "${HARDWARE_FLAVOR}" "${FIRMWARE_VERSION}" "${FIRMWARE_BUILD}" "${PROJECT_ID}" '' \
+    "${INSTANCE_ID}" "${RUN_ID}" || {
+    log_error "Failed to return warm instance ${INSTANCE_ID}."
+    exit 1
+  }
+}
+
+resize_warm_pool()
+{
+  local HARDWARE_FLAVOR="${1:?}"
+  local FIRMWARE_VERSION="${2:?}"
+  local FIRMWARE_BUILD="${3:?}"
+  local PROJECT_ID="${4:?}"
+  local APP_URL="${5:-}"
+  local MIN_IDLE="${WARM_POOL_MIN_IDLE:-1}"
+  local MAX_SIZE="${WARM_POOL_MAX_SIZE:-4}"
+  # Reclaim expired leases and warm idle instances up to MIN_IDLE ahead of demand
+  log_info "Resizing the warm ${HARDWARE_FLAVOR} ${FIRMWARE_VERSION} pool to ${MIN_IDLE} idle instances."
+  run_warm_pool_command pool-resize "${HARDWARE_FLAVOR}" "${FIRMWARE_VERSION}" "${FIRMWARE_BUILD}" "${PROJECT_ID}" "${APP_URL}" \
+    --min-idle "${MIN_IDLE}" --max-size "${MAX_SIZE}" || {
+    log_error "Failed to resize the warm ${HARDWARE_FLAVOR} ${FIRMWARE_VERSION} pool."
+    exit 1
+  }
 }
 
 create_instance()
@@ -151,6 +242,7 @@ create_instance()
   local FIRMWARE_BUILD="${3:?}"
   local PROJECT_ID="${4:?}"
   check_env_vars
+  metrics_phase start create
   local NEW_INSTANCE_NAME NEW_INSTANCE_NAME_PREFIX
   if [ -n "${5:-}" ]; then
     NEW_INSTANCE_NAME_PREFIX="$5"
@@ -211,6 +303,7 @@ EOF
     exit 1
   }
 
+  metrics_phase end create
   echo "${CREATED_INSTANCE_ID}"
 }
 
@@ -337,25 +430,19 @@ get_instance_json()
 get_instance_status()
 {
   local INSTANCE_ID="${1:?}"
-  local GET_INSTANCE_JSON INSTANCE_STATE
-  GET_INSTANCE_JSON="$(get_instance_json "${INSTANCE_ID}")"
-  INSTANCE_STATE="$(echo "${GET_INSTANCE_JSON}" | jq -r '.state')" || {
-    log_error "Failed to parse get details JSON response for instance ${INSTANCE_ID}."
+  run_corellium_client instance-status "${INSTANCE_ID}" || {
+    log_error "Failed to get status for instance ${INSTANCE_ID}."
     exit 1
   }
-  echo "${INSTANCE_STATE}"
 }
 
 get_instance_services_ip()
 {
   local INSTANCE_ID="${1:?}"
-  local GET_INSTANCE_JSON INSTANCE_SERVICES_IP
-  GET_INSTANCE_JSON="$(get_instance_json "${INSTANCE_ID}")"
-  INSTANCE_SERVICES_IP="$(echo "${GET_INSTANCE_JSON}" | jq -r '.serviceIp')" || {
-    log_error "Failed to parse get details JSON response for instance ${INSTANCE_ID}."
+  run_corellium_client services-ip "${INSTANCE_ID}" || {
+    log_error "Failed to get services IP for instance ${INSTANCE_ID}."
     exit 1
   }
-  echo "${INSTANCE_SERVICES_IP}"
 }
 
 get_instance_udid()
@@ -385,47 +472,34 @@ get_instance_flavor()
 is_agent_ready()
 {
   local INSTANCE_ID="${1:?}"
-  # pass in project ID to reduce the number of API calls
-  local PROJECT_ID="${2:?}"
-  local AGENT_READY_JSON_RESPONSE AGENT_READY_STATUS
-  AGENT_READY_JSON_RESPONSE="$(corellium ready --instance "${INSTANCE_ID}" --project "${PROJECT_ID}" 2> /dev/null)" || {
-    return 1 # corellium ready exits with nonzero status if agent isn't ready
-  }
-  AGENT_READY_STATUS="$(echo "${AGENT_READY_JSON_RESPONSE}" | jq -r '.ready')" || {
-    log_error 'Failed to parse agent ready JSON response.'
-    exit 1
-  }
-  if [ "${AGENT_READY_STATUS}" = 'true' ]; then
-    return 0
-  else
-    return 1
-  fi
+  run_corellium_client agent-ready "${INSTANCE_ID}" 2> /dev/null
 }
 
 wait_until_agent_ready()
 {
   local INSTANCE_ID="${1:?}"
-  local AGENT_READY_SLEEP_TIME='5'
-  local INSTANCE_STATUS_ON='on'
-  local PROJECT_ID INSTANCE_STATUS
-  PROJECT_ID="$(get_project_from_instance_id "${INSTANCE_ID}")"
-  log_info 'Waiting until virtual device agent is ready.'
-  # pass project ID into is_agent_ready() to reduce the number of API calls
-  while ! is_agent_ready "${INSTANCE_ID}" "${PROJECT_ID}"; do
-    INSTANCE_STATUS="$(get_instance_status "${INSTANCE_ID}")"
-    case "${INSTANCE_STATUS}" in
-      '')
-        log_warn "Failed to get instance status while waiting until agent ready."
-        ;;
-      "${INSTANCE_STATUS_ON}") ;;
-      *)
-        log_info "Instance is ${INSTANCE_STATUS} not ${INSTANCE_STATUS_ON}."
-        exit 1
-        ;;
-    esac
-    sleep "${AGENT_READY_SLEEP_TIME}"
-  done
-  log_info 'Virtual device agent is ready.'
+  metrics_phase start agent_ready
+  wait_until_agents_ready "${INSTANCE_ID}"
+  metrics_phase end agent_ready
+}
+
+wait_until_agents_ready()
+{
+  # Wait on several booting instances with one shared status poll instead of one loop per device
+  if [ "$#" -eq 0 ]; then
+    log_error 'No instance IDs supplied to wait_until_agents_ready.'
+    exit 1
+  fi
+  log_info "Waiting until the agent is ready on $# instances."
+  run_corellium_client wait-instance-state on "$@" || {
+    log_error 'Failed to wait for instances to be on.'
+    exit 1
+  }
+  run_corellium_client wait-agent-ready "$@" || {
+    log_error 'Failed to wait for virtual device agents to be ready.'
+    exit 1
+  }
+  log_info 'Virtual device agents are ready.'
 }
 
 kill_app()
@@ -450,7 +524,10 @@ kill_app()
 get_project_from_instance_id()
 {
   local INSTANCE_ID="${1:?}"
-  corellium instance get --instance "${INSTANCE_ID}" | jq -r '.project'
+  run_corellium_client project "${INSTANCE_ID}" || {
+    log_error "Failed to get the project of instance ${INSTANCE_ID}."
+    exit 1
+  }
 }
 
 get_projects_list()
@@ -463,30 +540,41 @@ install_app_from_url()
   local INSTANCE_ID="${1:?}"
   local APP_URL="${2:?}"
   local MINIMUM_FILE_SIZE_IN_KIB='32'
-  local PROJECT_ID APP_FILENAME DOWNLOADED_FILE_SIZE_IN_KIB
+  local PROJECT_ID APP_FILENAME APP_JSON APP_PATH APP_DESCRIPTION
   PROJECT_ID="$(get_project_from_instance_id "${INSTANCE_ID}")"
   APP_FILENAME="$(basename "${APP_URL}")"
-  log_info "Downloading ${APP_FILENAME}."
-  curl --silent --output "${APP_FILENAME}" "${APP_URL}" || {
+  metrics_phase start app_install
+  # Revalidate the cached binary with the server and check whether the device already has this exact build
+  log_info "Fetching ${APP_FILENAME} through the app cache."
+  APP_JSON="$(run_corellium_client fetch-app "${APP_URL}" \
+    --instance "${INSTANCE_ID}" \
+    --minimum-kib "${MINIMUM_FILE_SIZE_IN_KIB}")" || {
     log_error "Failed to download app ${APP_FILENAME}."
     exit 1
   }
-  log_info "Downloaded ${APP_FILENAME}."
-  log_info 'Checking download size.'
-  DOWNLOADED_FILE_SIZE_IN_KIB="$(du -k "${APP_FILENAME}" | cut -f1)"
-  [ "${DOWNLOADED_FILE_SIZE_IN_KIB}" -lt "${MINIMUM_FILE_SIZE_IN_KIB}" ] && {
-    log_error "Downloaded ${DOWNLOADED_FILE_SIZE_IN_KIB} KiB, below the minimum of ${MINIMUM_FILE_SIZE_IN_KIB} KiB."
-    exit 1
-  }
-  log_info "Size on disk is ${DOWNLOADED_FILE_SIZE_IN_KIB} KiB."
-  log_info "Installing ${APP_FILENAME}."
+  APP_PATH="$(jq -r '.path' <<< "${APP_JSON}")"
+  APP_DESCRIPTION="$(jq -r '"\(.bundle_id) \(.version) (\(.build)), \(.size / 1024 | floor) KiB"' <<< "${APP_JSON}")"
+  if [ "$(jq -r '.downloaded' <<< "${APP_JSON}")" = 'true' ]; then
+    log_info "Downloaded ${APP_DESCRIPTION}."
+  else
+    log_info "Cached copy of ${APP_DESCRIPTION} is current."
+  fi
+  if [ "$(jq -r '.installed' <<< "${APP_JSON}")" = 'true' ]; then
+    log_info "Skipping install, $(jq -r '.reason' <<< "${APP_JSON}")."
+    metrics_phase end app_install
+    return 0
+  fi
+  log_info "Installing ${APP_FILENAME}, $(jq -r '.reason' <<< "${APP_JSON}")."
   corellium apps install \
     --instance "${INSTANCE_ID}" \
     --project "${PROJECT_ID}" \
-    --app "${APP_FILENAME}" > /dev/null || {
+    --app "${APP_PATH}" > /dev/null || {
     log_error "Failed to install app ${APP_FILENAME}."
     exit 1
   }
+  run_corellium_client mark-app-installed "${INSTANCE_ID}" "${APP_URL}" ||
+    log_warn "Failed to record the installed build of ${APP_FILENAME}, the next run will reinstall it."
+  metrics_phase end app_install
   log_info "Installed ${APP_FILENAME}."
 }
 
@@ -527,6 +615,23 @@ is_app_running()
     jq -r --arg id "${APP_BUNDLE_ID}" '.[] | select(.bundleID == $id) | .running'
 }
 
+bulk_instance_action()
+{
+  # Start, stop, soft-stop, or delete a set of instances with bounded concurrency and one shared status poll
+  local ACTION="${1:?}"
+  shift
+  local BULK_CONCURRENCY="${BULK_CONCURRENCY:-8}"
+  local BULK_REQUESTS_PER_SECOND="${BULK_REQUESTS_PER_SECOND:-2}"
+  log_info "Running bulk ${ACTION} with up to ${BULK_CONCURRENCY} devices at once."
+  run_corellium_client bulk "${ACTION}" "$@" \
+    --concurrency "${BULK_CONCURRENCY}" \
+    --rate "${BULK_REQUESTS_PER_SECOND}" || {
+    log_error "Bulk ${ACTION} failed for at least one instance."
+    exit 1
+  }
+  log_info "Finished bulk ${ACTION}."
+}
+
 delete_unauthorized_devices()
 {
   if [[ -z "${AUTHORIZED_INSTANCES}" ]]; then
@@ -534,62 +639,24 @@ delete_unauthorized_devices()
     return 1
   fi
 
-  local INSTANCES_TO_KEEP=()
+  local THIS_INSTANCE_TO_KEEP
+  local KEEP_ARGS=()
   while IFS= read -r line; do
-    INSTANCES_TO_KEEP+=("$(echo "${line}" | tr -d '\r\n')")
-  done <<< "${AUTHORIZED_INSTANCES}"
-
-  local CORELLIUM_DEVICES_JSON ALL_EXISTING_DEVICES
-  CORELLIUM_DEVICES_JSON="$(corellium list)" || {
-    log_error 'Failed to get device list.'
-    exit 1
-  }
-  # disable lint check since all values are assumed to be UUIDs
-  #shellcheck disable=SC2207
-  ALL_EXISTING_DEVICES=($(echo "${CORELLIUM_DEVICES_JSON}" | jq -r '.[].id')) || {
-    log_error 'Failed to parse device list.'
-    exit 1
-  }
-
-  [[ ${#ALL_EXISTING_DEVICES[@]} -eq 0 ]] && {
-    log_info "No devices exist, so nothing to delete."
-    return
-  }
-
-  local UNAUTHORIZED_DEVICES=()
-  local IS_DEVICE_AUTHORIZED
-  for EXISTING_DEVICE in "${ALL_EXISTING_DEVICES[@]}"; do
-    log_info "Checking ${EXISTING_DEVICE}."
-    IS_DEVICE_AUTHORIZED='false'
-    for AUTHORIZED_DEVICE in "${INSTANCES_TO_KEEP[@]}"; do
-      if [ "${EXISTING_DEVICE}" = "${AUTHORIZED_DEVICE}" ]; then
-        IS_DEVICE_AUTHORIZED='true'
-        break
-      fi
-    done
-    if [ "${IS_DEVICE_AUTHORIZED}" = 'true' ]; then
-      log_info "Device ${EXISTING_DEVICE} is authorized."
-    else
-      log_info "Device ${EXISTING_DEVICE} is unauthorized."
-      UNAUTHORIZED_DEVICES+=("${EXISTING_DEVICE}")
+    THIS_INSTANCE_TO_KEEP="$(echo "${line}" | tr -d '\r\n')"
+    if [ -n "${THIS_INSTANCE_TO_KEEP}" ]; then
+      KEEP_ARGS+=(--keep "${THIS_INSTANCE_TO_KEEP}")
     fi
-  done
+  done <<< "${AUTHORIZED_INSTANCES}"
 
-  [[ ${#UNAUTHORIZED_DEVICES[@]} -eq 0 ]] && {
-    log_info "All devices are authorized, so nothing to delete."
-    return
-  }
+  log_info "Deleting every device not listed in AUTHORIZED_INSTANCES."
+  # Warm pool members are kept too; the pool restores, reclaims, and resizes them itself
+  bulk_instance_action delete --all "${KEEP_ARGS[@]}" --keep-name-prefix 'Warm Pool'
 
-  log_info "Deleting unauthorized devices."
-  for DEVICE_TO_DELETE in "${UNAUTHORIZED_DEVICES[@]}"; do
-    delete_instance "${DEVICE_TO_DELETE}"
-  done
   log_info "Deleted unauthorized devices."
 }
 
 start_demo_instances()
 {
-  local INSTANCE_START_SLEEP_TIME='30'
   local THIS_INSTANCE_TO_START
   local INSTANCES_TO_START=()
   while IFS= read -r line; do
@@ -598,10 +665,11 @@ start_demo_instances()
       INSTANCES_TO_START+=("${THIS_INSTANCE_TO_START}")
     fi
   done <<< "${START_INSTANCES}"
-  for INSTANCE_ID in "${INSTANCES_TO_START[@]}"; do
-    start_instance "${INSTANCE_ID}"
-    sleep "${INSTANCE_START_SLEEP_TIME}"
-  done
+  [[ ${#INSTANCES_TO_START[@]} -eq 0 ]] && {
+    log_info "No instances to start."
+    return
+  }
+  bulk_instance_action start "${INSTANCES_TO_START[@]}"
 }
 
 stop_demo_instances()
@@ -614,9 +682,11 @@ stop_demo_instances()
       INSTANCES_TO_STOP+=("${THIS_INSTANCE_TO_STOP}")
     fi
   done <<< "${STOP_INSTANCES}"
-  for INSTANCE_ID in "${INSTANCES_TO_STOP[@]}"; do
-    stop_instance "${INSTANCE_ID}"
-  done
+  [[ ${#INSTANCES_TO_STOP[@]} -eq 0 ]] && {
+    log_info "No instances to stop."
+    return
+  }
+  bulk_instance_action stop "${INSTANCES_TO_STOP[@]}"
 }
 
 download_file_to_local_path()
@@ -675,48 +745,28 @@ wait_for_instance_status()
 {
   local INSTANCE_ID="${1:?}"
   local TARGET_INSTANCE_STATUS="${2:?}"
-  local SLEEP_TIME_DEFAULT='2'
-  local INSTANCE_ERROR_STATUS='error'
-  local INSTANCE_PAUSED_STATUS='paused'
-  local INSTANCE_FAILURE_STATUS
 
   case "${TARGET_INSTANCE_STATUS}" in
     '')
       log_error 'TARGET_INSTANCE_STATUS parameter cannot be empty.'
       exit 1
       ;;
-    'off')
-      INSTANCE_FAILURE_STATUS='on'
-      ;;
-    'on')
-      INSTANCE_FAILURE_STATUS='off'
-      ;;
+    'off' | 'on') ;;
     *)
       log_error 'Unknown target instance status.'
       exit 1
       ;;
   esac
 
-  local CURRENT_INSTANCE_STATUS
-  CURRENT_INSTANCE_STATUS="$(get_instance_status "${INSTANCE_ID}")"
-  while [ "${CURRENT_INSTANCE_STATUS}" != "${TARGET_INSTANCE_STATUS}" ]; do
-    case "${CURRENT_INSTANCE_STATUS}" in
-      '')
-        log_warn "Failed to get instance status. Checking again in ${SLEEP_TIME_DEFAULT} seconds."
-        ;;
-      "${INSTANCE_FAILURE_STATUS}")
-        log_error "Target is ${TARGET_INSTANCE_STATUS}, but current status is ${CURRENT_INSTANCE_STATUS}."
-        exit 1
-        ;;
-      "${INSTANCE_ERROR_STATUS}" | "${INSTANCE_PAUSED_STATUS}")
-        log_error "Instance is in ${CURRENT_INSTANCE_STATUS} status."
-        exit
-        ;;
-      *) ;;
-    esac
-    sleep "${SLEEP_TIME_DEFAULT}"
-    CURRENT_INSTANCE_STATUS="$(get_instance_status "${INSTANCE_ID}")"
-  done
+  local METRICS_PHASE='boot'
+  [ "${TARGET_INSTANCE_STATUS}" = 'off' ] && METRICS_PHASE='shutdown'
+  metrics_phase start "${METRICS_PHASE}"
+  # Shared status poll through the pooled client, which fails at once on error, paused, or the opposite state
+  run_corellium_client wait-instance-state "${TARGET_INSTANCE_STATUS}" "${INSTANCE_ID}" || {
+    log_error "Instance ${INSTANCE_ID} did not reach ${TARGET_INSTANCE_STATUS}."
+    exit 1
+  }
+  metrics_phase end "${METRICS_PHASE}"
 }
 
 install_openvpn_dependencies()
@@ -1064,43 +1114,18 @@ is_app_running_on_instance()
 {
   local INSTANCE_ID="${1:?}"
   local APP_PACKAGE_NAME="${2:?}"
-  local PROJECT_ID APP_STATUS_JSON_RESPONSE APP_RUNNING_STATUS
-  PROJECT_ID="$(get_project_from_instance_id "${INSTANCE_ID}")"
-
-  APP_STATUS_JSON_RESPONSE="$(corellium instance apps \
-    --instance "${INSTANCE_ID}" \
-    --project "${PROJECT_ID}")" || {
-    log_warn 'Failed to check app status. Retrying.'
-    APP_STATUS_JSON_RESPONSE="$(corellium instance apps \
-      --instance "${INSTANCE_ID}" \
-      --project "${PROJECT_ID}")" || {
-      log_error 'Failed to check app status again.'
-      exit 1
-    }
-  }
-
-  APP_RUNNING_STATUS="$(echo "${APP_STATUS_JSON_RESPONSE}" |
-    jq -r \
-      --arg app_package_name "${APP_PACKAGE_NAME}" \
-      '.[] | select(.bundleID == $app_package_name) | .running')" || {
-    log_error 'Failed to parse app status JSON response.'
-    exit 1
-  }
-
-  if [ "${APP_RUNNING_STATUS}" = 'true' ]; then
-    return 0
-  else
-    return 1
-  fi
+  # One app list request per check, with no project lookup and no jq
+  run_corellium_client app-running "${INSTANCE_ID}" "${APP_PACKAGE_NAME}"
 }
 
 wait_until_app_is_running_on_instance()
 {
   local INSTANCE_ID="${1:?}"
   local APP_PACKAGE_NAME="${2:?}"
-  until is_app_running_on_instance "${INSTANCE_ID}" "${APP_PACKAGE_NAME}"; do
-    sleep 1
-  done
+  run_corellium_client wait-app-running "${INSTANCE_ID}" "${APP_PACKAGE_NAME}" || {
+    log_error "Failed to wait for ${APP_PACKAGE_NAME} to run on instance ${INSTANCE_ID}."
+    exit 1
+  }
 }
 
 ensure_app_is_running_on_instance()
@@ -1142,3 +1167,16 @@ remote_code_execution_with_ssh()
     exit 1
   }
 }
+
+remote_code_execution_batch()
+{
+  local TARGET_SERVICES_IP="${1:?}"
+  local TRANSPORT="${2:?}"
+  shift 2
+  # Run every command over one persistent adb or ssh shell instead of one connection per command
+  log_info "Executing $# commands on device at ${TARGET_SERVICES_IP} over ${TRANSPORT}."
+  python3 src/util/remote_executor.py "${TRANSPORT}" "${TARGET_SERVICES_IP}" "$@" || {
+    log_error "Failed to execute remote commands with ${TRANSPORT}."
+    exit 1
+  }
+}
@@ -14,6 +14,11 @@ install_frida_dependencies()
 get_frida_device_id()
 {
   local INSTANCE_ID="${1:?}"
+  # Resolved once per job: set CORELLIUM_FRIDA_DEVICE_ID to reuse an earlier lookup
+  if [ -n "${CORELLIUM_FRIDA_DEVICE_ID:-}" ]; then
+    echo "${CORELLIUM_FRIDA_DEVICE_ID}"
+    return
+  fi
   local GET_INSTANCE_JSON_RESPONSE INSTANCE_SERVICES_IP INSTANCE_UDID FRIDA_DEVICE_ID
   GET_INSTANCE_JSON_RESPONSE="$(corellium instance get --instance "${INSTANCE_ID}")"
   INSTANCE_FLAVOR="$(echo "${GET_INSTANCE_JSON_RESPONSE}" | jq -r '.flavor')"
@@ -70,58 +75,52 @@ run_frida_ps_usb()
   log_info 'Listed running apps.'
 }
 
+run_frida_scripts()
+{
+  # Spawn one app with one or more scripts through frida_runner.py; the run ends when every script sends
+  # {type: 'done'}, and in CI a script that never does fails the run after FRIDA_TIMEOUT_SECONDS
+  local APP_PACKAGE_NAME="${1:?}"
+  shift
+  local FRIDA_RUNNER_ARGS=("$@")
+  if [ "${CI:-false}" = 'true' ]; then
+    local FRIDA_TIMEOUT_SECONDS="${FRIDA_TIMEOUT_SECONDS:-60}"
+    log_info "Frida scripts must finish within ${FRIDA_TIMEOUT_SECONDS} seconds."
+    FRIDA_RUNNER_ARGS+=(--timeout "${FRIDA_TIMEOUT_SECONDS}")
+  else
+    log_info "Frida scripts will run until they finish."
+  fi
+  python3 src/util/frida_runner.py --spawn "${APP_PACKAGE_NAME}" "${FRIDA_RUNNER_ARGS[@]}" \
+    --messages "${FRIDA_MESSAGES_PATH:-frida_messages.jsonl}" || {
+    log_error "Frida scripts failed in ${APP_PACKAGE_NAME}."
+    exit 1
+  }
+  log_info "Frida scripts finished in ${APP_PACKAGE_NAME}."
+}
+
 run_frida_script_device()
 {
   local INSTANCE_ID="${1:?}"
   local APP_PACKAGE_NAME="${2:?}"
-  local FRIDA_SCRIPT_PATH="${3:?}"
-  local FRIDA_DEVICE_ID
+  shift 2
+  local FRIDA_DEVICE_ID FRIDA_SCRIPT_PATH
+  local FRIDA_SCRIPT_ARGS=()
+  for FRIDA_SCRIPT_PATH in "${@:?}"; do
+    FRIDA_SCRIPT_ARGS+=(--script "${FRIDA_SCRIPT_PATH}")
+  done
   FRIDA_DEVICE_ID="$(get_frida_device_id "${INSTANCE_ID}")"
-  log_info "Spawning app ${APP_PACKAGE_NAME} with Frida script $(basename "${FRIDA_SCRIPT_PATH}")."
-  if [ "${CI:-false}" = 'true' ]; then
-    command -v timeout > /dev/null || {
-      log_error 'Cannot find timeout dependency.'
-      exit 1
-    }
-    local FRIDA_TIMEOUT_SECONDS='10'
-    log_info "Frida script will timeout after ${FRIDA_TIMEOUT_SECONDS} seconds."
-    timeout "${FRIDA_TIMEOUT_SECONDS}" \
-      frida --device "${FRIDA_DEVICE_ID}" --file "${APP_PACKAGE_NAME}" --load "${FRIDA_SCRIPT_PATH}" || {
-      local FAILURE_EXIT_STATUS="$?"
-      if [ "${FAILURE_EXIT_STATUS}" -eq 124 ]; then
-        log_info "Frida successfully timed out after ${FRIDA_TIMEOUT_SECONDS} seconds."
-      else
-        log_error "Unknown exit status ${FAILURE_EXIT_STATUS}."
-        exit 1
-      fi
-    }
-  else
-    log_info "Frida script will run indefinitely with no timeout."
-    frida --device "${FRIDA_DEVICE_ID}" --file "${APP_PACKAGE_NAME}" --load "${FRIDA_SCRIPT_PATH}"
-  fi
+  log_info "Spawning app ${APP_PACKAGE_NAME} with Frida scripts $(basename -a "$@" | paste -sd ' ' -)."
+  run_frida_scripts "${APP_PACKAGE_NAME}" --device "${FRIDA_DEVICE_ID}" "${FRIDA_SCRIPT_ARGS[@]}"
 }
 
 run_frida_script_usb()
 {
   local APP_PACKAGE_NAME="${1:?}"
-  local FRIDA_SCRIPT_PATH="${2:?}"
-  log_info "Spawning app ${APP_PACKAGE_NAME} with Frida script $(basename "${FRIDA_SCRIPT_PATH}")."
-
-  if [ "${CI:-false}" = 'true' ]; then
-    local FRIDA_TIMEOUT_SECONDS='10'
-    log_info "Frida script will timeout after ${FRIDA_TIMEOUT_SECONDS} seconds."
-    timeout "${FRIDA_TIMEOUT_SECONDS}" \
-      frida --usb --file "${APP_PACKAGE_NAME}" --load "${FRIDA_SCRIPT_PATH}" || {
-      local FAILURE_EXIT_STATUS="$?"
-      if [ "${FAILURE_EXIT_STATUS}" -eq 124 ]; then
-        log_info "Frida successfully timed out after ${FRIDA_TIMEOUT_SECONDS} seconds."
-      else
-        log_error "Unknown exit status ${FAILURE_EXIT_STATUS}."
-        exit 1
-      fi
-    }
-  else
-    log_info "Frida script will run indefinitely with no timeout."
-    frida --usb --file "${APP_PACKAGE_NAME}" --load "${FRIDA_SCRIPT_PATH}"
-  fi
+  shift
+  local FRIDA_SCRIPT_PATH
+  local FRIDA_SCRIPT_ARGS=()
+  for FRIDA_SCRIPT_PATH in "${@:?}"; do
+    FRIDA_SCRIPT_ARGS+=(--script "${FRIDA_SCRIPT_PATH}")
+  done
+  log_info "Spawning app ${APP_PACKAGE_NAME} with Frida scripts $(basename -a "$@" | paste -sd ' ' -)."
+  run_frida_scripts "${APP_PACKAGE_NAME}" --usb "${FRIDA_SCRIPT_ARGS[@]}"
 }
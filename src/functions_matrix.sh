@@ -7,7 +7,7 @@ install_appium_server_and_dependencies()
   log_info 'Installing appium dependencies.'
   sudo apt-get -qq update
   sudo apt-get -qq install --assume-yes --no-install-recommends libusb-dev
-  python3 -m pip install -U Appium-Python-Client pymobiledevice3
+  python3 -m pip install -U Appium-Python-Client pymobiledevice3 zstandard
   log_info 'Installed appium dependencies.'
   log_info 'Installing appium and device drivers.'
   npm install --location=global appium
@@ -161,17 +161,37 @@ download_matrix_report_to_local_path()
   log_info "Downloaded ${MATRIX_REPORT_TARGET_FORMAT_UPPER} report for MATRIX assessment ${MATRIX_ASSESSMENT_ID}."
 }
 
-print_failed_matrix_checks()
+fetch_matrix_reports()
 {
   local INSTANCE_ID="${1:?}"
   local MATRIX_ASSESSMENT_ID="${2:?}"
-  local MATRIX_REPORT_FORMAT='json'
-  get_raw_matrix_report \
+  shift 2
+  local MATRIX_REPORT_FORMAT_ARGS=()
+  for MATRIX_REPORT_FORMAT in "${@:-html}"; do
+    MATRIX_REPORT_FORMAT_ARGS+=(--format "${MATRIX_REPORT_FORMAT}")
+  done
+  log_info "Fetching ${*:-html} reports for MATRIX assessment ${MATRIX_ASSESSMENT_ID}."
+  metrics_phase start report_download
+  run_corellium_client fetch-reports \
     "${INSTANCE_ID}" \
     "${MATRIX_ASSESSMENT_ID}" \
-    "${MATRIX_REPORT_FORMAT}" |
-    jq -r '.results[] | select(.outcome == "fail") | .name' |
-    sort
+    "${MATRIX_REPORT_FORMAT_ARGS[@]}" \
+    --output-dir . > /dev/null || {
+    log_error "Failed to fetch reports for MATRIX assessment ${MATRIX_ASSESSMENT_ID}."
+    exit 1
+  }
+  metrics_phase end report_download
+  log_info "Fetched reports for MATRIX assessment ${MATRIX_ASSESSMENT_ID}."
+}
+
+print_failed_matrix_checks()
+{
+  local INSTANCE_ID="${1:?}"
+  local MATRIX_ASSESSMENT_ID="${2:?}"
+  local MATRIX_JSON_REPORT_PATH
+  # Served from the report cache after the first download of a complete assessment
+  MATRIX_JSON_REPORT_PATH="$(run_corellium_client fetch-reports "${INSTANCE_ID}" "${MATRIX_ASSESSMENT_ID}" --format json)"
+  jq -r '.results[] | select(.outcome == "fail") | .name' "${MATRIX_JSON_REPORT_PATH}" | sort
 }
 
 delete_matrix_assessment()
@@ -227,6 +247,7 @@ run_full_matrix_assessment()
   local APP_BUNDLE_ID="${2:?}"
   local MATRIX_WORDLIST_ID="${3:?}"
   handle_open_matrix_assessment "${INSTANCE_ID}"
+  metrics_phase start matrix_test
   log_info "Creating MATRIX assessment."
   local MATRIX_ASSESSMENT_ID
   MATRIX_ASSESSMENT_ID="$(create_matrix_assessment "${INSTANCE_ID}" "${APP_BUNDLE_ID}" "${MATRIX_WORDLIST_ID}")"
@@ -241,18 +262,34 @@ run_full_matrix_assessment()
   ensure_app_is_running_on_instance "${INSTANCE_ID}" "${APP_BUNDLE_ID}"
   stop_matrix_monitoring "${INSTANCE_ID}" "${MATRIX_ASSESSMENT_ID}"
   test_matrix_evidence "${INSTANCE_ID}" "${MATRIX_ASSESSMENT_ID}"
+  metrics_phase end matrix_test
   log_info "Completed MATRIX assessment ${MATRIX_ASSESSMENT_ID}."
   kill_app "${INSTANCE_ID}" "${APP_BUNDLE_ID}"
-  download_matrix_report_to_local_path \
-    "${INSTANCE_ID}" \
-    "${MATRIX_ASSESSMENT_ID}" \
-    "matrix_report_${MATRIX_ASSESSMENT_ID}.html" \
-    'html'
-  download_matrix_report_to_local_path \
+  fetch_matrix_reports "${INSTANCE_ID}" "${MATRIX_ASSESSMENT_ID}" html json
+}
+
+run_matrix_workload_plan()
+{
+  # Run every workload in the plan inside shared monitoring windows instead of one assessment per scenario
+  local INSTANCE_ID="${1:?}"
+  local APP_BUNDLE_ID="${2:?}"
+  local MATRIX_WORDLIST_ID="${3:?}"
+  local MATRIX_WORKLOAD_PLAN_PATH="${4:-data/config/matrix_workloads_cafe.json}"
+  local MATRIX_EVIDENCE_DIR="${MATRIX_EVIDENCE_DIR:-matrix_evidence}"
+  check_env_vars
+  handle_open_matrix_assessment "${INSTANCE_ID}"
+  log_info "Running MATRIX workload plan ${MATRIX_WORKLOAD_PLAN_PATH}."
+  PYTHONUNBUFFERED=1 python3 src/util/matrix_orchestrator.py \
     "${INSTANCE_ID}" \
-    "${MATRIX_ASSESSMENT_ID}" \
-    "matrix_report_${MATRIX_ASSESSMENT_ID}.json" \
-    'json'
+    "${APP_BUNDLE_ID}" \
+    --wordlist "${MATRIX_WORDLIST_ID}" \
+    --plan "${MATRIX_WORKLOAD_PLAN_PATH}" \
+    --evidence-dir "${MATRIX_EVIDENCE_DIR}" \
+    --reports-dir . || {
+    log_error "MATRIX workload plan ${MATRIX_WORKLOAD_PLAN_PATH} did not complete; see ${MATRIX_EVIDENCE_DIR}/evidence.json."
+    exit 1
+  }
+  log_info "Completed MATRIX workload plan ${MATRIX_WORKLOAD_PLAN_PATH}."
 }
 
 get_matrix_assessment_status()
@@ -267,8 +304,6 @@ wait_for_matrix_assessment_status()
   local INSTANCE_ID="${1:?}"
   local ASSESSMENT_ID="${2:?}"
   local TARGET_ASSESSMENT_STATUS="${3:?}"
-  local SLEEP_TIME_DEFAULT='2'
-  local SLEEP_TIME_FOR_TESTING='5'
 
   case "${TARGET_ASSESSMENT_STATUS}" in
     'complete' | 'failed' | 'monitoring' | 'readyForTesting' | 'startMonitoring' | 'stopMonitoring' | 'testing') ;;
@@ -278,34 +313,32 @@ wait_for_matrix_assessment_status()
       ;;
   esac
 
-  local CURRENT_ASSESSMENT_STATUS LAST_ASSESSMENT_STATUS ASSESSMENT_STATUS_SLEEP_TIME
-  LAST_ASSESSMENT_STATUS='UNDEFINED'
-  CURRENT_ASSESSMENT_STATUS="$(get_matrix_assessment_status "${INSTANCE_ID}" "${ASSESSMENT_ID}")"
-  while [ "${CURRENT_ASSESSMENT_STATUS}" != "${TARGET_ASSESSMENT_STATUS}" ]; do
-    case "${CURRENT_ASSESSMENT_STATUS}" in
-      '')
-        log_warn "Failed to get instance status. Checking again in ${SLEEP_TIME_DEFAULT} seconds."
-        ASSESSMENT_STATUS_SLEEP_TIME="${SLEEP_TIME_DEFAULT}"
-        ;;
-      'failed')
-        log_error "Detected a failed run. Last state was '${LAST_ASSESSMENT_STATUS}'."
-        exit 1
-        ;;
-      'monitoring')
-        log_error 'Cannot wait when status is monitoring.'
-        exit 1
-        ;;
-      'testing')
-        ASSESSMENT_STATUS_SLEEP_TIME="${SLEEP_TIME_FOR_TESTING}"
-        ;;
-      *)
-        ASSESSMENT_STATUS_SLEEP_TIME="${SLEEP_TIME_DEFAULT}"
-        ;;
-    esac
-    sleep "${ASSESSMENT_STATUS_SLEEP_TIME}"
-    LAST_ASSESSMENT_STATUS="${CURRENT_ASSESSMENT_STATUS}"
-    CURRENT_ASSESSMENT_STATUS="$(get_matrix_assessment_status "${INSTANCE_ID}" "${ASSESSMENT_ID}")"
-  done
+  # Shared status poll through the pooled client, which fails on a failed run or an unexpected monitoring status
+  run_corellium_client wait-assessment-status "${INSTANCE_ID}" "${ASSESSMENT_ID}" "${TARGET_ASSESSMENT_STATUS}" || {
+    log_error "MATRIX assessment ${ASSESSMENT_ID} did not reach ${TARGET_ASSESSMENT_STATUS}."
+    exit 1
+  }
+}
+
+prepare_android_device_for_appium()
+{
+  local INSTANCE_ID="${1:?}"
+  local INSTANCE_SERVICES_IP
+  INSTANCE_SERVICES_IP="$(get_instance_services_ip "${INSTANCE_ID}")"
+  is_services_ip_conneted_with_adb "${INSTANCE_SERVICES_IP}" || {
+    log_error "Cannot find adb connection to ${INSTANCE_SERVICES_IP}."
+    exit 1
+  }
+  # Turn off animations and keep the screen awake and unlocked, over one root shell instead of one adb shell each
+  log_info "Preparing instance ${INSTANCE_ID} for Appium."
+  remote_code_execution_batch "${INSTANCE_SERVICES_IP}" adb \
+    'settings put global window_animation_scale 0' \
+    'settings put global transition_animation_scale 0' \
+    'settings put global animator_duration_scale 0' \
+    'svc power stayon true' \
+    'input keyevent KEYCODE_WAKEUP' \
+    'wm dismiss-keyguard'
+  log_info "Prepared instance ${INSTANCE_ID} for Appium."
 }
 
 run_appium_server()
@@ -321,6 +354,59 @@ run_appium_server()
   log_info 'Started appium server.'
 }
 
+run_appium_server_pool()
+{
+  # Several Appium servers behind 127.0.0.1:4723, each session with its own systemPort/wdaLocalPort set
+  local APPIUM_SERVER_COUNT="${1:-2}"
+  local APPIUM_POOL_LOG_DIR="${APPIUM_POOL_LOG_DIR:-appium_logs}"
+  log_info "Starting appium server pool with ${APPIUM_SERVER_COUNT} servers."
+  command -v appium > /dev/null || {
+    log_error 'Cannot find appium in PATH.'
+    exit 1
+  }
+  PYTHONUNBUFFERED=1 python3 src/util/appium_server_pool.py \
+    --servers "${APPIUM_SERVER_COUNT}" \
+    --port 4723 \
+    --log-dir "${APPIUM_POOL_LOG_DIR}" &
+  until curl --silent http://127.0.0.1:4723/status |
+    jq -e '.value.ready == true' > /dev/null; do sleep 0.1; done
+  log_info "Started appium server pool; server logs are in ${APPIUM_POOL_LOG_DIR}."
+}
+
+stop_appium_server_pool()
+{
+  pgrep -f 'src/util/appium_server_pool.py' > /dev/null || {
+    log_warn 'Appium server pool is not running.'
+    return 0
+  }
+  log_info 'Stopping appium server pool and its servers.'
+  pkill -INT -f 'src/util/appium_server_pool.py'
+  log_info 'Stopped appium server pool.'
+}
+
+run_appium_session_broker()
+{
+  local BROKER_PORT="${1:-4780}"
+  log_info 'Starting appium session broker.'
+  PYTHONUNBUFFERED=1 python3 src/util/appium_session_broker.py --port "${BROKER_PORT}" &
+  until curl --silent "http://127.0.0.1:${BROKER_PORT}/status" |
+    jq -e '.ready == true' > /dev/null; do sleep 0.1; done
+  export APPIUM_SESSION_BROKER="http://127.0.0.1:${BROKER_PORT}"
+  log_info "Started appium session broker at ${APPIUM_SESSION_BROKER}."
+}
+
+stop_appium_session_broker()
+{
+  pgrep -f 'src/util/appium_session_broker.py' > /dev/null || {
+    log_warn 'Appium session broker is not running.'
+    return 0
+  }
+  log_info 'Stopping appium session broker and closing its sessions.'
+  pkill -INT -f 'src/util/appium_session_broker.py'
+  unset APPIUM_SESSION_BROKER
+  log_info 'Stopped appium session broker.'
+}
+
 open_appium_session()
 {
   local INSTANCE_ID="${1:?}"
@@ -449,6 +535,24 @@ run_appium_interactions_cafe_android()
   log_info 'Finished automated Appium interactions.'
 }
 
+run_appium_interactions_cafe_android_fanout()
+{
+  if [ "$#" -eq 0 ]; then
+    log_error 'No instance IDs supplied to run_appium_interactions_cafe_android_fanout.'
+    exit 1
+  fi
+  local INSTANCE_SERVICES_IPS=()
+  for INSTANCE_ID in "$@"; do
+    INSTANCE_SERVICES_IPS+=("$(get_instance_services_ip "${INSTANCE_ID}")")
+  done
+  log_info "Starting automated Appium interactions on $# devices."
+  PYTHONUNBUFFERED=1 python3 src/util/appium_fanout.py android "${INSTANCE_SERVICES_IPS[@]}" || {
+    log_error 'Appium interactions failed on at least one device.'
+    exit 1
+  }
+  log_info "Finished automated Appium interactions on $# devices."
+}
+
 run_appium_interactions_template_android()
 {
   local INSTANCE_ID="${1:?}"
@@ -459,33 +563,44 @@ run_appium_interactions_template_android()
   log_info 'Finished automated Appium interactions.'
 }
 
+run_touch_replay_cafe_android()
+{
+  local INSTANCE_ID="${1:?}"
+  shift
+  local INSTANCE_SERVICES_IP
+  INSTANCE_SERVICES_IP="$(get_instance_services_ip "${INSTANCE_ID}")"
+  log_info 'Replaying recorded Corellium Cafe gestures.'
+  python3 src/util/touch_replay.py android "${INSTANCE_SERVICES_IP}" "$@" || {
+    log_error 'Gesture replay failed.'
+    exit 1
+  }
+  log_info 'Finished replaying recorded gestures.'
+}
+
 analyze_corellium_cafe_matrix_report_from_local_path()
 {
   local MATRIX_JSON_REPORT_PATH="${1:?}"
-  local MATRIX_CHECK_TO_ANALYZE='masvs-storage-1-android-12'
-  local MATRIX_CHECK_EXPECTED_OUTCOME='fail'
+  local MATRIX_EXPECTATIONS_PATH='data/config/matrix_expectations.json'
+  local MATRIX_HISTORY_ARGS=()
   [ -f "${MATRIX_JSON_REPORT_PATH}" ] || {
     log_error "${MATRIX_JSON_REPORT_PATH} is not a file."
     exit 1
   }
-  jq '.' "${MATRIX_JSON_REPORT_PATH}" > /dev/null 2>&1 || {
-    log_error "Failed to parse ${MATRIX_JSON_REPORT_PATH}."
+  if [ -n "${MATRIX_HISTORY_DB:-}" ]; then
+    MATRIX_HISTORY_ARGS=(--history "${MATRIX_HISTORY_DB}")
+    if [ -n "${MATRIX_HISTORY_FIRMWARE:-}" ]; then
+      MATRIX_HISTORY_ARGS+=(--meta "firmware=${MATRIX_HISTORY_FIRMWARE}")
+    fi
+  fi
+  log_info "Analyzing MATRIX report ${MATRIX_JSON_REPORT_PATH} against ${MATRIX_EXPECTATIONS_PATH}."
+  python3 src/util/matrix_report_analysis.py analyze \
+    "${MATRIX_JSON_REPORT_PATH}" \
+    --expectations "${MATRIX_EXPECTATIONS_PATH}" \
+    "${MATRIX_HISTORY_ARGS[@]}" || {
+    log_error "MATRIX report ${MATRIX_JSON_REPORT_PATH} does not meet the expected check outcomes."
     exit 1
   }
-  log_info "Listing failed assessment checks for ${report}."
-  print_matching_matrix_check_outcomes_from_local_json_path \
-    "${MATRIX_JSON_REPORT_PATH}" \
-    "${MATRIX_CHECK_EXPECTED_OUTCOME}"
-  log_info 'Listed failed assessment checks.'
-  log_info "Verifying MATRIX report ${report} is free of errors."
-  ensure_no_errors_in_matrix_checks "${MATRIX_JSON_REPORT_PATH}"
-  log_info "Verified MATRIX report ${report} is free of errors."
-  log_info "Verifying outcome of local storage check for report ${report}."
-  ensure_matrix_check_outcomes_from_local_json_path \
-    "${MATRIX_JSON_REPORT_PATH}" \
-    "${MATRIX_CHECK_TO_ANALYZE}" \
-    "${MATRIX_CHECK_EXPECTED_OUTCOME}"
-  log_info "Verified outcome of local storage check for report ${report}."
+  log_info "Verified MATRIX report ${MATRIX_JSON_REPORT_PATH}."
 }
 
 print_matching_matrix_check_outcomes_from_local_json_path()
@@ -530,38 +645,36 @@ ensure_matrix_check_outcomes_from_local_json_path()
   }
 }
 
-compress_matrix_runtime_artifacts()
+pull_matrix_runtime_artifacts()
 {
   local INSTANCE_ID="${1:?}"
-  local INSTANCE_SERVICES_IP INSTANCE_FLAVOR
+  local LOCAL_ARCHIVE_PATH="${2:?}"
+  local INSTANCE_SERVICES_IP INSTANCE_FLAVOR TRANSPORT
   INSTANCE_SERVICES_IP="$(get_instance_services_ip "${INSTANCE_ID}")"
   INSTANCE_FLAVOR="$(get_instance_flavor "${INSTANCE_ID}")"
   case "${INSTANCE_FLAVOR}" in
     ranchu)
       DEVICE_TEMP_DIRECTORY='/data/local/tmp'
+      TRANSPORT='adb'
+      is_services_ip_conneted_with_adb "${INSTANCE_SERVICES_IP}" || {
+        log_error "Cannot find adb connection to ${INSTANCE_SERVICES_IP}."
+        exit 1
+      }
       ;;
     *)
       DEVICE_TEMP_DIRECTORY='/tmp'
+      TRANSPORT='ssh'
       ;;
   esac
-  local ARCHIVE_INPUT_ARTIFACTS_PATH="${DEVICE_TEMP_DIRECTORY}/artifacts/"
-  local ARCHIVE_INPUT_ASSESSMENT_PATH="${DEVICE_TEMP_DIRECTORY}/assessment.*/"
-  local ARCHIVE_OUTPUT_PATH='/tmp/matrix_artifacts.tar.gz'
-
-  local TARGET_COMMANDS=(
-    "tar -czvf ${ARCHIVE_OUTPUT_PATH} ${ARCHIVE_INPUT_ARTIFACTS_PATH} ${ARCHIVE_INPUT_ASSESSMENT_PATH}"
-    "ls -l ${ARCHIVE_OUTPUT_PATH}"
-    "sha256sum ${ARCHIVE_OUTPUT_PATH}"
-  )
-  for target_command in "${TARGET_COMMANDS[@]}"; do
-    if [ "${INSTANCE_FLAVOR}" = 'ranchu' ]; then
-      remote_code_execution_with_adb \
-        "${INSTANCE_SERVICES_IP}" \
-        "${target_command}"
-    else
-      remote_code_execution_with_ssh \
-        "${INSTANCE_SERVICES_IP}" \
-        "${target_command}"
-    fi
-  done
+  # Stream the tar over one channel instead of writing an archive to the device disk and copying it off
+  log_info "Pulling MATRIX runtime artifacts from ${INSTANCE_SERVICES_IP} to ${LOCAL_ARCHIVE_PATH}."
+  python3 src/util/artifact_puller.py \
+    "${TRANSPORT}" \
+    "${INSTANCE_SERVICES_IP}" \
+    "${LOCAL_ARCHIVE_PATH}" \
+    "${DEVICE_TEMP_DIRECTORY}/artifacts/" \
+    "${DEVICE_TEMP_DIRECTORY}/assessment.*/" || {
+    log_error 'Failed to pull MATRIX runtime artifacts.'
+    exit 1
+  }
 }
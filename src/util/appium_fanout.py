@@ -0,0 +1,213 @@
+"""
+Run the Corellium Cafe Appium flow on several devices at once with a bounded worker pool.
+
+Each session gets its own cancellable deadline instead of the process-wide SIGALRM used by
+run_app_automation(), and produces its own result record instead of exiting the whole run.
+
+Usage:
+    python3 src/util/appium_fanout.py android 10.11.1.1 10.11.1.2 --workers 2
+    python3 src/util/appium_fanout.py ios <udid> <udid> --results appium_fanout_results.json
+"""
+
+import argparse
+import json
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from appium import webdriver
+from selenium.common.exceptions import WebDriverException
+
+import appium_interactions_cafe_android
+import appium_interactions_cafe_ios
+import appium_page_index
+import appium_screenshots
+import appium_session_broker
+
+PLATFORMS = {
+    'android': (appium_interactions_cafe_android, 'data/config/appium_android.json'),
+    'ios': (appium_interactions_cafe_ios, 'data/config/appium_ios.json'),
+}
+SESSION_STATUS_PASSED = 'passed'
+SESSION_STATUS_FAILED = 'failed'
+SESSION_STATUS_TIMEOUT = 'timeout'
+
+
+@dataclass
+class SessionResult:  # pylint: disable=too-many-instance-attributes
+    'Outcome of one Appium session in a fan-out run.'
+    target: str
+    udid: str
+    status: str = SESSION_STATUS_FAILED
+    exit_code: int = 1
+    error: str = ''
+    started_at: str = ''
+    duration_seconds: float = 0.0
+    screenshots: dict = field(default_factory=dict)
+
+
+class SessionDeadline:
+    '''Per-session timeout that cancels the session by closing its driver from a timer thread.
+
+    Closing the WebDriver session makes the in-flight command fail with a WebDriverException, so the
+    session unwinds on its own thread without touching any other session in the process.
+    '''
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expired = threading.Event()
+        self._driver = None
+        self._lock = threading.Lock()
+        self._timer = threading.Timer(seconds, self._expire)
+        self._timer.daemon = True
+
+
+    def start(self):
+        '''Start counting down'''
+        self._timer.start()
+
+
+    def attach(self, driver: webdriver.Remote):
+        '''Register the session driver, quitting it at once if the deadline already passed'''
+        with self._lock:
+            self._driver = driver
+            expired = self.expired.is_set()
+        if expired:
+            quit_quietly(driver)
+
+
+    def cancel(self):
+        '''Stop the countdown once the session has finished'''
+        self._timer.cancel()
+
+
+    def _expire(self):
+        '''Mark the deadline as expired and close the driver to interrupt the session'''
+        with self._lock:
+            self.expired.set()
+            driver = self._driver
+        if driver is not None:
+            if isinstance(driver, appium_session_broker.BrokeredRemote):
+                # A session interrupted mid-command is in an unknown state, so the broker should not reuse it
+                driver.broker_healthy = False
+            quit_quietly(driver)
+
+
+def quit_quietly(driver: webdriver.Remote):
+    '''Close a driver, ignoring errors from a session that is already gone'''
+    try:
+        driver.quit()
+    except WebDriverException:
+        pass
+
+
+def device_prefix(udid: str) -> str:
+    '''Filename-safe prefix for files written by one device's session'''
+    return re.sub(r'[^A-Za-z0-9]+', '_', udid).strip('_')
+
+
+def session_screenshots(screenshots: dict, udid: str) -> dict:
+    '''Prefix screenshot filenames with the device so parallel sessions do not overwrite each other'''
+    return {page: f'{device_prefix(udid)}_{filename}' for page, filename in screenshots.items()}
+
+
+def run_session(platform: str, config, target: str, udid: str, timeout: float) -> SessionResult:
+    '''Run interact_with_app() on one device and return its result record'''
+    module, _ = PLATFORMS[platform]
+    screenshots = session_screenshots(config.target_app['screenshots'], udid)
+    result = SessionResult(target=target, udid=udid, screenshots=screenshots,
+                           started_at=datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"))
+    deadline = SessionDeadline(timeout)
+    screenshot_pipeline = appium_screenshots.pipeline_from_config(
+        config.target_app, manifest_name=f'{device_prefix(udid)}_{appium_screenshots.DEFAULT_MANIFEST_NAME}')
+    start_time = time.monotonic()
+    driver = None
+    deadline.start()
+    try:
+        module.log_stdout(f"[{udid}] Loading target app in Appium session.")
+        driver = appium_session_broker.open_driver(module.get_appium_server_socket(config),
+                                                   options=module.build_options(config=config, udid=udid))
+        deadline.attach(driver)
+        driver.implicitly_wait(time_to_wait=config.timeouts['implicit_wait'])
+        module.log_stdout(f"[{udid}] Starting app interactions.")
+        helper = module.AppiumHelper(timeout=config.timeouts['explicit_wait'], driver=driver, screenshot_pipeline=screenshot_pipeline,
+                                     use_page_index=appium_page_index.page_index_from_env(),
+                                     wait_profiles=config.timeouts.get('wait_profiles'))
+        module.interact_with_app(helper=helper, screenshots=screenshots)
+        module.log_stdout(f"[{udid}] Finished app interactions.")
+        helper.save_wait_history()
+        module.log_stdout(f"[{udid}] {helper.cache_summary()}")
+        result.status = SESSION_STATUS_PASSED
+        result.exit_code = 0
+    except WebDriverException as e:
+        result.error = f'{type(e).__name__}: {e.msg if e.msg else e}'
+    except SystemExit as e:
+        # AppiumHelper exits on wait timeouts, which must only end this session
+        result.error = f'SystemExit: {e.code}'
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        # Any other failure in one session is recorded on its result so the other sessions keep going
+        result.error = f'{type(e).__name__}: {e}'
+    finally:
+        deadline.cancel()
+        screenshot_pipeline.close()
+        if deadline.expired.is_set():
+            result.status = SESSION_STATUS_TIMEOUT
+            result.exit_code = 1
+            result.error = f'Session exceeded its {timeout} second deadline. {result.error}'.strip()
+        if driver is not None and not deadline.expired.is_set():
+            module.log_stdout(f"[{udid}] Closing appium session.")
+            quit_quietly(driver)
+        result.duration_seconds = round(time.monotonic() - start_time, 3)
+    return result
+
+
+def get_udid(platform: str, config, target: str) -> str:
+    '''Map a services IP to an adb socket on Android; iOS targets are already UDIDs'''
+    if platform == 'android' and ':' not in target:
+        return f"{target}:{config.corellium['adb_port']}"
+    return target
+
+
+def run_fanout(platform: str, config, targets: list[str], max_workers: int, timeout: float) -> list[SessionResult]:
+    '''Run one session per target with at most max_workers sessions at a time'''
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='appium-session') as executor:
+        futures = [
+            executor.submit(run_session, platform, config, target, get_udid(platform, config, target), timeout)
+            for target in targets
+        ]
+        return [future.result() for future in futures]
+
+
+def load_config(platform: str):
+    '''Load the platform config the same way the single-device scripts do'''
+    module, config_path = PLATFORMS[platform]
+    with open(file=config_path, mode='r', encoding='utf-8') as f:
+        return module.AppiumConfig(**json.load(f))
+
+
+def main() -> int:
+    '''Parse arguments, run the fan-out, print a summary, and return the exit status'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('platform', choices=sorted(PLATFORMS))
+    parser.add_argument('targets', nargs='+', help='Android services IPs or iOS UDIDs')
+    parser.add_argument('--workers', type=int, default=4, help='maximum concurrent sessions')
+    parser.add_argument('--timeout', type=float, default=None, help='per-session deadline in seconds (default: automation_alarm)')
+    parser.add_argument('--results', default='appium_fanout_results.json', help='where to write the per-session results')
+    args = parser.parse_args()
+
+    config = load_config(args.platform)
+    timeout = args.timeout or config.timeouts['automation_alarm']
+    results = run_fanout(args.platform, config, args.targets, max(1, args.workers), timeout)
+    with open(file=args.results, mode='w', encoding='utf-8') as f:
+        json.dump([asdict(result) for result in results], f, indent=2)
+
+    for result in results:
+        print(f"{result.udid:<40} {result.status:<8} {result.duration_seconds:>8.1f}s {result.error}")
+    return 0 if all(result.exit_code == 0 for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
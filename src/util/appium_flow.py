@@ -0,0 +1,325 @@
+"""
+Declarative, cross-platform Appium flows for the Corellium Cafe apps.
+
+A flow is a JSON list of steps. Each step names an action and gives one locator per platform, so the
+Android and iOS scripts share a single description of the app journey. A flow is compiled once per
+platform into a plan: locator strategies are resolved and validated up front, steps for other platforms
+are dropped, and a wait followed by an action on the same element is merged into one lookup. A single
+executor then runs the plan, filling consecutive set_value steps as one form, and records how long each step took.
+
+Usage:
+    python3 src/util/appium_flow.py android 10.11.1.1
+    python3 src/util/appium_flow.py ios <udid> --flow data/config/appium_flow_cafe.json
+"""
+
+import argparse
+import json
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from appium.webdriver.common.appiumby import AppiumBy
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+import appium_page_index
+import appium_screenshots
+import appium_session_broker
+import appium_tracing
+import appium_waits
+from appium_helper import LOCATOR_CONDITIONS, AppiumHelper, log_stdout
+
+DEFAULT_FLOW_PATH = 'data/config/appium_flow_cafe.json'
+PLATFORM_NAMES = ('android', 'ios')
+ELEMENT_ACTIONS = {'click', 'set_value', 'find', 'wait_visible', 'wait_clickable'}
+DEVICE_ACTIONS = ELEMENT_ACTIONS | {'screenshot'}
+ACTIONS = DEVICE_ACTIONS | {'log'}
+WAIT_ACTIONS = {'wait_visible': 'visible', 'wait_clickable': 'clickable', 'find': 'present'}
+DEFAULT_WAITS = {'click': 'clickable', 'set_value': 'present', 'find': 'present'}
+# A merged step keeps the strictest of the two waits
+WAIT_STRENGTH = {'present': 0, 'visible': 1, 'clickable': 2}
+
+
+class FlowError(Exception):
+    '''Exception raised when a flow file cannot be compiled for a platform.'''
+
+
+@dataclass
+class PlanStep:  # pylint: disable=too-many-instance-attributes
+    'One compiled step with its locator strategy already resolved.'
+    name: str
+    action: str
+    by: str | None = None
+    value: str | None = None
+    wait: str | None = None
+    wait_profile: str | None = None
+    text: str | None = None
+    verify: bool = True
+    screenshot: str | None = None
+    message: str | None = None
+    navigates: bool = True
+    merged: list = field(default_factory=list)
+
+
+@dataclass
+class FlowPlan:
+    'A flow compiled for one platform.'
+    name: str
+    platform: str
+    steps: list[PlanStep]
+    merged_steps: int = 0
+
+
+@dataclass
+class StepTiming:
+    'How long one plan step took to run.'
+    name: str
+    action: str
+    duration_ms: float
+    merged: list = field(default_factory=list)
+
+
+def load_flow(path: str) -> dict:
+    '''Read a flow definition from a JSON file'''
+    with open(file=path, mode='r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def resolve_strategy(name: str, step_name: str) -> str:
+    '''Map an AppiumBy attribute name such as ID or IOS_CLASS_CHAIN to its locator strategy'''
+    strategy = getattr(AppiumBy, name, None) if name.isupper() else None
+    if not isinstance(strategy, str):
+        raise FlowError(f"Step '{step_name}' uses unknown locator strategy '{name}'.")
+    return strategy
+
+
+def compile_step(step: dict, index: int, platform: str, defaults: dict) -> PlanStep | None:
+    '''Compile one flow step for a platform, or return None if the step does not apply to it'''
+    name = step.get('name') or f"step-{index + 1}"
+    platform_fields = step.get(platform)
+    if platform_fields is None and (any(key in step for key in PLATFORM_NAMES) or platform not in step.get('platforms', PLATFORM_NAMES)):
+        return None
+    # Platform blocks hold the locator and may override any other step field
+    fields = {**defaults, **step, **(platform_fields or {})}
+    action = fields.get('action')
+    if action not in ACTIONS:
+        raise FlowError(f"Step '{name}' has unknown action '{action}'.")
+
+    plan_step = PlanStep(name=name, action=action, text=fields.get('text'), verify=fields.get('verify', True),
+                         screenshot=fields.get('screenshot'), message=fields.get('message'),
+                         navigates=fields.get('navigates', True))
+    if action in ELEMENT_ACTIONS:
+        if not fields.get('by') or not fields.get('value'):
+            raise FlowError(f"Step '{name}' needs a {platform} locator with 'by' and 'value'.")
+        plan_step.by = resolve_strategy(fields['by'], name)
+        plan_step.value = fields['value']
+        plan_step.wait = WAIT_ACTIONS.get(action) or fields.get('wait') or DEFAULT_WAITS[action]
+        if plan_step.wait not in LOCATOR_CONDITIONS:
+            raise FlowError(f"Step '{name}' has unknown wait '{plan_step.wait}'.")
+        plan_step.wait_profile = fields.get('wait_profile')
+        if plan_step.wait_profile is not None and plan_step.wait_profile not in appium_waits.DEFAULT_PROFILES:
+            raise FlowError(f"Step '{name}' has unknown wait profile '{plan_step.wait_profile}'.")
+    if action == 'set_value' and plan_step.text is None:
+        raise FlowError(f"Step '{name}' needs 'text' to set.")
+    if action == 'screenshot' and not plan_step.screenshot:
+        raise FlowError(f"Step '{name}' needs a 'screenshot' key from target_app.screenshots.")
+    return plan_step
+
+
+def merge_redundant_finds(steps: list[PlanStep]) -> tuple[list[PlanStep], int]:
+    '''Fold a wait or find into the next element action when both target the same locator
+
+    Log steps do not touch the device, so they do not separate a wait from the action that follows it.
+    '''
+    merged_steps: list[PlanStep] = []
+    merged_count = 0
+    pending: PlanStep | None = None
+    for step in steps:
+        if step.action == 'log':
+            merged_steps.append(step)
+            continue
+        if (pending is not None and step.action in ELEMENT_ACTIONS
+                and (pending.by, pending.value) == (step.by, step.value)):
+            merged_steps.remove(pending)
+            step.merged = [*pending.merged, pending.name]
+            if WAIT_STRENGTH[pending.wait] > WAIT_STRENGTH[step.wait]:
+                step.wait = pending.wait
+            step.wait_profile = step.wait_profile or pending.wait_profile
+            merged_count += 1
+        merged_steps.append(step)
+        pending = step if step.action in WAIT_ACTIONS else None
+    return merged_steps, merged_count
+
+
+def form_batches(steps: list[PlanStep]) -> list[list[PlanStep]]:
+    '''Group consecutive set_value steps into forms that can be resolved from one page snapshot
+
+    Every other step is a batch of its own. Fields in a form share a wait profile, since the helper fills them with one.
+    '''
+    batches: list[list[PlanStep]] = []
+    for step in steps:
+        previous = batches[-1][-1] if batches else None
+        if (previous is not None and step.action == 'set_value' and previous.action == 'set_value'
+                and step.wait_profile == previous.wait_profile):
+            batches[-1].append(step)
+        else:
+            batches.append([step])
+    return batches
+
+
+def compile_flow(flow: dict, platform: str) -> FlowPlan:
+    '''Compile a flow definition into a plan for one platform'''
+    if platform not in PLATFORM_NAMES:
+        raise FlowError(f"Unsupported platform '{platform}'.")
+    defaults = flow.get('platform_defaults', {}).get(platform, {})
+    steps = [compile_step(step, index, platform, defaults) for index, step in enumerate(flow.get('steps', []))]
+    steps, merged_count = merge_redundant_finds([step for step in steps if step is not None])
+    return FlowPlan(name=flow.get('name', 'flow'), platform=platform, steps=steps, merged_steps=merged_count)
+
+
+class FlowExecutor:
+    '''Run a compiled plan through an AppiumHelper and time every step.'''
+
+    def __init__(self, helper: AppiumHelper, screenshots: dict, tracer: appium_tracing.Tracer | None = None):
+        self.helper = helper
+        self.screenshots = screenshots
+        self.tracer = tracer
+        self.timings: list[StepTiming] = []
+
+
+    def run(self, plan: FlowPlan) -> list[StepTiming]:
+        '''Run every step in order and return the per-step timings'''
+        for batch in form_batches(plan.steps):
+            step = batch[0]
+            start = time.perf_counter_ns()
+            if self.tracer is None or step.action == 'log':
+                self.run_batch(batch)
+            else:
+                with self.tracer.span(step.name, appium_tracing.CATEGORY_STEP, action=step.action):
+                    self.run_batch(batch)
+            duration_ms = (time.perf_counter_ns() - start) / 1_000_000
+            if step.action != 'log':
+                # A form is timed as one step, listing the fields filled along with it
+                merged = [*step.merged, *(name for field_step in batch[1:] for name in (*field_step.merged, field_step.name))]
+                self.timings.append(StepTiming(name=step.name, action=step.action,
+                                               duration_ms=round(duration_ms, 3), merged=merged))
+        return self.timings
+
+
+    def run_batch(self, batch: list[PlanStep]):
+        '''Run a single step, or fill a form of set_value steps and then verify the fields that ask for it'''
+        if len(batch) == 1:
+            self.run_step(batch[0])
+            return
+        self.on_step_timeout(batch[0], lambda: self.helper.fill_form([(step.by, step.value, step.text, step.wait) for step in batch],
+                                                                     profile=batch[0].wait_profile))
+        for step in batch:
+            if step.verify:
+                self.helper.wait_until_element_value(by=step.by, value=step.value, desired_value=step.text)
+
+
+    def run_step(self, step: PlanStep):
+        '''Run one plan step'''
+        match step.action:
+            case 'log':
+                log_stdout(step.message)
+            case 'screenshot':
+                self.helper.save_screenshot(filename=self.screenshots[step.screenshot])
+            case 'click':
+                self.on_step_timeout(step, lambda: self.helper.click(by=step.by, value=step.value, condition=step.wait,
+                                                                     navigates=step.navigates, profile=step.wait_profile))
+            case 'set_value':
+                self.on_step_timeout(step, lambda: self.helper.type_text(by=step.by, value=step.value, text=step.text,
+                                                                         condition=step.wait, profile=step.wait_profile))
+                if step.verify:
+                    self.helper.wait_until_element_value(by=step.by, value=step.value, desired_value=step.text)
+            case _:
+                self.find(step)
+
+
+    def on_step_timeout(self, step: PlanStep, operation):
+        '''Run a helper operation, exiting with the step name if its element never meets the wait condition'''
+        try:
+            return operation()
+        except TimeoutException as e:
+            print(f"Timeout: Element for step '{step.name}' not {step.wait} after {self.helper.wait.last_timeout:g} seconds.")
+            print(f"TimeoutException: {e}")
+            sys.exit(1)
+
+
+    def find(self, step: PlanStep):
+        '''Locate the step element with its explicit wait condition, reusing the helper element cache'''
+        return self.on_step_timeout(step, lambda: self.helper.find_element(by=step.by, value=step.value, condition=step.wait,
+                                                                           profile=step.wait_profile))
+
+
+def print_timings(timings: list[StepTiming]):
+    '''Print per-step durations followed by the total'''
+    for timing in timings:
+        merged = f" (merged {', '.join(timing.merged)})" if timing.merged else ''
+        print(f"{timing.name:<36} {timing.action:<14} {timing.duration_ms:>10.1f} ms{merged}")
+    print(f"{'total':<36} {'':<14} {sum(timing.duration_ms for timing in timings):>10.1f} ms")
+
+
+def run_flow(platform: str, config, udid: str, plan: FlowPlan) -> list[StepTiming]:
+    '''Open an Appium session, run the plan, and close the session'''
+    # Imported here so compiling a flow does not need the per-platform scripts
+    import appium_fanout  # pylint: disable=import-outside-toplevel
+    module, _ = appium_fanout.PLATFORMS[platform]
+    tracer = appium_tracing.tracer_from_env()
+    screenshot_pipeline = appium_screenshots.pipeline_from_config(config.target_app)
+    log_stdout("Loading target app in Appium session.")
+    appium_server_socket = module.get_appium_server_socket(config)
+    driver = appium_session_broker.open_driver(appium_server_socket, options=module.build_options(config=config, udid=udid),
+                                               command_executor=appium_tracing.command_executor(appium_server_socket, tracer))
+    try:
+        # A short implicit wait lets each explicit-wait poll wait on the device (see appium_waits)
+        driver.implicitly_wait(time_to_wait=config.timeouts['implicit_wait'])
+        log_stdout(f"Running flow '{plan.name}' with {len(plan.steps)} steps ({plan.merged_steps} merged).")
+        helper = AppiumHelper(timeout=config.timeouts['explicit_wait'], driver=driver, screenshot_pipeline=screenshot_pipeline,
+                              use_page_index=appium_page_index.page_index_from_env(),
+                              wait_profiles=config.timeouts.get('wait_profiles'))
+        timings = FlowExecutor(helper=helper, screenshots=config.target_app['screenshots'], tracer=tracer).run(plan)
+        helper.save_wait_history()
+        log_stdout(helper.cache_summary())
+        return timings
+    finally:
+        screenshot_pipeline.close()
+        log_stdout("Closing appium session.")
+        driver.quit()
+        appium_tracing.finish(tracer)
+
+
+def main() -> int:
+    '''Compile the flow, run it on one device, and write the step timings'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('platform', choices=PLATFORM_NAMES)
+    parser.add_argument('target', help='Android services IP or iOS UDID')
+    parser.add_argument('--flow', default=DEFAULT_FLOW_PATH, help='flow definition to run')
+    parser.add_argument('--timings', default=None, help='where to write step timings (default: appium_flow_timings_<platform>.json)')
+    parser.add_argument('--compile-only', action='store_true', help='print the compiled plan without opening a session')
+    args = parser.parse_args()
+
+    try:
+        plan = compile_flow(load_flow(args.flow), args.platform)
+    except FlowError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    if args.compile_only:
+        print(json.dumps(asdict(plan), indent=2))
+        return 0
+
+    import appium_fanout  # pylint: disable=import-outside-toplevel
+    config = appium_fanout.load_config(args.platform)
+    udid = appium_fanout.get_udid(args.platform, config, args.target)
+    try:
+        timings = run_flow(args.platform, config, udid, plan)
+    except WebDriverException as e:
+        print(f"Appium flow failed: {type(e).__name__}: {e.msg if e.msg else e}", file=sys.stderr)
+        return 1
+    print_timings(timings)
+    with open(file=args.timings or f'appium_flow_timings_{args.platform}.json', mode='w', encoding='utf-8') as f:
+        json.dump({'flow': plan.name, 'platform': plan.platform, 'steps': [asdict(timing) for timing in timings]}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""
+Shared Appium helpers for the Corellium Cafe Android and iOS automation scripts.
+"""
+
+import os
+import sys
+from datetime import datetime, timezone
+from appium import webdriver
+from selenium.webdriver.common.actions import interaction
+from selenium.webdriver.common.actions.action_builder import ActionBuilder
+from selenium.webdriver.common.actions.pointer_input import PointerInput
+from selenium.common.exceptions import (
+    StaleElementReferenceException,
+    TimeoutException,
+)
+from selenium.webdriver.support.expected_conditions import (
+    element_to_be_clickable,
+    presence_of_element_located,
+    visibility_of_element_located,
+)
+from selenium.webdriver.remote.webelement import WebElement
+from appium_page_index import IndexedNode, PageIndex, STRATEGY_ATTRIBUTES
+from appium_waits import (
+    PROFILE_DEFAULT,
+    PROFILE_INPUT,
+    PROFILE_NAVIGATION,
+    AdaptiveWait,
+    ReadinessHistory,
+    build_profiles,
+    configure_server_waits,
+)
+
+LOCATOR_CONDITIONS = {
+    'present': presence_of_element_located,
+    'visible': visibility_of_element_located,
+    'clickable': element_to_be_clickable,
+}
+# Checks run against a cached element instead of locating it again; present needs no round trip
+CACHED_ELEMENT_CHECKS = {
+    'present': lambda element: True,
+    'visible': lambda element: element.is_displayed(),
+    'clickable': lambda element: element.is_displayed() and element.is_enabled(),
+}
+
+
+class AppiumHelper:  # pylint: disable=too-many-instance-attributes
+    '''Wrapper around appium.webdriver and adaptive explicit waits to improve readability and reduce repeated code in interact_with_app().
+
+    Elements are cached by (by, value) for the current screen, so a wait followed by an action on the same
+    element costs one lookup instead of two. Clicks are treated as navigation and clear the cache, and a
+    stale cached element is dropped and located again.
+
+    With use_page_index the helper instead resolves locators from one page_source snapshot per screen and
+    taps the element's coordinates, falling back to a live find when the snapshot does not have the element or has
+    it hidden. The snapshot is kept until a navigating click or a miss, and fill_form resolves every field of a
+    form against it in one pass before typing, since the keyboard can move fields once typing starts.
+
+    Waits poll per wait profile (see appium_waits): the first wait after a navigating click uses the navigation
+    profile, value checks use the input profile, and timeouts shrink to fit each locator's learned readiness time.
+    '''
+
+    def __init__(self, timeout: int, driver: webdriver.Remote, screenshot_pipeline=None,  # pylint: disable=too-many-arguments
+                 use_page_index: bool = False, *, wait_profiles: dict | None = None,
+                 wait_history: ReadinessHistory | None = None):
+        self.driver = driver
+        self.timeout = timeout
+        self.screenshot_pipeline = screenshot_pipeline
+        self.wait = AdaptiveWait(driver=driver, profiles=build_profiles(timeout, wait_profiles),
+                                 history=wait_history if wait_history is not None else ReadinessHistory.from_env())
+        self.after_navigation = False
+        self.element_cache: dict[tuple[str, str], WebElement] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        platform = str((driver.capabilities or {}).get('platformName', '')).lower()
+        self.page_index_platform = platform if use_page_index and platform in STRATEGY_ATTRIBUTES else None
+        self.page_index: PageIndex | None = None
+        self.page_snapshots = 0
+        self.index_hits = 0
+        self.index_misses = 0
+        self.server_waits = configure_server_waits(driver, platform)
+
+
+    def wait_profile(self, profile: str | None = None) -> str:
+        '''The given profile, or navigation for the first wait after a navigating click'''
+        if profile is not None:
+            return profile
+        return PROFILE_NAVIGATION if self.after_navigation else PROFILE_DEFAULT
+
+
+    def save_wait_history(self):
+        '''Keep this run's readiness times for the next run'''
+        self.wait.history.save()
+
+
+    def find_element(self, by: str, value: str, condition: str = 'present', profile: str | None = None) -> WebElement:
+        '''Return the cached element if it still meets condition, otherwise wait for it and cache it'''
+        locator = (by, value)
+        element = self.element_cache.get(locator)
+        if element is not None:
+            try:
+                if CACHED_ELEMENT_CHECKS[condition](element):
+                    self.cache_hits += 1
+                    return element
+            except StaleElementReferenceException:
+                self.invalidate_cache(by=by, value=value)
+        self.cache_misses += 1
+        element = self.wait.until(LOCATOR_CONDITIONS[condition](locator), key=f'{condition}:{by}={value}',
+                                  profile=self.wait_profile(profile))
+        self.after_navigation = False
+        self.element_cache[locator] = element
+        return element
+
+
+    def invalidate_cache(self, by: str | None = None, value: str | None = None):
+        '''Drop one cached element, or every cached element when no locator is given'''
+        if by is None:
+            self.element_cache.clear()
+            self.page_index = None
+        else:
+            self.element_cache.pop((by, value), None)
+
+
+    def cache_summary(self) -> str:
+        '''Describe element cache hits and misses for the session log'''
+        summary = f"Element cache: {self.cache_hits} hits, {self.cache_misses} misses. Waits: {self.wait.polls} polls."
+        if self.page_index_platform is not None:
+            summary += (f" Page index: {self.page_snapshots} snapshots, {self.index_hits} hits, "
+                        f"{self.index_misses} misses.")
+        return summary
+
+
+    def indexed_node(self, by: str, value: str, condition: str = 'present') -> IndexedNode | None:
+        '''Resolve a locator to a node that can be tapped by coordinates, or return None to fall back to a live find'''
+        if self.page_index_platform is None:
+            return None
+        return self._usable_node(self._snapshot().resolve(by, value), condition)
+
+
+    def _snapshot(self) -> PageIndex:
+        '''The page index for the current screen, taking a page_source snapshot if there is none'''
+        if self.page_index is None:
+            self.page_index = PageIndex.from_source(self.driver.page_source, self.page_index_platform)
+            self.page_snapshots += 1
+        return self.page_index
+
+
+    def _usable_node(self, node: IndexedNode | None, condition: str) -> IndexedNode | None:
+        '''Count an index hit or miss, dropping the snapshot on a miss so the next lookup sees the current screen'''
+        # Whatever the condition, a tap at the coordinates of a hidden node would land on something else
+        if node is None or not node.displayed or (condition == 'clickable' and not node.enabled):
+            self.index_misses += 1
+            self.page_index = None
+            return None
+        self.index_hits += 1
+        self.after_navigation = False
+        return node
+
+
+    def tap(self, node: IndexedNode, text: str | None = None):
+        '''Tap the centre of an indexed element and optionally type into it, in one W3C actions request'''
+        actions = ActionBuilder(self.driver, mouse=PointerInput(interaction.POINTER_TOUCH, 'finger'))
+        actions.pointer_action.move_to_location(*node.center).pointer_down().pointer_up()
+        if text:
+            # Idle the keyboard for the three pointer ticks so the keys land after the tap
+            actions.key_action.pause().pause().pause().send_keys(text)
+        actions.perform()
+
+
+    def click(self, by: str, value: str, condition: str = 'present', navigates: bool = True,  # pylint: disable=too-many-arguments
+              profile: str | None = None):
+        '''Click an element, tapping its indexed coordinates when the page index has it'''
+        node = self.indexed_node(by=by, value=value, condition=condition)
+        if node is not None:
+            self.tap(node)
+        else:
+            try:
+                self._find_live(by=by, value=value, condition=condition, profile=profile).click()
+            except StaleElementReferenceException:
+                self.invalidate_cache(by=by, value=value)
+                self._find_live(by=by, value=value, condition=condition, profile=profile).click()
+        if navigates:
+            # A click can open another screen, so elements found before it may no longer be there
+            self.invalidate_cache()
+            self.after_navigation = True
+
+
+    def type_text(self, by: str, value: str, text: str, condition: str = 'present',  # pylint: disable=too-many-arguments
+                  profile: str | None = None):
+        '''Type into an element, tapping its indexed coordinates when the page index has it'''
+        self._type_into(self.indexed_node(by=by, value=value, condition=condition), by=by, value=value, text=text,
+                        condition=condition, profile=profile)
+
+
+    def fill_form(self, fields: list[tuple[str, str, str, str]], profile: str | None = None):
+        '''Type into each (by, value, text, condition) field, resolving every field from one page index snapshot'''
+        if self.page_index_platform is None:
+            for by, value, text, condition in fields:
+                self._type_into(None, by=by, value=value, text=text, condition=condition, profile=profile)
+            return
+        snapshot = self._snapshot()
+        # Resolved before the first tap, which opens the keyboard and can resize the screen under later fields
+        nodes = snapshot.resolve_many([(by, value) for by, value, _, _ in fields])
+        for by, value, text, condition in fields:
+            if self.page_index is snapshot:
+                node = self._usable_node(nodes[(by, value)], condition)
+            else:
+                # A miss dropped the snapshot, so the remaining fields are resolved against a fresh one
+                node = self.indexed_node(by=by, value=value, condition=condition)
+            self._type_into(node, by=by, value=value, text=text, condition=condition, profile=profile)
+
+
+    def _type_into(self, node: IndexedNode | None, by: str, value: str, text: str,  # pylint: disable=too-many-arguments,too-many-positional-arguments
+                   condition: str, profile: str | None):
+        '''Tap and type into an indexed node, or find the element live and send keys to it'''
+        if node is not None:
+            self.tap(node, text=text)
+            return
+        try:
+            self._find_live(by=by, value=value, condition=condition, profile=profile).send_keys(text)
+        except StaleElementReferenceException:
+            self.invalidate_cache(by=by, value=value)
+            self._find_live(by=by, value=value, condition=condition, profile=profile).send_keys(text)
+
+
+    def click_when_ready(self, by: str, value: str, navigates: bool = True):
+        '''Wait until an element is clickable then click it'''
+        try:
+            self.click(by=by, value=value, condition='clickable', navigates=navigates)
+        except TimeoutException as e:
+            print(f"Timeout: Element not clickable after {self.wait.last_timeout:g} seconds.")
+            print(f"TimeoutException: {e}")
+            sys.exit(1)
+
+
+    def save_screenshot(self, filename: str = "screenshot.png"):
+        '''Capture a screenshot and save to working directory, in the background when a pipeline is attached'''
+        if self.screenshot_pipeline is not None:
+            self.screenshot_pipeline.capture(self.driver, filename)
+            log_stdout(f"Appium - Captured screenshot {filename}; writing in the background.")
+            return
+        screenshot_path: str = os.path.join(os.getcwd(), filename)
+        log_stdout(f"Appium - Saving screenshot as {filename}.")
+        self.driver.save_screenshot(screenshot_path)
+        log_stdout("Appium - Saved screenshot.")
+
+
+    def set_element_value(self, by: str, value: str, desired_value: str):
+        '''Find an element, send keys, then wait until element value'''
+        try:
+            self.type_text(by=by, value=value, text=desired_value)
+            self.wait_until_element_value(by=by, value=value, desired_value=desired_value)
+        except TimeoutException as e:
+            print(f"Timeout: Element not clickable after {self.wait.last_timeout:g} seconds.")
+            print(f"TimeoutException: {e}")
+            sys.exit(1)
+
+
+    def wait_until_clickable(self, by: str, value: str):
+        '''Wait until an element is clickable then return the element'''
+        try:
+            return self.find_element(by=by, value=value, condition='clickable')
+        except TimeoutException as e:
+            print(f"Timeout: Element not clickable after {self.wait.last_timeout:g} seconds.")
+            print(f"TimeoutException: {e}")
+            sys.exit(1)
+
+
+    def wait_until_visible(self, by: str, value: str):
+        '''Wait until an element is visible then return the element'''
+        try:
+            return self.find_element(by=by, value=value, condition='visible')
+        except TimeoutException as e:
+            print(f"Timeout: Element not visible after {self.wait.last_timeout:g} seconds.")
+            print(f"TimeoutException: {e}")
+            sys.exit(1)
+
+
+    def wait_until_element_value(self, by: str, value: str, desired_value):
+        '''Wait until text is present in an element value then return the elemeent'''
+        try:
+            return self.wait.until(self._cached_text_present(by=by, value=value, desired_value=desired_value),
+                                   key=f'value:{by}={value}', profile=PROFILE_INPUT)
+        except TimeoutException as e:
+            print(f"Timeout: Element value '{desired_value}' not present after {self.wait.last_timeout:g} seconds.")
+            print(f"TimeoutException: {e}")
+            sys.exit(1)
+
+
+    def _cached_text_present(self, by: str, value: str, desired_value: str):
+        '''Like text_to_be_present_in_element, but polls the cached element instead of locating it on every poll'''
+        def _predicate(driver):
+            element = self.element_cache.get((by, value))
+            if element is not None:
+                try:
+                    present = desired_value in element.text
+                except StaleElementReferenceException:
+                    self.invalidate_cache(by=by, value=value)
+                else:
+                    self.cache_hits += 1
+                    return element if present else False
+            self.cache_misses += 1
+            element = driver.find_element(by=by, value=value)
+            self.element_cache[(by, value)] = element
+            return element if desired_value in element.text else False
+        return _predicate
+
+
+    def _find_live(self, by: str, value: str, condition: str, profile: str | None = None) -> WebElement:
+        '''Locate an element the page index missed, dropping a snapshot that was taken before the element rendered'''
+        element = self.find_element(by=by, value=value, condition=condition, profile=profile)
+        if self.page_index is not None and self.page_index.can_resolve(by, value):
+            self.page_index = None
+        return element
+
+
+def log_stdout(message: str):
+    '''Print message to stdout with current timestamp'''
+    current_datetime = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+    print(f"[-] {current_datetime} INFO: {message}")
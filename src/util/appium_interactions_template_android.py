@@ -37,6 +37,7 @@ APPIUM_SERVER_SOCKET = f'http://{APPIUM_SERVER_IP}:{APPIUM_SERVER_PORT}'
 # ==== APPIUM DRIVER ====
 APPIUM_DRIVER_IMPLICITLY_WAIT=5 # seconds
 APPIUM_DRIVER_EXPLICITLY_WAIT=20 # seconds
+APPIUM_DRIVER_POLL_FREQUENCY=0.1 # seconds
 
 # =====================================
 # ===== END CONSTANTS DEFINITIONS =====
@@ -89,8 +90,10 @@ def run_app_automation(udid: str):
         log_stdout(f"Loading target app {TARGET_APP_PACKAGE} in Appium session.")
         driver = webdriver.Remote(APPIUM_SERVER_SOCKET, options=options)
         log_stdout("Successfully loaded target app.")
-        driver.implicitly_wait(APPIUM_DRIVER_IMPLICITLY_WAIT * 1000)
-        driver_wait = WebDriverWait(driver, APPIUM_DRIVER_EXPLICITLY_WAIT, ignored_exceptions=[StaleElementReferenceException])
+        # implicitly_wait takes seconds; pasted Inspector recordings call find_element directly and rely on it
+        driver.implicitly_wait(APPIUM_DRIVER_IMPLICITLY_WAIT)
+        driver_wait = WebDriverWait(driver, APPIUM_DRIVER_EXPLICITLY_WAIT, poll_frequency=APPIUM_DRIVER_POLL_FREQUENCY,
+                                    ignored_exceptions=[StaleElementReferenceException])
         log_stdout("Starting app interaction steps.")
         interact_with_app(driver, driver_wait)
         log_stdout("Finished app interactions.")
@@ -0,0 +1,227 @@
+"""
+In-memory index of an Appium page source for resolving many locators from one snapshot.
+
+Every find_element on a virtual device makes UiAutomator2 or XCUITest walk the accessibility tree. The
+index parses one page_source per screen and answers ID, accessibility ID, class name, simple UiSelector,
+simple iOS predicate, and simple iOS class chain locators locally, returning each element's bounds and state.
+Locators it cannot evaluate return None so the caller can fall back to a live find.
+
+The Cafe scripts turn the index on when APPIUM_PAGE_INDEX is set to 1.
+"""
+
+import os
+import re
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from appium.webdriver.common.appiumby import AppiumBy
+
+PAGE_INDEX_ENV_VAR = 'APPIUM_PAGE_INDEX'
+ANDROID_BOUNDS = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+IOS_CLASS_CHAIN = re.compile(r'\*\*/(?P<type>XCUIElementType\w+)(?:\[`(?P<attribute>\w+) == "(?P<value>(?:[^"\\]|\\.)*)"`\])?(?:\[(?P<index>\d+)\])?')
+IOS_PREDICATE_CLAUSE = re.compile(r'(?P<attribute>\w+) == "(?P<value>(?:[^"\\]|\\.)*)"')
+UI_SELECTOR_CALL = re.compile(r'\.(?P<method>\w+)\((?:"(?P<text>(?:[^"\\]|\\.)*)"|(?P<number>\d+))\)')
+UI_SELECTOR_ATTRIBUTES = {'text': 'text', 'resourceId': 'resource-id', 'description': 'content-desc', 'className': 'class'}
+# Attributes each locator strategy matches on, per platform
+STRATEGY_ATTRIBUTES = {
+    'android': {AppiumBy.ID: 'resource-id', AppiumBy.ACCESSIBILITY_ID: 'content-desc', AppiumBy.CLASS_NAME: 'class'},
+    'ios': {AppiumBy.ID: 'name', AppiumBy.ACCESSIBILITY_ID: 'name', AppiumBy.CLASS_NAME: 'type'},
+}
+INDEXED_ATTRIBUTES = {
+    'android': ('resource-id', 'content-desc', 'class', 'text'),
+    'ios': ('name', 'label', 'type', 'value'),
+}
+
+
+@dataclass
+class IndexedNode:
+    'One element from the page source with its on-screen rectangle.'
+    attributes: dict
+    rect: tuple[int, int, int, int]
+    order: int = 0
+
+    @property
+    def center(self) -> tuple[int, int]:
+        '''Point to tap to hit the element'''
+        x, y, width, height = self.rect
+        return x + width // 2, y + height // 2
+
+
+    @property
+    def displayed(self) -> bool:
+        '''True if the source marks the element visible'''
+        return self.attributes.get('displayed', self.attributes.get('visible', 'true')) == 'true'
+
+
+    @property
+    def enabled(self) -> bool:
+        '''True if the source marks the element enabled'''
+        return self.attributes.get('enabled', 'true') == 'true'
+
+
+def page_index_from_env() -> bool:
+    '''True when APPIUM_PAGE_INDEX asks the helper to resolve locators from page source snapshots'''
+    return os.environ.get(PAGE_INDEX_ENV_VAR, '').lower() in ('1', 'true', 'yes')
+
+
+def parse_ui_selector(selector: str) -> tuple[list[tuple[str, str]], int] | None:
+    '''Split a new UiSelector() chain into attribute filters and an instance, or None if it uses other methods'''
+    prefix = 'new UiSelector()'
+    if not selector.startswith(prefix):
+        return None
+    calls = list(UI_SELECTOR_CALL.finditer(selector, len(prefix)))
+    if not calls or ''.join(call[0] for call in calls) != selector[len(prefix):]:
+        return None
+    filters = []
+    instance = 0
+    for call in calls:
+        if call['method'] == 'instance' and call['number'] is not None:
+            instance = int(call['number'])
+        elif call['method'] in UI_SELECTOR_ATTRIBUTES and call['text'] is not None:
+            filters.append((UI_SELECTOR_ATTRIBUTES[call['method']], call['text'].replace('\\"', '"')))
+        else:
+            return None
+    return filters, instance
+
+
+def parse_ios_predicate(predicate: str) -> list[tuple[str, str]] | None:
+    '''Split an attr == "value" AND ... predicate into attribute filters, or None if it uses other operators'''
+    filters = []
+    position = 0
+    while True:
+        clause = IOS_PREDICATE_CLAUSE.match(predicate, position)
+        if clause is None:
+            return None
+        filters.append((clause['attribute'], clause['value'].replace('\\"', '"')))
+        position = clause.end()
+        if position == len(predicate):
+            return filters
+        if not predicate.startswith(' AND ', position):
+            return None
+        position += len(' AND ')
+
+
+def node_rect(attributes: dict) -> tuple[int, int, int, int]:
+    '''Read x, y, width, height from Android bounds or iOS x/y/width/height attributes'''
+    match = ANDROID_BOUNDS.fullmatch(attributes.get('bounds', ''))
+    if match:
+        left, top, right, bottom = (int(group) for group in match.groups())
+        return left, top, right - left, bottom - top
+    return tuple(int(float(attributes.get(key, 0))) for key in ('x', 'y', 'width', 'height'))
+
+
+class PageIndex:
+    '''Elements of one page source, indexed by the attributes locators match on.'''
+
+    def __init__(self, nodes: list[IndexedNode], platform: str):
+        self.platform = platform
+        self.nodes = nodes
+        self.by_attribute: dict[tuple[str, str], list[IndexedNode]] = {}
+        for node in nodes:
+            for attribute in INDEXED_ATTRIBUTES[platform]:
+                if node.attributes.get(attribute):
+                    self.by_attribute.setdefault((attribute, node.attributes[attribute]), []).append(node)
+
+
+    @classmethod
+    def from_source(cls, source: str, platform: str) -> 'PageIndex':
+        '''Parse a UiAutomator2 or XCUITest page source'''
+        return cls.from_tree(ET.fromstring(source), platform)
+
+
+    @classmethod
+    def from_tree(cls, root: ET.Element, platform: str) -> 'PageIndex':
+        '''Index a parsed page source; node order follows root.iter()'''
+        nodes = []
+        for order, element in enumerate(root.iter()):
+            attributes = dict(element.attrib)
+            if platform == 'android':
+                attributes.setdefault('class', element.tag)
+            else:
+                attributes.setdefault('type', element.tag)
+            nodes.append(IndexedNode(attributes=attributes, rect=node_rect(attributes), order=order))
+        return cls(nodes, platform)
+
+
+    def lookup(self, attribute: str, value: str) -> list[IndexedNode]:
+        '''Nodes whose attribute equals value, in document order'''
+        return self.by_attribute.get((attribute, value), [])
+
+
+    def resolve(self, by: str, value: str) -> IndexedNode | None:
+        '''Return the first node a live find would return, or None if the index cannot tell'''
+        matches = self.find_all(by, value)
+        return matches[0] if matches else None
+
+
+    def find_all(self, by: str, value: str) -> list[IndexedNode] | None:
+        '''Nodes a live find_elements would return, in document order, or None if the index cannot evaluate the locator'''
+        attribute = STRATEGY_ATTRIBUTES[self.platform].get(by)
+        if attribute is not None:
+            matches = self.lookup(attribute, value)
+            if not matches and self.platform == 'android' and by == AppiumBy.ID and ':id/' not in value:
+                # UiAutomator2 accepts bare IDs and prefixes the app package
+                matches = [node for node in self.nodes if node.attributes.get('resource-id', '').endswith(f':id/{value}')]
+            return matches
+        if by == AppiumBy.IOS_CLASS_CHAIN and self.platform == 'ios':
+            return self._find_class_chain(value)
+        if by == AppiumBy.IOS_PREDICATE and self.platform == 'ios':
+            return self._find_predicate(value)
+        if by == AppiumBy.ANDROID_UIAUTOMATOR and self.platform == 'android':
+            return self._find_ui_selector(value)
+        return None
+
+
+    def can_resolve(self, by: str, value: str) -> bool:
+        '''True if the index can evaluate the locator, so a miss means the element was not in the snapshot'''
+        if by in STRATEGY_ATTRIBUTES[self.platform]:
+            return True
+        if by == AppiumBy.IOS_CLASS_CHAIN and self.platform == 'ios':
+            return IOS_CLASS_CHAIN.fullmatch(value) is not None
+        if by == AppiumBy.IOS_PREDICATE and self.platform == 'ios':
+            return parse_ios_predicate(value) is not None
+        if by == AppiumBy.ANDROID_UIAUTOMATOR and self.platform == 'android':
+            return parse_ui_selector(value) is not None
+        return False
+
+
+    def resolve_many(self, locators: list[tuple[str, str]]) -> dict[tuple[str, str], IndexedNode | None]:
+        '''Resolve a batch of (by, value) locators against this one snapshot'''
+        return {locator: self.resolve(*locator) for locator in locators}
+
+
+    def _find_class_chain(self, chain: str) -> list[IndexedNode] | None:
+        '''Evaluate **/Type, **/Type[`attr == "value"`], and an optional [n] index'''
+        match = IOS_CLASS_CHAIN.fullmatch(chain)
+        if match is None:
+            return None
+        matches = self.lookup('type', match['type'])
+        if match['attribute']:
+            expected = match['value'].replace('\\"', '"')
+            matches = [node for node in matches if node.attributes.get(match['attribute']) == expected]
+        if not match['index']:
+            return matches
+        index = int(match['index']) - 1
+        return matches[index:index + 1] if index >= 0 else []
+
+
+    def _find_predicate(self, predicate: str) -> list[IndexedNode] | None:
+        '''Evaluate predicates made of attr == "value" clauses joined by AND'''
+        filters = parse_ios_predicate(predicate)
+        if filters is None:
+            return None
+        matches = self.nodes
+        for attribute, expected in filters:
+            matches = [node for node in matches if node.attributes.get(attribute) == expected]
+        return matches
+
+
+    def _find_ui_selector(self, selector: str) -> list[IndexedNode] | None:
+        '''Evaluate new UiSelector() chains of text, resourceId, description, className, and instance'''
+        parsed = parse_ui_selector(selector)
+        if parsed is None:
+            return None
+        filters, instance = parsed
+        matches = self.nodes
+        for attribute, expected in filters:
+            matches = [node for node in matches if node.attributes.get(attribute) == expected]
+        return matches[instance:instance + 1] if '.instance(' in selector else matches
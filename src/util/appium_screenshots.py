@@ -0,0 +1,178 @@
+"""
+Background screenshot pipeline for AppiumHelper.save_screenshot.
+
+Only the capture itself, which has to see the screen at that moment, runs on the interaction thread. The
+base64 payload is queued for a writer thread that decodes it, hashes it, optionally downscales and
+re-encodes it, and writes it to disk. A frame identical to an earlier one is not encoded or written again;
+its filename is hard-linked to the earlier file so every expected screenshot still exists. A manifest
+records when each frame was captured.
+
+Downscaling and JPEG/WebP output need Pillow; without it frames are written as captured PNGs.
+"""
+
+import base64
+import hashlib
+import io
+import json
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+DEFAULT_MANIFEST_NAME = 'screenshot_manifest.json'
+IMAGE_FORMATS = {'png': ('PNG', '.png'), 'jpeg': ('JPEG', '.jpg'), 'webp': ('WEBP', '.webp')}
+
+
+@dataclass
+class ScreenshotRecord:  # pylint: disable=too-many-instance-attributes
+    'Manifest entry for one captured frame.'
+    requested_filename: str
+    filename: str
+    captured_at: str
+    capture_ms: float
+    sha256: str = ''
+    bytes: int = 0
+    image_format: str = 'png'
+    duplicate_of: str | None = None
+    error: str | None = None
+
+
+class ScreenshotPipeline:  # pylint: disable=too-many-instance-attributes
+    '''Capture screenshots on the caller thread and encode and write them on a writer thread.'''
+
+    def __init__(self, output_dir: str | None = None, *, max_queue: int = 8,  # pylint: disable=too-many-arguments
+                 image_format: str = 'png', max_size: int | None = None, quality: int = 80,
+                 manifest_name: str = DEFAULT_MANIFEST_NAME):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported screenshot format '{image_format}'.")
+        self.output_dir = output_dir or os.getcwd()
+        self.image_format = image_format
+        self.max_size = max_size
+        self.quality = quality
+        self.manifest_path = os.path.join(self.output_dir, manifest_name)
+        if Image is None and (image_format != 'png' or max_size is not None):
+            print(f"WARNING: Pillow is not installed, so screenshots are saved as full-size PNG instead of {image_format} "
+                  f"with max_size {max_size}. Install it from requirements-pip-appium.txt.", file=sys.stderr)
+        self.records: list[ScreenshotRecord] = []
+        self._by_hash: dict[str, ScreenshotRecord] = {}
+        # A bounded queue makes capture() wait for the writer instead of holding every frame in memory
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._write_loop, name='screenshot-writer', daemon=True)
+        self._thread.start()
+        self._closed = False
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+
+    def capture(self, driver, filename: str) -> ScreenshotRecord:
+        '''Grab the current screen and queue it for writing'''
+        captured_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]
+        start = time.perf_counter_ns()
+        payload = driver.get_screenshot_as_base64()
+        record = ScreenshotRecord(requested_filename=filename, filename=filename, captured_at=captured_at,
+                                  capture_ms=round((time.perf_counter_ns() - start) / 1_000_000, 3))
+        self.records.append(record)
+        self._queue.put((record, payload))
+        return record
+
+
+    def close(self):
+        '''Wait for queued frames to be written, then write the manifest'''
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        with open(file=self.manifest_path, mode='w', encoding='utf-8') as f:
+            json.dump([asdict(record) for record in self.records], f, indent=2)
+
+
+    def _write_loop(self):
+        '''Write frames until close() queues the sentinel'''
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            record, payload = item
+            try:
+                self._write(record, base64.b64decode(payload))
+            except (OSError, ValueError) as e:
+                record.error = f'{type(e).__name__}: {e}'
+
+
+    def _write(self, record: ScreenshotRecord, png: bytes):
+        '''Deduplicate, encode, and write one frame'''
+        record.sha256 = hashlib.sha256(png).hexdigest()
+        record.filename = self._output_filename(record.requested_filename)
+        path = os.path.join(self.output_dir, record.filename)
+        original = self._by_hash.get(record.sha256)
+        if original is not None:
+            record.duplicate_of = original.filename
+            record.image_format = original.image_format
+            record.bytes = original.bytes
+            self._link(os.path.join(self.output_dir, original.filename), path)
+            return
+        data, record.image_format = self._encode(png)
+        if os.path.exists(path):
+            # The old file may be a hard link shared with another frame
+            os.remove(path)
+        with open(file=path, mode='wb') as f:
+            f.write(data)
+        record.bytes = len(data)
+        self._by_hash[record.sha256] = record
+
+
+    def _output_filename(self, filename: str) -> str:
+        '''Swap the extension when frames are re-encoded'''
+        if self.image_format == 'png' or Image is None:
+            return filename
+        return os.path.splitext(filename)[0] + IMAGE_FORMATS[self.image_format][1]
+
+
+    def _encode(self, png: bytes) -> tuple[bytes, str]:
+        '''Downscale and re-encode a PNG frame when configured and Pillow is available'''
+        if Image is None or (self.image_format == 'png' and self.max_size is None):
+            return png, 'png'
+        with Image.open(io.BytesIO(png)) as image:
+            if self.max_size is not None:
+                image.thumbnail((self.max_size, self.max_size))
+            if self.image_format == 'jpeg':
+                image = image.convert('RGB')
+            output = io.BytesIO()
+            image.save(output, format=IMAGE_FORMATS[self.image_format][0], quality=self.quality)
+        return output.getvalue(), self.image_format
+
+
+    @staticmethod
+    def _link(source: str, destination: str):
+        '''Point destination at an identical earlier frame without writing it again'''
+        if os.path.abspath(source) == os.path.abspath(destination):
+            return
+        if os.path.exists(destination):
+            os.remove(destination)
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
+
+
+def pipeline_from_config(target_app: dict, output_dir: str | None = None,
+                         manifest_name: str = DEFAULT_MANIFEST_NAME) -> ScreenshotPipeline:
+    '''Build a pipeline from the optional screenshot_format and screenshot_max_size target_app settings'''
+    return ScreenshotPipeline(output_dir=output_dir, image_format=target_app.get('screenshot_format', 'png'),
+                              max_size=target_app.get('screenshot_max_size'), manifest_name=manifest_name)
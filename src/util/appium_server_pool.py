@@ -0,0 +1,640 @@
+"""
+Pool of local Appium servers behind one WebDriver endpoint, so parallel sessions on a runner neither share a
+server nor collide on ports.
+
+A single Appium server handles every session on the runner, and every UiAutomator2 session asks for systemPort
+8200, chromedriverPort 9515, and mjpegServerPort 7810 unless told otherwise (wdaLocalPort 8100 and
+mjpegServerPort 9100 for XCUITest), so a second parallel session fails to start or takes over the first one's
+forward. The pool starts several Appium servers on their own ports and listens on 4723 itself, where
+data/config/appium_*.json already point the scripts. A new session goes to the healthy server with the fewest
+sessions, with free ports filled into any port capabilities the client left unset. Every later command for the
+session is forwarded to the same server. The ports are freed when the session is deleted, when it sits idle past
+the idle timeout, or when its server dies.
+
+A monitor thread checks each server's process and /status, and restarts a server that exits or stops answering on
+a thread of its own, so a slow restart does not hold up the checks of the other servers.
+Each server's output goes to appium_<port>.log in the log directory, rotated by size.
+
+Usage:
+    python3 src/util/appium_server_pool.py --servers 3
+    python3 src/util/appium_server_pool.py --servers 2 --port 4723 --base-port 4724 --log-dir appium_logs
+    python3 src/util/appium_server_pool.py --servers 2 --server-config '' \\
+        --appium-command 'python3 src/util/fake_webdriver_server.py android'
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import logging.handlers
+import os
+import re
+import shlex
+import socket
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from appium_helper import log_stdout
+
+DEFAULT_POOL_PORT = 4723
+DEFAULT_BASE_PORT = 4724
+DEFAULT_SERVER_CONFIG_PATH = 'data/config/appium_server.json'
+DEFAULT_LOG_DIR = 'appium_logs'
+DEFAULT_LOG_MAX_BYTES = 20 * 1024 * 1024
+DEFAULT_LOG_BACKUPS = 3
+# Host ports each driver needs per session, as (first port, ports in the range)
+PORT_CAPABILITIES = {
+    'android': {
+        'appium:systemPort': (8200, 100),
+        'appium:chromedriverPort': (9515, 100),
+        'appium:mjpegServerPort': (7810, 100),
+    },
+    'ios': {
+        'appium:wdaLocalPort': (8100, 100),
+        'appium:mjpegServerPort': (9100, 100),
+    },
+}
+# Server config keys the pool sets itself for every server
+POOL_CONTROLLED_SERVER_KEYS = {'port', 'log'}
+# Consecutive failed /status checks before a running server is restarted
+MAX_STATUS_FAILURES = 3
+SESSION_PATH = re.compile(r'(?P<base>.*?)/session/(?P<session_id>[^/]+)(?P<rest>/.*)?')
+NEW_SESSION_PATH = re.compile(r'.*/session')
+
+
+class PoolError(Exception):
+    '''W3C error the pool answers with when it cannot forward a command.'''
+
+    def __init__(self, status: int, error: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.error = error
+        self.message = message
+
+
+# ==== PORTS ====
+
+
+def port_is_free(port: int) -> bool:
+    '''True if nothing on the runner is listening on the port'''
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        try:
+            probe.bind(('127.0.0.1', port))
+        except OSError:
+            return False
+    return True
+
+
+class PortAllocator:
+    '''Hand out per-session host ports from fixed ranges, never giving the same port to two sessions'''
+
+    def __init__(self, ranges: dict[str, dict[str, tuple[int, int]]] | None = None, is_free=port_is_free):
+        self.ranges = ranges or PORT_CAPABILITIES
+        self.is_free = is_free
+        self.in_use: set[int] = set()
+        self._lock = threading.Lock()
+
+
+    def allocate(self, platform: str, capabilities: dict) -> dict[str, int]:
+        '''Ports for every port capability of the platform that the client did not set'''
+        allocated = {}
+        with self._lock:
+            try:
+                for capability, (first, count) in self.ranges.get(platform, {}).items():
+                    if capability in capabilities:
+                        continue
+                    port = next((port for port in range(first, first + count)
+                                 if port not in self.in_use and self.is_free(port)), None)
+                    if port is None:
+                        raise PoolError(500, 'session not created', f'No free port left for {capability}.')
+                    self.in_use.add(port)
+                    allocated[capability] = port
+            except PoolError:
+                self.in_use.difference_update(allocated.values())
+                raise
+        return allocated
+
+
+    def release(self, ports: dict[str, int]):
+        '''Return a session's ports'''
+        with self._lock:
+            self.in_use.difference_update(ports.values())
+
+
+def session_platform(capabilities: dict) -> str | None:
+    '''android or ios from the platformName or automationName capability'''
+    platform = str(capabilities.get('platformName', '')).lower()
+    automation = str(capabilities.get('appium:automationName', '')).lower()
+    if platform == 'android' or automation == 'uiautomator2':
+        return 'android'
+    if platform == 'ios' or automation == 'xcuitest':
+        return 'ios'
+    return None
+
+
+def requested_capabilities(body: dict) -> dict:
+    '''The capabilities a new session request asks for, merging alwaysMatch with the first firstMatch entry'''
+    capabilities = body.get('capabilities') or {}
+    first_match = capabilities.get('firstMatch') or [{}]
+    return {**capabilities.get('alwaysMatch', {}), **first_match[0], **body.get('desiredCapabilities', {})}
+
+
+def add_capabilities(body: dict, ports: dict[str, int]) -> dict:
+    '''Put allocated ports into a new session request body, in the W3C and legacy capability objects it has'''
+    capabilities = body.setdefault('capabilities', {})
+    capabilities.setdefault('alwaysMatch', {}).update(ports)
+    if 'desiredCapabilities' in body:
+        body['desiredCapabilities'].update(ports)
+    return body
+
+
+# ==== SERVERS ====
+
+
+def server_arguments(config_path: str | None) -> list[str]:
+    '''Appium command line options from the server section of appium_server.json, except the ones the pool sets'''
+    if not config_path:
+        return []
+    with open(file=config_path, mode='r', encoding='utf-8') as f:
+        server = json.load(f).get('server', {})
+    arguments = []
+    for key, value in server.items():
+        if key in POOL_CONTROLLED_SERVER_KEYS or value is False:
+            continue
+        arguments += [f'--{key}'] if value is True else [f'--{key}', str(value)]
+    return arguments
+
+
+@dataclass
+class AppiumServer:  # pylint: disable=too-many-instance-attributes
+    'One Appium server process owned by the pool.'
+    port: int
+    command: list[str]
+    log: logging.Logger
+    process: subprocess.Popen | None = None
+    healthy: bool = False
+    failures: int = 0
+    restarts: int = 0
+    # Sessions open on the server plus new session requests in flight to it
+    load: int = 0
+    started_at: float = 0.0
+
+    @property
+    def url(self) -> str:
+        '''Base URL commands are forwarded to'''
+        return f'http://127.0.0.1:{self.port}'
+
+
+    def start(self):
+        '''Start the process, sending its output to the rotating log'''
+        self.process = subprocess.Popen([*self.command, '--port', str(self.port)], stdout=subprocess.PIPE,  # pylint: disable=consider-using-with
+                                        stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+        self.started_at = time.monotonic()
+        self.failures = 0
+        threading.Thread(target=self._copy_output, args=(self.process,), name=f'appium-{self.port}-log', daemon=True).start()
+
+
+    def stop(self, timeout: float = 10):
+        '''Stop the process, killing it if it does not exit in time'''
+        self.healthy = False
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+    def running(self) -> bool:
+        '''True while the process has not exited'''
+        return self.process is not None and self.process.poll() is None
+
+
+    def ready(self, timeout: float = 5) -> bool:
+        '''True if the server answers /status with ready'''
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=timeout)
+        try:
+            connection.request('GET', '/status')
+            response = connection.getresponse()
+            value = json.loads(response.read() or b'{}').get('value') or {}
+        except (OSError, ValueError, http.client.HTTPException):
+            return False
+        finally:
+            connection.close()
+        return response.status == 200 and bool(value.get('ready'))
+
+
+    def wait_ready(self, timeout: float) -> bool:
+        '''Wait for the server to come up, giving up early if the process exits'''
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and self.running():
+            if self.ready():
+                self.healthy = True
+                return True
+            time.sleep(0.2)
+        return False
+
+
+    def _copy_output(self, process: subprocess.Popen):
+        '''Write each output line of one process to the server log'''
+        for line in process.stdout:
+            self.log.info(line.decode('utf-8', errors='replace').rstrip('\n'))
+
+
+def server_log(port: int, log_dir: str, max_bytes: int, backups: int) -> logging.Logger:
+    '''Logger writing one server's output to log_dir/appium_<port>.log, rotated by size'''
+    os.makedirs(log_dir, exist_ok=True)
+    logger = logging.getLogger(f'appium_server_pool.{port}')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if not logger.handlers:
+        handler = logging.handlers.RotatingFileHandler(os.path.join(log_dir, f'appium_{port}.log'),
+                                                       maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+    return logger
+
+
+@dataclass
+class PooledSession:
+    'A session the pool routed to one of its servers.'
+    session_id: str
+    server: AppiumServer
+    ports: dict[str, int]
+    last_used: float = field(default_factory=time.monotonic)
+
+
+# ==== POOL ====
+
+
+class AppiumServerPool:  # pylint: disable=too-many-instance-attributes
+    '''Start, watch, and route sessions to several Appium servers'''
+
+    def __init__(self, servers: list[AppiumServer], *, allocator: PortAllocator | None = None,  # pylint: disable=too-many-arguments
+                 max_sessions: int = 4, idle_timeout: float = 600, health_interval: float = 5,
+                 startup_timeout: float = 120, request_timeout: float = 900):
+        self.servers = servers
+        self.allocator = allocator or PortAllocator()
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.health_interval = health_interval
+        self.startup_timeout = startup_timeout
+        self.request_timeout = request_timeout
+        self.sessions: dict[str, PooledSession] = {}
+        self.sessions_created = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # Ports of the servers a restart thread is bringing back up
+        self._restarting: set[int] = set()
+        self._connections = threading.local()
+        self._monitor_thread = threading.Thread(target=self._monitor_loop, name='appium-pool-monitor', daemon=True)
+
+
+    def start(self):
+        '''Start every server, wait for them to be ready, and start the monitor'''
+        for server in self.servers:
+            server.start()
+        for server in self.servers:
+            if server.wait_ready(self.startup_timeout):
+                log_stdout(f"Pool - Appium server on port {server.port} is ready.")
+            else:
+                log_stdout(f"Pool - Appium server on port {server.port} did not become ready; the monitor will restart it.")
+        self._monitor_thread.start()
+
+
+    def shutdown(self):
+        '''Stop the monitor and every server'''
+        self._stop.set()
+        for server in self.servers:
+            server.stop()
+
+
+    def status(self) -> dict:
+        '''W3C /status body, ready while at least one server is healthy'''
+        healthy = [server for server in self.servers if server.healthy]
+        return {
+            'ready': bool(healthy),
+            'message': f'{len(healthy)} of {len(self.servers)} Appium servers are healthy.',
+            'sessions': len(self.sessions),
+            'created': self.sessions_created,
+            'servers': [{'port': server.port, 'healthy': server.healthy, 'load': server.load,
+                         'restarts': server.restarts} for server in self.servers],
+        }
+
+
+    # ==== ROUTING ====
+
+    def create_session(self, path: str, body: dict, headers: dict) -> tuple[int, bytes, str]:
+        '''Send a new session request to the least loaded healthy server with free ports filled in'''
+        capabilities = requested_capabilities(body)
+        server = self._reserve_server()
+        ports = {}
+        try:
+            ports = self.allocator.allocate(session_platform(capabilities), capabilities)
+            status, payload, content_type = self._send(server, 'POST', path, json.dumps(add_capabilities(body, ports)).encode('utf-8'), headers)
+            session_id = self._session_id(status, payload)
+        except BaseException:
+            self._unreserve(server, ports)
+            raise
+        if session_id is None:
+            self._unreserve(server, ports)
+            return status, payload, content_type
+        with self._lock:
+            self.sessions[session_id] = PooledSession(session_id, server, ports)
+            self.sessions_created += 1
+        described = ', '.join(f'{name.split(":")[-1]} {port}' for name, port in ports.items())
+        log_stdout(f"Pool - Session {session_id} on port {server.port}{f' with {described}' if described else ''}.")
+        return status, payload, content_type
+
+
+    def forward(self, method: str, path: str, session_id: str, body: bytes, headers: dict, *,  # pylint: disable=too-many-arguments
+                closes: bool = False) -> tuple[int, bytes, str]:
+        '''Send a session command to the server that owns the session, freeing the session when the command closes it'''
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.monotonic()
+        if session is None:
+            raise PoolError(404, 'invalid session id', f'Session {session_id} is not open in the Appium server pool.')
+        if not session.server.healthy:
+            self._drop(session)
+            raise PoolError(404, 'invalid session id', f'The Appium server for session {session_id} was restarted.')
+        result = self._send(session.server, method, path, body, headers)
+        if closes:
+            self._drop(session)
+        return result
+
+
+    def forward_any(self, method: str, path: str, body: bytes, headers: dict) -> tuple[int, bytes, str]:
+        '''Send a command that belongs to no session to the first healthy server'''
+        server = next((server for server in self.servers if server.healthy), None)
+        if server is None:
+            raise PoolError(503, 'unknown error', 'No Appium server in the pool is healthy.')
+        return self._send(server, method, path, body, headers)
+
+
+    def _reserve_server(self) -> AppiumServer:
+        '''Count a new session against the healthy server with the lowest load'''
+        with self._lock:
+            candidates = [server for server in self.servers if server.healthy and server.load < self.max_sessions]
+            if not candidates:
+                raise PoolError(500, 'session not created',
+                                f'Every healthy Appium server already has {self.max_sessions} sessions, or none is healthy.')
+            server = min(candidates, key=lambda server: server.load)
+            server.load += 1
+            return server
+
+
+    def _unreserve(self, server: AppiumServer, ports: dict[str, int]):
+        '''Undo a reservation for a session that was not created'''
+        with self._lock:
+            server.load -= 1
+        self.allocator.release(ports)
+
+
+    def _drop(self, session: PooledSession):
+        '''Forget a session and return its load and ports'''
+        with self._lock:
+            if self.sessions.pop(session.session_id, None) is None:
+                return
+            session.server.load -= 1
+        self.allocator.release(session.ports)
+
+
+    @staticmethod
+    def _session_id(status: int, payload: bytes) -> str | None:
+        '''Session ID from a new session response, in the W3C or legacy shape'''
+        if status != 200:
+            return None
+        try:
+            response = json.loads(payload)
+        except ValueError:
+            return None
+        return (response.get('value') or {}).get('sessionId') or response.get('sessionId')
+
+
+    def _send(self, server: AppiumServer, method: str, path: str, body: bytes, headers: dict) -> tuple[int, bytes, str]:
+        '''Forward one request over a kept-alive connection, reconnecting once if the server closed it'''
+        for attempt in range(2):
+            connection = self._connection(server)
+            try:
+                connection.request(method, path, body=body or None, headers=headers)
+                response = connection.getresponse()
+                return response.status, response.read(), response.getheader('Content-Type', 'application/json')
+            except (ConnectionError, http.client.HTTPException) as e:
+                connection.close()
+                self._connections.by_port.pop(server.port, None)
+                if attempt:
+                    raise PoolError(502, 'unknown error', f'Appium server on port {server.port} is not reachable: {e}') from e
+            except OSError as e:
+                connection.close()
+                self._connections.by_port.pop(server.port, None)
+                raise PoolError(502, 'unknown error', f'Appium server on port {server.port} is not reachable: {e}') from e
+        raise AssertionError('unreachable')
+
+
+    def _connection(self, server: AppiumServer) -> http.client.HTTPConnection:
+        '''This thread's connection to a server'''
+        if not hasattr(self._connections, 'by_port'):
+            self._connections.by_port = {}
+        connection = self._connections.by_port.get(server.port)
+        if connection is None:
+            connection = http.client.HTTPConnection('127.0.0.1', server.port, timeout=self.request_timeout)
+            self._connections.by_port[server.port] = connection
+        return connection
+
+
+    # ==== MONITOR ====
+
+    def _monitor_loop(self):
+        '''Check the servers and idle sessions every health_interval seconds'''
+        while not self._stop.wait(self.health_interval):
+            for server in self.servers:
+                self._check(server)
+            self._reap_idle()
+
+
+    def _check(self, server: AppiumServer):
+        '''Restart a server whose process exited or which failed several status checks in a row'''
+        if self._stop.is_set() or server.port in self._restarting:
+            return
+        if server.running() and server.ready():
+            server.failures = 0
+            server.healthy = True
+            return
+        server.failures += 1
+        if server.running() and server.failures < MAX_STATUS_FAILURES:
+            return
+        reason = f'exited with {server.process.returncode}' if not server.running() else 'stopped answering /status'
+        log_stdout(f"Pool - Appium server on port {server.port} {reason}; restarting it.")
+        server.healthy = False
+        self._restarting.add(server.port)
+        # Waiting for the server to come back can take minutes, so the other servers keep being checked meanwhile
+        threading.Thread(target=self._restart, args=(server, reason), name=f'appium-{server.port}-restart', daemon=True).start()
+
+
+    def _restart(self, server: AppiumServer, reason: str):
+        '''Stop a server, free its sessions, and start it again'''
+        try:
+            server.stop()
+            for session in [session for session in list(self.sessions.values()) if session.server is server]:
+                self._drop(session)
+            if self._stop.is_set():
+                return
+            server.log.info(f'==== Restarted by the Appium server pool after it {reason} ====')
+            server.restarts += 1
+            server.start()
+            if server.wait_ready(self.startup_timeout):
+                log_stdout(f"Pool - Appium server on port {server.port} is ready again.")
+        finally:
+            self._restarting.discard(server.port)
+
+
+    def _reap_idle(self):
+        '''Free sessions that have had no command for idle_timeout seconds, as their client is gone'''
+        cutoff = time.monotonic() - self.idle_timeout
+        for session in [session for session in list(self.sessions.values()) if session.last_used < cutoff]:
+            log_stdout(f"Pool - Closing session {session.session_id} after {self.idle_timeout:g} idle seconds.")
+            try:
+                self._send(session.server, 'DELETE', f'/session/{session.session_id}', b'', {})
+            except PoolError:
+                pass
+            self._drop(session)
+
+
+# ==== HTTP ====
+
+
+class AppiumPoolHandler(BaseHTTPRequestHandler):
+    '''Request handler that exposes the pool as one Appium server.'''
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    pool: AppiumServerPool = None
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        '''Keep the pool quiet'''
+
+
+    def send_body(self, status: int, body: bytes, content_type: str = 'application/json; charset=utf-8'):
+        '''Write a response with a Content-Length so the connection stays open'''
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def dispatch(self, method: str):
+        '''Answer /status, route new sessions, and forward everything else to the owning server'''
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        path = self.path.split('?', 1)[0].rstrip('/')
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+        try:
+            if method == 'GET' and path.endswith('/status'):
+                status, payload, content_type = 200, json.dumps({'value': self.pool.status()}).encode('utf-8'), 'application/json'
+            elif method == 'POST' and NEW_SESSION_PATH.fullmatch(path):
+                status, payload, content_type = self.pool.create_session(self.path, json.loads(body or b'{}'), headers)
+            elif (match := SESSION_PATH.fullmatch(path)) is not None:
+                status, payload, content_type = self.pool.forward(method, self.path, match.group('session_id'), body, headers,
+                                                                  closes=method == 'DELETE' and match.group('rest') is None)
+            else:
+                status, payload, content_type = self.pool.forward_any(method, self.path, body, headers)
+        except PoolError as e:
+            status, content_type = e.status, 'application/json; charset=utf-8'
+            payload = json.dumps({'value': {'error': e.error, 'message': e.message, 'stacktrace': ''}}).encode('utf-8')
+        except ValueError as e:
+            status, content_type = 400, 'application/json; charset=utf-8'
+            payload = json.dumps({'value': {'error': 'invalid argument', 'message': str(e), 'stacktrace': ''}}).encode('utf-8')
+        self.send_body(status, payload, content_type)
+
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        '''Handle GET requests'''
+        self.dispatch('GET')
+
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        '''Handle POST requests'''
+        self.dispatch('POST')
+
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        '''Handle DELETE requests'''
+        self.dispatch('DELETE')
+
+
+class AppiumServerPoolServer:
+    '''Serve an AppiumServerPool on a background thread, for use as a context manager.'''
+
+    def __init__(self, pool: AppiumServerPool, host: str = '127.0.0.1', port: int = 0):
+        self.pool = pool
+        handler = type('BoundAppiumPoolHandler', (AppiumPoolHandler,), {'pool': pool})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+
+    @property
+    def url(self) -> str:
+        '''Base URL to point the Appium clients at'''
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+    def __enter__(self):
+        self.pool.start()
+        self.thread.start()
+        return self
+
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.pool.shutdown()
+
+
+def build_pool(args: argparse.Namespace) -> AppiumServerPool:
+    '''Servers on consecutive ports from base_port, each running the Appium command with the shared server config'''
+    command = [*shlex.split(args.appium_command), *server_arguments(args.server_config)]
+    servers = [AppiumServer(port, command, server_log(port, args.log_dir, args.log_max_bytes, args.log_backups))
+               for port in range(args.base_port, args.base_port + args.servers)]
+    return AppiumServerPool(servers, max_sessions=args.max_sessions, idle_timeout=args.idle_timeout,
+                            health_interval=args.health_interval, startup_timeout=args.startup_timeout)
+
+
+def main():
+    '''Run the pool until interrupted, then stop every server'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', type=int, default=2, help='Appium servers to run')
+    parser.add_argument('--host', default='127.0.0.1', help='address the pool listens on')
+    parser.add_argument('--port', type=int, default=DEFAULT_POOL_PORT, help='port the pool listens on')
+    parser.add_argument('--base-port', type=int, default=DEFAULT_BASE_PORT, help='port of the first Appium server')
+    parser.add_argument('--appium-command', default='appium', help='command that starts one server, before --port')
+    parser.add_argument('--server-config', default=DEFAULT_SERVER_CONFIG_PATH, help="server options to pass on ('' for none)")
+    parser.add_argument('--max-sessions', type=int, default=4, help='sessions per server')
+    parser.add_argument('--idle-timeout', type=float, default=600, help='seconds without a command before a session is closed')
+    parser.add_argument('--health-interval', type=float, default=5, help='seconds between server health checks')
+    parser.add_argument('--startup-timeout', type=float, default=120, help='seconds to wait for a server to be ready')
+    parser.add_argument('--log-dir', default=DEFAULT_LOG_DIR)
+    parser.add_argument('--log-max-bytes', type=int, default=DEFAULT_LOG_MAX_BYTES, help='size at which a server log rotates')
+    parser.add_argument('--log-backups', type=int, default=DEFAULT_LOG_BACKUPS, help='rotated logs kept per server')
+    args = parser.parse_args()
+    if args.servers < 1:
+        parser.error('--servers must be at least 1')
+    with AppiumServerPoolServer(build_pool(args), host=args.host, port=args.port) as server:
+        log_stdout(f"Appium server pool listening at {server.url} with {args.servers} servers.")
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            log_stdout("Appium server pool shutting down.")
+
+
+if __name__ == "__main__":
+    main()
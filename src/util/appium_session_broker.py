@@ -0,0 +1,510 @@
+"""
+Long-lived broker that keeps one warm Appium session per device and lends it to flows.
+
+Creating a session installs and starts UiAutomator2 on Android or brings up WebDriverAgent on iOS, which
+is often the slowest part of a run. The broker creates each device's session once and, between flows,
+resets the app with terminate/activate instead. Idle sessions are health-checked in the background and
+recycled when they stop answering, get too old, or have served too many flows. A lease lasts lease_timeout
+seconds and the flow's driver renews it with a heartbeat while it is open, so a session whose flow was killed
+before releasing it is reclaimed and recycled once its lease runs out. Heartbeats and releases must carry the
+lease_id the lease returned, so a flow whose lease was reclaimed cannot renew or release the next flow's lease.
+
+Start the broker, then run the Cafe scripts with APPIUM_SESSION_BROKER set so they lease instead of
+creating sessions:
+    python3 src/util/appium_session_broker.py --port 4780 &
+    APPIUM_SESSION_BROKER=http://127.0.0.1:4780 python3 src/util/appium_interactions_cafe_android.py 10.11.1.1
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from appium import webdriver
+from appium.options.common.base import AppiumOptions
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.remote.command import Command
+
+from appium_helper import log_stdout
+
+BROKER_ENV_VAR = 'APPIUM_SESSION_BROKER'
+DEFAULT_BROKER_PORT = 4780
+DEFAULT_LEASE_TIMEOUT = 300
+APP_ID_CAPABILITIES = ('appium:appPackage', 'appium:bundleId')
+
+
+class BrokerError(Exception):
+    '''Exception raised when the broker cannot lend or return a session.'''
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+@dataclass
+class WarmSession:  # pylint: disable=too-many-instance-attributes
+    'One device session kept open by the broker.'
+    udid: str
+    appium_url: str
+    capabilities: dict
+    driver: webdriver.Remote
+    created_at: float = field(default_factory=time.monotonic)
+    uses: int = 0
+    leased: bool = False
+    lease_id: str | None = None
+    lease_expires_at: float = 0.0
+    last_checked: float = field(default_factory=time.monotonic)
+
+    @property
+    def app_id(self) -> str | None:
+        '''Package name or bundle ID to reset between flows'''
+        return next((self.capabilities[key] for key in APP_ID_CAPABILITIES if self.capabilities.get(key)), None)
+
+
+    def lease_expired(self) -> bool:
+        '''True for a lease whose flow stopped renewing it, as when the flow was killed'''
+        return self.leased and time.monotonic() >= self.lease_expires_at
+
+
+    def describe(self) -> dict:
+        '''JSON view of the session for the broker API'''
+        return {
+            'udid': self.udid,
+            'appium_url': self.appium_url,
+            'session_id': self.driver.session_id,
+            'capabilities': self.driver.caps,
+            'uses': self.uses,
+            'leased': self.leased,
+            'lease_id': self.lease_id,
+            'lease_seconds_left': round(max(self.lease_expires_at - time.monotonic(), 0), 1) if self.leased else None,
+            'age_seconds': round(time.monotonic() - self.created_at, 1),
+        }
+
+
+def create_driver(appium_url: str, capabilities: dict) -> webdriver.Remote:
+    '''Open a new Appium session'''
+    return webdriver.Remote(command_executor=appium_url, options=AppiumOptions().load_capabilities(capabilities))
+
+
+class SessionBroker:  # pylint: disable=too-many-instance-attributes
+    '''Lend warm sessions, reset apps between flows, and recycle sessions that go bad.'''
+
+    def __init__(self, *, max_uses: int = 25, max_age: float = 3600, health_interval: float = 30,  # pylint: disable=too-many-arguments
+                 lease_timeout: float = DEFAULT_LEASE_TIMEOUT, driver_factory=create_driver):
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.health_interval = health_interval
+        self.lease_timeout = lease_timeout
+        self.driver_factory = driver_factory
+        self.sessions: dict[str, WarmSession] = {}
+        self.sessions_created = 0
+        self.sessions_recycled = 0
+        self._lock = threading.Lock()
+        self._device_locks: dict[str, threading.Lock] = {}
+        self._stop = threading.Event()
+        self._health_thread = threading.Thread(target=self._health_loop, name='session-health', daemon=True)
+
+
+    def start(self):
+        '''Start the background health checks'''
+        self._health_thread.start()
+
+
+    def _device_lock(self, udid: str) -> threading.Lock:
+        '''Lock serializing lease, release, and recycle for one device'''
+        with self._lock:
+            return self._device_locks.setdefault(udid, threading.Lock())
+
+
+    def lease(self, appium_url: str, capabilities: dict) -> dict:
+        '''Lend the device's warm session, creating or recycling it when needed'''
+        udid = capabilities.get('appium:udid')
+        if not udid:
+            raise BrokerError(400, 'Capabilities must include appium:udid.')
+        with self._device_lock(udid):
+            session = self.sessions.get(udid)
+            if session is not None and session.lease_expired():
+                self._reclaim(session)
+                session = None
+            if session is not None and session.leased:
+                raise BrokerError(409, f'Session for {udid} is already leased.')
+            if session is not None and (session.appium_url, session.capabilities) != (appium_url, capabilities):
+                log_stdout(f"Broker - Capabilities changed for {udid}; recycling its session.")
+                self._recycle(session)
+                session = None
+            if session is not None and not self._reset(session):
+                session = None
+            if session is None:
+                log_stdout(f"Broker - Creating session for {udid}.")
+                try:
+                    driver = self.driver_factory(appium_url, capabilities)
+                except WebDriverException as e:
+                    raise BrokerError(502, f'Failed to create session for {udid}: {e.msg if e.msg else e}') from e
+                session = WarmSession(udid=udid, appium_url=appium_url, capabilities=capabilities, driver=driver)
+                self.sessions[udid] = session
+                self.sessions_created += 1
+            session.leased = True
+            session.lease_id = uuid.uuid4().hex
+            session.lease_expires_at = time.monotonic() + self.lease_timeout
+            session.uses += 1
+            return {**session.describe(), 'lease_timeout': self.lease_timeout}
+
+
+    def _leased_session(self, udid: str, lease_id: str | None) -> WarmSession:
+        '''The session leased under lease_id, or a 400, 404, or 409 when the caller does not hold it'''
+        if not lease_id:
+            raise BrokerError(400, f'A lease_id is required to renew or release the session for {udid}.')
+        session = self.sessions.get(udid)
+        if session is None:
+            raise BrokerError(404, f'No session for {udid}.')
+        if not session.leased or session.lease_id != lease_id:
+            raise BrokerError(409, f'Lease {lease_id} on {udid} expired or was reclaimed.')
+        return session
+
+
+    def heartbeat(self, udid: str, lease_id: str | None) -> dict:
+        '''Extend a lease by another lease_timeout seconds'''
+        with self._device_lock(udid):
+            session = self._leased_session(udid, lease_id)
+            session.lease_expires_at = time.monotonic() + self.lease_timeout
+            return session.describe()
+
+
+    def release(self, udid: str, lease_id: str | None, healthy: bool = True) -> dict:
+        '''Take a session back, recycling it if the flow reported it unhealthy'''
+        with self._device_lock(udid):
+            session = self._leased_session(udid, lease_id)
+            session.leased = False
+            session.lease_id = None
+            if not healthy:
+                self._recycle(session)
+                return {'udid': udid, 'recycled': True}
+            return session.describe()
+
+
+    def close(self, udid: str | None = None):
+        '''Quit one session, or every session when no device is given'''
+        sessions = list(self.sessions.values()) if udid is None else [self.sessions[udid]] if udid in self.sessions else []
+        for session in sessions:
+            with self._device_lock(session.udid):
+                self._recycle(session)
+
+
+    def shutdown(self):
+        '''Stop health checks and quit every session'''
+        self._stop.set()
+        self.close()
+
+
+    def _expired(self, session: WarmSession) -> bool:
+        '''True once a session has served max_uses flows or lived max_age seconds'''
+        return session.uses >= self.max_uses or time.monotonic() - session.created_at >= self.max_age
+
+
+    def _healthy(self, session: WarmSession) -> bool:
+        '''Cheap round trip that fails once the session or device is gone'''
+        session.last_checked = time.monotonic()
+        try:
+            session.driver.execute(Command.GET_TIMEOUTS)
+        except WebDriverException:
+            return False
+        return True
+
+
+    def _reset(self, session: WarmSession) -> bool:
+        '''Restart the app in an existing session; recycle it and return False if that fails'''
+        if self._expired(session) or not self._healthy(session):
+            log_stdout(f"Broker - Recycling session for {session.udid} before reuse.")
+            self._recycle(session)
+            return False
+        if session.app_id is None:
+            return True
+        try:
+            session.driver.terminate_app(session.app_id)
+            session.driver.activate_app(session.app_id)
+        except WebDriverException as e:
+            log_stdout(f"Broker - App reset failed for {session.udid}: {e.msg if e.msg else e}")
+            self._recycle(session)
+            return False
+        log_stdout(f"Broker - Reset {session.app_id} on {session.udid} for reuse.")
+        return True
+
+
+    def _reclaim(self, session: WarmSession):
+        '''Recycle a session whose lease expired, since the flow that held it may have left it in any state'''
+        log_stdout(f"Broker - Lease {session.lease_id} on {session.udid} expired without a release; reclaiming its session.")
+        self._recycle(session)
+
+
+    def _recycle(self, session: WarmSession):
+        '''Quit a session and forget it so the next lease creates a fresh one'''
+        if self.sessions.get(session.udid) is session:
+            del self.sessions[session.udid]
+        self.sessions_recycled += 1
+        try:
+            session.driver.quit()
+        except WebDriverException:
+            pass
+
+
+    def _health_loop(self):
+        '''Check idle sessions and reclaim abandoned leases every health_interval seconds'''
+        while not self._stop.wait(self.health_interval):
+            for session in list(self.sessions.values()):
+                lock = self._device_lock(session.udid)
+                if not lock.acquire(blocking=False):
+                    continue
+                try:
+                    if self.sessions.get(session.udid) is not session:
+                        continue
+                    if session.lease_expired():
+                        self._reclaim(session)
+                    elif not session.leased and not self._healthy(session):
+                        log_stdout(f"Broker - Session for {session.udid} failed its health check; recycling.")
+                        self._recycle(session)
+                finally:
+                    lock.release()
+
+
+class SessionBrokerHandler(BaseHTTPRequestHandler):
+    '''Request handler exposing a SessionBroker as a small JSON API.'''
+
+    protocol_version = 'HTTP/1.1'
+    broker: SessionBroker = None
+    routes: list = []
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        '''Keep the broker quiet'''
+
+
+    def send_json(self, status: int, payload):
+        '''Write a JSON response with a Content-Length so the connection stays open'''
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def dispatch(self, method: str):
+        '''Route the request to the first matching handler'''
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else {}
+        path = self.path.split('?', 1)[0]
+        for route_method, pattern, handler in self.routes:
+            match = pattern.fullmatch(path)
+            if route_method == method and match:
+                try:
+                    status, payload = handler(self.broker, body, **match.groupdict())
+                except BrokerError as e:
+                    status, payload = e.status, {'error': e.message}
+                self.send_json(status, payload)
+                return
+        self.send_json(404, {'error': f'No route for {method} {path}'})
+
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        '''Handle GET requests'''
+        self.dispatch('GET')
+
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        '''Handle POST requests'''
+        self.dispatch('POST')
+
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        '''Handle DELETE requests'''
+        self.dispatch('DELETE')
+
+
+def route(method: str, pattern: str):
+    '''Register a broker API handler for a method and path pattern'''
+    def decorator(handler):
+        SessionBrokerHandler.routes.append((method, re.compile(pattern), handler))
+        return handler
+    return decorator
+
+
+@route('GET', '/status')
+def get_status(broker, body):
+    '''Report that the broker is up, with session counters'''
+    return 200, {'ready': True, 'sessions': len(broker.sessions),
+                 'created': broker.sessions_created, 'recycled': broker.sessions_recycled}
+
+
+@route('GET', '/sessions')
+def list_sessions(broker, body):
+    '''List warm sessions'''
+    return 200, [session.describe() for session in list(broker.sessions.values())]
+
+
+@route('POST', '/sessions/lease')
+def lease_session(broker, body):
+    '''Lend a warm session for the requested capabilities'''
+    return 200, broker.lease(body.get('appium_url'), body.get('capabilities') or {})
+
+
+@route('POST', r'/sessions/(?P<udid>[^/]+)/heartbeat')
+def renew_session(broker, body, udid):
+    '''Extend a lease'''
+    return 200, broker.heartbeat(urllib.request.unquote(udid), lease_id=body.get('lease_id'))
+
+
+@route('POST', r'/sessions/(?P<udid>[^/]+)/release')
+def release_session(broker, body, udid):
+    '''Return a leased session'''
+    return 200, broker.release(urllib.request.unquote(udid), lease_id=body.get('lease_id'),
+                               healthy=body.get('healthy', True))
+
+
+@route('DELETE', r'/sessions/(?P<udid>[^/]+)')
+def delete_session(broker, body, udid):
+    '''Quit one warm session'''
+    broker.close(urllib.request.unquote(udid))
+    return 200, {'udid': udid, 'closed': True}
+
+
+# ==== CLIENT ====
+
+def broker_request(broker_url: str, method: str, path: str, body: dict | None = None) -> dict:
+    '''Call the broker API and return the decoded response'''
+    request = urllib.request.Request(f'{broker_url.rstrip("/")}{path}', method=method,
+                                     data=json.dumps(body or {}).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        raise BrokerError(e.code, json.load(e).get('error', str(e))) from e
+
+
+class BrokeredRemote(webdriver.Remote):  # pylint: disable=too-many-ancestors
+    '''webdriver.Remote attached to a broker session; quit() hands the session back instead of ending it.'''
+
+    def __init__(self, command_executor, broker_url: str, lease: dict, options: AppiumOptions):
+        self.broker_url = broker_url
+        self.lease = lease
+        # Set to False before quit() to have the broker recycle the session instead of reusing it
+        self.broker_healthy = True
+        self._heartbeat_stop = threading.Event()
+        super().__init__(command_executor=command_executor, options=options)
+        # Renew the lease while this process is alive; if it is killed the heartbeats stop and the broker reclaims
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name='broker-heartbeat', daemon=True)
+        self._heartbeat_thread.start()
+
+
+    def start_session(self, capabilities, browser_profile=None):
+        '''Attach to the leased session instead of creating one'''
+        self.session_id = self.lease['session_id']
+        self.caps = self.lease['capabilities']
+
+
+    def _lease_path(self, action: str) -> str:
+        '''Broker API path for an action on this lease'''
+        return f"/sessions/{urllib.request.quote(self.lease['udid'], safe='')}/{action}"
+
+
+    def _heartbeat_loop(self):
+        '''Renew the lease a few times per lease_timeout until quit()'''
+        interval = self.lease.get('lease_timeout', DEFAULT_LEASE_TIMEOUT) / 3
+        while not self._heartbeat_stop.wait(interval):
+            try:
+                broker_request(self.broker_url, 'POST', self._lease_path('heartbeat'), {'lease_id': self.lease.get('lease_id')})
+            except BrokerError as e:
+                log_stdout(f"Session broker stopped renewing session {self.session_id}: {e.message}")
+                return
+            except urllib.error.URLError as e:
+                log_stdout(f"Failed to renew session {self.session_id} with the session broker: {e.reason}")
+
+
+    def quit(self):
+        '''Release the session to the broker and close the local connection'''
+        self._heartbeat_stop.set()
+        try:
+            broker_request(self.broker_url, 'POST', self._lease_path('release'),
+                           {'healthy': self.broker_healthy, 'lease_id': self.lease.get('lease_id')})
+        except (BrokerError, urllib.error.URLError) as e:
+            log_stdout(f"Failed to release session {self.session_id} to the session broker: {e}")
+        finally:
+            self.stop_client()
+            self.command_executor.close()
+
+
+def open_driver(appium_server_socket: str, options: AppiumOptions, command_executor=None) -> webdriver.Remote:
+    '''Lease a warm session when APPIUM_SESSION_BROKER is set, otherwise create a session as before'''
+    command_executor = command_executor or appium_server_socket
+    broker_url = os.environ.get(BROKER_ENV_VAR)
+    if not broker_url:
+        return webdriver.Remote(command_executor=command_executor, options=options)
+    try:
+        lease = broker_request(broker_url, 'POST', '/sessions/lease',
+                               {'appium_url': appium_server_socket, 'capabilities': options.to_capabilities()})
+    except BrokerError as e:
+        raise WebDriverException(f'Session broker could not lend a session: {e.message}') from e
+    except urllib.error.URLError as e:
+        raise WebDriverException(f'Session broker at {broker_url} is unreachable: {e.reason}') from e
+    log_stdout(f"Leased warm session {lease['session_id']} ({lease['uses']} uses) from the session broker.")
+    return BrokeredRemote(command_executor=command_executor, broker_url=broker_url, lease=lease, options=options)
+
+
+class SessionBrokerServer:
+    '''Serve a SessionBroker on a background thread, for use as a context manager.'''
+
+    def __init__(self, broker: SessionBroker, host: str = '127.0.0.1', port: int = 0):
+        self.broker = broker
+        handler = type('BoundSessionBrokerHandler', (SessionBrokerHandler,), {'broker': broker})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+
+    @property
+    def url(self) -> str:
+        '''Base URL to put in APPIUM_SESSION_BROKER'''
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+    def __enter__(self):
+        self.broker.start()
+        self.thread.start()
+        return self
+
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.broker.shutdown()
+
+
+def main():
+    '''Run the broker until interrupted, then quit every warm session'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=DEFAULT_BROKER_PORT)
+    parser.add_argument('--max-uses', type=int, default=25, help='flows served before a session is recreated')
+    parser.add_argument('--max-age', type=float, default=3600, help='seconds before a session is recreated')
+    parser.add_argument('--health-interval', type=float, default=30, help='seconds between idle session health checks')
+    parser.add_argument('--lease-timeout', type=float, default=DEFAULT_LEASE_TIMEOUT,
+                        help='seconds a lease lasts without a heartbeat before its session is reclaimed')
+    args = parser.parse_args()
+    broker = SessionBroker(max_uses=args.max_uses, max_age=args.max_age, health_interval=args.health_interval,
+                           lease_timeout=args.lease_timeout)
+    with SessionBrokerServer(broker, port=args.port) as server:
+        log_stdout(f"Session broker listening at {server.url}.")
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            log_stdout("Session broker shutting down.")
+
+
+if __name__ == "__main__":
+    main()
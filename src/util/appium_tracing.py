@@ -0,0 +1,305 @@
+"""
+Tracing for the Appium interaction layer.
+
+Records one span per AppiumHelper step and one per WebDriver HTTP command, timed with the monotonic
+nanosecond clock, with request and response sizes and retry counts on each command. Traces are written
+as JSON lines and as Chrome trace events (open in chrome://tracing or https://ui.perfetto.dev), and the
+slowest steps are printed at the end of the run.
+
+Tracing is off unless APPIUM_TRACE is set to an output prefix, for example:
+    APPIUM_TRACE=appium_trace_android python3 src/util/appium_interactions_cafe_android.py 10.11.1.1
+writes appium_trace_android.jsonl and appium_trace_android.trace.json.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from urllib import parse
+from appium.webdriver.appium_connection import AppiumConnection
+
+TRACE_ENV_VAR = 'APPIUM_TRACE'
+HELPER_STEP_METHODS = (
+    'click',
+    'click_when_ready',
+    'fill_form',
+    'find_element',
+    'save_screenshot',
+    'set_element_value',
+    'type_text',
+    'wait_until_clickable',
+    'wait_until_element_value',
+    'wait_until_visible',
+)
+CATEGORY_STEP = 'step'
+CATEGORY_HTTP = 'http'
+
+
+@dataclass
+class Span:  # pylint: disable=too-many-instance-attributes
+    'One timed operation in a trace.'
+    span_id: int
+    name: str
+    category: str
+    start_ns: int
+    end_ns: int = 0
+    parent_id: int | None = None
+    thread_id: int = 0
+    attributes: dict = field(default_factory=dict)
+
+    @property
+    def duration_ns(self) -> int:
+        '''Span duration in nanoseconds'''
+        return self.end_ns - self.start_ns
+
+
+class Tracer:
+    '''Collect nested spans from any number of threads.'''
+
+    def __init__(self, clock=time.perf_counter_ns):
+        self.clock = clock
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._next_id = 1
+        self.origin_ns = clock()
+
+
+    def _stack(self) -> list[Span]:
+        '''Open spans on the calling thread, innermost last'''
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+
+    def start_span(self, name: str, category: str, **attributes) -> Span:
+        '''Open a span as a child of the innermost open span on this thread'''
+        stack = self._stack()
+        with self._lock:
+            span_id = self._next_id
+            self._next_id += 1
+        span = Span(span_id=span_id, name=name, category=category, start_ns=self.clock(),
+                    parent_id=stack[-1].span_id if stack else None,
+                    thread_id=threading.get_ident(), attributes=attributes)
+        stack.append(span)
+        return span
+
+
+    def end_span(self, span: Span, **attributes):
+        '''Close a span and record it'''
+        span.end_ns = self.clock()
+        span.attributes.update(attributes)
+        stack = self._stack()
+        if span in stack:
+            stack.remove(span)
+        with self._lock:
+            self.spans.append(span)
+
+
+    def current_span(self) -> Span | None:
+        '''Innermost open span on this thread'''
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+
+    def span(self, name: str, category: str = CATEGORY_STEP, **attributes):
+        '''Context manager that times the enclosed block as a span'''
+        return _SpanContext(self, name, category, attributes)
+
+
+    @classmethod
+    def load_jsonl(cls, path: str) -> 'Tracer':
+        '''Rebuild a Tracer from a file written by write_jsonl'''
+        tracer = cls()
+        with open(file=path, mode='r', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                record.pop('duration_ns', None)
+                tracer.spans.append(Span(**record))
+        if tracer.spans:
+            tracer.origin_ns = min(span.start_ns for span in tracer.spans)
+        return tracer
+
+
+    def write_jsonl(self, path: str):
+        '''Write one JSON object per span, in start order'''
+        with open(file=path, mode='w', encoding='utf-8') as f:
+            for span in sorted(self.spans, key=lambda span: span.start_ns):
+                f.write(json.dumps({**asdict(span), 'duration_ns': span.duration_ns}) + '\n')
+
+
+    def write_chrome_trace(self, path: str):
+        '''Write spans as Chrome trace-event complete events with microsecond timestamps'''
+        events = [
+            {
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': (span.start_ns - self.origin_ns) / 1000,
+                'dur': span.duration_ns / 1000,
+                'pid': os.getpid(),
+                'tid': span.thread_id,
+                'args': span.attributes,
+            }
+            for span in self.spans
+        ]
+        with open(file=path, mode='w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+    def slowest_steps(self, limit: int = 10) -> list[dict]:
+        '''Top-level step spans ordered by duration, with the HTTP commands each one issued'''
+        children: dict[int, list[Span]] = {}
+        for span in self.spans:
+            if span.parent_id is not None:
+                children.setdefault(span.parent_id, []).append(span)
+
+        def http_spans(span: Span) -> list[Span]:
+            found = []
+            for child in children.get(span.span_id, []):
+                found.extend([child] if child.category == CATEGORY_HTTP else http_spans(child))
+            return found
+
+        step_ids = {span.span_id for span in self.spans if span.category == CATEGORY_STEP}
+        # Commands sent straight through helper.driver have no step around them, so they count as steps
+        steps = [span for span in self.spans
+                 if (span.category == CATEGORY_STEP and span.parent_id not in step_ids)
+                 or (span.category == CATEGORY_HTTP and span.parent_id is None)]
+        rows = []
+        for span in sorted(steps, key=lambda span: span.duration_ns, reverse=True)[:limit]:
+            commands = [span] if span.category == CATEGORY_HTTP else http_spans(span)
+            rows.append({
+                'step': span.name,
+                'duration_ms': span.duration_ns / 1_000_000,
+                'commands': len(commands),
+                'http_ms': sum(command.duration_ns for command in commands) / 1_000_000,
+                'response_bytes': sum(command.attributes.get('response_bytes', 0) for command in commands),
+            })
+        return rows
+
+
+    def print_summary(self, limit: int = 10):
+        '''Print the slowest steps and overall HTTP command totals'''
+        commands = [span for span in self.spans if span.category == CATEGORY_HTTP]
+        print(f"{'slowest steps':<72}{'ms':>10}{'cmds':>6}{'http ms':>10}{'resp KiB':>10}")
+        for row in self.slowest_steps(limit):
+            print(f"{row['step'][:71]:<72}{row['duration_ms']:>10.1f}{row['commands']:>6}"
+                  f"{row['http_ms']:>10.1f}{row['response_bytes'] / 1024:>10.1f}")
+        print(f"{len(commands)} HTTP commands, {sum(span.duration_ns for span in commands) / 1_000_000:.1f} ms, "
+              f"{sum(span.attributes.get('retries', 0) for span in commands)} retries.")
+
+
+class _SpanContext:
+    '''Context manager returned by Tracer.span.'''
+
+    def __init__(self, tracer: Tracer, name: str, category: str, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.attributes = attributes
+        self.span = None
+
+
+    def __enter__(self) -> Span:
+        self.span = self.tracer.start_span(self.name, self.category, **self.attributes)
+        return self.span
+
+
+    def __exit__(self, exc_type, exc, traceback):
+        attributes = {'error': exc_type.__name__} if exc_type is not None else {}
+        self.tracer.end_span(self.span, **attributes)
+
+
+class TracingAppiumConnection(AppiumConnection):
+    '''AppiumConnection that records a span for every WebDriver HTTP command.'''
+
+    def __init__(self, remote_server_addr: str, tracer: Tracer, **kwargs):
+        super().__init__(remote_server_addr=remote_server_addr, **kwargs)
+        self.tracer = tracer
+        self._command = threading.local()
+        if getattr(self, '_conn', None) is not None:
+            self._conn.request = self._wrap_pool_request(self._conn.request)
+
+
+    def _wrap_pool_request(self, request):
+        '''Record status, response size, and urllib3 retries on the span of the command being sent'''
+        @functools.wraps(request)
+        def traced_request(*args, **kwargs):
+            response = request(*args, **kwargs)
+            span = self.tracer.current_span()
+            if span is not None and span.category == CATEGORY_HTTP:
+                history = getattr(getattr(response, 'retries', None), 'history', ()) or ()
+                span.attributes['status'] = response.status
+                span.attributes['response_bytes'] = len(response.data or b'')
+                span.attributes['retries'] = span.attributes.get('retries', 0) + len(history)
+            return response
+        return traced_request
+
+
+    def execute(self, command, params):
+        '''Remember the logical command name for the HTTP span'''
+        self._command.name = command
+        try:
+            return super().execute(command, params)
+        finally:
+            self._command.name = None
+
+
+    def _request(self, method, url, body=None):
+        '''Send one HTTP request inside a span; redirects re-enter here and count as retries'''
+        current = self.tracer.current_span()
+        if current is not None and current.category == CATEGORY_HTTP:
+            current.attributes['retries'] = current.attributes.get('retries', 0) + 1
+            return super()._request(method, url, body=body)
+        command = getattr(self._command, 'name', None) or method
+        with self.tracer.span(command, CATEGORY_HTTP, method=method, path=parse.urlparse(url).path,
+                              request_bytes=len(body.encode('utf-8')) if body else 0, retries=0):
+            return super()._request(method, url, body=body)
+
+
+def tracer_from_env() -> Tracer | None:
+    '''Return a Tracer when APPIUM_TRACE is set, otherwise None'''
+    return Tracer() if os.environ.get(TRACE_ENV_VAR) else None
+
+
+def command_executor(appium_server_socket: str, tracer: Tracer | None):
+    '''Return a value for webdriver.Remote(command_executor=...) that traces HTTP commands when tracing'''
+    if tracer is None:
+        return appium_server_socket
+    return TracingAppiumConnection(remote_server_addr=appium_server_socket, tracer=tracer)
+
+
+def describe_step(method_name: str, kwargs: dict) -> str:
+    '''Span name for a helper call, such as click_when_ready(id=com.corellium.cafe:id/loginButton)'''
+    if 'by' in kwargs:
+        return f"{method_name}({kwargs['by']}={kwargs.get('value')})"
+    if 'filename' in kwargs:
+        return f"{method_name}({kwargs['filename']})"
+    return method_name
+
+
+def instrument_helper(helper, tracer: Tracer | None):
+    '''Wrap the AppiumHelper step methods so each call records a step span'''
+    if tracer is None:
+        return helper
+    for method_name in HELPER_STEP_METHODS:
+        method = getattr(helper, method_name)
+
+        @functools.wraps(method)
+        def traced(*args, _method=method, _name=method_name, **kwargs):
+            with tracer.span(describe_step(_name, kwargs), CATEGORY_STEP):
+                return _method(*args, **kwargs)
+        setattr(helper, method_name, traced)
+    return helper
+
+
+def finish(tracer: Tracer | None):
+    '''Write trace files and print the slowest steps'''
+    if tracer is None:
+        return
+    prefix = os.environ.get(TRACE_ENV_VAR, 'appium_trace')
+    tracer.write_jsonl(f'{prefix}.jsonl')
+    tracer.write_chrome_trace(f'{prefix}.trace.json')
+    tracer.print_summary()
@@ -0,0 +1,216 @@
+"""
+Adaptive explicit waits for AppiumHelper.
+
+Selenium's WebDriverWait polls every 500 ms for as long as one global timeout, so an element that renders 50 ms
+after the first miss still costs half a second, and every step gets the same 20 second budget. Waits here poll
+after 50 ms and back off towards a ceiling, with the first poll, ceiling, and timeout taken from a per-step wait
+profile: `navigation` for the first element on a screen a click just opened, `input` for a typed value to show
+up, and `default` for everything else.
+
+When APPIUM_WAIT_HISTORY names a JSON file, the time each locator took to become ready is kept there across
+runs. Once a locator has a few samples, its timeout shrinks to a multiple of its usual readiness time, so a
+broken step fails in seconds rather than after the profile timeout, and polling stays quick for elements that
+are usually ready quickly.
+
+The driver does part of the waiting. The scripts keep the implicit wait short (0.5 seconds in the platform
+configs) so each find polls on the device and returns as soon as the element renders, without the round trip of
+another client poll, while a miss costs half a second instead of stalling the explicit wait for 5. And
+configure_server_waits shortens the driver's wait for the app to go idle before each command, which UiAutomator2
+and XCUITest otherwise hold for up to 10 seconds on screens that keep animating.
+"""
+
+import fcntl
+import json
+import os
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass, replace
+from selenium.common.exceptions import (
+    NoSuchElementException,
+    StaleElementReferenceException,
+    TimeoutException,
+    WebDriverException,
+)
+
+WAIT_HISTORY_ENV_VAR = 'APPIUM_WAIT_HISTORY'
+PROFILE_DEFAULT = 'default'
+PROFILE_NAVIGATION = 'navigation'
+PROFILE_INPUT = 'input'
+# Samples a locator needs before its learned timeout replaces the profile timeout
+MIN_SAMPLES = 3
+MAX_SAMPLES = 50
+# Driver settings that bound the wait for the app to go idle before each command
+SERVER_WAIT_SETTINGS = {
+    'android': {'waitForIdleTimeout': 500},
+    'ios': {'waitForIdleTimeout': 1.0, 'animationCoolOffTimeout': 0.5},
+}
+
+
+@dataclass
+class WaitProfile:
+    'How one kind of step polls and how long it may wait.'
+    timeout: float = 20.0
+    first_poll: float = 0.05
+    max_poll: float = 0.25
+    backoff: float = 1.4
+    # Learned timeouts are the usual readiness time times margin, never below min_timeout
+    margin: float = 4.0
+    min_timeout: float = 3.0
+
+
+DEFAULT_PROFILES = {
+    PROFILE_DEFAULT: WaitProfile(),
+    PROFILE_NAVIGATION: WaitProfile(timeout=30.0, first_poll=0.1, max_poll=0.5, min_timeout=5.0),
+    PROFILE_INPUT: WaitProfile(timeout=10.0, first_poll=0.02, max_poll=0.1, min_timeout=2.0),
+}
+
+
+def build_profiles(timeout: float, overrides: dict | None = None) -> dict[str, WaitProfile]:
+    '''Default profiles with the default profile timeout set to timeout and any fields overridden from config'''
+    profiles = dict(DEFAULT_PROFILES)
+    profiles[PROFILE_DEFAULT] = replace(profiles[PROFILE_DEFAULT], timeout=float(timeout))
+    for name, fields in (overrides or {}).items():
+        if name not in profiles:
+            raise ValueError(f"Unknown wait profile '{name}'.")
+        profiles[name] = replace(profiles[name], **fields)
+    return profiles
+
+
+def poll_intervals(profile: WaitProfile, expected: float | None = None):
+    '''Sleep lengths between polls, growing from the first poll to the ceiling
+
+    The ceiling drops to a quarter of the expected readiness time, so a step that is usually ready in 200 ms
+    is not polled once a second.
+    '''
+    ceiling = profile.max_poll if expected is None else min(profile.max_poll, max(profile.first_poll, expected / 4))
+    interval = profile.first_poll
+    while True:
+        yield min(interval, ceiling)
+        interval *= profile.backoff
+
+
+class ReadinessHistory:
+    '''How long each locator took to become ready in earlier runs, kept in a JSON file'''
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self.samples: dict[str, list[float]] = self.read(path) if path else {}
+        # Samples recorded since the last save, merged into whatever the file holds by then
+        self.unsaved: dict[str, list[float]] = {}
+
+
+    @staticmethod
+    def read(path: str) -> dict[str, list[float]]:
+        '''Samples stored in a history file, or none if it is missing or damaged'''
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(file=path, mode='r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # A damaged history only costs the learned timeouts, so start again
+            return {}
+
+
+    @classmethod
+    def from_env(cls) -> 'ReadinessHistory':
+        '''History stored where APPIUM_WAIT_HISTORY points, or kept in memory for this run only'''
+        return cls(os.environ.get(WAIT_HISTORY_ENV_VAR) or None)
+
+
+    def record(self, key: str, seconds: float):
+        '''Add one readiness time, keeping the most recent samples'''
+        for history in (self.samples, self.unsaved):
+            samples = history.setdefault(key, [])
+            samples.append(round(seconds, 4))
+            del samples[:-MAX_SAMPLES]
+
+
+    def expected(self, key: str) -> float | None:
+        '''Median readiness time, once the locator has enough samples'''
+        samples = self.samples.get(key, [])
+        return statistics.median(samples) if len(samples) >= MIN_SAMPLES else None
+
+
+    def timeout_for(self, key: str, profile: WaitProfile) -> float:
+        '''The locator's 95th percentile readiness time times margin, capped by the profile timeout, once it is known'''
+        samples = sorted(self.samples.get(key, []))
+        if len(samples) < MIN_SAMPLES:
+            return profile.timeout
+        slowest_usual = samples[min(len(samples) - 1, round(0.95 * (len(samples) - 1)))]
+        return min(profile.timeout, max(profile.min_timeout, slowest_usual * profile.margin))
+
+
+    def save(self):
+        '''Merge this run's samples into the file under a lock and write it through a rename
+
+        Parallel sessions share one history, so the file is read again under the lock and only the samples
+        recorded since the last save are added to it; the rename means a killed run cannot leave half a file.
+        '''
+        if not self.path:
+            return
+        with open(file=f'{self.path}.lock', mode='a', encoding='utf-8') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            merged = self.read(self.path)
+            for key, samples in self.unsaved.items():
+                merged[key] = [*merged.get(key, []), *samples][-MAX_SAMPLES:]
+            descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)),
+                                                          prefix='.appium-waits-')
+            with os.fdopen(descriptor, 'w', encoding='utf-8') as f:
+                json.dump(merged, f, indent=2, sort_keys=True)
+            os.replace(temporary_path, self.path)
+        self.samples = merged
+        self.unsaved = {}
+
+
+class AdaptiveWait:  # pylint: disable=too-many-instance-attributes,too-few-public-methods
+    '''Drop-in for WebDriverWait.until that polls per profile and learns readiness times per locator'''
+
+    def __init__(self, driver, profiles: dict[str, WaitProfile], history: ReadinessHistory,  # pylint: disable=too-many-arguments
+                 ignored_exceptions=(NoSuchElementException, StaleElementReferenceException),
+                 clock=time.monotonic, sleep=time.sleep):
+        self.driver = driver
+        self.profiles = profiles
+        self.history = history
+        self.ignored_exceptions = tuple(ignored_exceptions)
+        self.clock = clock
+        self.sleep = sleep
+        self.polls = 0
+        self.last_timeout = profiles[PROFILE_DEFAULT].timeout
+
+
+    def until(self, condition, key: str | None = None, profile: str = PROFILE_DEFAULT, message: str = ''):
+        '''Poll condition until it returns a truthy value and return it, or raise TimeoutException'''
+        wait_profile = self.profiles[profile]
+        timeout = self.history.timeout_for(key, wait_profile) if key else wait_profile.timeout
+        self.last_timeout = timeout
+        intervals = poll_intervals(wait_profile, self.history.expected(key) if key else None)
+        start = self.clock()
+        deadline = start + timeout
+        while True:
+            self.polls += 1
+            try:
+                value = condition(self.driver)
+            except self.ignored_exceptions:
+                value = None
+            if value:
+                if key:
+                    self.history.record(key, self.clock() - start)
+                return value
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                raise TimeoutException(message or f'Not ready after {timeout:.1f} seconds with the {profile} wait profile.')
+            self.sleep(min(next(intervals), remaining))
+
+
+def configure_server_waits(driver, platform: str, settings: dict | None = None) -> bool:
+    '''Shorten the driver's idle wait before each command, returning False if the server refused the settings'''
+    settings = settings if settings is not None else SERVER_WAIT_SETTINGS.get(platform)
+    if not settings:
+        return False
+    try:
+        driver.update_settings(settings)
+    except WebDriverException:
+        return False
+    return True
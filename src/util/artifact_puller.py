@@ -0,0 +1,440 @@
+"""
+Stream a tar archive of device directories straight into a local compressed file.
+
+The archive is never written to the device. Instead, `tar -cf -` runs behind one `adb exec-out` or ssh channel,
+and its output is compressed (zstd when the zstandard package is installed, gzip otherwise) and hashed locally as it
+arrives, so device reads overlap with the transfer. The output is a series of independent compressed frames, one per
+checkpoint, which standard zstd and gzip tools read back as a single stream. A checkpoint is taken at a tar member
+boundary every few megabytes and recorded in <output>.resume.json, so an interrupted pull picks up at that raw byte
+offset instead of starting over. When the pull completes, <output>.manifest.json lists every archived file with its
+size and SHA-256, alongside the size and SHA-256 of the compressed archive.
+
+Usage:
+    python3 artifact_puller.py adb <services_ip> <output.tar.zst> <remote_path>...
+    python3 artifact_puller.py ssh <services_ip> <output.tar.gz> <remote_path>... [--retries 3]
+    python3 artifact_puller.py local . <output.tar.zst> <path>... [--checkpoint-mb 8]
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import zlib
+from dataclasses import asdict, dataclass, field
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TAR_BLOCK_SIZE = 512
+READ_CHUNK_SIZE = 256 * 1024
+DEFAULT_CHECKPOINT_BYTES = 8 * 1024 * 1024
+ADB_PORT = 5001
+TRANSPORTS = ('adb', 'ssh', 'local')
+
+
+class ArtifactPullError(Exception):
+    '''The remote tar stream failed or could not be resumed'''
+
+
+# ==== COMPRESSION ====
+
+
+class FrameCompressor:
+    '''Compress into independent frames so a file can be truncated at any frame end and appended to again'''
+
+    def __init__(self, codec: str, level: int):
+        if codec == 'zstd' and zstandard is None:
+            raise ArtifactPullError('The zstandard package is required for .zst output.')
+        self.codec = codec
+        self.level = level
+        self._compressor = None
+
+
+    def compress(self, data: bytes) -> bytes:
+        '''Compress data into the current frame, starting one if needed'''
+        if self._compressor is None:
+            if self.codec == 'zstd':
+                self._compressor = zstandard.ZstdCompressor(level=self.level).compressobj()
+            else:
+                self._compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return self._compressor.compress(data)
+
+
+    def end_frame(self) -> bytes:
+        '''Finish the current frame and return its trailing bytes'''
+        if self._compressor is None:
+            return b''
+        compressor, self._compressor = self._compressor, None
+        return compressor.flush()
+
+
+def codec_for_path(path: str) -> str:
+    '''Compression codec implied by the output file name'''
+    if path.endswith(('.zst', '.zstd')):
+        return 'zstd'
+    if path.endswith(('.gz', '.tgz')):
+        return 'gzip'
+    raise ArtifactPullError(f'Cannot infer a compression codec from {path}; use a .zst or .gz suffix.')
+
+
+# ==== TAR STREAM ====
+
+
+@dataclass
+class Member:
+    'One file seen in the tar stream.'
+    name: str
+    size: int
+    sha256: str
+
+
+def parse_number(field_bytes: bytes) -> int:
+    '''Decode a tar numeric header field, octal or GNU base-256'''
+    if field_bytes and field_bytes[0] & 0x80:
+        return int.from_bytes(bytes([field_bytes[0] & 0x7f]) + field_bytes[1:], 'big')
+    digits = field_bytes.strip(b'\0 ')
+    return int(digits, 8) if digits else 0
+
+
+def pax_path(data: bytes) -> str | None:
+    '''The path record of a pax extended header, if any'''
+    for record in data.split(b'\n'):
+        _, _, keyword_value = record.partition(b' ')
+        keyword, _, value = keyword_value.partition(b'=')
+        if keyword == b'path':
+            return value.decode('utf-8', 'replace')
+    return None
+
+
+class TarTracker:  # pylint: disable=too-many-instance-attributes
+    '''Follow tar headers in a byte stream to find member boundaries and hash each regular file'''
+
+    def __init__(self, offset: int = 0):
+        self.offset = offset
+        self.members: list[Member] = []
+        self.finished = False
+        self._header = b''
+        self._remaining = 0
+        self._padding = 0
+        self._member: dict | None = None
+        self._hash = None
+        self._long_name: str | None = None
+        self._extended = b''
+
+
+    @property
+    def at_boundary(self) -> bool:
+        '''Whether the stream is between members'''
+        return not self._header and not self._remaining and not self._padding and self._member is None
+
+
+    def feed(self, chunk: bytes) -> list[int]:
+        '''Consume a chunk and return the stream offsets, within it, where a member ended'''
+        boundaries = []
+        position = 0
+        while position < len(chunk) and not self.finished:
+            if self._remaining:
+                take = min(self._remaining, len(chunk) - position)
+                self._consume_data(chunk[position:position + take])
+                self._remaining -= take
+                position += take
+            elif self._padding:
+                take = min(self._padding, len(chunk) - position)
+                self._padding -= take
+                position += take
+            else:
+                take = min(TAR_BLOCK_SIZE - len(self._header), len(chunk) - position)
+                self._header += chunk[position:position + take]
+                position += take
+                if len(self._header) == TAR_BLOCK_SIZE:
+                    header, self._header = self._header, b''
+                    self._start_member(header)
+            if self._member is not None and not self._remaining and not self._padding:
+                self._end_member()
+            if self.at_boundary:
+                boundaries.append(self.offset + position)
+        self.offset += len(chunk)
+        return boundaries
+
+
+    def _start_member(self, header: bytes):
+        '''Begin a member from its header block'''
+        if header == bytes(TAR_BLOCK_SIZE):
+            self.finished = True
+            return
+        size = parse_number(header[124:136])
+        self._remaining = size
+        self._padding = -size % TAR_BLOCK_SIZE
+        self._member = {'type': header[156:157], 'size': size, 'name': self._header_name(header)}
+        self._hash = hashlib.sha256()
+        self._extended = b''
+
+
+    def _header_name(self, header: bytes) -> str:
+        '''Member name from the ustar name and prefix fields or a preceding long name record'''
+        if self._long_name is not None:
+            name, self._long_name = self._long_name, None
+            return name
+        name = header[0:100].split(b'\0', 1)[0].decode('utf-8', 'replace')
+        if header[257:262] == b'ustar':
+            prefix = header[345:500].split(b'\0', 1)[0].decode('utf-8', 'replace')
+            if prefix:
+                name = f'{prefix}/{name}'
+        return name
+
+
+    def _consume_data(self, data: bytes):
+        '''Hash file data, or keep it when it describes the next member'''
+        if self._member['type'] in (b'L', b'x'):
+            self._extended += data
+        else:
+            self._hash.update(data)
+
+
+    def _end_member(self):
+        '''Record a finished member'''
+        member_type = self._member['type']
+        if member_type == b'L':
+            self._long_name = self._extended.split(b'\0', 1)[0].decode('utf-8', 'replace')
+        elif member_type == b'x':
+            self._long_name = pax_path(self._extended)
+        elif member_type in (b'0', b'\0', b'7'):
+            self.members.append(Member(self._member['name'], self._member['size'], self._hash.hexdigest()))
+        self._member = None
+        self._hash = None
+
+
+# ==== TRANSPORT ====
+
+
+def tar_command(paths: list[str], offset: int) -> str:
+    '''Device shell command that writes the tar stream, starting at a raw byte offset'''
+    # Remote paths are passed unquoted so the device shell can expand globs such as assessment.*/
+    command = f'tar -cf - {" ".join(paths)}'
+    return f'{command} | tail -c +{offset + 1}' if offset else command
+
+
+def transport_argv(transport: str, target: str, command: str) -> list[str]:
+    '''Local command line that runs a device shell command over the chosen channel'''
+    if transport == 'adb':
+        # exec-out keeps the stream binary-safe, unlike adb shell with a terminal
+        return ['adb', '-s', f'{target}:{ADB_PORT}', 'exec-out', f'su root sh -c {shlex.quote(command)}']
+    if transport == 'ssh':
+        return ['ssh', f'root@{target}', command]
+    return ['sh', '-c', command]
+
+
+# ==== PULLER ====
+
+
+@dataclass
+class ResumeState:
+    'Progress of a pull as of its last checkpoint.'
+    paths: list[str]
+    codec: str
+    raw_offset: int = 0
+    compressed_offset: int = 0
+    tail: str = ''
+    members: list[dict] = field(default_factory=list)
+
+
+@dataclass
+class PullResult:
+    'The finished archive.'
+    path: str
+    size: int
+    sha256: str
+    raw_bytes: int
+    members: list[Member]
+    resumed_from: int
+
+
+class ArtifactPuller:  # pylint: disable=too-many-instance-attributes
+    '''Pull device paths as a compressed tar archive over one channel, resuming from the last checkpoint'''
+
+    def __init__(self, transport: str, target: str, output_path: str, paths: list[str], *,  # pylint: disable=too-many-arguments
+                 checkpoint_bytes: int = DEFAULT_CHECKPOINT_BYTES, level: int = 3):
+        self.transport = transport
+        self.target = target
+        self.output_path = output_path
+        self.paths = paths
+        self.checkpoint_bytes = checkpoint_bytes
+        self.codec = codec_for_path(output_path)
+        self.level = level if self.codec == 'zstd' else min(level * 2, 9)
+        self.state_path = f'{output_path}.resume.json'
+        self.manifest_path = f'{output_path}.manifest.json'
+
+
+    def load_state(self) -> ResumeState | None:
+        '''Checkpoint left by an interrupted pull of the same paths, if any'''
+        try:
+            with open(file=self.state_path, mode='r', encoding='utf-8') as f:
+                state = ResumeState(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+        if state.paths != self.paths or state.codec != self.codec or not os.path.exists(self.output_path):
+            return None
+        return state
+
+
+    def save_state(self, state: ResumeState):
+        '''Record a checkpoint through a rename so it is never half written'''
+        temporary_path = f'{self.state_path}.tmp'
+        with open(file=temporary_path, mode='w', encoding='utf-8') as f:
+            json.dump(asdict(state), f)
+        os.replace(temporary_path, self.state_path)
+
+
+    def pull(self, resume: bool = True) -> PullResult:
+        '''Stream the archive to the output path and write its manifest'''
+        state = self.load_state() if resume else None
+        if state is None:
+            state = ResumeState(self.paths, self.codec)
+        resumed_from = state.raw_offset
+        output_hash = hashlib.sha256()
+        with open(file=self.output_path, mode='r+b' if state.compressed_offset else 'w+b') as output:
+            # Frames after the checkpoint may be incomplete, so drop them and rehash what is kept
+            output.truncate(state.compressed_offset)
+            while block := output.read(READ_CHUNK_SIZE):
+                output_hash.update(block)
+            self._stream(state, output, output_hash)
+        self._write_manifest(state, output_hash.hexdigest())
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        return PullResult(self.output_path, state.compressed_offset, output_hash.hexdigest(), state.raw_offset,
+                          [Member(**member) for member in state.members], resumed_from)
+
+
+    def _stream(self, state: ResumeState, output, output_hash):
+        '''Run the remote tar and write compressed frames, checkpointing at member boundaries'''
+        tail = base64.b64decode(state.tail)
+        # Re-read the block before the checkpoint to confirm the device is producing the same stream
+        overlap = len(tail)
+        command = tar_command(self.paths, state.raw_offset - overlap)
+        process = subprocess.Popen(transport_argv(self.transport, self.target, command),  # pylint: disable=consider-using-with
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        errors = []
+        error_reader = threading.Thread(target=lambda: errors.append(process.stderr.read()), daemon=True)
+        error_reader.start()
+        tracker = TarTracker(state.raw_offset)
+        tracker.members = [Member(**member) for member in state.members]
+        compressor = FrameCompressor(self.codec, self.level)
+        since_checkpoint = 0
+
+        def write(data: bytes):
+            output.write(data)
+            output_hash.update(data)
+
+        try:
+            while chunk := process.stdout.read(READ_CHUNK_SIZE):
+                if overlap:
+                    taken = min(overlap, len(chunk))
+                    if chunk[:taken] != tail[len(tail) - overlap:len(tail) - overlap + taken]:
+                        raise ArtifactPullError('The remote archive changed since the last checkpoint; pull without resuming.')
+                    overlap -= taken
+                    chunk = chunk[taken:]
+                boundaries = tracker.feed(chunk)
+                since_checkpoint += len(chunk)
+                split = boundaries[-1] - (tracker.offset - len(chunk)) if boundaries else None
+                if since_checkpoint >= self.checkpoint_bytes and split is not None:
+                    write(compressor.compress(chunk[:split]))
+                    write(compressor.end_frame())
+                    output.flush()
+                    state.raw_offset = tracker.offset - len(chunk) + split
+                    state.compressed_offset = output.tell()
+                    state.tail = base64.b64encode((tail + chunk[:split])[-TAR_BLOCK_SIZE:]).decode('ascii')
+                    state.members = [asdict(member) for member in tracker.members]
+                    self.save_state(state)
+                    tail = base64.b64decode(state.tail)
+                    chunk = chunk[split:]
+                    since_checkpoint = len(chunk)
+                else:
+                    tail = (tail + chunk)[-TAR_BLOCK_SIZE:]
+                write(compressor.compress(chunk))
+            write(compressor.end_frame())
+        finally:
+            process.stdout.close()
+            return_code = process.wait()
+            error_reader.join()
+        if return_code != 0 or not tracker.finished:
+            message = b''.join(errors).decode('utf-8', 'replace').strip() or f'exit status {return_code}'
+            raise ArtifactPullError(f'Remote tar stream ended early: {message}')
+        state.raw_offset = tracker.offset
+        state.compressed_offset = output.tell()
+        state.members = [asdict(member) for member in tracker.members]
+
+
+    def _write_manifest(self, state: ResumeState, sha256: str):
+        '''Write the per-file manifest next to the archive'''
+        manifest = {
+            'archive': os.path.basename(self.output_path),
+            'size': state.compressed_offset,
+            'sha256': sha256,
+            'raw_bytes': state.raw_offset,
+            'files': state.members,
+        }
+        with open(file=self.manifest_path, mode='w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+
+def verify_archive(path: str, codec: str) -> int:
+    '''Decompress an archive end to end and return its raw size'''
+    if codec == 'zstd':
+        with open(path, 'rb') as f, zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True) as reader:
+            return sum(len(block) for block in iter(lambda: reader.read(READ_CHUNK_SIZE), b''))
+    with gzip.open(path, 'rb') as reader:
+        return sum(len(block) for block in iter(lambda: reader.read(READ_CHUNK_SIZE), b''))
+
+
+def main():
+    '''Pull the archive, retrying from the last checkpoint, and print its size, hash, and manifest path'''
+    parser = argparse.ArgumentParser(description='Stream device directories into a local compressed tar archive.')
+    parser.add_argument('transport', choices=TRANSPORTS, help='Channel that runs tar on the device')
+    parser.add_argument('target', help='Services IP of the device, or any value for local')
+    parser.add_argument('output_path', help='Local archive path ending in .zst or .gz')
+    parser.add_argument('remote_paths', nargs='+', help='Device paths to archive')
+    parser.add_argument('--retries', type=int, default=3, help='Resume attempts after a failed stream')
+    parser.add_argument('--checkpoint-mb', type=int, default=DEFAULT_CHECKPOINT_BYTES // (1024 * 1024),
+                        help='Raw megabytes between resume checkpoints')
+    parser.add_argument('--level', type=int, default=3, help='Compression level')
+    parser.add_argument('--no-resume', action='store_true', help='Ignore any checkpoint from an earlier pull')
+    parser.add_argument('--verify', action='store_true', help='Decompress the finished archive to check it')
+    args = parser.parse_args()
+
+    try:
+        puller = ArtifactPuller(args.transport, args.target, args.output_path, args.remote_paths,
+                                checkpoint_bytes=args.checkpoint_mb * 1024 * 1024, level=args.level)
+    except ArtifactPullError as e:
+        print(f'ERROR: {e}', file=sys.stderr)
+        sys.exit(1)
+    resume = not args.no_resume
+    for attempt in range(args.retries + 1):
+        try:
+            result = puller.pull(resume=resume)
+            break
+        except ArtifactPullError as e:
+            print(f'ERROR: {e}', file=sys.stderr)
+            if attempt == args.retries:
+                sys.exit(1)
+            print(f'Resuming pull, attempt {attempt + 2} of {args.retries + 1}.', file=sys.stderr)
+            resume = 'changed since the last checkpoint' not in str(e)
+    if args.verify and verify_archive(result.path, puller.codec) != result.raw_bytes:
+        print(f'ERROR: {result.path} does not decompress to the streamed size.', file=sys.stderr)
+        sys.exit(1)
+    if result.resumed_from:
+        print(f'Resumed from raw byte {result.resumed_from}.')
+    print(f'{result.size} {result.path}')
+    print(f'{result.sha256}  {result.path}')
+    print(f'{len(result.members)} files, {result.raw_bytes} raw bytes, manifest at {puller.manifest_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Benchmark the Corellium Cafe Appium scripts offline against the fake WebDriver server.
+
+Each run starts a fresh fake server, points the platform config at it, and calls run_app_automation()
+end to end with tracing on. The harness reports p50/p95 flow duration, WebDriver commands per run, and
+round trips per step, and appends the result to a JSON-lines file keyed by git commit so a regression
+shows up as a delta against the previous commit with the same settings.
+
+Usage:
+    python3 src/util/benchmark_appium_flow.py android --runs 5 --latency-ms 40 --jitter-ms 10
+    python3 src/util/benchmark_appium_flow.py ios --runs 5 --late-rate 0.2 --results appium_benchmark_results.jsonl
+    python3 src/util/benchmark_appium_flow.py ios --runs 5 --page-index
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+
+import appium_fanout
+import appium_flow
+import appium_page_index
+import appium_tracing
+from fake_webdriver_server import FakeWebDriverServer, FakeWebDriverState, add_fault_arguments, faults_from_args
+
+DEFAULT_RESULTS_PATH = 'appium_benchmark_results.jsonl'
+
+
+@dataclass
+class RunResult:
+    'Measurements from one benchmark run.'
+    passed: bool
+    duration_ms: float
+    commands: int
+    steps: int
+    screenshots: int
+    output: str = ''
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    '''Nearest-rank percentile that also works for a single sample'''
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def run_once(platform: str, flow: dict, faults, workdir: str, page_index: bool = False) -> RunResult:
+    '''Run the platform script once against a fresh fake server'''
+    module, _ = appium_fanout.PLATFORMS[platform]
+    config = appium_fanout.load_config(platform)
+    state = FakeWebDriverState.from_flow(flow, platform, faults=faults)
+    plan = appium_flow.compile_flow(flow, platform)
+    trace_prefix = os.path.join(workdir, 'trace')
+    output = io.StringIO()
+    passed = True
+    with FakeWebDriverServer(state) as server, contextlib.chdir(workdir):
+        config = replace(config, appium_server={'ip': server.host, 'port': str(server.port)})
+        os.environ[appium_tracing.TRACE_ENV_VAR] = trace_prefix
+        os.environ[appium_page_index.PAGE_INDEX_ENV_VAR] = '1' if page_index else '0'
+        start = time.perf_counter_ns()
+        try:
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                module.run_app_automation(config=config, udid=appium_fanout.get_udid(platform, config, '127.0.0.1'),
+                                          plan=plan)
+        except SystemExit as e:
+            passed = e.code in (None, 0)
+        finally:
+            duration_ms = (time.perf_counter_ns() - start) / 1_000_000
+            os.environ.pop(appium_tracing.TRACE_ENV_VAR, None)
+            os.environ.pop(appium_page_index.PAGE_INDEX_ENV_VAR, None)
+    steps = appium_tracing.Tracer.load_jsonl(f'{trace_prefix}.jsonl').slowest_steps(limit=None)
+    return RunResult(passed=passed, duration_ms=duration_ms, commands=state.commands,
+                     steps=len(steps), screenshots=state.screenshots_served, output=output.getvalue())
+
+
+def summarize(runs: list[RunResult]) -> dict:
+    '''Aggregate the passing runs into the numbers stored per commit'''
+    passing = [run for run in runs if run.passed] or runs
+    durations = [run.duration_ms for run in passing]
+    commands = statistics.mean(run.commands for run in passing)
+    steps = statistics.mean(run.steps for run in passing)
+    return {
+        'runs': len(runs),
+        'failures': sum(not run.passed for run in runs),
+        'p50_ms': round(percentile(durations, 0.50), 1),
+        'p95_ms': round(percentile(durations, 0.95), 1),
+        'commands_per_run': round(commands, 1),
+        'steps_per_run': round(steps, 1),
+        'round_trips_per_step': round(commands / steps, 2) if steps else None,
+    }
+
+
+def git_commit() -> str:
+    '''Short hash of HEAD, marked dirty when the tree has local changes'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{commit}-dirty' if dirty else commit
+
+
+def load_results(path: str) -> list[dict]:
+    '''Read earlier benchmark records'''
+    if not os.path.exists(path):
+        return []
+    with open(file=path, mode='r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def previous_result(history: list[dict], record: dict) -> dict | None:
+    '''Most recent record from another commit with the same platform and fault settings'''
+    for earlier in reversed(history):
+        if (earlier['platform'], earlier['settings']) == (record['platform'], record['settings']) and earlier['commit'] != record['commit']:
+            return earlier
+    return None
+
+
+def print_report(record: dict, baseline: dict | None):
+    '''Print this commit's numbers beside the previous commit's'''
+    print(f"{'metric':<22}{record['commit']:>16}" + (f"{baseline['commit']:>16}{'change':>10}" if baseline else ''))
+    for metric in ('p50_ms', 'p95_ms', 'commands_per_run', 'steps_per_run', 'round_trips_per_step', 'failures'):
+        current = record['summary'][metric]
+        line = f"{metric:<22}{current!s:>16}"
+        if baseline:
+            earlier = baseline['summary'].get(metric)
+            change = f"{(current - earlier) / earlier:+.1%}" if earlier and current is not None else ''
+            line += f"{earlier!s:>16}{change:>10}"
+        print(line)
+
+
+def main() -> int:
+    '''Run the benchmark, store the result, and compare it with the previous commit'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('platform', choices=sorted(appium_fanout.PLATFORMS))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--results', default=DEFAULT_RESULTS_PATH, help='JSON-lines file of results per commit')
+    parser.add_argument('--page-index', action='store_true', help='resolve locators from one page source snapshot per screen')
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    flow = appium_flow.load_flow(args.flow)
+    faults = faults_from_args(args)
+    runs = []
+    for index in range(args.runs):
+        if faults.seed is not None:
+            faults = replace(faults, seed=args.seed + index)
+        with tempfile.TemporaryDirectory(prefix='appium-benchmark-') as workdir:
+            run = run_once(args.platform, flow, faults, workdir, page_index=args.page_index)
+        runs.append(run)
+        print(f"run {index + 1}/{args.runs}: {'passed' if run.passed else 'FAILED'} in {run.duration_ms:.0f} ms, "
+              f"{run.commands} commands, {run.steps} steps", file=sys.stderr)
+        if not run.passed:
+            print(run.output[-2000:], file=sys.stderr)
+
+    settings = {key: value for key, value in vars(args).items() if key not in ('platform', 'runs', 'results', 'seed')}
+    record = {
+        'commit': git_commit(),
+        'recorded_at': datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"),
+        'platform': args.platform,
+        'settings': settings,
+        'summary': summarize(runs),
+    }
+    history = load_results(args.results)
+    print_report(record, previous_result(history, record))
+    with open(file=args.results, mode='a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
+    return 0 if record['summary']['failures'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+"""
+Native Python client for the Corellium REST API.
+
+Keeps HTTP connections alive between calls and caches instance to project lookups, so status checks
+no longer need a fresh corellium CLI process and jq pipeline each time.
+"""
+
+from .artifacts import AppMetadata, ArtifactCache, CachedArtifact
+from .bulk import BulkLifecycle, DeviceResult
+from .cache import TtlCache
+from .client import CorelliumClient
+from .connection import ConnectionPool, CorelliumApiError
+from .models import App, Assessment, Instance, Project, Snapshot
+from .reports import FetchedReport, ReportCache, ReportFetcher
+from .scheduler import Job, Lease, QuotaScheduler
+from .warm_pool import PoolLease, PoolSpec, WarmPool
+
+__all__ = [
+    'App',
+    'AppMetadata',
+    'ArtifactCache',
+    'Assessment',
+    'BulkLifecycle',
+    'CachedArtifact',
+    'ConnectionPool',
+    'CorelliumApiError',
+    'CorelliumClient',
+    'DeviceResult',
+    'FetchedReport',
+    'Instance',
+    'Job',
+    'Lease',
+    'PoolLease',
+    'PoolSpec',
+    'Project',
+    'QuotaScheduler',
+    'ReportCache',
+    'ReportFetcher',
+    'Snapshot',
+    'TtlCache',
+    'WarmPool',
+]
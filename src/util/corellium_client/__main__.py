@@ -0,0 +1,279 @@
+"""
+Command line entry point so the shell functions can query Corellium through the pooled client.
+
+Examples:
+    python3 -m corellium_client instance-status <instance_id>
+    python3 -m corellium_client services-ip <instance_id>
+    python3 -m corellium_client agent-ready <instance_id>
+    python3 -m corellium_client app-running <instance_id> <bundle_id>
+    python3 -m corellium_client available-cores <project_id>
+    python3 -m corellium_client wait-instance-state on <instance_id> [<instance_id> ...] --timeout 900
+    python3 -m corellium_client wait-agent-ready <instance_id> [<instance_id> ...]
+    python3 -m corellium_client wait-assessment-status <instance_id> <assessment_id> complete
+    python3 -m corellium_client wait-app-running <instance_id> <bundle_id>
+    python3 -m corellium_client wait-available-cores <project_id> 6
+    python3 -m corellium_client admit <project_id> --flavor ranchu --timeout 3600
+    python3 -m corellium_client pool-lease <run_id> --project <id> --flavor ranchu --os 14.0.0 --osbuild <build>
+    python3 -m corellium_client pool-return <instance_id> <run_id> --project <id> --flavor ranchu --os 14.0.0 --osbuild <build>
+    python3 -m corellium_client pool-resize --queue-depth 3 --project <id> --flavor ranchu --os 14.0.0 --osbuild <build>
+    python3 -m corellium_client fetch-reports <instance_id> <assessment_id> --format html --format json --output-dir .
+    python3 -m corellium_client fetch-app <app_url> --instance <instance_id> --minimum-kib 32
+    python3 -m corellium_client mark-app-installed <instance_id> <app_url>
+    python3 -m corellium_client bulk start <instance_id> [<instance_id> ...] --concurrency 4 --rate 0.5
+    python3 -m corellium_client bulk delete --all --keep <instance_id> --keep <instance_id> --report bulk_delete.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from dataclasses import asdict
+from datetime import datetime, timezone
+
+from .artifacts import (DEFAULT_ARTIFACT_CACHE_DIR, DEFAULT_MAX_ARTIFACT_CACHE_BYTES, ArtifactCache, ArtifactError,
+                        check_installed, mark_installed)
+from .bulk import (BULK_ACTIONS, DEFAULT_CONCURRENCY, DEFAULT_DEVICE_TIMEOUT, DEFAULT_REQUESTS_PER_SECOND, BulkLifecycle,
+                   format_results, select_instances)
+from .client import CorelliumClient
+from .connection import CorelliumApiError
+from .reports import DEFAULT_CACHE_DIR, DEFAULT_MAX_CACHE_BYTES, REPORT_FORMATS, ReportCache, ReportFetcher
+from .scheduler import Job, QuotaScheduler
+from .warm_pool import DEFAULT_LEASE_TTL, PoolSpec, WarmPool
+from .watcher import StatusWatcher, WatchFailedError
+
+
+async def run_command(args: argparse.Namespace) -> int:  # pylint: disable=too-many-branches
+    '''Run one subcommand, print its result, and return the exit status'''
+    async with CorelliumClient.from_env() as client:
+        match args.command:
+            case 'instance-status':
+                print(await client.get_instance_status(args.instance_id))
+            case 'services-ip':
+                print(await client.get_instance_services_ip(args.instance_id))
+            case 'project':
+                print(await client.get_project_from_instance_id(args.instance_id))
+            case 'agent-ready':
+                return 0 if await client.is_agent_ready(args.instance_id) else 1
+            case 'app-running':
+                return 0 if await client.is_app_running(args.instance_id, args.bundle_id) else 1
+            case 'available-cores':
+                print(await client.get_available_cores(args.project_id))
+            case 'wait-instance-state' | 'wait-agent-ready' | 'wait-assessment-status' | 'wait-app-running' | 'wait-available-cores':
+                await run_wait_command(client, args)
+            case 'admit':
+                boot_options = {'cores': args.cores, 'ram': args.ram} if args.cores else None
+                # One job per process, so this is a quota poll for this runner; there is no queue across runners
+                job = Job.from_boot_options('admit', args.flavor, boot_options)
+                async with QuotaScheduler(client, args.project_id) as scheduler:
+                    await scheduler.submit(job, args.timeout)
+                print(f'Admitted {job.cores} cores and {job.ram} MB of RAM in project {args.project_id}.')
+            case 'pool-lease' | 'pool-return' | 'pool-resize' | 'pool-status' | 'pool-drain':
+                return await run_pool_command(client, args)
+            case 'fetch-reports':
+                cache = ReportCache(args.cache_dir, max_bytes=args.max_cache_mb * 1024 * 1024)
+                reports = await ReportFetcher(client, cache).fetch(args.instance_id, args.assessment_id,
+                                                                   tuple(args.formats or REPORT_FORMATS), args.output_dir)
+                for report in reports:
+                    print(report.path)
+            case 'fetch-app' | 'mark-app-installed':
+                await run_app_command(client, args)
+            case 'bulk':
+                return await run_bulk_command(client, args)
+            case _:
+                raise ValueError(f'Unknown command {args.command}')
+    return 0
+
+
+async def run_wait_command(client: CorelliumClient, args: argparse.Namespace):
+    '''Run one of the wait subcommands through a shared StatusWatcher'''
+    async with StatusWatcher(client) as watcher:
+        match args.command:
+            case 'wait-instance-state':
+                await asyncio.gather(*(watcher.wait_for_instance_state(instance_id, args.state, args.timeout,
+                                                                       after_start=args.after_start)
+                                       for instance_id in args.instance_ids))
+            case 'wait-agent-ready':
+                await asyncio.gather(*(watcher.wait_for_agent_ready(instance_id, args.timeout)
+                                       for instance_id in args.instance_ids))
+            case 'wait-assessment-status':
+                await watcher.wait_for_assessment_status(args.instance_id, args.assessment_id, args.status, args.timeout)
+            case 'wait-app-running':
+                await watcher.wait_for_app_running(args.instance_id, args.bundle_id, args.timeout)
+            case 'wait-available-cores':
+                print(await watcher.wait_for_available_cores(args.project_id, args.cores, args.timeout))
+            case _:
+                raise ValueError(f'Unknown command {args.command}')
+
+
+async def run_app_command(client: CorelliumClient, args: argparse.Namespace):
+    '''Run one of the app binary cache subcommands'''
+    cache = ArtifactCache(args.cache_dir, max_bytes=args.max_cache_mb * 1024 * 1024)
+    match args.command:
+        case 'fetch-app':
+            artifact = await asyncio.to_thread(cache.fetch, args.app_url, args.minimum_kib * 1024)
+            installed, reason = False, 'no instance given'
+            if args.instance_id:
+                installed, reason = await check_installed(client, args.instance_id, artifact)
+            print(json.dumps({'path': artifact.path, 'sha256': artifact.sha256, 'size': artifact.size,
+                              **asdict(artifact.metadata), 'downloaded': artifact.downloaded,
+                              'installed': installed, 'reason': reason}))
+        case 'mark-app-installed':
+            artifact = cache.get(args.app_url)
+            if artifact is None:
+                raise LookupError(f'{args.app_url} is not in the app cache.')
+            await mark_installed(client, args.instance_id, artifact)
+        case _:
+            raise ValueError(f'Unknown command {args.command}')
+
+
+async def run_bulk_command(client: CorelliumClient, args: argparse.Namespace) -> int:
+    '''Apply one lifecycle action to a set of instances, print a per-device report, and fail if any device failed'''
+    if args.action == 'delete' and args.select_all and not (args.keep or args.keep_name_prefixes):
+        raise ValueError('Refusing to delete every instance without at least one --keep or --keep-name-prefix.')
+    instances = await client.list_instances()
+    instance_ids = select_instances(instances, args.instance_ids, args.select_all, args.keep, tuple(args.keep_name_prefixes))
+    async with StatusWatcher(client) as watcher:
+        bulk = BulkLifecycle(client, watcher, concurrency=args.concurrency, requests_per_second=args.rate, timeout=args.timeout)
+        results = await bulk.run(args.action, instance_ids, instances)
+    print(format_results(results))
+    if args.report:
+        with open(file=args.report, mode='w', encoding='utf-8') as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+    return 1 if any(result.failed for result in results) else 0
+
+
+async def run_pool_command(client: CorelliumClient, args: argparse.Namespace) -> int:
+    '''Run one of the warm pool subcommands and return the exit status'''
+    boot_options = {'cores': args.cores, 'ram': args.ram} if args.cores else None
+    spec = PoolSpec(args.project_id, args.flavor, args.os_version, args.os_build, boot_options,
+                    min_idle=args.min_idle, max_size=args.max_size)
+
+    async def prepare(instance_id: str):
+        # Values go in as positional parameters ($1 is the instance, then each --prepare-arg), never spliced into the command
+        process = await asyncio.create_subprocess_exec('bash', '-c', args.prepare_command, 'prepare', instance_id, *args.prepare_args,
+                                                       env={**os.environ, 'INSTANCE_ID': instance_id}, stdout=sys.stderr)
+        if await process.wait() != 0:
+            raise RuntimeError(f'Prepare command failed for instance {instance_id}.')
+
+    async with WarmPool(client, spec, prepare=prepare if args.prepare_command else None, lease_ttl=args.lease_ttl) as pool:
+        match args.command:
+            case 'pool-lease':
+                lease = await pool.lease(args.run_id, args.timeout)
+                print(lease.instance_id)
+            case 'pool-return':
+                # A lease that expired and was reclaimed has nothing left to return, which is only a warning
+                await pool.give_back(args.instance_id, args.run_id)
+            case 'pool-resize':
+                print(await pool.resize(args.queue_depth))
+            case 'pool-status':
+                for member in await pool.members():
+                    expires = datetime.fromtimestamp(member.expires_at, timezone.utc).isoformat() if member.expires_at else ''
+                    print(member.instance.id, member.status, member.run_id or '', expires)
+            case 'pool-drain':
+                print(await pool.drain())
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    '''Build the argument parser for every subcommand'''
+    parser = argparse.ArgumentParser(prog='corellium_client', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command in ('instance-status', 'services-ip', 'project', 'agent-ready'):
+        subparsers.add_parser(command).add_argument('instance_id')
+    app_running = subparsers.add_parser('app-running')
+    app_running.add_argument('instance_id')
+    app_running.add_argument('bundle_id')
+    subparsers.add_parser('available-cores').add_argument('project_id')
+    wait_instance_state = subparsers.add_parser('wait-instance-state')
+    wait_instance_state.add_argument('state', choices=['on', 'off'])
+    wait_instance_state.add_argument('instance_ids', nargs='+')
+    wait_instance_state.add_argument('--after-start', action='store_true',
+                                     help='a start request was just sent, so tolerate off until the instance leaves it')
+    wait_agent_ready = subparsers.add_parser('wait-agent-ready')
+    wait_agent_ready.add_argument('instance_ids', nargs='+')
+    wait_assessment_status = subparsers.add_parser('wait-assessment-status')
+    wait_assessment_status.add_argument('instance_id')
+    wait_assessment_status.add_argument('assessment_id')
+    wait_assessment_status.add_argument('status')
+    wait_app_running = subparsers.add_parser('wait-app-running')
+    wait_app_running.add_argument('instance_id')
+    wait_app_running.add_argument('bundle_id')
+    wait_available_cores = subparsers.add_parser('wait-available-cores')
+    wait_available_cores.add_argument('project_id')
+    wait_available_cores.add_argument('cores', type=int)
+    admit = subparsers.add_parser('admit')
+    admit.add_argument('project_id')
+    admit.add_argument('--flavor', default='ranchu', help='take cores and RAM from the default bootOptions for this flavor')
+    admit.add_argument('--cores', type=int, default=None, help='cores from explicit bootOptions')
+    admit.add_argument('--ram', type=int, default=0, help='RAM in MB from explicit bootOptions')
+    admit.add_argument('--timeout', type=float, default=None, help='seconds before giving up')
+    pool_options = argparse.ArgumentParser(add_help=False)
+    pool_options.add_argument('--project', dest='project_id', required=True)
+    pool_options.add_argument('--flavor', required=True)
+    pool_options.add_argument('--os', dest='os_version', required=True)
+    pool_options.add_argument('--osbuild', dest='os_build', required=True)
+    pool_options.add_argument('--cores', type=int, default=None, help='bootOptions cores for new pool instances')
+    pool_options.add_argument('--ram', type=int, default=0, help='bootOptions RAM in MB for new pool instances')
+    pool_options.add_argument('--min-idle', type=int, default=1)
+    pool_options.add_argument('--max-size', type=int, default=4)
+    pool_options.add_argument('--prepare-command', default=None,
+                              help='bash command run before a new instance is snapshotted, with the instance ID as $1')
+    pool_options.add_argument('--prepare-arg', dest='prepare_args', action='append', default=[],
+                              help='passed to the prepare command as the next positional parameter; repeat for several')
+    pool_options.add_argument('--lease-ttl', type=float, default=DEFAULT_LEASE_TTL,
+                              help='seconds a lease lasts before the pool reclaims the instance')
+    pool_lease = subparsers.add_parser('pool-lease', parents=[pool_options])
+    pool_lease.add_argument('run_id')
+    pool_lease.add_argument('--timeout', type=float, default=None, help='seconds before giving up')
+    pool_return = subparsers.add_parser('pool-return', parents=[pool_options])
+    pool_return.add_argument('instance_id')
+    pool_return.add_argument('run_id', help='the run the instance was leased to')
+    subparsers.add_parser('pool-resize', parents=[pool_options]).add_argument('--queue-depth', type=int, default=0)
+    subparsers.add_parser('pool-status', parents=[pool_options])
+    subparsers.add_parser('pool-drain', parents=[pool_options])
+    fetch_reports = subparsers.add_parser('fetch-reports')
+    fetch_reports.add_argument('instance_id')
+    fetch_reports.add_argument('assessment_id')
+    fetch_reports.add_argument('--format', dest='formats', action='append', choices=REPORT_FORMATS, help='repeat for several formats (default: all)')
+    fetch_reports.add_argument('--output-dir', default=None, help='copy the reports here as matrix_report_<assessment_id>.<format>')
+    fetch_reports.add_argument('--cache-dir', default=os.environ.get('MATRIX_REPORT_CACHE_DIR', DEFAULT_CACHE_DIR))
+    fetch_reports.add_argument('--max-cache-mb', type=int, default=DEFAULT_MAX_CACHE_BYTES // (1024 * 1024))
+    bulk = subparsers.add_parser('bulk')
+    bulk.add_argument('action', choices=BULK_ACTIONS)
+    bulk.add_argument('instance_ids', nargs='*')
+    bulk.add_argument('--all', dest='select_all', action='store_true', help='act on every instance the API token can see')
+    bulk.add_argument('--keep', action='append', default=[], help='never act on this instance; repeat for several')
+    bulk.add_argument('--keep-name-prefix', dest='keep_name_prefixes', action='append', default=[],
+                      help='never act on instances whose name starts with this; repeat for several')
+    bulk.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='devices in transition at once')
+    bulk.add_argument('--rate', type=float, default=DEFAULT_REQUESTS_PER_SECOND, help='lifecycle requests per second')
+    bulk.add_argument('--timeout', type=float, default=DEFAULT_DEVICE_TIMEOUT, help='seconds each device may take')
+    bulk.add_argument('--report', default=None, help='also write the per-device results here as JSON')
+    app_cache_options = argparse.ArgumentParser(add_help=False)
+    app_cache_options.add_argument('--cache-dir', default=os.environ.get('APP_CACHE_DIR', DEFAULT_ARTIFACT_CACHE_DIR))
+    app_cache_options.add_argument('--max-cache-mb', type=int, default=DEFAULT_MAX_ARTIFACT_CACHE_BYTES // (1024 * 1024))
+    fetch_app = subparsers.add_parser('fetch-app', parents=[app_cache_options])
+    fetch_app.add_argument('app_url')
+    fetch_app.add_argument('--instance', dest='instance_id', default=None, help='also check whether this build is installed here')
+    fetch_app.add_argument('--minimum-kib', type=int, default=0, help='reject downloads smaller than this')
+    mark_app_installed = subparsers.add_parser('mark-app-installed', parents=[app_cache_options])
+    mark_app_installed.add_argument('instance_id')
+    mark_app_installed.add_argument('app_url')
+    for wait_parser in (wait_instance_state, wait_agent_ready, wait_assessment_status, wait_app_running, wait_available_cores):
+        wait_parser.add_argument('--timeout', type=float, default=None, help='seconds before giving up')
+    return parser
+
+
+def main() -> int:
+    '''Parse arguments and run the requested subcommand'''
+    args = build_parser().parse_args()
+    try:
+        return asyncio.run(run_command(args))
+    except (ArtifactError, CorelliumApiError, LookupError, RuntimeError, TimeoutError, ValueError, WatchFailedError) as e:
+        print(f'ERROR: {e}', file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
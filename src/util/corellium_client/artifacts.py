@@ -0,0 +1,312 @@
+"""
+Content-addressed cache of app binaries, and the check that skips reinstalling a build the device already has.
+
+Each download is stored once as objects/<sha256>.<apk|ipa>. Beside it, refs/<sha256 of the URL>.json records the
+object, the server's ETag and Last-Modified headers, and the bundle ID and version read from the binary itself, so
+a repeat fetch is a conditional request that costs one 304 when the build has not changed.
+
+The agent's apps list names the bundles on a device but not which build of them is installed. After an install a
+small marker holding the binary's SHA-256 is written to the device through the agent file API, and since a snapshot
+keeps the marker along with the app, a reused or restored device is only skipped when both still match.
+"""
+
+import hashlib
+import json
+import os
+import plistlib
+import re
+import struct
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+import zipfile
+from dataclasses import asdict, dataclass
+from urllib.parse import unquote, urlsplit
+
+from .client import CorelliumClient
+from .connection import CorelliumApiError
+from .reports import atomic_write
+
+DEFAULT_ARTIFACT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'corellium', 'app_binaries')
+DEFAULT_MAX_ARTIFACT_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+DOWNLOAD_TIMEOUT = 300
+# Directories the agent can write on each platform that survive a reboot and are kept in snapshots
+INSTALL_MARKER_DIRS = {'android': '/data/local/tmp', 'ios': '/var/tmp'}
+IPA_INFO_PLIST = re.compile(r'Payload/[^/]+\.app/Info\.plist')
+
+# ==== BINARY XML ====
+# Chunk types and attribute resource IDs of the compiled AndroidManifest.xml inside an APK
+AXML_STRING_POOL = 0x0001
+AXML_START_ELEMENT = 0x0102
+AXML_RESOURCE_MAP = 0x0180
+AXML_UTF8_FLAG = 0x0100
+AXML_TYPE_STRING = 0x03
+AXML_NO_STRING = 0xffffffff
+ANDROID_ATTRIBUTE_NAMES = {0x0101021b: 'versionCode', 0x0101021c: 'versionName'}
+
+
+class ArtifactError(Exception):
+    '''Exception raised when an app binary cannot be downloaded or read.'''
+
+
+@dataclass
+class AppMetadata:
+    'Identity of an app build, read from its APK manifest or IPA Info.plist.'
+    platform: str
+    bundle_id: str
+    version: str
+    build: str
+
+    def describe(self) -> str:
+        '''Bundle ID and version for log messages'''
+        return f'{self.bundle_id} {self.version} ({self.build})'
+
+
+@dataclass
+class CachedArtifact:  # pylint: disable=too-many-instance-attributes
+    'An app binary in the cache and whether this fetch had to download it.'
+    url: str
+    path: str
+    sha256: str
+    size: int
+    metadata: AppMetadata
+    etag: str | None = None
+    last_modified: str | None = None
+    downloaded: bool = False
+
+
+def axml_length(data: bytes, position: int, wide: bool) -> tuple[int, int]:
+    '''Read a string pool length, which takes a second unit when the high bit of the first is set'''
+    if wide:
+        first = struct.unpack_from('<H', data, position)[0]
+        if first & 0x8000:
+            return ((first & 0x7fff) << 16) | struct.unpack_from('<H', data, position + 2)[0], position + 4
+        return first, position + 2
+    first = data[position]
+    if first & 0x80:
+        return ((first & 0x7f) << 8) | data[position + 1], position + 2
+    return first, position + 1
+
+
+def axml_strings(data: bytes, offset: int) -> list[str]:
+    '''Decode the strings of a binary XML string pool chunk'''
+    _, header_size, _, count, _, flags, strings_start, _ = struct.unpack_from('<HHIIIIII', data, offset)
+    base = offset + strings_start
+    strings = []
+    for start in struct.unpack_from(f'<{count}I', data, offset + header_size):
+        position = base + start
+        if flags & AXML_UTF8_FLAG:
+            # UTF-8 strings give their length in UTF-16 units first, then in bytes
+            _, position = axml_length(data, position, wide=False)
+            length, position = axml_length(data, position, wide=False)
+            strings.append(data[position:position + length].decode('utf-8', errors='replace'))
+        else:
+            length, position = axml_length(data, position, wide=True)
+            strings.append(data[position:position + length * 2].decode('utf-16-le', errors='replace'))
+    return strings
+
+
+def axml_attributes(data: bytes, position: int, strings: list[str], resource_ids: list[int]) -> dict[str, str]:
+    '''Decode the attributes of a binary XML start element, naming android: attributes by resource ID'''
+    _, _, attribute_start, attribute_size, attribute_count = struct.unpack_from('<IIHHH', data, position)
+    attributes = {}
+    for index in range(attribute_count):
+        _, name, raw_value, _, _, data_type, value = struct.unpack_from(
+            '<IIIHBBI', data, position + attribute_start + index * attribute_size)
+        key = ANDROID_ATTRIBUTE_NAMES.get(resource_ids[name] if name < len(resource_ids) else None, strings[name])
+        if data_type == AXML_TYPE_STRING:
+            attributes[key] = strings[value]
+        elif raw_value != AXML_NO_STRING:
+            attributes[key] = strings[raw_value]
+        else:
+            attributes[key] = str(value)
+    return attributes
+
+
+def read_android_manifest(data: bytes) -> dict[str, str]:
+    '''Attributes of the root manifest element of a compiled AndroidManifest.xml'''
+    strings: list[str] = []
+    resource_ids: list[int] = []
+    offset = struct.unpack_from('<H', data, 2)[0]
+    while offset + 8 <= len(data):
+        chunk_type, header_size, size = struct.unpack_from('<HHI', data, offset)
+        if chunk_type == AXML_STRING_POOL:
+            strings = axml_strings(data, offset)
+        elif chunk_type == AXML_RESOURCE_MAP:
+            resource_ids = list(struct.unpack_from(f'<{(size - header_size) // 4}I', data, offset + header_size))
+        elif chunk_type == AXML_START_ELEMENT:
+            return axml_attributes(data, offset + header_size, strings, resource_ids)
+        if size < 8:
+            break
+        offset += size
+    raise ArtifactError('AndroidManifest.xml has no manifest element.')
+
+
+def read_app_metadata(path: str) -> AppMetadata:
+    '''Read the bundle ID and version from an APK manifest or an IPA Info.plist'''
+    metadata = None
+    try:
+        with zipfile.ZipFile(path) as archive:
+            names = archive.namelist()
+            if 'AndroidManifest.xml' in names:
+                manifest = read_android_manifest(archive.read('AndroidManifest.xml'))
+                metadata = AppMetadata('android', manifest.get('package', ''),
+                                       manifest.get('versionName', ''), manifest.get('versionCode', ''))
+            elif plist_name := next((name for name in names if IPA_INFO_PLIST.fullmatch(name)), None):
+                info = plistlib.loads(archive.read(plist_name))
+                metadata = AppMetadata('ios', str(info.get('CFBundleIdentifier', '')),
+                                       str(info.get('CFBundleShortVersionString', '')), str(info.get('CFBundleVersion', '')))
+    except (zipfile.BadZipFile, plistlib.InvalidFileException, struct.error, IndexError, ValueError) as e:
+        raise ArtifactError(f'Cannot read app metadata from {path}: {e}') from e
+    if metadata is None:
+        raise ArtifactError(f'{path} is neither an APK nor an IPA.')
+    if not metadata.bundle_id:
+        raise ArtifactError(f'{path} does not name its bundle ID.')
+    return metadata
+
+
+class ArtifactCache:
+    '''App binaries stored once by content hash and found by the URL they were downloaded from.'''
+
+    def __init__(self, root: str = DEFAULT_ARTIFACT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_ARTIFACT_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(root, 'objects')
+        self.refs_dir = os.path.join(root, 'refs')
+        self._lock = threading.Lock()
+
+
+    def ref_path(self, url: str) -> str:
+        '''Reference file for one URL'''
+        return os.path.join(self.refs_dir, f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json")
+
+
+    def get(self, url: str) -> CachedArtifact | None:
+        '''Find the cached binary for a URL without asking the server'''
+        try:
+            with open(file=self.ref_path(url), mode='r', encoding='utf-8') as f:
+                ref = json.load(f)
+            path = os.path.join(self.objects_dir, ref['object'])
+            # Mark the object as recently used for eviction
+            os.utime(path)
+            return CachedArtifact(url, path, ref['sha256'], ref['size'], AppMetadata(**ref['metadata']),
+                                  etag=ref.get('etag'), last_modified=ref.get('last_modified'))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+
+    def fetch(self, url: str, minimum_bytes: int = 0, timeout: float = DOWNLOAD_TIMEOUT) -> CachedArtifact:
+        '''Return the binary for a URL, downloading it only when the server no longer has the cached one'''
+        cached = self.get(url)
+        headers = {}
+        if cached is not None and cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached is not None and cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout) as response:
+                return self.put(url, response, minimum_bytes, cached)
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and cached is not None:
+                return cached
+            raise ArtifactError(f'Download of {url} failed with HTTP {e.code}.') from e
+        except (urllib.error.URLError, OSError) as e:
+            raise ArtifactError(f'Download of {url} failed: {e}') from e
+
+
+    def put(self, url: str, response, minimum_bytes: int, cached: CachedArtifact | None) -> CachedArtifact:
+        '''Stream a download into the objects directory under its SHA-256 and point the URL's reference at it'''
+        extension = os.path.splitext(unquote(urlsplit(url).path))[1].lower() or '.bin'
+        os.makedirs(self.objects_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.objects_dir, prefix='.tmp-')
+        try:
+            with os.fdopen(descriptor, 'wb') as f:
+                while chunk := response.read(DOWNLOAD_CHUNK_BYTES):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            if size < minimum_bytes:
+                raise ArtifactError(f'Downloaded {size // 1024} KiB from {url}, below the minimum of {minimum_bytes // 1024} KiB.')
+            sha256 = digest.hexdigest()
+            unchanged = cached is not None and cached.sha256 == sha256
+            metadata = cached.metadata if unchanged else read_app_metadata(temporary_path)
+            path = os.path.join(self.objects_dir, f'{sha256}{extension}')
+            os.replace(temporary_path, path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        artifact = CachedArtifact(url, path, sha256, size, metadata, etag=response.headers.get('ETag'),
+                                  last_modified=response.headers.get('Last-Modified'), downloaded=True)
+        ref = {'url': url, 'object': os.path.basename(path), 'sha256': sha256, 'size': size, 'etag': artifact.etag,
+               'last_modified': artifact.last_modified, 'metadata': asdict(metadata)}
+        atomic_write(self.ref_path(url), json.dumps(ref, indent=2).encode('utf-8'))
+        self.evict(keep=path)
+        return artifact
+
+
+    def evict(self, keep: str | None = None):
+        '''Remove the least recently used objects, and references to them, until the cache fits'''
+        with self._lock:
+            try:
+                objects = [entry for entry in os.scandir(self.objects_dir) if entry.is_file() and not entry.name.startswith('.')]
+            except OSError:
+                return
+            stats = {entry.path: entry.stat() for entry in objects}
+            total = sum(stat.st_size for stat in stats.values())
+            evicted = set()
+            for path in sorted(stats, key=lambda path: stats[path].st_mtime):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                os.remove(path)
+                total -= stats[path].st_size
+                evicted.add(os.path.basename(path))
+            if evicted:
+                self._drop_refs(evicted)
+
+
+    def _drop_refs(self, evicted: set[str]):
+        '''Remove reference files that point at evicted objects'''
+        for entry in os.scandir(self.refs_dir):
+            try:
+                with open(file=entry.path, mode='r', encoding='utf-8') as f:
+                    stale = json.load(f).get('object') in evicted
+            except (OSError, ValueError):
+                stale = True
+            if stale:
+                os.remove(entry.path)
+
+
+# ==== INSTALL MARKERS ====
+
+def install_marker_path(metadata: AppMetadata) -> str:
+    '''Device path of the marker recording which build of an app was installed from the cache'''
+    return f'{INSTALL_MARKER_DIRS[metadata.platform]}/.app_cache_{metadata.bundle_id}.json'
+
+
+async def check_installed(client: CorelliumClient, instance_id: str, artifact: CachedArtifact) -> tuple[bool, str]:
+    '''Whether the instance already has this exact build, and a reason for the log'''
+    metadata = artifact.metadata
+    if not any(app.bundle_id == metadata.bundle_id for app in await client.list_apps(instance_id)):
+        return False, f'{metadata.bundle_id} is not installed'
+    try:
+        marker = json.loads(await client.read_device_file(instance_id, install_marker_path(metadata)))
+    except (CorelliumApiError, ValueError):
+        return False, f'{metadata.bundle_id} is installed but not from the app cache'
+    if marker.get('sha256') != artifact.sha256:
+        installed = f"{marker.get('bundle_id')} {marker.get('version')} ({marker.get('build')})"
+        if installed == metadata.describe():
+            return False, f'{installed} is installed from a different binary'
+        return False, f'{installed} is installed, not {metadata.describe()}'
+    return True, f'{metadata.describe()} is already installed'
+
+
+async def mark_installed(client: CorelliumClient, instance_id: str, artifact: CachedArtifact):
+    '''Record on the device which build was just installed'''
+    marker = {'sha256': artifact.sha256, 'url': artifact.url, **asdict(artifact.metadata)}
+    await client.write_device_file(instance_id, install_marker_path(artifact.metadata), json.dumps(marker).encode('utf-8'))
@@ -0,0 +1,160 @@
+"""
+Start, stop, soft-stop, or delete a whole set of instances at once.
+
+The instance list is fetched once and every device is looked up in it by ID, so deciding what to touch is one
+request whatever the fleet size. Requests are spaced out by a rate limiter and at most a fixed number of devices
+are in transition at a time, which staggers boots on an appliance without a fixed sleep between them. Every
+device then waits on the same StatusWatcher, so the whole set is watched with one instance list per tick.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+
+from .client import CorelliumClient
+from .connection import CorelliumApiError
+from .models import Instance
+from .watcher import StatusWatcher, WatchFailedError
+
+BULK_ACTIONS = ('start', 'stop', 'soft-stop', 'delete')
+DEFAULT_CONCURRENCY = 8
+DEFAULT_REQUESTS_PER_SECOND = 2.0
+DEFAULT_DEVICE_TIMEOUT = 900
+INSTANCE_STATUS_ON = 'on'
+INSTANCE_STATUS_OFF = 'off'
+INSTANCE_STATUS_CREATING = 'creating'
+
+
+@dataclass
+class DeviceResult:  # pylint: disable=too-many-instance-attributes
+    'What a bulk operation did to one instance.'
+    instance_id: str
+    action: str
+    outcome: str
+    initial_state: str | None = None
+    final_state: str | None = None
+    seconds: float = 0.0
+    error: str | None = None
+
+    @property
+    def failed(self) -> bool:
+        '''True when the device did not end up where the action wanted it'''
+        return self.outcome in ('failed', 'missing')
+
+
+def select_instances(instances: list[Instance], instance_ids: list[str], select_all: bool, keep: list[str],
+                     keep_name_prefixes: tuple[str, ...] = ()) -> list[str]:
+    '''Instance IDs to act on, in order and without duplicates, leaving out kept IDs and names with a kept prefix'''
+    kept = set(keep)
+    if keep_name_prefixes:
+        kept.update(instance.id for instance in instances if instance.name.startswith(keep_name_prefixes))
+    selected = [instance.id for instance in instances] if select_all else instance_ids
+    return [instance_id for instance_id in dict.fromkeys(selected) if instance_id not in kept]
+
+
+class RateLimiter:  # pylint: disable=too-few-public-methods
+    '''Let callers through no faster than a fixed number per second.'''
+
+    def __init__(self, per_second: float, clock=time.monotonic, sleep=asyncio.sleep):
+        self.interval = 1 / per_second if per_second > 0 else 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+
+    async def wait(self):
+        '''Wait for the next free slot'''
+        async with self._lock:
+            now = self.clock()
+            if self._next > now:
+                await self.sleep(self._next - now)
+                now = self._next
+            self._next = now + self.interval
+
+
+class BulkLifecycle:
+    '''Apply one lifecycle action to many instances with bounded concurrency and shared status polling.'''
+
+    def __init__(self, client: CorelliumClient, watcher: StatusWatcher, *,  # pylint: disable=too-many-arguments
+                 concurrency: int = DEFAULT_CONCURRENCY, requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+                 timeout: float | None = DEFAULT_DEVICE_TIMEOUT, clock=time.monotonic):
+        self.client = client
+        self.watcher = watcher
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.limiter = RateLimiter(requests_per_second, clock=clock)
+        self.timeout = timeout
+        self.clock = clock
+
+
+    async def run(self, action: str, instance_ids: list[str], instances: list[Instance] | None = None) -> list[DeviceResult]:
+        '''Apply action to every instance and return one result per instance, in the order given'''
+        if action not in BULK_ACTIONS:
+            raise ValueError(f"Unknown bulk action '{action}'.")
+        if instances is None:
+            instances = await self.client.list_instances()
+        by_id = {instance.id: instance for instance in instances}
+        return list(await asyncio.gather(*(self.apply(action, instance_id, by_id.get(instance_id))
+                                           for instance_id in dict.fromkeys(instance_ids))))
+
+
+    async def apply(self, action: str, instance_id: str, instance: Instance | None) -> DeviceResult:
+        '''Apply action to one instance, holding a concurrency slot until it reaches its final state'''
+        result = DeviceResult(instance_id, action, 'done', initial_state=instance.state if instance else None)
+        if instance is None:
+            # Nothing left to delete is success, but a missing device cannot be started or stopped
+            result.outcome = 'skipped' if action == 'delete' else 'missing'
+            result.error = None if action == 'delete' else f'Instance {instance_id} does not exist.'
+            return result
+        async with self.semaphore:
+            started = self.clock()
+            try:
+                result.outcome, result.final_state = await self._transition(action, instance)
+            except (CorelliumApiError, LookupError, TimeoutError, WatchFailedError) as e:
+                result.outcome = 'failed'
+                result.error = str(e)
+            result.seconds = round(self.clock() - started, 1)
+        return result
+
+
+    async def _transition(self, action: str, instance: Instance) -> tuple[str, str]:
+        '''Send the request for action if the instance needs it, wait for the target state, and return the outcome and state'''
+        match action:
+            case 'start':
+                if instance.state == INSTANCE_STATUS_ON:
+                    return 'skipped', instance.state
+                if instance.state != INSTANCE_STATUS_CREATING:
+                    await self.limiter.wait()
+                    await self.client.start_instance(instance.id)
+                await self.watcher.wait_for_instance_state(instance.id, INSTANCE_STATUS_ON, self.timeout, after_start=True)
+                return 'done', INSTANCE_STATUS_ON
+            case 'stop' | 'soft-stop':
+                if instance.state == INSTANCE_STATUS_OFF:
+                    return 'skipped', instance.state
+                if instance.state == INSTANCE_STATUS_CREATING:
+                    # A device that is still being created has to come on before it can be stopped
+                    await self.watcher.wait_for_instance_state(instance.id, INSTANCE_STATUS_ON, self.timeout)
+                await self.limiter.wait()
+                await self.client.stop_instance(instance.id, soft=action == 'soft-stop')
+                await self.watcher.wait_for_instance_state(instance.id, INSTANCE_STATUS_OFF, self.timeout)
+                return 'done', INSTANCE_STATUS_OFF
+            case 'delete':
+                await self.limiter.wait()
+                await self.client.delete_instance(instance.id)
+                await self.watcher.wait_for_instance_deleted(instance.id, self.timeout)
+                return 'done', 'deleted'
+            case _:
+                raise ValueError(f"Unknown bulk action '{action}'.")
+
+
+def format_results(results: list[DeviceResult]) -> str:
+    '''Per-device report table followed by a one-line summary'''
+    lines = [f"{'INSTANCE':<36}  {'ACTION':<9}  {'OUTCOME':<7}  {'FROM':<8}  {'TO':<8}  {'SECONDS':>7}  ERROR"]
+    for result in results:
+        lines.append(f'{result.instance_id:<36}  {result.action:<9}  {result.outcome:<7}  {result.initial_state or "-":<8}  '
+                     f'{result.final_state or "-":<8}  {result.seconds:>7.1f}  {result.error or ""}'.rstrip())
+    counts = {}
+    for result in results:
+        counts[result.outcome] = counts.get(result.outcome, 0) + 1
+    lines.append(f"{len(results)} devices: " + ', '.join(f'{count} {outcome}' for outcome, count in sorted(counts.items())))
+    return '\n'.join(lines)
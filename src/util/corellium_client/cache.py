@@ -0,0 +1,45 @@
+"""
+Small time-to-live cache for Corellium lookups that rarely change, such as instance to project.
+"""
+
+import threading
+import time
+
+
+class TtlCache:
+    '''Thread-safe mapping whose entries expire a fixed number of seconds after they are stored.'''
+
+    def __init__(self, ttl: float, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: dict = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key, default=None):
+        '''Return the cached value for key, or default if it is missing or expired'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > self.clock():
+                self.hits += 1
+                return entry[0]
+            self._entries.pop(key, None)
+            self.misses += 1
+            return default
+
+
+    def set(self, key, value):
+        '''Store value for key until the TTL elapses'''
+        with self._lock:
+            self._entries[key] = (value, self.clock() + self.ttl)
+
+
+    def invalidate(self, key=None):
+        '''Drop one key, or every key when called without arguments'''
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
@@ -0,0 +1,274 @@
+"""
+Async client for the Corellium REST API that reuses keep-alive connections across calls.
+"""
+
+import asyncio
+import os
+from urllib.parse import quote
+
+from .cache import TtlCache
+from .connection import ConnectionPool, CorelliumApiError
+from .models import App, Assessment, Instance, Project, Snapshot
+
+API_PREFIX = '/api/v1'
+DEFAULT_PROJECT_CACHE_TTL = 300
+
+
+class CorelliumClient:  # pylint: disable=too-many-public-methods
+    '''Async wrapper around the Corellium REST API backed by a pooled HTTP connection.'''
+
+    def __init__(self, endpoint: str, api_token: str, *,  # pylint: disable=too-many-arguments
+                 max_connections: int = 8, timeout: float = 30,
+                 verify_tls: bool = True, project_cache_ttl: float = DEFAULT_PROJECT_CACHE_TTL):
+        self.pool = ConnectionPool(endpoint, max_size=max_connections, timeout=timeout, verify_tls=verify_tls)
+        self.headers = {
+            'Accept': 'application/json',
+            'Authorization': f'Bearer {api_token}',
+        }
+        self.project_cache = TtlCache(ttl=project_cache_ttl)
+
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'CorelliumClient':
+        '''Build a client from CORELLIUM_API_ENDPOINT and CORELLIUM_API_TOKEN like check_env_vars in functions.sh'''
+        endpoint = os.environ.get('CORELLIUM_API_ENDPOINT')
+        api_token = os.environ.get('CORELLIUM_API_TOKEN')
+        if not endpoint:
+            raise RuntimeError('CORELLIUM_API_ENDPOINT unset or empty.')
+        if not api_token:
+            raise RuntimeError('CORELLIUM_API_TOKEN unset or empty.')
+        # Match the Node CLI, which skips certificate checks when NODE_TLS_REJECT_UNAUTHORIZED=0
+        kwargs.setdefault('verify_tls', os.environ.get('NODE_TLS_REJECT_UNAUTHORIZED', '1') != '0')
+        return cls(endpoint, api_token, **kwargs)
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        self.close()
+
+
+    def close(self):
+        '''Close every pooled connection'''
+        self.pool.close()
+
+
+    def request_sync(self, method: str, path: str, *, params: dict | None = None, body=None, raw: bool = False,  # pylint: disable=too-many-arguments
+                     content_type: str | None = None):
+        '''Send a blocking API request and return the decoded JSON (or raw bytes) body'''
+        headers = {**self.headers, 'Content-Type': content_type} if content_type else self.headers
+        response = self.pool.request(method, f'{API_PREFIX}{path}', params=params, body=body, headers=headers)
+        if response.status >= 400:
+            raise CorelliumApiError(method, path, response.status, response.body)
+        return response.body if raw else response.json()
+
+
+    async def request(self, method: str, path: str, *, params: dict | None = None, body=None, raw: bool = False,  # pylint: disable=too-many-arguments
+                      content_type: str | None = None):
+        '''Send an API request on a worker thread so many calls can share the pool concurrently'''
+        return await asyncio.to_thread(self.request_sync, method, path, params=params, body=body, raw=raw,
+                                       content_type=content_type)
+
+
+    # ==== INSTANCES ====
+
+    async def list_instances(self) -> list[Instance]:
+        '''List every instance visible to the API token in one request'''
+        instances = [Instance.from_json(item) for item in await self.request('GET', '/instances')]
+        for instance in instances:
+            self.project_cache.set(instance.id, instance.project)
+        return instances
+
+
+    async def get_instance(self, instance_id: str) -> Instance:
+        '''Get details for one instance'''
+        instance = Instance.from_json(await self.request('GET', f'/instances/{instance_id}'))
+        self.project_cache.set(instance.id, instance.project)
+        return instance
+
+
+    async def does_instance_exist(self, instance_id: str) -> bool:
+        '''Return True if the instance exists'''
+        try:
+            await self.get_instance(instance_id)
+        except CorelliumApiError as e:
+            if e.status == 404:
+                return False
+            raise
+        return True
+
+
+    async def get_instance_status(self, instance_id: str) -> str:
+        '''Return the instance state, such as on, off, or creating'''
+        return (await self.get_instance(instance_id)).state
+
+
+    async def get_instance_services_ip(self, instance_id: str) -> str | None:
+        '''Return the services IP used for adb, ssh, and usbfluxd connections'''
+        return (await self.get_instance(instance_id)).service_ip
+
+
+    async def get_project_from_instance_id(self, instance_id: str) -> str:
+        '''Return the instance project ID, served from the TTL cache when possible'''
+        project_id = self.project_cache.get(instance_id)
+        if project_id is None:
+            project_id = (await self.get_instance(instance_id)).project
+        return project_id
+
+
+    async def create_instance(self, request_data: dict) -> str:
+        '''Create an instance from a create_instance payload and return its ID'''
+        response = await self.request('POST', '/instances', body=request_data)
+        return response['id']
+
+
+    async def start_instance(self, instance_id: str):
+        '''Ask the instance to start without waiting for it to be on'''
+        await self.request('POST', f'/instances/{instance_id}/start', body={})
+
+
+    async def stop_instance(self, instance_id: str, soft: bool = False):
+        '''Ask the instance to stop without waiting for it to be off'''
+        await self.request('POST', f'/instances/{instance_id}/stop', body={'soft': soft})
+
+
+    async def delete_instance(self, instance_id: str):
+        '''Delete the instance and drop it from the project cache'''
+        await self.request('DELETE', f'/instances/{instance_id}')
+        self.project_cache.invalidate(instance_id)
+
+
+    async def rename_instance(self, instance_id: str, name: str) -> Instance:
+        '''Rename the instance and return it as updated'''
+        return Instance.from_json(await self.request('PATCH', f'/instances/{instance_id}', body={'name': name}))
+
+
+    # ==== SNAPSHOTS ====
+
+    async def list_snapshots(self, instance_id: str) -> list[Snapshot]:
+        '''List the snapshots of the instance'''
+        return [Snapshot.from_json(item) for item in await self.request('GET', f'/instances/{instance_id}/snapshots')]
+
+
+    async def create_snapshot(self, instance_id: str, name: str) -> Snapshot:
+        '''Snapshot the instance in its current state'''
+        return Snapshot.from_json(await self.request('POST', f'/instances/{instance_id}/snapshots', body={'name': name}))
+
+
+    async def restore_snapshot(self, instance_id: str, snapshot_id: str):
+        '''Restore the instance to a snapshot without waiting for it to boot'''
+        await self.request('POST', f'/instances/{instance_id}/snapshots/{snapshot_id}/restore', body={})
+
+
+    async def delete_snapshot(self, instance_id: str, snapshot_id: str):
+        '''Delete a snapshot'''
+        await self.request('DELETE', f'/instances/{instance_id}/snapshots/{snapshot_id}')
+
+
+    # ==== AGENT AND APPS ====
+
+    async def is_agent_ready(self, instance_id: str) -> bool:
+        '''Return True once the on-device agent reports ready'''
+        try:
+            response = await self.request('GET', f'/instances/{instance_id}/agent/v1/app/ready')
+        except CorelliumApiError:
+            # The agent endpoint errors until the device has booted far enough to answer
+            return False
+        return bool((response or {}).get('ready', False))
+
+
+    async def list_apps(self, instance_id: str) -> list[App]:
+        '''List the apps installed on the instance'''
+        response = await self.request('GET', f'/instances/{instance_id}/agent/v1/app/apps')
+        items = response.get('apps', []) if isinstance(response, dict) else response
+        return [App.from_json(item) for item in items]
+
+
+    async def is_app_running(self, instance_id: str, bundle_id: str) -> bool:
+        '''Return True if the app is installed and running on the instance'''
+        return any(app.bundle_id == bundle_id and app.running for app in await self.list_apps(instance_id))
+
+
+    async def kill_app(self, instance_id: str, bundle_id: str):
+        '''Kill a running app'''
+        await self.request('POST', f'/instances/{instance_id}/agent/v1/app/apps/{bundle_id}/kill')
+
+
+    async def run_app(self, instance_id: str, bundle_id: str):
+        '''Launch an installed app'''
+        await self.request('POST', f'/instances/{instance_id}/agent/v1/app/apps/{bundle_id}/run')
+
+
+    async def read_device_file(self, instance_id: str, path: str) -> bytes:
+        '''Download a file from the device filesystem through the agent'''
+        return await self.request('GET', f"/instances/{instance_id}/agent/v1/file/device/{quote(path, safe='')}", raw=True)
+
+
+    async def write_device_file(self, instance_id: str, path: str, data: bytes):
+        '''Upload a file to the device filesystem through the agent'''
+        await self.request('PUT', f"/instances/{instance_id}/agent/v1/file/device/{quote(path, safe='')}", body=data,
+                           content_type='application/octet-stream')
+
+
+    # ==== PROJECTS ====
+
+    async def list_projects(self) -> list[Project]:
+        '''List projects with their core quotas'''
+        return [Project.from_json(item) for item in await self.request('GET', '/projects')]
+
+
+    async def get_available_cores(self, project_id: str) -> int:
+        '''Return quotas.cores - quotasUsed.cores for the project'''
+        for project in await self.list_projects():
+            if project.id == project_id:
+                return project.available_cores
+        raise LookupError(f'Project {project_id} does not exist.')
+
+
+    # ==== MATRIX ====
+
+    async def list_assessments(self, instance_id: str) -> list[Assessment]:
+        '''List the MATRIX assessments for the instance'''
+        response = await self.request('GET', f'/services/matrix/{instance_id}/assessments')
+        return [Assessment.from_json(item) for item in response]
+
+
+    async def get_assessment(self, instance_id: str, assessment_id: str) -> Assessment:
+        '''Get one MATRIX assessment'''
+        return Assessment.from_json(await self.request('GET', f'/services/matrix/{instance_id}/assessments/{assessment_id}'))
+
+
+    async def download_matrix_report(self, instance_id: str, report_id: str, report_format: str = 'html') -> bytes:
+        '''Download a MATRIX report as html or json bytes'''
+        return await self.request('GET', f'/services/matrix/{instance_id}/reports/{report_id}/download',
+                                  params={'format': report_format}, raw=True)
+
+
+    async def create_assessment(self, instance_id: str, bundle_id: str, wordlist_id: str | None = None) -> Assessment:
+        '''Create a MATRIX assessment of the app, optionally with a wordlist image'''
+        body = {'instanceId': instance_id, 'bundleId': bundle_id}
+        if wordlist_id:
+            body['wordlistId'] = wordlist_id
+        return Assessment.from_json(await self.request('POST', f'/services/matrix/{instance_id}/assessments', body=body))
+
+
+    async def start_assessment_monitoring(self, instance_id: str, assessment_id: str):
+        '''Ask MATRIX to start monitoring without waiting for the monitoring status'''
+        await self.request('POST', f'/services/matrix/{instance_id}/assessments/{assessment_id}/start', body={})
+
+
+    async def stop_assessment_monitoring(self, instance_id: str, assessment_id: str):
+        '''Ask MATRIX to stop monitoring without waiting for the readyForTesting status'''
+        await self.request('POST', f'/services/matrix/{instance_id}/assessments/{assessment_id}/stop', body={})
+
+
+    async def test_assessment(self, instance_id: str, assessment_id: str):
+        '''Ask MATRIX to test the collected evidence without waiting for the complete status'''
+        await self.request('POST', f'/services/matrix/{instance_id}/assessments/{assessment_id}/test', body={})
+
+
+    async def delete_assessment(self, instance_id: str, assessment_id: str):
+        '''Delete a MATRIX assessment'''
+        await self.request('DELETE', f'/services/matrix/{instance_id}/assessments/{assessment_id}')
@@ -0,0 +1,118 @@
+"""
+Keep-alive HTTP connection pool for the Corellium REST API.
+"""
+
+import http.client
+import json
+import ssl
+import threading
+from dataclasses import dataclass
+from urllib.parse import urlencode, urlsplit
+
+
+class CorelliumApiError(Exception):
+    '''Exception raised when the Corellium REST API returns an error status.'''
+
+    def __init__(self, method: str, path: str, status: int, body: bytes):
+        self.method = method
+        self.path = path
+        self.status = status
+        self.body = body
+        super().__init__(f"{method} {path} returned HTTP {status}: {body[:200]!r}")
+
+
+@dataclass
+class HttpResponse:
+    'Status, headers, and raw body of a completed HTTP request.'
+    status: int
+    headers: dict
+    body: bytes
+
+    def json(self):
+        '''Decode the response body as JSON, treating an empty body as None'''
+        if not self.body:
+            return None
+        return json.loads(self.body)
+
+
+class ConnectionPool:  # pylint: disable=too-many-instance-attributes
+    '''Thread-safe pool of persistent HTTP(S) connections to a single origin.'''
+
+    def __init__(self, endpoint: str, max_size: int = 8, timeout: float = 30, verify_tls: bool = True):
+        parts = urlsplit(endpoint if '://' in endpoint else f'https://{endpoint}')
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.max_size = max_size
+        self.timeout = timeout
+        self.ssl_context = ssl.create_default_context() if verify_tls else ssl._create_unverified_context()  # pylint: disable=protected-access
+        self._idle: list[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max_size)
+        self.connections_opened = 0
+        self.requests_sent = 0
+
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        '''Open a new connection to the pool origin'''
+        self.connections_opened += 1
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=self.ssl_context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+
+    def _checkout(self) -> http.client.HTTPConnection:
+        '''Reuse an idle connection or open a new one'''
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._new_connection()
+
+
+    def _checkin(self, connection: http.client.HTTPConnection, reusable: bool):
+        '''Return a connection to the idle list or close it'''
+        if not reusable:
+            connection.close()
+            return
+        with self._lock:
+            self._idle.append(connection)
+
+
+    def request(self, method: str, path: str, *, params: dict | None = None, body=None, headers: dict | None = None) -> HttpResponse:
+        '''Send a request over a pooled connection, retrying once if a reused connection was closed by the server'''
+        if params:
+            path = f'{path}?{urlencode(params)}'
+        request_headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+            request_headers.setdefault('Content-Type', 'application/json')
+        with self._semaphore:
+            try:
+                return self._send(method, path, payload, request_headers)
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # An idle keep-alive connection may have been closed by the server, so retry once on a fresh one.
+                return self._send(method, path, payload, request_headers)
+
+
+    def _send(self, method: str, path: str, payload: bytes | None, headers: dict) -> HttpResponse:
+        '''Send one request and read the full response'''
+        connection = self._checkout()
+        try:
+            connection.request(method, path, body=payload, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except Exception:
+            connection.close()
+            raise
+        self.requests_sent += 1
+        self._checkin(connection, reusable=not response.will_close)
+        return HttpResponse(status=response.status, headers=dict(response.getheaders()), body=data)
+
+
+    def close(self):
+        '''Close every idle connection'''
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
@@ -0,0 +1,144 @@
+"""
+Typed views of the JSON objects returned by the Corellium REST API.
+"""
+
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Instance:  # pylint: disable=too-many-instance-attributes
+    'A Corellium virtual device as returned by /api/v1/instances.'
+    id: str
+    name: str
+    state: str
+    flavor: str
+    project: str
+    service_ip: str | None = None
+    udid: str | None = None
+    os_version: str | None = None
+    os_build: str | None = None
+    cores: int | None = None
+    ram: int | None = None
+    raw: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'Instance':
+        '''Build an Instance from an API response object'''
+        boot_options = data.get('bootOptions') or {}
+        return cls(
+            id=data['id'],
+            name=data.get('name', ''),
+            state=data.get('state', ''),
+            flavor=data.get('flavor', ''),
+            project=data.get('project', ''),
+            service_ip=data.get('serviceIp'),
+            udid=boot_options.get('udid'),
+            os_version=data.get('os'),
+            os_build=data.get('osbuild'),
+            cores=boot_options.get('cores'),
+            ram=boot_options.get('ram'),
+            raw=data,
+        )
+
+    @property
+    def is_ranchu(self) -> bool:
+        '''True for Android (ranchu) instances'''
+        return self.flavor == 'ranchu'
+
+
+@dataclass
+class App:
+    'An app installed on a Corellium virtual device.'
+    bundle_id: str
+    name: str
+    running: bool
+    raw: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'App':
+        '''Build an App from an agent apps list entry'''
+        return cls(
+            bundle_id=data.get('bundleID', ''),
+            name=data.get('name', ''),
+            running=bool(data.get('running', False)),
+            raw=data,
+        )
+
+
+@dataclass
+class Assessment:
+    'A Corellium MATRIX assessment.'
+    id: str
+    status: str
+    instance_id: str | None = None
+    bundle_id: str | None = None
+    report_id: str | None = None
+    raw: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'Assessment':
+        '''Build an Assessment from an API response object'''
+        return cls(
+            id=data['id'],
+            status=data.get('status', ''),
+            instance_id=data.get('instanceId'),
+            bundle_id=data.get('bundleId'),
+            report_id=data.get('reportId'),
+            raw=data,
+        )
+
+
+@dataclass
+class Project:
+    'A Corellium project with its CPU core and RAM quotas.'
+    id: str
+    name: str
+    cores_quota: int
+    cores_used: int
+    ram_quota: int = 0
+    ram_used: int = 0
+    raw: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'Project':
+        '''Build a Project from an API response object'''
+        return cls(
+            id=data['id'],
+            name=data.get('name', ''),
+            cores_quota=(data.get('quotas') or {}).get('cores', 0),
+            cores_used=(data.get('quotasUsed') or {}).get('cores', 0),
+            ram_quota=(data.get('quotas') or {}).get('ram', 0),
+            ram_used=(data.get('quotasUsed') or {}).get('ram', 0),
+            raw=data,
+        )
+
+    @property
+    def available_cores(self) -> int:
+        '''CPU cores still free in the project quota'''
+        return self.cores_quota - self.cores_used
+
+    @property
+    def available_ram(self) -> int | None:
+        '''RAM in MB still free in the project quota, or None when the project has no RAM quota'''
+        return self.ram_quota - self.ram_used if self.ram_quota else None
+
+
+@dataclass
+class Snapshot:
+    'A saved state of an instance that it can be restored to.'
+    id: str
+    name: str
+    instance_id: str
+    created: bool
+    raw: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'Snapshot':
+        '''Build a Snapshot from an API response object'''
+        return cls(
+            id=data['id'],
+            name=data.get('name', ''),
+            instance_id=data.get('instance', ''),
+            created=bool((data.get('status') or {}).get('created', False)),
+            raw=data,
+        )
@@ -0,0 +1,183 @@
+"""
+Content-addressed on-disk cache and concurrent fetcher for MATRIX reports.
+
+A complete assessment's reports never change, so each format is downloaded once and kept under
+objects/<sha256>.<format>, with a small reference file at refs/<assessment_id>/<report_id>.<format>
+naming the object. Writes go to a temporary file that is renamed into place, so a reader never sees a
+partial report, and the least recently used objects are evicted once the cache grows past its size limit.
+"""
+
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from dataclasses import dataclass
+
+from .client import CorelliumClient
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'corellium', 'matrix_reports')
+DEFAULT_MAX_CACHE_BYTES = 512 * 1024 * 1024
+REPORT_FORMATS = ('html', 'json')
+ASSESSMENT_STATUS_COMPLETE = 'complete'
+
+
+@dataclass
+class FetchedReport:
+    'Where one report format ended up and whether it came from the cache.'
+    assessment_id: str
+    report_id: str
+    report_format: str
+    path: str
+    cached: bool
+
+
+def atomic_write(path: str, data: bytes):
+    '''Write data to path through a temporary file in the same directory and a rename'''
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+class ReportCache:
+    '''Reports stored once by content hash and found by assessment ID, report ID, and format.'''
+
+    def __init__(self, root: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(root, 'objects')
+        self.refs_dir = os.path.join(root, 'refs')
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    def ref_path(self, assessment_id: str, report_id: str, report_format: str) -> str:
+        '''Reference file for one report format'''
+        return os.path.join(self.refs_dir, assessment_id, f'{report_id}.{report_format}')
+
+
+    def get(self, assessment_id: str, report_id: str | None, report_format: str) -> FetchedReport | None:
+        '''Find a cached report, matching any report ID for the assessment when report_id is None'''
+        if report_id is None:
+            report_id = self.find_report_id(assessment_id, report_format)
+        object_path = None
+        if report_id is not None:
+            try:
+                with open(file=self.ref_path(assessment_id, report_id, report_format), mode='r', encoding='utf-8') as f:
+                    object_path = os.path.join(self.objects_dir, f'{f.read().strip()}.{report_format}')
+                # Mark the object as recently used for eviction
+                os.utime(object_path)
+            except OSError:
+                object_path = None
+        with self._lock:
+            if object_path is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return FetchedReport(assessment_id, report_id, report_format, object_path, cached=True)
+
+
+    def find_report_id(self, assessment_id: str, report_format: str) -> str | None:
+        '''Report ID cached for an assessment, so a lookup can skip asking the API for it'''
+        try:
+            names = os.listdir(os.path.join(self.refs_dir, assessment_id))
+        except OSError:
+            return None
+        report_ids = [name[:-len(report_format) - 1] for name in names if name.endswith(f'.{report_format}')]
+        return report_ids[0] if len(report_ids) == 1 else None
+
+
+    def put(self, assessment_id: str, report_id: str, report_format: str, data: bytes) -> FetchedReport:
+        '''Store a report and point its reference at it, then evict down to the size limit'''
+        digest = hashlib.sha256(data).hexdigest()
+        object_path = os.path.join(self.objects_dir, f'{digest}.{report_format}')
+        if not os.path.exists(object_path):
+            atomic_write(object_path, data)
+        atomic_write(self.ref_path(assessment_id, report_id, report_format), digest.encode('ascii'))
+        self.evict(keep=object_path)
+        return FetchedReport(assessment_id, report_id, report_format, object_path, cached=False)
+
+
+    def evict(self, keep: str | None = None):
+        '''Remove the least recently used objects, and references to them, until the cache fits'''
+        with self._lock:
+            try:
+                objects = [entry for entry in os.scandir(self.objects_dir) if entry.is_file() and not entry.name.startswith('.')]
+            except OSError:
+                return
+            stats = {entry.path: entry.stat() for entry in objects}
+            total = sum(stat.st_size for stat in stats.values())
+            evicted = set()
+            for path in sorted(stats, key=lambda path: stats[path].st_mtime):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                os.remove(path)
+                total -= stats[path].st_size
+                evicted.add(os.path.basename(path))
+            if evicted:
+                self._drop_refs(evicted)
+
+
+    def _drop_refs(self, evicted: set[str]):
+        '''Delete references whose objects were evicted'''
+        for directory, _, names in os.walk(self.refs_dir):
+            for name in names:
+                path = os.path.join(directory, name)
+                with open(file=path, mode='r', encoding='utf-8') as f:
+                    digest = f.read().strip()
+                if f'{digest}{os.path.splitext(name)[1]}' in evicted:
+                    os.remove(path)
+            if directory != self.refs_dir and not os.listdir(directory):
+                os.rmdir(directory)
+
+
+class ReportFetcher:  # pylint: disable=too-few-public-methods
+    '''Fetch every requested report format for an assessment at once, serving repeats from the cache.'''
+
+    def __init__(self, client: CorelliumClient, cache: ReportCache):
+        self.client = client
+        self.cache = cache
+
+
+    async def fetch(self, instance_id: str, assessment_id: str, formats: tuple[str, ...] = REPORT_FORMATS,
+                    output_dir: str | None = None) -> list[FetchedReport]:
+        '''Return a FetchedReport per format, copying each to output_dir/matrix_report_<id>.<format> when given'''
+        reports = {report_format: self.cache.get(assessment_id, None, report_format) for report_format in formats}
+        missing = [report_format for report_format, report in reports.items() if report is None]
+        if missing:
+            assessment = await self.client.get_assessment(instance_id, assessment_id)
+            if not assessment.report_id:
+                raise LookupError(f'MATRIX assessment {assessment_id} has no report yet.')
+            downloads = await asyncio.gather(*(self.client.download_matrix_report(instance_id, assessment.report_id, report_format)
+                                               for report_format in missing))
+            for report_format, data in zip(missing, downloads):
+                if assessment.status == ASSESSMENT_STATUS_COMPLETE:
+                    reports[report_format] = await asyncio.to_thread(self.cache.put, assessment_id, assessment.report_id,
+                                                                     report_format, data)
+                elif output_dir is not None:
+                    # Reports of an unfinished assessment can still change, so they are not cached
+                    path = os.path.join(output_dir, f'matrix_report_{assessment_id}.{report_format}')
+                    await asyncio.to_thread(atomic_write, path, data)
+                    reports[report_format] = FetchedReport(assessment_id, assessment.report_id, report_format, path, cached=False)
+                else:
+                    raise LookupError(f'MATRIX assessment {assessment_id} is {assessment.status}; '
+                                      'pass an output directory to fetch its reports without caching them.')
+        if output_dir is not None:
+            for report in reports.values():
+                destination = os.path.join(output_dir, f'matrix_report_{assessment_id}.{report.report_format}')
+                if os.path.abspath(report.path) != os.path.abspath(destination):
+                    await asyncio.to_thread(shutil.copyfile, report.path, destination)
+                    report.path = destination
+        return [reports[report_format] for report_format in formats]
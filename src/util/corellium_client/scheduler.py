@@ -0,0 +1,283 @@
+"""
+Quota-aware admission for runs that each need an instance's worth of project CPU cores and RAM.
+
+Jobs wait in one queue annotated with the cores and RAM their instance will take, read from the same bootOptions
+that create_instance sends. One shared poll of the project quota serves the whole queue, and each pass bin-packs as
+many waiting jobs as fit into the free capacity, highest priority first and then the runner with the fewest running
+jobs, backfilling smaller jobs around one that does not fit yet unless it has waited past the starvation limit.
+Capacity granted to an admitted job stays reserved until a poll taken after its instance was created shows it in
+quotasUsed, so two jobs are never admitted into the same cores. Releasing a job triggers a poll straight away, so
+the next job is admitted as soon as the capacity is back instead of on the next fixed-interval check, and the poll
+backs off no further than the old 15 second loop, starting over whenever the free capacity changes.
+
+The queue lives in one process. The admit command that wait_until_available_cores runs builds a scheduler for a
+single job, so across CI runners there is no shared queue, priority, or fairness; each runner gets a quota poll
+that reacts to freed capacity sooner than the fixed sleep did.
+"""
+
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+from .connection import CorelliumApiError
+
+# Resources each flavor takes when create_instance sends no bootOptions of its own
+DEFAULT_BOOT_OPTIONS = {
+    'ranchu': {'cores': 4, 'ram': 4096},
+    'ios': {'cores': 6, 'ram': 6144},
+}
+
+
+@dataclass
+class Job:
+    'One pending run with the resources its instance will take from the project quota.'
+    id: str
+    cores: int
+    ram: int = 0
+    priority: int = 0
+    runner: str = ''
+    submitted_at: float = 0.0
+
+    @classmethod
+    def from_boot_options(cls, job_id: str, flavor: str, boot_options: dict | None = None, **fields) -> 'Job':
+        '''Build a Job from the bootOptions create_instance sends for a flavor'''
+        options = boot_options or DEFAULT_BOOT_OPTIONS['ranchu' if flavor == 'ranchu' else 'ios']
+        return cls(id=job_id, cores=options['cores'], ram=options.get('ram', 0), **fields)
+
+
+@dataclass
+class Lease:
+    'Capacity granted to an admitted job until it is released.'
+    job: Job
+    admitted_at: float
+    started_at: float | None = None
+    released: bool = False
+
+
+@dataclass
+class Capacity:
+    'Free project capacity as of the last poll, net of reservations.'
+    cores: int
+    ram: int | None
+
+    def fits(self, job: Job) -> bool:
+        '''Whether the job fits in this capacity'''
+        return job.cores <= self.cores and (self.ram is None or job.ram <= self.ram)
+
+    def take(self, job: Job):
+        '''Subtract the job's resources'''
+        self.cores -= job.cores
+        if self.ram is not None:
+            self.ram -= job.ram
+
+
+@dataclass
+class Pending:
+    'A queued job and the future its submitter is waiting on.'
+    job: Job
+    future: asyncio.Future
+    order: int
+    blocked_since: float | None = None
+
+
+def plan(pending: list[Pending], capacity: Capacity, running_by_runner: Counter, now: float,
+         starvation_seconds: float) -> list[Pending]:
+    '''Choose the waiting jobs to admit into the free capacity'''
+    running = Counter(running_by_runner)
+    remaining = list(pending)
+    admitted = []
+    while remaining:
+        # Re-rank after every pick so one runner's burst does not take all the capacity
+        entry = min(remaining, key=lambda entry: (-entry.job.priority, running[entry.job.runner], entry.order))
+        remaining.remove(entry)
+        if capacity.fits(entry.job):
+            capacity.take(entry.job)
+            running[entry.job.runner] += 1
+            admitted.append(entry)
+            continue
+        if entry.blocked_since is None:
+            entry.blocked_since = now
+        if now - entry.blocked_since >= starvation_seconds:
+            # Stop backfilling so the freed capacity accumulates for the starved job
+            break
+    return admitted
+
+
+class QuotaScheduler:  # pylint: disable=too-many-instance-attributes
+    '''Admit queued jobs into a project's free CPU cores and RAM from one shared quota poll.'''
+
+    def __init__(self, client, project_id: str, *, min_interval: float = 0.5, max_interval: float = 15,  # pylint: disable=too-many-arguments
+                 backoff: float = 1.6, jitter: float = 0.2, starvation_seconds: float = 300,
+                 clock=time.monotonic, sleep=asyncio.sleep):
+        self.client = client
+        self.project_id = project_id
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.starvation_seconds = starvation_seconds
+        self.clock = clock
+        self.sleep = sleep
+        self.pending: list[Pending] = []
+        self.leases: list[Lease] = []
+        self.polls = 0
+        self.interval = min_interval
+        self._last_free: tuple[int, int | None] | None = None
+        self.free_changed = False
+        self._order = itertools.count()
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+
+    async def close(self):
+        '''Stop the scheduling loop and cancel any jobs still waiting'''
+        for entry in self.pending:
+            entry.future.cancel()
+        self.pending.clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+    # ==== PUBLIC API ====
+
+    async def submit(self, job: Job, timeout: float | None = None) -> Lease:
+        '''Queue a job and wait until it is admitted'''
+        job.submitted_at = job.submitted_at or self.clock()
+        entry = Pending(job, asyncio.get_running_loop().create_future(), next(self._order))
+        self.pending.append(entry)
+        self._poke()
+        try:
+            return await asyncio.wait_for(asyncio.shield(entry.future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if entry.future.done() and not entry.future.cancelled() and entry.future.exception() is None:
+                # Admitted just as the wait ended, so hand the capacity straight back
+                self.release(entry.future.result())
+            else:
+                entry.future.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                raise TimeoutError(f'Timed out waiting for {job.cores} cores and {job.ram} MB of RAM '
+                                   f'in project {self.project_id}.') from None
+            raise
+        finally:
+            if entry in self.pending:
+                self.pending.remove(entry)
+
+
+    def mark_started(self, lease: Lease):
+        '''Note that the job's instance now exists, so the next poll counts it in quotasUsed'''
+        lease.started_at = self.clock()
+
+
+    def release(self, lease: Lease):
+        '''Return a job's capacity, after its instance was deleted, and check the queue straight away'''
+        lease.released = True
+        if lease in self.leases:
+            self.leases.remove(lease)
+        self._poke()
+
+
+    @property
+    def running_by_runner(self) -> Counter:
+        '''Admitted jobs that have not been released, per runner'''
+        return Counter(lease.job.runner for lease in self.leases)
+
+
+    # ==== SCHEDULING LOOP ====
+
+    def _poke(self):
+        '''Schedule promptly, starting the loop if needed'''
+        self.interval = self.min_interval
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+
+    async def _run(self):
+        '''Poll and admit until nothing is waiting'''
+        while self.pending:
+            self._wakeup.clear()
+            await self.schedule()
+            if not self.pending:
+                break
+            # Capacity held by this scheduler's jobs comes back through release, which polls at once, so the
+            # periodic poll only has to notice capacity freed elsewhere in the project
+            if self.free_changed:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * self.backoff, self.max_interval)
+            await self._sleep_until_next_pass()
+
+
+    async def _sleep_until_next_pass(self):
+        '''Sleep for the jittered interval, waking early on a submit or release'''
+        delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        sleeper = asyncio.ensure_future(self.sleep(delay))
+        wakeup = asyncio.ensure_future(self._wakeup.wait())
+        try:
+            await asyncio.wait({sleeper, wakeup}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            sleeper.cancel()
+            wakeup.cancel()
+
+
+    async def capacity(self) -> Capacity | None:
+        '''Poll the project quota and subtract capacity reserved for jobs it does not show yet'''
+        polled_at = self.clock()
+        self.polls += 1
+        self.free_changed = False
+        try:
+            projects = await self.client.list_projects()
+        except (CorelliumApiError, OSError):
+            return None
+        project = next((project for project in projects if project.id == self.project_id), None)
+        if project is None:
+            raise LookupError(f'Project {self.project_id} does not exist.')
+        # A lease stays reserved until a poll that started after its instance was created
+        reserved = [lease for lease in self.leases if lease.started_at is None or lease.started_at >= polled_at]
+        available_ram = project.available_ram
+        free = (project.available_cores, available_ram)
+        self.free_changed = self._last_free is not None and free != self._last_free
+        self._last_free = free
+        return Capacity(
+            cores=project.available_cores - sum(lease.job.cores for lease in reserved),
+            ram=None if available_ram is None else available_ram - sum(lease.job.ram for lease in reserved),
+        )
+
+
+    async def schedule(self) -> int:
+        '''Run one pass of polling and bin-packing and return the number of jobs admitted'''
+        waiting = [entry for entry in self.pending if not entry.future.done()]
+        if not waiting:
+            return 0
+        try:
+            capacity = await self.capacity()
+        except LookupError as e:
+            for entry in waiting:
+                entry.future.set_exception(e)
+            return 0
+        if capacity is None:
+            return 0
+        now = self.clock()
+        admitted = plan(waiting, capacity, self.running_by_runner, now, self.starvation_seconds)
+        for entry in admitted:
+            lease = Lease(entry.job, admitted_at=now)
+            self.leases.append(lease)
+            entry.future.set_result(lease)
+        self.pending = [entry for entry in self.pending if not entry.future.done()]
+        return len(admitted)
@@ -0,0 +1,347 @@
+"""
+Simulated Corellium service for benchmarking the StatusWatcher and QuotaScheduler against the shell-style loops.
+
+Instances boot, agents come up, and assessments progress on a scripted timeline, and a simulated project quota
+counts the cores and RAM of every instance that exists, so no appliance is needed. Time is scaled down so a
+multi-minute boot finishes in well under a second.
+
+Example:
+    python3 -m corellium_client.simulation --devices 8 --time-scale 0.005
+    python3 -m corellium_client.simulation --scenario scheduler --jobs 16 --project-cores 24
+
+The scheduler scenario compares the shell loop, the admit command as CI runs it (one job per runner, each polling
+on its own), and one in-process QuotaScheduler queue, which only applies when a single process submits every job.
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from dataclasses import dataclass
+
+from .models import App, Assessment, Instance, Project
+from .scheduler import Job, QuotaScheduler
+from .watcher import StatusWatcher
+
+
+class SimulatedClock:
+    '''Simulated seconds derived from the wall clock, so sleeps can be scaled down.'''
+
+    def __init__(self, time_scale: float):
+        self.time_scale = time_scale
+        self.start = time.monotonic()
+
+
+    def now(self) -> float:
+        '''Simulated seconds since the clock started'''
+        return (time.monotonic() - self.start) / self.time_scale
+
+
+    async def sleep(self, seconds: float):
+        '''Sleep for a number of simulated seconds'''
+        await asyncio.sleep(seconds * self.time_scale)
+
+
+@dataclass
+class SimulatedDevice:
+    'Scripted timeline for one simulated instance.'
+    instance_id: str
+    project_id: str
+    boot_seconds: float
+    agent_seconds: float
+    assessment_seconds: float
+
+
+class SimulatedCorelliumClient:
+    '''Drop-in stand-in for CorelliumClient that serves a scripted state machine and counts API calls.'''
+
+    def __init__(self, clock: SimulatedClock, devices: list[SimulatedDevice], project_cores: int = 24):
+        self.clock = clock
+        self.devices = {device.instance_id: device for device in devices}
+        self.project_cores = project_cores
+        self.api_calls = 0
+
+
+    def _state(self, device: SimulatedDevice) -> str:
+        '''Instance state at the current simulated time'''
+        return 'on' if self.clock.now() >= device.boot_seconds else 'booting'
+
+
+    def _instance(self, device: SimulatedDevice) -> Instance:
+        '''Instance object for a device at the current simulated time'''
+        return Instance(id=device.instance_id, name=device.instance_id, state=self._state(device),
+                        flavor='ranchu', project=device.project_id, cores=4)
+
+
+    async def list_instances(self) -> list[Instance]:
+        '''Return every simulated instance'''
+        self.api_calls += 1
+        return [self._instance(device) for device in self.devices.values()]
+
+
+    async def get_instance(self, instance_id: str) -> Instance:
+        '''Return one simulated instance'''
+        self.api_calls += 1
+        return self._instance(self.devices[instance_id])
+
+
+    async def get_instance_status(self, instance_id: str) -> str:
+        '''Return one simulated instance state'''
+        return (await self.get_instance(instance_id)).state
+
+
+    async def is_agent_ready(self, instance_id: str) -> bool:
+        '''Return True once the simulated agent is up'''
+        self.api_calls += 1
+        device = self.devices[instance_id]
+        return self.clock.now() >= device.boot_seconds + device.agent_seconds
+
+
+    async def list_assessments(self, instance_id: str) -> list[Assessment]:
+        '''Return one assessment per device that completes after assessment_seconds'''
+        self.api_calls += 1
+        device = self.devices[instance_id]
+        status = 'complete' if self.clock.now() >= device.assessment_seconds else 'testing'
+        return [Assessment(id=f'{instance_id}-assessment', status=status, instance_id=instance_id)]
+
+
+    async def get_assessment(self, instance_id: str, assessment_id: str) -> Assessment:
+        '''Return the simulated assessment for a device'''
+        return (await self.list_assessments(instance_id))[0]
+
+
+    async def list_apps(self, instance_id: str) -> list[App]:
+        '''Return no apps'''
+        self.api_calls += 1
+        return []
+
+
+    async def list_projects(self) -> list[Project]:
+        '''Return one project with every booted device counted against the quota'''
+        self.api_calls += 1
+        used = sum(4 for device in self.devices.values() if self._state(device) == 'on')
+        return [Project(id='sim-project', name='sim-project', cores_quota=self.project_cores, cores_used=used)]
+
+
+def build_devices(count: int, seed: int = 1) -> list[SimulatedDevice]:
+    '''Create devices with boot, agent, and assessment times spread like real Android runs'''
+    rng = random.Random(seed)
+    return [
+        SimulatedDevice(
+            instance_id=f'sim-{index:03d}',
+            project_id='sim-project',
+            boot_seconds=rng.uniform(45, 120),
+            agent_seconds=rng.uniform(20, 90),
+            assessment_seconds=rng.uniform(200, 400),
+        )
+        for index in range(count)
+    ]
+
+
+async def poll_like_shell(client: SimulatedCorelliumClient, clock: SimulatedClock, device: SimulatedDevice) -> float:
+    '''Reproduce wait_for_instance_status (2s) then wait_until_agent_ready (5s) for one device'''
+    while await client.get_instance_status(device.instance_id) != 'on':
+        await clock.sleep(2)
+    while not await client.is_agent_ready(device.instance_id):
+        await client.get_instance_status(device.instance_id)
+        await clock.sleep(5)
+    return clock.now() - (device.boot_seconds + device.agent_seconds)
+
+
+async def poll_with_watcher(watcher: StatusWatcher, clock: SimulatedClock, device: SimulatedDevice) -> float:
+    '''Wait for the same milestones through the shared watcher'''
+    await watcher.wait_for_instance_state(device.instance_id, 'on')
+    await watcher.wait_for_agent_ready(device.instance_id)
+    return clock.now() - (device.boot_seconds + device.agent_seconds)
+
+
+async def benchmark(devices: int, time_scale: float, max_interval: float) -> dict:
+    '''Run both strategies over the same timeline and return API calls and detection lag for each'''
+    results = {}
+    for strategy in ('shell', 'watcher'):
+        clock = SimulatedClock(time_scale)
+        fleet = build_devices(devices)
+        client = SimulatedCorelliumClient(clock, fleet)
+        if strategy == 'shell':
+            lags = await asyncio.gather(*(poll_like_shell(client, clock, device) for device in fleet))
+        else:
+            async with StatusWatcher(client, min_interval=0.5, max_interval=max_interval, clock=clock.now, sleep=clock.sleep) as watcher:
+                lags = await asyncio.gather(*(poll_with_watcher(watcher, clock, device) for device in fleet))
+        results[strategy] = {
+            'api_calls': client.api_calls,
+            'mean_lag_seconds': round(statistics.mean(lags), 2),
+            'max_lag_seconds': round(max(lags), 2),
+        }
+    return results
+
+
+# ==== QUOTA SCHEDULING ====
+
+
+@dataclass
+class SimulatedRun:
+    'One CI run that needs an instance for run_seconds.'
+    job: Job
+    run_seconds: float
+
+
+class SimulatedQuotaClient:
+    '''Project whose quotasUsed counts every simulated instance that currently exists, plus other users' cores.'''
+
+    def __init__(self, project_cores: int, project_ram: int, external_cores: int = 0):
+        self.project_cores = project_cores
+        self.project_ram = project_ram
+        self.external_cores = external_cores
+        self.instances: dict[str, Job] = {}
+        self.peak_instances = 0
+        self.api_calls = 0
+
+
+    async def list_projects(self) -> list[Project]:
+        '''Return the project with its current usage'''
+        self.api_calls += 1
+        return [Project(id='sim-project', name='sim-project', cores_quota=self.project_cores, ram_quota=self.project_ram,
+                        cores_used=self.external_cores + sum(job.cores for job in self.instances.values()),
+                        ram_used=sum(job.ram for job in self.instances.values()))]
+
+
+    def create_instance(self, job: Job):
+        '''Create the instance for a run, failing like the API when the quota is exceeded'''
+        used = self.external_cores + sum(existing.cores for existing in self.instances.values())
+        if used + job.cores > self.project_cores:
+            raise RuntimeError(f'Creating {job.id} would exceed the project core quota.')
+        self.instances[job.id] = job
+        self.peak_instances = max(self.peak_instances, len(self.instances))
+
+
+    def delete_instance(self, job: Job):
+        '''Delete the instance for a run'''
+        self.instances.pop(job.id, None)
+
+
+def build_runs(count: int, runners: int = 2, seed: int = 1) -> list[SimulatedRun]:
+    '''Create a mix of Android and iOS runs from several runners with realistic durations'''
+    rng = random.Random(seed)
+    runs = []
+    for index in range(count):
+        flavor = rng.choice(['ranchu', 'iphone'])
+        job = Job.from_boot_options(f'run-{index:03d}', flavor, runner=f'runner-{index % runners}')
+        runs.append(SimulatedRun(job, rng.uniform(300, 900)))
+    return runs
+
+
+async def run_like_shell(client: SimulatedQuotaClient, clock: SimulatedClock, runs: list[SimulatedRun],
+                         max_parallel: int = 2) -> dict[str, float]:
+    '''Reproduce max-parallel jobs that each poll wait_until_available_cores every 15 seconds'''
+    queue = list(runs)
+    waits = {}
+    queued_at = clock.now()
+
+    async def worker():
+        while queue:
+            run = queue.pop(0)
+            while True:
+                project = (await client.list_projects())[0]
+                if project.available_cores >= run.job.cores:
+                    break
+                await clock.sleep(15)
+            waits[run.job.id] = clock.now() - queued_at
+            client.create_instance(run.job)
+            await clock.sleep(run.run_seconds)
+            client.delete_instance(run.job)
+
+    await asyncio.gather(*(worker() for _ in range(max_parallel)))
+    return waits
+
+
+async def run_like_admit(client: SimulatedQuotaClient, clock: SimulatedClock, runs: list[SimulatedRun],
+                         max_parallel: int = 2) -> dict[str, float]:
+    '''Reproduce max-parallel jobs that each run the admit command, a one-job QuotaScheduler per runner'''
+    queue = list(runs)
+    waits = {}
+    queued_at = clock.now()
+
+    async def worker():
+        while queue:
+            run = queue.pop(0)
+            async with QuotaScheduler(client, 'sim-project', clock=clock.now, sleep=clock.sleep) as scheduler:
+                await scheduler.submit(run.job)
+            waits[run.job.id] = clock.now() - queued_at
+            client.create_instance(run.job)
+            await clock.sleep(run.run_seconds)
+            client.delete_instance(run.job)
+
+    await asyncio.gather(*(worker() for _ in range(max_parallel)))
+    return waits
+
+
+async def run_with_scheduler(client: SimulatedQuotaClient, clock: SimulatedClock, runs: list[SimulatedRun]) -> dict[str, float]:
+    '''Submit every run to one QuotaScheduler and run each as soon as it is admitted
+
+    This is the in-process queue, which CI does not have: each runner polls on its own (see run_like_admit).
+    '''
+    waits = {}
+    queued_at = clock.now()
+    async with QuotaScheduler(client, 'sim-project', clock=clock.now, sleep=clock.sleep) as scheduler:
+        async def run_one(run: SimulatedRun):
+            lease = await scheduler.submit(run.job)
+            waits[run.job.id] = clock.now() - queued_at
+            client.create_instance(run.job)
+            scheduler.mark_started(lease)
+            await clock.sleep(run.run_seconds)
+            client.delete_instance(run.job)
+            scheduler.release(lease)
+
+        await asyncio.gather(*(run_one(run) for run in runs))
+    return waits
+
+
+async def benchmark_scheduler(jobs: int, time_scale: float, project_cores: int) -> dict:
+    '''Run the same jobs through shell polling, per-runner admit, and one in-process queue, and compare them'''
+    results = {}
+    for strategy in ('shell', 'admit', 'in-process'):
+        clock = SimulatedClock(time_scale)
+        runs = build_runs(jobs)
+        client = SimulatedQuotaClient(project_cores, project_ram=project_cores * 1024)
+        match strategy:
+            case 'shell':
+                waits = await run_like_shell(client, clock, runs)
+            case 'admit':
+                waits = await run_like_admit(client, clock, runs)
+            case _:
+                waits = await run_with_scheduler(client, clock, runs)
+        results[strategy] = {
+            'api_calls': client.api_calls,
+            'makespan_seconds': round(clock.now()),
+            'mean_wait_seconds': round(statistics.mean(waits.values())),
+            'peak_instances': client.peak_instances,
+        }
+    return results
+
+
+def main():
+    '''Print a side-by-side comparison of the shell-style loops and the shared Python equivalents'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=['watcher', 'scheduler'], default='watcher')
+    parser.add_argument('--devices', type=int, default=8)
+    parser.add_argument('--jobs', type=int, default=16, help='runs to schedule in the scheduler scenario')
+    parser.add_argument('--project-cores', type=int, default=24, help='project core quota in the scheduler scenario')
+    parser.add_argument('--time-scale', type=float, default=0.005, help='wall seconds per simulated second')
+    parser.add_argument('--max-interval', type=float, default=4, help='watcher backoff ceiling in simulated seconds')
+    args = parser.parse_args()
+    if args.scenario == 'scheduler':
+        results = asyncio.run(benchmark_scheduler(args.jobs, args.time_scale, args.project_cores))
+        print(f"{'strategy':<11}{'api calls':>11}{'makespan (s)':>14}{'mean wait (s)':>15}{'peak instances':>16}")
+        for strategy, result in results.items():
+            print(f"{strategy:<11}{result['api_calls']:>11}{result['makespan_seconds']:>14}"
+                  f"{result['mean_wait_seconds']:>15}{result['peak_instances']:>16}")
+        return
+    results = asyncio.run(benchmark(args.devices, args.time_scale, args.max_interval))
+    print(f"{'strategy':<10}{'api calls':>12}{'mean lag (s)':>16}{'max lag (s)':>14}")
+    for strategy, result in results.items():
+        print(f"{strategy:<10}{result['api_calls']:>12}{result['mean_lag_seconds']:>16}{result['max_lag_seconds']:>14}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,509 @@
+"""
+Local stand-in for the Corellium REST API used to exercise CorelliumClient without a real appliance.
+
+Run it directly to serve a couple of fake instances on 127.0.0.1:
+    python3 -m corellium_client.stub_server --port 8080
+"""
+
+import argparse
+import json
+import re
+import copy
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote
+
+STUB_API_TOKEN = 'stub-token'
+
+
+class StubCorelliumState:  # pylint: disable=too-many-instance-attributes
+    '''In-memory instances, projects, apps, device files, and assessments served by the stub API.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.instances: dict[str, dict] = {}
+        self.projects: dict[str, dict] = {}
+        self.apps: dict[str, list[dict]] = {}
+        self.assessments: dict[str, dict[str, dict]] = {}
+        self.agent_ready: dict[str, bool] = {}
+        self.reports: dict[str, dict] = {}
+        self.snapshots: dict[str, dict[str, dict]] = {}
+        self.snapshot_apps: dict[str, list[dict]] = {}
+        self.device_files: dict[str, dict[str, bytes]] = {}
+        self.snapshot_files: dict[str, dict[str, bytes]] = {}
+        # When set, created and restored instances boot for this many seconds before they are on
+        self.boot_seconds: float | None = None
+        self.booting: dict[str, float] = {}
+        # When set, MATRIX tests take this many seconds before their assessment is complete
+        self.test_seconds: float | None = None
+        self.testing: dict[tuple[str, str], float] = {}
+        self.test_report: dict = {'results': []}
+        self.request_counts: dict[str, int] = {}
+        self.connections = 0
+
+
+    def add_project(self, project_id: str, cores: int = 24, cores_used: int = 0, ram: int = 0, ram_used: int = 0) -> dict:
+        '''Add a project with a CPU core quota and, when ram is set, a RAM quota in MB'''
+        project = {'id': project_id, 'name': project_id, 'quotas': {'cores': cores}, 'quotasUsed': {'cores': cores_used}}
+        if ram:
+            project['quotas']['ram'] = ram
+            project['quotasUsed']['ram'] = ram_used
+        self.projects[project_id] = project
+        return project
+
+
+    def add_instance(self, project_id: str, flavor: str = 'ranchu', state: str = 'on', **fields) -> dict:
+        '''Add an instance to a project and return its JSON object'''
+        instance_id = fields.pop('id', str(uuid.uuid4()))
+        boot_options = fields.pop('bootOptions', {'cores': 4, 'ram': 4096, 'udid': instance_id})
+        instance = {
+            'id': instance_id,
+            'name': fields.pop('name', f'Stub {instance_id[:8]}'),
+            'state': state,
+            'flavor': flavor,
+            'project': project_id,
+            'serviceIp': fields.pop('serviceIp', f'10.11.1.{len(self.instances) + 1}'),
+            'bootOptions': boot_options,
+            **fields,
+        }
+        self.instances[instance_id] = instance
+        self.apps.setdefault(instance_id, [])
+        self.assessments.setdefault(instance_id, {})
+        self.agent_ready.setdefault(instance_id, state == 'on')
+        return instance
+
+
+    def add_report(self, instance_id: str, report: dict, status: str = 'complete') -> dict:
+        '''Add an assessment with a finished MATRIX report and return the assessment'''
+        assessment_id = str(uuid.uuid4())
+        report_id = str(uuid.uuid4())
+        assessment = {'id': assessment_id, 'status': status, 'instanceId': instance_id, 'reportId': report_id}
+        self.assessments.setdefault(instance_id, {})[assessment_id] = assessment
+        self.reports[report_id] = report
+        return assessment
+
+
+    def boot(self, instance_id: str):
+        '''Start booting an instance, or turn it on at once when no boot time is set'''
+        if self.boot_seconds is None:
+            self.instances[instance_id]['state'] = 'on'
+            self.agent_ready[instance_id] = True
+        else:
+            self.instances[instance_id]['state'] = 'booting'
+            self.agent_ready[instance_id] = False
+            self.booting[instance_id] = time.monotonic() + self.boot_seconds
+
+
+    def advance(self):
+        '''Turn on every instance whose boot time has passed and finish every test whose time has passed'''
+        now = time.monotonic()
+        for instance_id, ready_at in list(self.booting.items()):
+            if now >= ready_at:
+                del self.booting[instance_id]
+                if instance_id in self.instances:
+                    self.instances[instance_id]['state'] = 'on'
+                    self.agent_ready[instance_id] = True
+        for (instance_id, assessment_id), ready_at in list(self.testing.items()):
+            if now >= ready_at:
+                del self.testing[(instance_id, assessment_id)]
+                self.complete_assessment(instance_id, assessment_id)
+
+
+    def complete_assessment(self, instance_id: str, assessment_id: str):
+        '''Give an assessment a copy of the test report and mark it complete'''
+        assessment = self.assessments.get(instance_id, {}).get(assessment_id)
+        if assessment is None:
+            return
+        report_id = str(uuid.uuid4())
+        self.reports[report_id] = copy.deepcopy(self.test_report)
+        assessment.update(status='complete', reportId=report_id)
+
+
+    def count(self, route_name: str):
+        '''Count one request against a route name'''
+        with self.lock:
+            self.request_counts[route_name] = self.request_counts.get(route_name, 0) + 1
+
+
+class StubCorelliumHandler(BaseHTTPRequestHandler):
+    '''Request handler that serves StubCorelliumState over HTTP/1.1 keep-alive.'''
+
+    protocol_version = 'HTTP/1.1'
+    state: StubCorelliumState = None
+    routes: list = []
+
+    def setup(self):
+        super().setup()
+        with self.state.lock:
+            self.state.connections += 1
+
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        '''Keep the stub quiet'''
+
+
+    def send_json(self, status: int, payload):
+        '''Write a JSON response, or raw bytes as HTML, with a Content-Length so the connection stays open'''
+        if isinstance(payload, bytes):
+            body, content_type = payload, 'text/html'
+        else:
+            body, content_type = b'' if payload is None else json.dumps(payload).encode('utf-8'), 'application/json'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def read_json(self):
+        '''Read and decode the request body, if any, passing anything but JSON through as bytes'''
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return None
+        data = self.rfile.read(length)
+        if self.headers.get('Content-Type', 'application/json') != 'application/json':
+            return data
+        return json.loads(data)
+
+
+    def dispatch(self, method: str):
+        '''Route the request to the first matching handler'''
+        if self.headers.get('Authorization') != f'Bearer {STUB_API_TOKEN}':
+            self.send_json(401, {'error': 'Unauthorized'})
+            return
+        path, _, query = self.path.partition('?')
+        for route_method, pattern, handler in self.routes:
+            match = pattern.fullmatch(path)
+            if route_method == method and match:
+                self.state.count(handler.__name__)
+                with self.state.lock:
+                    self.state.advance()
+                # GET handlers receive the query parameters in place of a body
+                body = dict(parse_qsl(query)) if method == 'GET' else self.read_json()
+                status, payload = handler(self.state, body, **match.groupdict())
+                self.send_json(status, payload)
+                return
+        self.send_json(404, {'error': f'No route for {method} {path}'})
+
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        '''Handle GET requests'''
+        self.dispatch('GET')
+
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        '''Handle POST requests'''
+        self.dispatch('POST')
+
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        '''Handle DELETE requests'''
+        self.dispatch('DELETE')
+
+
+    def do_PATCH(self):  # pylint: disable=invalid-name
+        '''Handle PATCH requests'''
+        self.dispatch('PATCH')
+
+
+    def do_PUT(self):  # pylint: disable=invalid-name
+        '''Handle PUT requests'''
+        self.dispatch('PUT')
+
+
+def route(method: str, pattern: str):
+    '''Register a stub API handler for a method and path pattern'''
+    def decorator(handler):
+        StubCorelliumHandler.routes.append((method, re.compile(f'/api/v1{pattern}'), handler))
+        return handler
+    return decorator
+
+
+ID = r'[^/]+'
+
+
+@route('GET', '/instances')
+def list_instances(state, body):
+    '''Return every instance'''
+    return 200, list(state.instances.values())
+
+
+@route('POST', '/instances')
+def create_instance(state, body):
+    '''Create an instance in the creating state, booting it when the state has a boot time'''
+    if body.get('project') not in state.projects:
+        return 400, {'error': 'Project not found'}
+    instance = state.add_instance(body['project'], flavor=body.get('flavor', 'ranchu'), state='creating',
+                                  name=body.get('name'), os=body.get('os'), osbuild=body.get('osbuild'),
+                                  bootOptions=body.get('bootOptions', {'cores': 6, 'ram': 6144}))
+    if state.boot_seconds is not None:
+        state.boot(instance['id'])
+    return 200, {'id': instance['id']}
+
+
+@route('GET', f'/instances/(?P<instance_id>{ID})')
+def get_instance(state, body, instance_id):
+    '''Return one instance'''
+    instance = state.instances.get(instance_id)
+    return (200, instance) if instance else (404, {'error': 'Instance not found'})
+
+
+@route('PATCH', f'/instances/(?P<instance_id>{ID})')
+def update_instance(state, body, instance_id):
+    '''Rename an instance'''
+    instance = state.instances.get(instance_id)
+    if instance is None:
+        return 404, {'error': 'Instance not found'}
+    if 'name' in body:
+        instance['name'] = body['name']
+    return 200, instance
+
+
+@route('DELETE', f'/instances/(?P<instance_id>{ID})')
+def delete_instance(state, body, instance_id):
+    '''Delete one instance and its snapshots'''
+    if state.instances.pop(instance_id, None) is None:
+        return 404, {'error': 'Instance not found'}
+    state.device_files.pop(instance_id, None)
+    for snapshot_id in state.snapshots.pop(instance_id, {}):
+        state.snapshot_apps.pop(snapshot_id, None)
+        state.snapshot_files.pop(snapshot_id, None)
+    return 204, None
+
+
+@route('GET', f'/instances/(?P<instance_id>{ID})/snapshots')
+def list_snapshots(state, body, instance_id):
+    '''Return the snapshots of an instance'''
+    if instance_id not in state.instances:
+        return 404, {'error': 'Instance not found'}
+    return 200, list(state.snapshots.get(instance_id, {}).values())
+
+
+@route('POST', f'/instances/(?P<instance_id>{ID})/snapshots')
+def create_snapshot(state, body, instance_id):
+    '''Snapshot an instance, keeping its installed apps and device files so a restore brings them back'''
+    if instance_id not in state.instances:
+        return 404, {'error': 'Instance not found'}
+    snapshot = {'id': str(uuid.uuid4()), 'name': body.get('name', ''), 'instance': instance_id,
+                'status': {'created': True}}
+    state.snapshots.setdefault(instance_id, {})[snapshot['id']] = snapshot
+    state.snapshot_apps[snapshot['id']] = copy.deepcopy(state.apps.get(instance_id, []))
+    state.snapshot_files[snapshot['id']] = dict(state.device_files.get(instance_id, {}))
+    return 200, snapshot
+
+
+@route('POST', f'/instances/(?P<instance_id>{ID})/snapshots/(?P<snapshot_id>{ID})/restore')
+def restore_snapshot(state, body, instance_id, snapshot_id):
+    '''Put the instance back to a snapshot, rebooting it'''
+    if snapshot_id not in state.snapshots.get(instance_id, {}):
+        return 404, {'error': 'Snapshot not found'}
+    state.apps[instance_id] = copy.deepcopy(state.snapshot_apps[snapshot_id])
+    state.device_files[instance_id] = dict(state.snapshot_files.get(snapshot_id, {}))
+    state.boot(instance_id)
+    return 204, None
+
+
+@route('DELETE', f'/instances/(?P<instance_id>{ID})/snapshots/(?P<snapshot_id>{ID})')
+def delete_snapshot(state, body, instance_id, snapshot_id):
+    '''Delete one snapshot'''
+    if state.snapshots.get(instance_id, {}).pop(snapshot_id, None) is None:
+        return 404, {'error': 'Snapshot not found'}
+    state.snapshot_apps.pop(snapshot_id, None)
+    state.snapshot_files.pop(snapshot_id, None)
+    return 204, None
+
+
+@route('POST', f'/instances/(?P<instance_id>{ID})/start')
+def start_instance(state, body, instance_id):
+    '''Boot an instance, turning it on at once unless a boot time is set'''
+    if instance_id not in state.instances:
+        return 404, {'error': 'Instance not found'}
+    state.boot(instance_id)
+    return 204, None
+
+
+@route('POST', f'/instances/(?P<instance_id>{ID})/stop')
+def stop_instance(state, body, instance_id):
+    '''Turn an instance off immediately'''
+    if instance_id not in state.instances:
+        return 404, {'error': 'Instance not found'}
+    state.instances[instance_id]['state'] = 'off'
+    state.agent_ready[instance_id] = False
+    return 204, None
+
+
+@route('GET', f'/instances/(?P<instance_id>{ID})/agent/v1/app/ready')
+def agent_ready(state, body, instance_id):
+    '''Report whether the instance agent is ready'''
+    if not state.agent_ready.get(instance_id):
+        return 503, {'error': 'Agent not ready'}
+    return 200, {'ready': True}
+
+
+@route('GET', f'/instances/(?P<instance_id>{ID})/agent/v1/app/apps')
+def list_apps(state, body, instance_id):
+    '''Return the apps installed on an instance'''
+    return 200, {'apps': state.apps.get(instance_id, [])}
+
+
+@route('POST', f'/instances/(?P<instance_id>{ID})/agent/v1/app/apps/(?P<bundle_id>{ID})/kill')
+def kill_app(state, body, instance_id, bundle_id):
+    '''Mark an app as not running'''
+    for app in state.apps.get(instance_id, []):
+        if app['bundleID'] == bundle_id:
+            app['running'] = False
+    return 204, None
+
+
+@route('POST', f'/instances/(?P<instance_id>{ID})/agent/v1/app/apps/(?P<bundle_id>{ID})/run')
+def run_app(state, body, instance_id, bundle_id):
+    '''Mark an installed app as running'''
+    for app in state.apps.get(instance_id, []):
+        if app['bundleID'] == bundle_id:
+            app['running'] = True
+            return 204, None
+    return 404, {'error': 'App not found'}
+
+
+@route('GET', f'/instances/(?P<instance_id>{ID})/agent/v1/file/device/(?P<path>{ID})')
+def read_device_file(state, body, instance_id, path):
+    '''Return a file from the device filesystem'''
+    data = state.device_files.get(instance_id, {}).get(unquote(path))
+    if data is None:
+        return 404, {'error': 'File not found'}
+    return 200, data
+
+
+@route('PUT', f'/instances/(?P<instance_id>{ID})/agent/v1/file/device/(?P<path>{ID})')
+def write_device_file(state, body, instance_id, path):
+    '''Store a file on the device filesystem'''
+    if instance_id not in state.instances:
+        return 404, {'error': 'Instance not found'}
+    state.device_files.setdefault(instance_id, {})[unquote(path)] = body or b''
+    return 204, None
+
+
+@route('GET', '/projects')
+def list_projects(state, body):
+    '''Return every project'''
+    return 200, list(state.projects.values())
+
+
+@route('GET', f'/services/matrix/(?P<instance_id>{ID})/assessments')
+def list_assessments(state, body, instance_id):
+    '''Return every assessment for an instance'''
+    return 200, list(state.assessments.get(instance_id, {}).values())
+
+
+@route('GET', f'/services/matrix/(?P<instance_id>{ID})/assessments/(?P<assessment_id>{ID})')
+def get_assessment(state, body, instance_id, assessment_id):
+    '''Return one assessment'''
+    assessment = state.assessments.get(instance_id, {}).get(assessment_id)
+    return (200, assessment) if assessment else (404, {'error': 'Assessment not found'})
+
+
+@route('POST', f'/services/matrix/(?P<instance_id>{ID})/assessments')
+def create_assessment(state, body, instance_id):
+    '''Create an assessment, refusing a second open one on the same instance like MATRIX does'''
+    if instance_id not in state.instances:
+        return 404, {'error': 'Instance not found'}
+    assessments = state.assessments.setdefault(instance_id, {})
+    if any(assessment['status'] not in ('complete', 'failed') for assessment in assessments.values()):
+        return 409, {'error': 'Instance already has an open assessment'}
+    assessment_id = str(uuid.uuid4())
+    assessment = {'id': assessment_id, 'status': 'new', 'instanceId': instance_id,
+                  'bundleId': body.get('bundleId'), 'wordlistId': body.get('wordlistId'), 'reportId': None}
+    assessments[assessment_id] = assessment
+    return 200, assessment
+
+
+@route('POST', f'/services/matrix/(?P<instance_id>{ID})/assessments/(?P<assessment_id>{ID})/(?P<action>start|stop|test)')
+def change_assessment(state, body, instance_id, assessment_id, action):
+    '''Start monitoring (launching the app), stop monitoring, or start testing an assessment'''
+    assessment = state.assessments.get(instance_id, {}).get(assessment_id)
+    if assessment is None:
+        return 404, {'error': 'Assessment not found'}
+    match action:
+        case 'start':
+            assessment['status'] = 'monitoring'
+            for app in state.apps.get(instance_id, []):
+                if app['bundleID'] == assessment.get('bundleId'):
+                    app['running'] = True
+        case 'stop':
+            assessment['status'] = 'readyForTesting'
+        case 'test':
+            if state.test_seconds is None:
+                state.complete_assessment(instance_id, assessment_id)
+            else:
+                assessment['status'] = 'testing'
+                state.testing[(instance_id, assessment_id)] = time.monotonic() + state.test_seconds
+    return 204, None
+
+
+@route('DELETE', f'/services/matrix/(?P<instance_id>{ID})/assessments/(?P<assessment_id>{ID})')
+def delete_assessment(state, body, instance_id, assessment_id):
+    '''Delete one assessment'''
+    if state.assessments.get(instance_id, {}).pop(assessment_id, None) is None:
+        return 404, {'error': 'Assessment not found'}
+    state.testing.pop((instance_id, assessment_id), None)
+    return 204, None
+
+
+@route('GET', f'/services/matrix/(?P<instance_id>{ID})/reports/(?P<report_id>{ID})/download')
+def download_report(state, body, instance_id, report_id):
+    '''Return a report as JSON, or as a minimal HTML page'''
+    report = state.reports.get(report_id)
+    if report is None:
+        return 404, {'error': 'Report not found'}
+    if body.get('format', 'html') == 'json':
+        return 200, report
+    rows = ''.join(f"<tr><td>{result.get('id')}</td><td>{result.get('outcome')}</td></tr>" for result in report.get('results', []))
+    return 200, f'<html><body><table>{rows}</table></body></html>'.encode('utf-8')
+
+
+class StubCorelliumServer:
+    '''Run the stub API on a background thread, for use as a context manager.'''
+
+    def __init__(self, state: StubCorelliumState | None = None, host: str = '127.0.0.1', port: int = 0):
+        self.state = state or StubCorelliumState()
+        handler = type('BoundStubCorelliumHandler', (StubCorelliumHandler,), {'state': self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+
+    @property
+    def endpoint(self) -> str:
+        '''Base URL to pass to CorelliumClient'''
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    '''Serve a demo project with one Android and one iOS instance until interrupted'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+    demo_state = StubCorelliumState()
+    demo_state.add_project('stub-project')
+    demo_state.add_instance('stub-project', flavor='ranchu')
+    demo_state.add_instance('stub-project', flavor='iphone17pm', state='off')
+    with StubCorelliumServer(demo_state, port=args.port) as server:
+        print(f'Serving stub Corellium API at {server.endpoint} with token {STUB_API_TOKEN}')
+        server.thread.join()
+
+
+if __name__ == '__main__':
+    main()
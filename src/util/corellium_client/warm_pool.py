@@ -0,0 +1,301 @@
+"""
+Warm pool of booted instances that runs lease instead of creating and cold-booting their own.
+
+Each pool covers one flavor and firmware in one project. A pool instance is created, booted, prepared (for example
+by installing the Cafe app), and snapshotted once, then handed from run to run: a run leases a ready instance, and
+when it is given back the instance is restored to its snapshot, so the next run starts from the same prepared state
+after a restore rather than a create, cold boot, and app install. Pool membership and state live in the instance
+names (`Warm Pool <flavor> <os> | ready`, `| leased <run_id> <expires>`, and so on), so separate CI jobs share one
+pool through the API without any other coordination. The API has no compare-and-swap, so a claim renames the
+instance, waits for concurrent renames to settle, and only wins if the name still reads back as its own; a losing
+claim leaves the instance to the run whose name stuck. Every lease carries a wall-clock expiry, and a lease that is
+not given back before it expires (a killed job, a cancelled workflow) is reclaimed, restored, and made ready again
+by the next resize. The pool grows or shrinks its idle instances to match the queue depth, within its size limit.
+"""
+
+import asyncio
+import random
+import sys
+import time
+from dataclasses import dataclass
+
+from .connection import CorelliumApiError
+from .models import Instance
+from .watcher import StatusWatcher, WatchFailedError
+
+POOL_NAME_PREFIX = 'Warm Pool'
+POOL_STATUS_SEPARATOR = ' | '
+STATUS_WARMING = 'warming'
+STATUS_READY = 'ready'
+STATUS_LEASED = 'leased'
+STATUS_RESTORING = 'restoring'
+DEFAULT_SNAPSHOT_NAME = 'warm-pool-ready'
+DEFAULT_LEASE_TTL = 2 * 60 * 60
+DEFAULT_CLAIM_SETTLE = 3
+
+
+@dataclass
+class PoolSpec:  # pylint: disable=too-many-instance-attributes
+    'Which instances a pool keeps and how many.'
+    project_id: str
+    flavor: str
+    os_version: str
+    os_build: str
+    boot_options: dict | None = None
+    min_idle: int = 1
+    max_size: int = 4
+    snapshot_name: str = DEFAULT_SNAPSHOT_NAME
+
+    @property
+    def name_prefix(self) -> str:
+        '''Instance name prefix shared by every member of the pool'''
+        return f'{POOL_NAME_PREFIX} {self.flavor} {self.os_version}'
+
+    def request_data(self, status: str) -> dict:
+        '''The create_instance payload for a new pool member'''
+        data = {
+            'project': self.project_id,
+            'name': f'{self.name_prefix}{POOL_STATUS_SEPARATOR}{status}',
+            'flavor': self.flavor,
+            'os': self.os_version,
+            'osbuild': self.os_build,
+        }
+        if self.boot_options:
+            data['bootOptions'] = self.boot_options
+        return data
+
+
+@dataclass
+class PoolMember:
+    'An instance in the pool with the status, lease holder, and lease expiry read from its name.'
+    instance: Instance
+    status: str
+    run_id: str | None = None
+    expires_at: float | None = None
+
+    def expired(self, now: float) -> bool:
+        '''True for a lease whose holder did not give it back in time, or that has no readable expiry'''
+        return self.status == STATUS_LEASED and (self.expires_at is None or self.expires_at <= now)
+
+
+@dataclass
+class PoolLease:
+    'A pool instance leased to one run.'
+    instance_id: str
+    run_id: str
+    service_ip: str | None
+    warm: bool
+
+
+class WarmPool:  # pylint: disable=too-many-instance-attributes
+    '''Keep prepared instances of one flavor and firmware ready to lease, and restore them when they come back.'''
+
+    def __init__(self, client, spec: PoolSpec, *, prepare=None, boot_timeout: float = 900,  # pylint: disable=too-many-arguments
+                 poll_interval: float = 5, lease_ttl: float = DEFAULT_LEASE_TTL, claim_settle: float = DEFAULT_CLAIM_SETTLE,
+                 clock=time.monotonic, wall_clock=time.time, sleep=asyncio.sleep):
+        self.client = client
+        self.spec = spec
+        self.prepare = prepare
+        self.boot_timeout = boot_timeout
+        self.poll_interval = poll_interval
+        self.lease_ttl = lease_ttl
+        self.claim_settle = claim_settle
+        self.clock = clock
+        # Lease expiries are compared across CI jobs on different hosts, so they use wall-clock time
+        self.wall_clock = wall_clock
+        self.sleep = sleep
+        self.watcher = StatusWatcher(client, clock=clock, sleep=sleep)
+        self.restores = 0
+        self.cold_boots = 0
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.watcher.close()
+
+
+    def name_for(self, status: str, run_id: str | None = None) -> str:
+        '''Instance name that records a pool status, with a fresh lease expiry for a leased instance'''
+        suffix = status
+        if run_id:
+            suffix = f'{status} {run_id}'
+            if status == STATUS_LEASED:
+                suffix += f' {int(self.wall_clock() + self.lease_ttl)}'
+        return f'{self.spec.name_prefix}{POOL_STATUS_SEPARATOR}{suffix}'
+
+
+    def member(self, instance: Instance) -> PoolMember | None:
+        '''The instance as a pool member with the status read from its name, or None if it is not in this pool'''
+        prefix, separator, status = instance.name.partition(POOL_STATUS_SEPARATOR)
+        if not separator or prefix != self.spec.name_prefix or instance.project != self.spec.project_id:
+            return None
+        status, _, holder = status.partition(' ')
+        run_id, _, expires = holder.partition(' ')
+        return PoolMember(instance, status, run_id or None, float(expires) if expires.isdigit() else None)
+
+
+    async def members(self) -> list[PoolMember]:
+        '''Every instance in the pool with its status, from one instance list'''
+        members = (self.member(instance) for instance in await self.client.list_instances())
+        return [member for member in members if member is not None]
+
+
+    # ==== LEASE AND RETURN ====
+
+    async def lease(self, run_id: str, timeout: float | None = None) -> PoolLease:
+        '''Lease a ready instance, booting a new one if the pool has room and none is ready'''
+        deadline = None if timeout is None else self.clock() + timeout
+        interval = self.poll_interval
+        while True:
+            members = await self.members()
+            ready = [member for member in members if member.status == STATUS_READY]
+            random.shuffle(ready)
+            for member in ready:
+                if await self._claim(member.instance, member.instance.name, self.name_for(STATUS_LEASED, run_id)):
+                    return PoolLease(member.instance.id, run_id, member.instance.service_ip, warm=True)
+            if any(member.expired(self.wall_clock()) for member in members) and await self.reclaim(members):
+                continue
+            if len(members) < self.spec.max_size:
+                instance = await self.warm(STATUS_LEASED, run_id)
+                return PoolLease(instance.id, run_id, instance.service_ip, warm=False)
+            if deadline is not None and self.clock() >= deadline:
+                raise TimeoutError(f'No {self.spec.name_prefix} instance became ready for run {run_id}.')
+            delay = interval if deadline is None else min(interval, max(deadline - self.clock(), 0))
+            await self.sleep(delay)
+            interval = min(interval * 1.5, 60)
+
+
+    async def _claim(self, instance: Instance, expected_name: str, claimed_name: str) -> bool:
+        '''Rename an instance from expected_name to claimed_name and return whether this claim is the one that stuck'''
+        try:
+            if (await self.client.get_instance(instance.id)).name != expected_name:
+                return False
+            await self.client.rename_instance(instance.id, claimed_name)
+            if (await self.client.get_instance(instance.id)).name != claimed_name:
+                return False
+            # Another run that read expected_name before this rename may still be renaming, so let both land and check
+            # again; the last rename wins, and the run that reads back someone else's name walks away
+            await self.sleep(self.claim_settle)
+            return (await self.client.get_instance(instance.id)).name == claimed_name
+        except CorelliumApiError:
+            return False
+
+
+    async def give_back(self, instance_id: str, run_id: str) -> bool:
+        '''Restore an instance leased to run_id and mark it ready, or return False if the run no longer holds it'''
+        instance = await self.client.get_instance(instance_id)
+        member = self.member(instance)
+        if member is None or member.status != STATUS_LEASED or member.run_id != run_id:
+            # The lease expired and was reclaimed, perhaps re-leased to another run whose device must not be restored
+            print(f'WARNING: Instance {instance_id} is no longer leased to run {run_id}; leaving it alone.', file=sys.stderr)
+            return False
+        # Claim first, so a reclaim racing this return does not restore the instance twice
+        if not await self._claim(instance, instance.name, self.name_for(STATUS_RESTORING)):
+            return False
+        await self._restore(instance_id)
+        return True
+
+
+    async def _restore(self, instance_id: str):
+        '''Restore a claimed instance to its prepared snapshot and mark it ready, deleting it if that fails'''
+        try:
+            snapshot = await self._snapshot(instance_id)
+            if snapshot is None:
+                raise LookupError(f'Instance {instance_id} has no {self.spec.snapshot_name} snapshot.')
+            await self.client.restore_snapshot(instance_id, snapshot.id)
+            await self._wait_until_ready(instance_id)
+        except (CorelliumApiError, LookupError, TimeoutError, WatchFailedError) as e:
+            # The next resize warms a replacement
+            print(f'WARNING: Deleting pool instance {instance_id} after a failed restore: {e}', file=sys.stderr)
+            await self.client.delete_instance(instance_id)
+            return
+        self.restores += 1
+        await self.client.rename_instance(instance_id, self.name_for(STATUS_READY))
+
+
+    # ==== POOL SIZE ====
+
+    async def warm(self, status: str = STATUS_READY, run_id: str | None = None) -> Instance:
+        '''Create, boot, prepare, and snapshot a new pool instance, then give it a status'''
+        instance_id = await self.client.create_instance(self.spec.request_data(STATUS_WARMING))
+        self.cold_boots += 1
+        try:
+            await self._wait_until_ready(instance_id)
+            if self.prepare is not None:
+                await self.prepare(instance_id)
+            snapshot = await self.client.create_snapshot(instance_id, self.spec.snapshot_name)
+            while not snapshot.created:
+                await self.sleep(self.poll_interval)
+                snapshot = await self._snapshot(instance_id)
+                if snapshot is None:
+                    raise LookupError(f'Snapshot {self.spec.snapshot_name} of instance {instance_id} disappeared.')
+            return await self.client.rename_instance(instance_id, self.name_for(status, run_id))
+        except BaseException:
+            await self.client.delete_instance(instance_id)
+            raise
+
+
+    async def reclaim(self, members: list[PoolMember] | None = None) -> int:
+        '''Restore every instance whose lease expired and return how many were made ready again'''
+        if members is None:
+            members = await self.members()
+        now = self.wall_clock()
+        expired = [member for member in members if member.expired(now)]
+        reclaimed = 0
+        for member in expired:
+            # Claim first, so two jobs reclaiming at once do not both restore the same instance
+            if not await self._claim(member.instance, member.instance.name, self.name_for(STATUS_RESTORING)):
+                continue
+            print(f'WARNING: Reclaiming pool instance {member.instance.id} from run {member.run_id}, '
+                  'whose lease expired.', file=sys.stderr)
+            await self._restore(member.instance.id)
+            reclaimed += 1
+        return reclaimed
+
+
+    async def resize(self, queue_depth: int = 0) -> dict[str, int]:
+        '''Reclaim expired leases, then warm or delete idle instances to match the queue depth within the pool limits'''
+        reclaimed = await self.reclaim()
+        members = await self.members()
+        idle = [member for member in members if member.status in (STATUS_READY, STATUS_WARMING, STATUS_RESTORING)]
+        busy = len(members) - len(idle)
+        target = min(max(self.spec.min_idle, queue_depth), self.spec.max_size - busy)
+        warmed = deleted = 0
+        if len(idle) < target:
+            warmed = target - len(idle)
+            await asyncio.gather(*(self.warm() for _ in range(warmed)))
+        else:
+            surplus = [member for member in idle if member.status == STATUS_READY][:len(idle) - target]
+            for member in surplus:
+                # Claim before deleting so a run cannot lease an instance that is about to go away
+                if await self._claim(member.instance, member.instance.name, self.name_for(STATUS_LEASED, 'drain')):
+                    await self.client.delete_instance(member.instance.id)
+                    deleted += 1
+        return {'busy': busy, 'idle': len(idle) + warmed - deleted, 'warmed': warmed, 'deleted': deleted, 'reclaimed': reclaimed}
+
+
+    async def drain(self) -> int:
+        '''Delete every pool instance that is not leased and return how many were deleted'''
+        deleted = 0
+        for member in await self.members():
+            if member.status == STATUS_READY and await self._claim(member.instance, member.instance.name,
+                                                                   self.name_for(STATUS_LEASED, 'drain')):
+                await self.client.delete_instance(member.instance.id)
+                deleted += 1
+        return deleted
+
+
+    async def _wait_until_ready(self, instance_id: str):
+        '''Wait for the instance to be on and its agent ready, through the shared watcher'''
+        # Called right after a create or restore request, so a stale off is not yet a failure
+        await self.watcher.wait_for_instance_state(instance_id, 'on', self.boot_timeout, after_start=True)
+        await self.watcher.wait_for_agent_ready(instance_id, self.boot_timeout)
+
+
+    async def _snapshot(self, instance_id: str):
+        '''The pool snapshot of an instance, if it exists'''
+        snapshots = await self.client.list_snapshots(instance_id)
+        return next((snapshot for snapshot in snapshots if snapshot.name == self.spec.snapshot_name), None)
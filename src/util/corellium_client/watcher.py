@@ -0,0 +1,370 @@
+"""
+Multiplexed status watcher that serves many waits from one bulk poll per tick.
+
+Each tick lists instances once and resolves every waiter whose condition is met. Agent, app, and assessment
+waits also need a call per instance, which is only repeated when the instance's listed state changed or the
+last result is as old as the shell loop interval, since those can change without the instance list showing
+it. The poll interval starts short, backs off exponentially with jitter while nothing changes, resets when
+something does, and never sleeps past the nearest deadline. It also never backs off past the interval of
+the shell loop each pending wait replaces, so no wait notices a change later than it used to.
+"""
+
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+
+from .connection import CorelliumApiError
+
+INSTANCE_FAILURE_STATES = {
+    'on': {'off', 'error', 'paused'},
+    'off': {'error', 'paused'},
+}
+# Right after a start request the API can still report off for a moment, so off only fails a wait for on
+# once the instance has been seen to leave it or this many seconds have passed
+START_REQUEST_GRACE = 60
+# Poll intervals of the wait_for_instance_status, wait_until_agent_ready, wait_for_matrix_assessment_status,
+# wait_until_app_is_running_on_instance, and wait_until_available_cores loops in the shell functions
+MAX_INTERVAL_BY_KIND = {'instance': 2, 'deleted': 2, 'agent': 5, 'assessment': 2, 'app': 1, 'cores': 15}
+ASSESSMENT_TESTING_MAX_INTERVAL = 5
+AGENT_FAILURE_STATES = {'off', 'error', 'paused', 'deleting'}
+ASSESSMENT_STATUSES = {'complete', 'failed', 'monitoring', 'readyForTesting', 'startMonitoring', 'stopMonitoring', 'testing'}
+
+
+class WatchFailedError(Exception):
+    '''Exception raised when a watched resource reaches a state that the target can no longer follow.'''
+
+
+@dataclass
+class Waiter:
+    'One pending wait registered with the StatusWatcher.'
+    kind: str
+    key: tuple
+    target: object
+    deadline: float | None
+    future: asyncio.Future
+    last_seen: object = None
+    grace_until: float | None = None
+
+
+@dataclass
+class Snapshot:
+    'Everything observed during one watcher tick.'
+    instances: dict = field(default_factory=dict)
+    agent_ready: dict = field(default_factory=dict)
+    assessments: dict = field(default_factory=dict)
+    apps: dict = field(default_factory=dict)
+    projects: dict = field(default_factory=dict)
+    observed_at: float = 0.0
+
+
+class StatusWatcher:  # pylint: disable=too-many-instance-attributes
+    '''Track instance, agent, app, assessment, and core-quota waits with one shared polling loop.'''
+
+    def __init__(self, client, *, min_interval: float = 0.5, max_interval: float = 15, backoff: float = 1.6,  # pylint: disable=too-many-arguments
+                 jitter: float = 0.2, clock=time.monotonic, sleep=asyncio.sleep):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.clock = clock
+        self.sleep = sleep
+        self.waiters: list[Waiter] = []
+        self.interval = min_interval
+        self.ticks = 0
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+        # Last agent, assessment, and app result per (kind, instance ID) with the listed state and time it was fetched
+        self._fetched: dict[tuple, tuple] = {}
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+
+    async def close(self):
+        '''Stop the polling loop and cancel any outstanding waits'''
+        for waiter in self.waiters:
+            waiter.future.cancel()
+        self.waiters.clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+    # ==== PUBLIC WAITS ====
+
+    async def wait_for_instance_state(self, instance_id: str, state: str, timeout: float | None = None, *,
+                                      after_start: bool = False):
+        '''Wait until the instance reaches state, such as on or off, tolerating a stale off after a start request when after_start is set'''
+        if state not in INSTANCE_FAILURE_STATES:
+            raise ValueError(f'Unknown target instance status {state}.')
+        grace_until = self.clock() + START_REQUEST_GRACE if after_start and state == 'on' else None
+        return await self._register('instance', (instance_id,), state, timeout, grace_until)
+
+
+    async def wait_for_instance_deleted(self, instance_id: str, timeout: float | None = None):
+        '''Wait until the instance no longer appears in the instance list'''
+        return await self._register('deleted', (instance_id,), 'deleted', timeout)
+
+
+    async def wait_for_agent_ready(self, instance_id: str, timeout: float | None = None):
+        '''Wait until the instance agent reports ready'''
+        return await self._register('agent', (instance_id,), True, timeout)
+
+
+    async def wait_for_assessment_status(self, instance_id: str, assessment_id: str, status: str, timeout: float | None = None):
+        '''Wait until the MATRIX assessment reaches status, such as complete'''
+        if status not in ASSESSMENT_STATUSES:
+            raise ValueError(f"Unsupported target assessment status '{status}'.")
+        return await self._register('assessment', (instance_id, assessment_id), status, timeout)
+
+
+    async def wait_for_app_running(self, instance_id: str, bundle_id: str, timeout: float | None = None):
+        '''Wait until the app is running on the instance'''
+        return await self._register('app', (instance_id, bundle_id), True, timeout)
+
+
+    async def wait_for_available_cores(self, project_id: str, cores: int, timeout: float | None = None):
+        '''Wait until the project has at least cores CPU cores free'''
+        return await self._register('cores', (project_id,), cores, timeout)
+
+
+    # ==== POLLING LOOP ====
+
+    async def _register(self, kind: str, key: tuple, target, timeout: float | None,  # pylint: disable=too-many-arguments
+                        grace_until: float | None = None):
+        '''Add a waiter, make sure the loop is running, and wait for it to resolve'''
+        deadline = None if timeout is None else self.clock() + timeout
+        waiter = Waiter(kind=kind, key=key, target=target, deadline=deadline, future=asyncio.get_running_loop().create_future(),
+                        grace_until=grace_until)
+        self.waiters.append(waiter)
+        # A new waiter should be checked promptly rather than after a backed-off sleep
+        self.interval = self.min_interval
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        try:
+            return await waiter.future
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+
+    async def _run(self):
+        '''Poll until no waiters remain'''
+        while self.waiters:
+            self._wakeup.clear()
+            changed = await self.tick()
+            if not self.waiters:
+                break
+            self.interval = self.min_interval if changed else min(self.interval * self.backoff, self.interval_ceiling())
+            await self._sleep_until_next_tick()
+
+
+    def interval_ceiling(self) -> float:
+        '''Longest backoff allowed, which is the shortest shell loop interval among the pending waits'''
+        ceilings = [self.max_interval]
+        for waiter in self.waiters:
+            if waiter.kind == 'assessment' and waiter.last_seen == 'testing':
+                ceilings.append(ASSESSMENT_TESTING_MAX_INTERVAL)
+            else:
+                ceilings.append(MAX_INTERVAL_BY_KIND.get(waiter.kind, self.max_interval))
+        return max(self.min_interval, min(ceilings))
+
+
+    async def _sleep_until_next_tick(self):
+        '''Sleep for the jittered interval, waking early for the nearest deadline or a new waiter'''
+        delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        deadlines = [waiter.deadline for waiter in self.waiters if waiter.deadline is not None]
+        if deadlines:
+            delay = max(0.0, min(delay, min(deadlines) - self.clock()))
+        sleeper = asyncio.ensure_future(self.sleep(delay))
+        wakeup = asyncio.ensure_future(self._wakeup.wait())
+        try:
+            await asyncio.wait({sleeper, wakeup}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            sleeper.cancel()
+            wakeup.cancel()
+
+
+    async def tick(self) -> bool:
+        '''Run one bulk poll, resolve finished waiters, and return True if anything changed'''
+        self.ticks += 1
+        pending = [waiter for waiter in self.waiters if not waiter.future.done()]
+        try:
+            snapshot = await self._poll(pending)
+        except (CorelliumApiError, OSError):
+            # Match the shell loops, which warn and check again on a failed status request
+            snapshot = None
+        changed = False
+        now = self.clock()
+        for waiter in pending:
+            if waiter.future.done():
+                # The caller cancelled this wait while the poll was in flight
+                continue
+            if snapshot is not None:
+                observed = self._evaluate(waiter, snapshot)
+                changed = changed or observed != waiter.last_seen
+                waiter.last_seen = observed
+            if not waiter.future.done() and waiter.deadline is not None and now >= waiter.deadline:
+                waiter.future.set_exception(TimeoutError(
+                    f'Timed out waiting for {waiter.kind} {"/".join(waiter.key)} to reach {waiter.target}; last seen {waiter.last_seen}.'))
+        self.waiters = [waiter for waiter in self.waiters if not waiter.future.done()]
+        return changed
+
+
+    async def _poll(self, waiters: list[Waiter]) -> Snapshot:
+        '''Fetch everything the waiters need with as few API calls as possible'''
+        snapshot = Snapshot(observed_at=self.clock())
+        kinds = {waiter.kind for waiter in waiters}
+        if kinds & {'instance', 'deleted', 'agent', 'assessment', 'app'}:
+            snapshot.instances = {instance.id: instance for instance in await self.client.list_instances()}
+        if 'cores' in kinds:
+            snapshot.projects = {project.id: project for project in await self.client.list_projects()}
+
+        stale = self._stale_after(waiters)
+        fetch = [(kind, instance_id) for kind, instance_id in sorted(stale) if self._needs_fetch(kind, instance_id, stale, snapshot)]
+        fetchers = {'agent': self.client.is_agent_ready, 'assessment': self.client.list_assessments, 'app': self.client.list_apps}
+        results = await asyncio.gather(*(fetchers[kind](instance_id) for kind, instance_id in fetch))
+        for (kind, instance_id), result in zip(fetch, results):
+            state = getattr(snapshot.instances.get(instance_id), 'state', None)
+            self._fetched[(kind, instance_id)] = (state, result, snapshot.observed_at)
+        # Forget instances nobody is waiting on so a later wait starts with a fresh call
+        self._fetched = {key: value for key, value in self._fetched.items() if key in stale}
+
+        for (kind, instance_id), (listed_state, result, _) in self._fetched.items():
+            if listed_state != getattr(snapshot.instances.get(instance_id), 'state', None):
+                # Only an agent wait on an instance that is not on skips the call, and its old result no longer holds
+                continue
+            match kind:
+                case 'agent':
+                    snapshot.agent_ready[instance_id] = result
+                case 'assessment':
+                    snapshot.assessments[instance_id] = {assessment.id: assessment for assessment in result}
+                case 'app':
+                    snapshot.apps[instance_id] = result
+        return snapshot
+
+
+    @staticmethod
+    def _stale_after(waiters: list[Waiter]) -> dict:
+        '''Map each pending per-instance call to how long its last result may be reused'''
+        stale = {}
+        for waiter in waiters:
+            if waiter.kind not in ('agent', 'assessment', 'app'):
+                continue
+            seconds = MAX_INTERVAL_BY_KIND[waiter.kind]
+            if waiter.kind == 'assessment' and waiter.last_seen == 'testing':
+                seconds = ASSESSMENT_TESTING_MAX_INTERVAL
+            key = (waiter.kind, waiter.key[0])
+            stale[key] = min(seconds, stale.get(key, seconds))
+        return stale
+
+
+    def _needs_fetch(self, kind: str, instance_id: str, stale: dict, snapshot: Snapshot) -> bool:
+        '''True when the listed state changed since the last call or the result would be older than the shell loop interval by the next tick'''
+        state = getattr(snapshot.instances.get(instance_id), 'state', None)
+        if kind == 'agent' and state != 'on':
+            return False
+        cached = self._fetched.get((kind, instance_id))
+        if cached is None:
+            return True
+        listed_state, _, fetched_at = cached
+        return listed_state != state or snapshot.observed_at - fetched_at + self.interval * (1 + self.jitter) >= stale[(kind, instance_id)]
+
+
+    def _evaluate(self, waiter: Waiter, snapshot: Snapshot):  # pylint: disable=too-many-return-statements
+        '''Resolve the waiter if its condition holds and return the value observed for it'''
+        match waiter.kind:
+            case 'instance':
+                return self._evaluate_instance(waiter, snapshot)
+            case 'deleted':
+                instance = snapshot.instances.get(waiter.key[0])
+                if instance is None:
+                    waiter.future.set_result(True)
+                    return 'deleted'
+                return instance.state
+            case 'agent':
+                return self._evaluate_agent(waiter, snapshot)
+            case 'assessment':
+                return self._evaluate_assessment(waiter, snapshot)
+            case 'app':
+                apps = snapshot.apps.get(waiter.key[0], [])
+                running = any(app.bundle_id == waiter.key[1] and app.running for app in apps)
+                if running:
+                    waiter.future.set_result(True)
+                return running
+            case 'cores':
+                project = snapshot.projects.get(waiter.key[0])
+                if project is None:
+                    waiter.future.set_exception(LookupError(f'Project {waiter.key[0]} does not exist.'))
+                    return None
+                if project.available_cores >= waiter.target:
+                    waiter.future.set_result(project.available_cores)
+                return project.available_cores
+            case _:
+                raise ValueError(f'Unknown waiter kind {waiter.kind}')
+
+
+    @staticmethod
+    def _evaluate_instance(waiter: Waiter, snapshot: Snapshot):
+        '''Check an instance state waiter against the instance list'''
+        instance = snapshot.instances.get(waiter.key[0])
+        if instance is None:
+            waiter.future.set_exception(LookupError(f'Instance {waiter.key[0]} does not exist.'))
+            return None
+        if instance.state == waiter.target:
+            waiter.future.set_result(instance)
+        elif instance.state in INSTANCE_FAILURE_STATES[waiter.target]:
+            # A failure state is terminal on any observation, except the stale off just after a start request
+            start_race = instance.state == 'off' and waiter.grace_until is not None and snapshot.observed_at < waiter.grace_until
+            if not start_race:
+                waiter.future.set_exception(WatchFailedError(
+                    f'Target is {waiter.target}, but instance {instance.id} is {instance.state}.'))
+        else:
+            # Once the instance has left off, a later off is a real failure
+            waiter.grace_until = None
+        return instance.state
+
+
+    @staticmethod
+    def _evaluate_agent(waiter: Waiter, snapshot: Snapshot):
+        '''Check an agent ready waiter against the instance list and agent results'''
+        instance = snapshot.instances.get(waiter.key[0])
+        if instance is None:
+            waiter.future.set_exception(LookupError(f'Instance {waiter.key[0]} does not exist.'))
+            return None
+        if snapshot.agent_ready.get(instance.id):
+            waiter.future.set_result(True)
+            return True
+        if instance.state in AGENT_FAILURE_STATES:
+            waiter.future.set_exception(WatchFailedError(f'Instance {instance.id} is {instance.state} while waiting for the agent.'))
+        return instance.state
+
+
+    @staticmethod
+    def _evaluate_assessment(waiter: Waiter, snapshot: Snapshot):
+        '''Check an assessment status waiter against the assessment list'''
+        instance_id, assessment_id = waiter.key
+        assessment = snapshot.assessments.get(instance_id, {}).get(assessment_id)
+        if assessment is None:
+            waiter.future.set_exception(LookupError(f'Assessment {assessment_id} does not exist.'))
+            return None
+        if assessment.status == waiter.target:
+            waiter.future.set_result(assessment)
+        elif assessment.status == 'failed':
+            waiter.future.set_exception(WatchFailedError(
+                f"Detected a failed run. Last state was '{waiter.last_seen}'."))
+        elif assessment.status == 'monitoring':
+            waiter.future.set_exception(WatchFailedError('Cannot wait when status is monitoring.'))
+        return assessment.status
@@ -0,0 +1,218 @@
+"""
+Local stand-in for a Frida device, so frida_runner.py can run without frida, frida-server, or a Corellium device.
+
+It has the parts of the frida Device, Session, and Script API the runner uses. Loading a script replays a list
+of timed events on a background thread, the way frida delivers messages from the agent: send() payloads, console.log
+lines, and uncaught errors. By default a script replays its console.log string literals and then sends the completion
+message. A process can be set to exit partway through, which detaches its session as a crash would, and every API
+call is counted so a test can check how many connections and attaches a run took.
+
+Run a script against it through the runner:
+    python3 src/util/frida_runner.py --fake --spawn com.corellium.cafe --script src/util/frida_script_example.js
+"""
+
+import itertools
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+CONSOLE_LOG_LITERAL = re.compile(r'''console\.log\(\s*(['"])(.*?)\1\s*\)''')
+
+
+@dataclass
+class FakeApplication:
+    'An installed app as enumerate_applications lists it, with pid 0 when it is not running.'
+    identifier: str
+    name: str
+    pid: int = 0
+
+
+@dataclass
+class FakeEvent:
+    'One thing a fake script does after it loads.'
+    delay: float
+    message: dict | None = None
+    log: str | None = None
+    data: bytes | None = None
+
+
+def default_events(source: str, done_type: str = 'done') -> list[FakeEvent]:
+    '''Replay the script's console.log string literals, then report completion'''
+    events = [FakeEvent(0.0, log=match.group(2)) for match in CONSOLE_LOG_LITERAL.finditer(source)]
+    return events + [FakeEvent(0.0, message={'type': 'send', 'payload': {'type': done_type}})]
+
+
+class FakeScript:
+    '''A loaded script that replays its events on a thread'''
+
+    def __init__(self, session: 'FakeSession', name: str, events: list[FakeEvent]):
+        self.session = session
+        self.name = name
+        self.events = events
+        self.loaded = False
+        self._handlers = {}
+        self._log_handler = None
+        self._unloaded = threading.Event()
+
+
+    def on(self, signal: str, handler):  # pylint: disable=invalid-name
+        '''Register a message handler'''
+        self._handlers[signal] = handler
+
+
+    def set_log_handler(self, handler):
+        '''Register the console.log handler'''
+        self._log_handler = handler
+
+
+    def load(self):
+        '''Start replaying the events'''
+        if self.session.detached:
+            raise RuntimeError('session is gone')
+        self.session.device.calls['load'] += 1
+        self.loaded = True
+        threading.Thread(target=self._replay, daemon=True).start()
+
+
+    def unload(self):
+        '''Stop replaying'''
+        self.session.device.calls['unload'] += 1
+        self._unloaded.set()
+
+
+    def _replay(self):
+        '''Deliver each event after its delay until the script is unloaded or the session ends'''
+        for event in self.events:
+            if self._unloaded.wait(event.delay) or self.session.detached:
+                return
+            if event.log is not None and self._log_handler is not None:
+                self._log_handler('info', event.log)
+            if event.message is not None and 'message' in self._handlers:
+                self._handlers['message'](event.message, event.data)
+
+
+class FakeSession:
+    '''A session attached to one fake process'''
+
+    def __init__(self, device: 'FakeDevice', pid: int):
+        self.device = device
+        self.pid = pid
+        self.detached = False
+        self._handlers = {}
+        self._lock = threading.Lock()
+
+
+    def on(self, signal: str, handler):  # pylint: disable=invalid-name
+        '''Register the detached handler'''
+        self._handlers[signal] = handler
+
+
+    def create_script(self, source: str, name: str | None = None) -> FakeScript:
+        '''Create a script whose events come from the device's event factory'''
+        self.device.calls['create_script'] += 1
+        return FakeScript(self, name or 'script', self.device.events_for(source))
+
+
+    def detach(self, reason: str = 'application-requested', crash=None):
+        '''End the session once, telling the detached handler why'''
+        with self._lock:
+            if self.detached:
+                return
+            self.detached = True
+        self.device.calls['detach'] += 1
+        if 'detached' in self._handlers:
+            self._handlers['detached'](reason, crash)
+
+
+class FakeDevice:  # pylint: disable=too-many-instance-attributes
+    '''A device whose processes run fake scripts'''
+
+    def __init__(self, events_for=default_events, exit_after: dict[str, float] | None = None,
+                 attach_delay: float = 0.0, missing: set[str] | None = None, process_names: dict[str, str] | None = None):
+        self.events_for = events_for
+        # Seconds after resume at which a process exits, by target name
+        self.exit_after = exit_after or {}
+        self.attach_delay = attach_delay
+        self.missing = missing or set()
+        # Process name of each app by bundle ID, where they differ as they do on iOS
+        self.process_names = process_names or {}
+        self.calls = Counter()
+        self.processes: dict[int, str] = {}
+        self.sessions: list[FakeSession] = []
+        self._pids = itertools.count(1000)
+        self._lock = threading.Lock()
+
+
+    def spawn(self, program) -> int:
+        '''Start a suspended process'''
+        name = program[0] if isinstance(program, list) else program
+        self.calls['spawn'] += 1
+        if name in self.missing:
+            raise RuntimeError(f'unable to find application with identifier {name}')
+        with self._lock:
+            pid = next(self._pids)
+            self.processes[pid] = self.process_names.get(name, name)
+        return pid
+
+
+    def enumerate_applications(self) -> list[FakeApplication]:
+        '''Every app the device knows of, with the PID of its process when it is running'''
+        self.calls['enumerate_applications'] += 1
+        with self._lock:
+            pids = {name: pid for pid, name in self.processes.items()}
+        return [FakeApplication(identifier, process_name, pids.get(process_name, 0))
+                for identifier, process_name in self.process_names.items()]
+
+
+    def attach(self, target) -> FakeSession:
+        '''Attach to a PID or a running process name'''
+        self.calls['attach'] += 1
+        time.sleep(self.attach_delay)
+        with self._lock:
+            if isinstance(target, str):
+                if target in self.missing or target in self.process_names:
+                    # A bundle ID is not a process name when the two differ, as frida reports on iOS
+                    raise RuntimeError(f'unable to find process with name {target}')
+                pid = next((pid for pid, name in self.processes.items() if name == target), None)
+                if pid is None:
+                    pid = next(self._pids)
+                    self.processes[pid] = target
+            elif target in self.processes:
+                pid = target
+            else:
+                raise RuntimeError(f'unable to find process with pid {target}')
+            session = FakeSession(self, pid)
+            self.sessions.append(session)
+        name = self.processes[pid]
+        if name in self.exit_after and isinstance(target, str):
+            self._exit_later(session, self.exit_after[name])
+        return session
+
+
+    def resume(self, pid: int):
+        '''Let a spawned process run, starting its exit timer if it has one'''
+        self.calls['resume'] += 1
+        name = self.processes.get(pid)
+        if name in self.exit_after:
+            for session in self.sessions:
+                if session.pid == pid:
+                    self._exit_later(session, self.exit_after[name])
+
+
+    def kill(self, pid: int):
+        '''End a process and detach its sessions'''
+        self.calls['kill'] += 1
+        with self._lock:
+            self.processes.pop(pid, None)
+        for session in self.sessions:
+            if session.pid == pid:
+                session.detach('process-terminated')
+
+
+    def _exit_later(self, session: FakeSession, delay: float):
+        '''Detach a session after a delay, as when the app exits or crashes'''
+        timer = threading.Timer(delay, session.detach, args=('process-terminated',))
+        timer.daemon = True
+        timer.start()
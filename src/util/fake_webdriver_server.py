@@ -0,0 +1,545 @@
+"""
+Local stand-in for an Appium server that serves a scripted Corellium Cafe element tree over the W3C
+WebDriver protocol, so the Appium scripts can run without a Corellium device.
+
+The element tree is built from the locators in the flow file, so every element the Cafe scripts look up
+exists. Each command can be slowed down with a fixed latency plus jitter, elements can be made to appear
+late after a screen change, element commands can fail with stale element references, and each locator
+strategy can be given its own lookup cost. The page source lists the elements that have rendered, each
+with its own bounds, and W3C touch actions tap whichever element is under the pointer, so the page index
+mode can be exercised offline as well.
+
+Run it directly and point data/config/appium_<platform>.json at it:
+    python3 src/util/fake_webdriver_server.py android --port 4723 --latency-ms 40 --jitter-ms 10
+"""
+
+import argparse
+import base64
+import json
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.etree import ElementTree as ET
+from appium.webdriver.common.appiumby import AppiumBy
+
+import appium_flow
+from appium_page_index import IOS_CLASS_CHAIN, parse_ios_predicate, parse_ui_selector
+
+W3C_ELEMENT_KEY = 'element-6066-11e4-a52e-4f735466cecf'
+
+
+class WebDriverError(Exception):
+    '''W3C WebDriver error returned to the client as a JSON error object.'''
+
+    def __init__(self, status: int, error: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.error = error
+        self.message = message
+
+
+@dataclass
+class FaultConfig:
+    'Latency and fault injection settings for the fake server.'
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    late_rate: float = 0.0
+    late_ms: float = 500.0
+    stale_rate: float = 0.0
+    seed: int | None = None
+    # Extra milliseconds a find takes per locator strategy, for the device-side tree walk
+    lookup_ms: dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class FakeElement:  # pylint: disable=too-many-instance-attributes
+    'One element in the scripted tree.'
+    element_id: str
+    by: str
+    value: str
+    text: str = ''
+    displayed: bool = True
+    enabled: bool = True
+    appears_at: float = 0.0
+    seen_on_screen: int = -1
+    rect: tuple[int, int, int, int] = (0, 0, 0, 0)
+
+
+def png_bytes(width: int, height: int, rgb: tuple[int, int, int]) -> bytes:
+    '''Encode a solid-colour RGB PNG'''
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    row = b'\x00' + bytes(rgb) * width
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(row * height))
+            + chunk(b'IEND', b''))
+
+
+class FakeWebDriverState:  # pylint: disable=too-many-instance-attributes
+    '''Sessions, elements, and counters served by the fake WebDriver server.'''
+
+    def __init__(self, platform: str, faults: FaultConfig | None = None, screen_size: tuple[int, int] = (360, 780)):
+        self.platform = platform
+        self.faults = faults or FaultConfig()
+        self.screen_size = screen_size
+        self.lock = threading.Lock()
+        self.rng = random.Random(self.faults.seed)
+        self.sessions: dict[str, dict] = {}
+        self.elements: dict[tuple[str, str], FakeElement] = {}
+        self.elements_by_id: dict[str, FakeElement] = {}
+        self.request_counts: dict[str, int] = {}
+        self.screen = 0
+        self.screenshots_served = 0
+
+
+    @classmethod
+    def from_flow(cls, flow: dict, platform: str, **kwargs) -> 'FakeWebDriverState':
+        '''Build a tree with one element per locator the flow uses on the platform'''
+        state = cls(platform, **kwargs)
+        for step in appium_flow.compile_flow(flow, platform).steps:
+            if step.by is not None:
+                state.add_element(step.by, step.value)
+        return state
+
+
+    def add_element(self, by: str, value: str, **fields) -> FakeElement:
+        '''Add an element reachable through one locator'''
+        element = self.elements.get((by, value))
+        if element is None:
+            # Stack elements in rows so each has its own tap target
+            fields.setdefault('rect', (0, 24 * len(self.elements), self.screen_size[0], 20))
+            element = FakeElement(element_id=str(uuid.uuid4()), by=by, value=value, **fields)
+            self.elements[(by, value)] = element
+            self.elements_by_id[element.element_id] = element
+        return element
+
+
+    def count(self, route_name: str):
+        '''Count one request against a route name'''
+        with self.lock:
+            self.request_counts[route_name] = self.request_counts.get(route_name, 0) + 1
+
+
+    @property
+    def commands(self) -> int:
+        '''Total WebDriver commands served'''
+        return sum(self.request_counts.values())
+
+
+    def command_delay(self) -> float:
+        '''Seconds to hold the next response, from the configured latency and jitter'''
+        with self.lock:
+            jitter = self.rng.uniform(-self.faults.jitter_ms, self.faults.jitter_ms)
+        return max(0.0, self.faults.latency_ms + jitter) / 1000
+
+
+    def rendered_in(self, element: FakeElement) -> float:
+        '''Seconds until the element renders on the current screen, deciding once per screen whether it is late'''
+        with self.lock:
+            if element.seen_on_screen != self.screen:
+                element.seen_on_screen = self.screen
+                late = self.rng.random() < self.faults.late_rate
+                element.appears_at = time.monotonic() + (self.faults.late_ms / 1000 if late else 0)
+        return element.appears_at - time.monotonic()
+
+
+    def locate(self, session: dict, by: str, value: str) -> FakeElement:
+        '''Find an element, honouring the session implicit wait for elements that appear late'''
+        time.sleep(self.faults.lookup_ms.get(by, 0.0) / 1000)
+        element = self.elements.get((by, value))
+        implicit_wait = session['implicit_ms'] / 1000
+        if element is None:
+            time.sleep(implicit_wait)
+            raise WebDriverError(404, 'no such element', f'An element could not be located using {by}={value}.')
+        remaining = self.rendered_in(element)
+        if remaining > implicit_wait:
+            time.sleep(implicit_wait)
+            raise WebDriverError(404, 'no such element', f'An element could not be located using {by}={value}.')
+        if remaining > 0:
+            time.sleep(remaining)
+        return element
+
+
+    def element_at(self, x: float, y: float) -> FakeElement | None:
+        '''The element whose bounds contain a point'''
+        for element in self.elements.values():
+            left, top, width, height = element.rect
+            if left <= x < left + width and top <= y < top + height:
+                return element
+        return None
+
+
+    def page_source(self) -> str:
+        '''UiAutomator2 or XCUITest style XML of the elements rendered on the current screen'''
+        root = ET.Element('hierarchy' if self.platform == 'android' else 'XCUIElementTypeApplication')
+        for element in self.elements.values():
+            if self.rendered_in(element) > 0:
+                continue
+            attributes = self.source_attributes(element)
+            tag = attributes.get('class', attributes.get('type', 'android.view.View' if self.platform == 'android' else 'XCUIElementTypeOther'))
+            ET.SubElement(root, tag, attributes)
+        return ET.tostring(root, encoding='unicode')
+
+
+    def source_attributes(self, element: FakeElement) -> dict:
+        '''Page source attributes that make the element's own locator match it'''
+        displayed = str(element.displayed).lower()
+        enabled = str(element.enabled).lower()
+        x, y, width, height = element.rect
+        if self.platform == 'android':
+            attributes = {'text': element.text, 'bounds': f'[{x},{y}][{x + width},{y + height}]',
+                          'displayed': displayed, 'enabled': enabled}
+            if element.by == AppiumBy.ID:
+                attributes['resource-id'] = element.value
+            elif element.by == AppiumBy.ACCESSIBILITY_ID:
+                attributes['content-desc'] = element.value
+            elif element.by == AppiumBy.CLASS_NAME:
+                attributes['class'] = element.value
+            elif element.by == AppiumBy.ANDROID_UIAUTOMATOR and parse_ui_selector(element.value):
+                attributes.update(parse_ui_selector(element.value)[0])
+            return attributes
+        attributes = {'value': element.text, 'x': str(x), 'y': str(y), 'width': str(width), 'height': str(height),
+                      'visible': displayed, 'enabled': enabled}
+        chain = IOS_CLASS_CHAIN.fullmatch(element.value) if element.by == AppiumBy.IOS_CLASS_CHAIN else None
+        predicate = parse_ios_predicate(element.value) if element.by == AppiumBy.IOS_PREDICATE else None
+        if element.by in (AppiumBy.ACCESSIBILITY_ID, AppiumBy.ID):
+            attributes['name'] = element.value
+        elif element.by == AppiumBy.CLASS_NAME:
+            attributes['type'] = element.value
+        elif chain is not None:
+            attributes['type'] = chain['type']
+            if chain['attribute']:
+                attributes[chain['attribute']] = chain['value'].replace('\\"', '"')
+        elif predicate is not None:
+            attributes.update(predicate)
+        return attributes
+
+
+    def element(self, element_id: str) -> FakeElement:
+        '''Look up an element by ID, failing like a real server when it is stale'''
+        with self.lock:
+            element = self.elements_by_id.get(element_id)
+            if element is not None and self.rng.random() < self.faults.stale_rate:
+                # Re-render the element so the client's handle no longer matches
+                del self.elements_by_id[element_id]
+                element.element_id = str(uuid.uuid4())
+                self.elements_by_id[element.element_id] = element
+                element = None
+        if element is None:
+            raise WebDriverError(404, 'stale element reference', f'Element {element_id} is no longer attached to the DOM.')
+        return element
+
+
+    def screenshot(self) -> str:
+        '''Base64 PNG whose colour changes with the current screen'''
+        with self.lock:
+            self.screenshots_served += 1
+            screen = self.screen
+        rgb = ((screen * 47) % 256, (screen * 89) % 256, (screen * 131) % 256)
+        return base64.b64encode(png_bytes(*self.screen_size, rgb)).decode('ascii')
+
+
+class FakeWebDriverHandler(BaseHTTPRequestHandler):
+    '''Request handler that serves FakeWebDriverState over HTTP/1.1 keep-alive.'''
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, which Nagle plus delayed ACKs would stall by ~40 ms
+    disable_nagle_algorithm = True
+    state: FakeWebDriverState = None
+    routes: list = []
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        '''Keep the fake server quiet'''
+
+
+    def send_json(self, status: int, payload):
+        '''Write a W3C response body with a Content-Length so the connection stays open'''
+        body = json.dumps({'value': payload}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def read_json(self):
+        '''Read and decode the request body, if any'''
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length) or b'{}')
+
+
+    def dispatch(self, method: str):
+        '''Route the request to the first matching handler after the injected latency'''
+        path = self.path.split('?', 1)[0].rstrip('/')
+        body = self.read_json()
+        time.sleep(self.state.command_delay())
+        for route_method, pattern, handler in self.routes:
+            match = pattern.fullmatch(path)
+            if route_method == method and match:
+                self.state.count(handler.__name__)
+                try:
+                    groups = match.groupdict()
+                    if 'session_id' in groups:
+                        groups['session'] = self.session(groups.pop('session_id'))
+                    status, payload = handler(self.state, body, **groups)
+                except WebDriverError as e:
+                    status, payload = e.status, {'error': e.error, 'message': e.message, 'stacktrace': ''}
+                self.send_json(status, payload)
+                return
+        # Appium clients send settings and log commands the scripts do not depend on
+        self.state.count('unhandled')
+        self.send_json(200, None)
+
+
+    def session(self, session_id: str) -> dict:
+        '''Look up an open session'''
+        session = self.state.sessions.get(session_id)
+        if session is None:
+            raise WebDriverError(404, 'invalid session id', f'Session {session_id} does not exist.')
+        return session
+
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        '''Handle GET requests'''
+        self.dispatch('GET')
+
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        '''Handle POST requests'''
+        self.dispatch('POST')
+
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        '''Handle DELETE requests'''
+        self.dispatch('DELETE')
+
+
+def route(method: str, pattern: str):
+    '''Register a fake WebDriver handler for a method and path pattern'''
+    def decorator(handler):
+        FakeWebDriverHandler.routes.append((method, re.compile(pattern), handler))
+        return handler
+    return decorator
+
+
+SESSION = r'/session/(?P<session_id>[^/]+)'
+ELEMENT = SESSION + r'/element/(?P<element_id>[^/]+)'
+
+
+@route('GET', '/status')
+def get_status(state, body):
+    '''Report that the server is ready, as Appium does'''
+    return 200, {'ready': True, 'message': 'The fake server is ready to accept new connections'}
+
+
+@route('POST', '/session')
+def new_session(state, body):
+    '''Open a session with the requested capabilities'''
+    capabilities = body.get('capabilities', {}).get('alwaysMatch', {})
+    session_id = str(uuid.uuid4())
+    state.sessions[session_id] = {'capabilities': capabilities, 'implicit_ms': 0}
+    return 200, {'sessionId': session_id, 'capabilities': capabilities}
+
+
+@route('DELETE', SESSION)
+def delete_session(state, body, session):
+    '''Close a session'''
+    state.sessions = {key: value for key, value in state.sessions.items() if value is not session}
+    return 200, None
+
+
+@route('POST', SESSION + '/timeouts')
+def set_timeouts(state, body, session):
+    '''Set the implicit wait'''
+    if 'implicit' in body:
+        session['implicit_ms'] = body['implicit'] or 0
+    return 200, None
+
+
+@route('POST', SESSION + '/element')
+def find_element(state, body, session):
+    '''Find one element by locator'''
+    element = state.locate(session, body.get('using'), body.get('value'))
+    return 200, {W3C_ELEMENT_KEY: element.element_id}
+
+
+@route('POST', SESSION + '/elements')
+def find_elements(state, body, session):
+    '''Find elements by locator, returning an empty list when there are none'''
+    try:
+        element = state.locate(session, body.get('using'), body.get('value'))
+    except WebDriverError:
+        return 200, []
+    return 200, [{W3C_ELEMENT_KEY: element.element_id}]
+
+
+@route('GET', ELEMENT + '/displayed')
+def is_displayed(state, body, session, element_id):
+    '''Report whether the element is displayed'''
+    return 200, state.element(element_id).displayed
+
+
+@route('GET', ELEMENT + '/enabled')
+def is_enabled(state, body, session, element_id):
+    '''Report whether the element is enabled'''
+    return 200, state.element(element_id).enabled
+
+
+@route('GET', ELEMENT + '/text')
+def get_text(state, body, session, element_id):
+    '''Return the element text'''
+    return 200, state.element(element_id).text
+
+
+@route('GET', ELEMENT + '/attribute/(?P<name>[^/]+)')
+def get_attribute(state, body, session, element_id, name):
+    '''Return the few attributes the Cafe scripts read'''
+    element = state.element(element_id)
+    return 200, {'value': element.text, 'text': element.text, 'displayed': 'true', 'enabled': 'true'}.get(name)
+
+
+@route('POST', ELEMENT + '/click')
+def click(state, body, session, element_id):
+    '''Click the element, which moves the app to a new screen'''
+    state.element(element_id)
+    with state.lock:
+        state.screen += 1
+    return 200, None
+
+
+@route('POST', ELEMENT + '/value')
+def send_keys(state, body, session, element_id):
+    '''Type into the element'''
+    element = state.element(element_id)
+    element.text += body.get('text', ''.join(body.get('value', [])))
+    return 200, None
+
+
+@route('POST', ELEMENT + '/clear')
+def clear(state, body, session, element_id):
+    '''Clear the element text'''
+    state.element(element_id).text = ''
+    return 200, None
+
+
+@route('GET', SESSION + '/source')
+def page_source(state, body, session):
+    '''Return the page source of the current screen'''
+    return 200, state.page_source()
+
+
+@route('POST', SESSION + '/actions')
+def perform_actions(state, body, session):
+    '''Tap the element under a touch pointer, which moves the app to a new screen, then type any keys into it'''
+    for source in body.get('actions', []):
+        if source.get('type') != 'pointer':
+            continue
+        x, y = 0, 0
+        for action in source.get('actions', []):
+            if action.get('type') == 'pointerMove':
+                x, y = action.get('x', 0), action.get('y', 0)
+            elif action.get('type') == 'pointerDown':
+                session['focused'] = state.element_at(x, y)
+                if session['focused'] is not None:
+                    with state.lock:
+                        state.screen += 1
+    focused = session.get('focused')
+    for source in body.get('actions', []):
+        if source.get('type') == 'key' and focused is not None:
+            focused.text += ''.join(action['value'] for action in source.get('actions', []) if action.get('type') == 'keyDown')
+    return 200, None
+
+
+@route('GET', SESSION + '/window/rect')
+def window_rect(state, body, session):
+    '''Return the screen size'''
+    width, height = state.screen_size
+    return 200, {'x': 0, 'y': 0, 'width': width, 'height': height}
+
+
+@route('GET', SESSION + '/screenshot')
+def screenshot(state, body, session):
+    '''Return a base64 PNG of the current screen'''
+    return 200, state.screenshot()
+
+
+class FakeWebDriverServer:
+    '''Run the fake WebDriver server on a background thread, for use as a context manager.'''
+
+    def __init__(self, state: FakeWebDriverState, host: str = '127.0.0.1', port: int = 0):
+        self.state = state
+        handler = type('BoundFakeWebDriverHandler', (FakeWebDriverHandler,), {'state': self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+
+    @property
+    def host(self) -> str:
+        '''Address the server listens on'''
+        return self.httpd.server_address[0]
+
+
+    @property
+    def port(self) -> int:
+        '''Port the server listens on'''
+        return self.httpd.server_address[1]
+
+
+    @property
+    def url(self) -> str:
+        '''Base URL to pass to webdriver.Remote'''
+        return f'http://{self.host}:{self.port}'
+
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser):
+    '''Add the latency and fault injection options shared with the benchmark harness'''
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='fixed delay added to every command')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='uniform +/- jitter added to the latency')
+    parser.add_argument('--late-rate', type=float, default=0.0, help='chance an element renders late after a screen change')
+    parser.add_argument('--late-ms', type=float, default=500.0, help='how late a late element renders')
+    parser.add_argument('--stale-rate', type=float, default=0.0, help='chance an element command fails as stale')
+    parser.add_argument('--seed', type=int, default=None, help='random seed for jitter and faults')
+    parser.add_argument('--flow', default=appium_flow.DEFAULT_FLOW_PATH, help='flow whose locators make up the element tree')
+
+
+def faults_from_args(args: argparse.Namespace) -> FaultConfig:
+    '''Build a FaultConfig from parsed fault options'''
+    return FaultConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, late_rate=args.late_rate,
+                       late_ms=args.late_ms, stale_rate=args.stale_rate, seed=args.seed)
+
+
+def main():
+    '''Serve the Cafe element tree for one platform until interrupted'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('platform', choices=appium_flow.PLATFORM_NAMES)
+    parser.add_argument('--port', type=int, default=4723)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    state = FakeWebDriverState.from_flow(appium_flow.load_flow(args.flow), args.platform, faults=faults_from_args(args))
+    with FakeWebDriverServer(state, port=args.port) as server:
+        print(f'Serving fake {args.platform} WebDriver at {server.url} with {len(state.elements)} elements')
+        server.thread.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+"""
+Run Frida scripts in several apps over one device connection and keep everything the scripts send.
+
+The device is opened once and shared: each app is spawned (or an already running process attached to) on its own
+thread, every script is loaded into every app, and spawned apps are resumed only once their scripts are in place.
+Messages from send(), console.log lines, and uncaught script errors go to a bounded ring buffer, for callers that
+want the recent messages in memory, and to a JSON-lines file that keeps all of them. A run ends when every script
+in every app has sent `send({type: 'done'})` or its app has gone away, rather than after a fixed timeout; the
+timeout is only an upper bound, and reaching it is a failure.
+
+Usage:
+    python3 frida_runner.py --device 10.11.1.1:5001 --spawn com.corellium.cafe --script frida_script_example.js
+    python3 frida_runner.py --usb --spawn com.corellium.Cafe --attach SpringBoard --script a.js --script b.js --timeout 60
+    python3 frida_runner.py --fake --spawn com.corellium.cafe --script frida_script_example.js
+"""
+
+import argparse
+import collections
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+
+try:
+    import frida
+except ImportError:
+    frida = None
+
+DEFAULT_MESSAGES_PATH = 'frida_messages.jsonl'
+DEFAULT_BUFFER_SIZE = 10000
+DONE_MESSAGE_TYPE = 'done'
+DEVICE_TIMEOUT_SECONDS = 10
+MODE_SPAWN = 'spawn'
+MODE_ATTACH = 'attach'
+KIND_SEND = 'send'
+KIND_ERROR = 'error'
+KIND_LOG = 'log'
+# Errors frida raises for a device, process, or script operation that failed; the fake device raises RuntimeError
+FRIDA_ERRORS = (RuntimeError, OSError) + tuple(
+    getattr(frida, name) for name in ('InvalidArgumentError', 'InvalidOperationError', 'ProcessNotFoundError',
+                                      'ProcessNotRespondingError', 'ExecutableNotFoundError', 'NotSupportedError',
+                                      'PermissionDeniedError', 'ServerNotRunningError', 'TimedOutError',
+                                      'TransportError', 'ProtocolError')
+    if frida is not None and hasattr(frida, name)
+)
+
+
+class FridaRunnerError(Exception):
+    '''The device could not be opened or an app could not be instrumented'''
+
+
+@dataclass
+class Target:
+    'An app to instrument: a package or bundle ID to spawn, or a bundle ID, process name, or PID to attach to.'
+    name: str
+    mode: str = MODE_SPAWN
+
+
+@dataclass
+class ScriptFile:
+    'A Frida script and the name its messages are recorded under.'
+    name: str
+    source: str
+
+    @classmethod
+    def load(cls, path: str) -> 'ScriptFile':
+        '''Read a script from disk'''
+        with open(file=path, mode='r', encoding='utf-8') as f:
+            return cls(name=os.path.basename(path), source=f.read())
+
+
+@dataclass
+class MessageRecord:  # pylint: disable=too-many-instance-attributes
+    'One message from a script.'
+    received_at: float
+    target: str
+    pid: int | None
+    script: str
+    kind: str
+    payload: object = None
+    level: str | None = None
+    data_bytes: int = 0
+
+
+class MessageSink:
+    '''Keep the most recent messages in a ring buffer and append every message to a JSON-lines file'''
+
+    def __init__(self, path: str | None = None, capacity: int = DEFAULT_BUFFER_SIZE, echo=None):
+        self.buffer: collections.deque[MessageRecord] = collections.deque(maxlen=capacity)
+        self.received = 0
+        self.errors = 0
+        self.echo = echo
+        self.lock = threading.Lock()
+        self._file = open(file=path, mode='a', encoding='utf-8') if path else None  # pylint: disable=consider-using-with
+
+
+    @property
+    def dropped(self) -> int:
+        '''Messages that have fallen out of the ring buffer, though not out of the file'''
+        return self.received - len(self.buffer)
+
+
+    def put(self, record: MessageRecord):
+        '''Store one message; called from frida's threads'''
+        with self.lock:
+            self.buffer.append(record)
+            self.received += 1
+            if record.kind == KIND_ERROR:
+                self.errors += 1
+            if self._file is not None:
+                self._file.write(json.dumps(asdict(record), default=repr) + '\n')
+        if self.echo is not None:
+            self.echo(record)
+
+
+    def recent(self, limit: int | None = None) -> list[MessageRecord]:
+        '''The newest messages in the buffer, oldest first'''
+        with self.lock:
+            records = list(self.buffer)
+        return records if limit is None else records[-limit:]
+
+
+    def close(self):
+        '''Flush and close the JSON-lines file'''
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+@dataclass
+class TargetRun:  # pylint: disable=too-many-instance-attributes
+    'The live state of one instrumented app.'
+    target: Target
+    pid: int | None = None
+    session: object = None
+    scripts: dict = field(default_factory=dict)
+    pending: set = field(default_factory=set)
+    detached: str | None = None
+    error: str | None = None
+    spawned: bool = False
+
+    @property
+    def complete(self) -> bool:
+        '''Whether every script is done, or the app is gone or never started'''
+        return not self.pending or self.detached is not None or self.error is not None
+
+
+class FridaRunner:
+    '''Instrument several apps on one device and wait for their scripts to report completion'''
+
+    def __init__(self, device, sink: MessageSink, done_type: str = DONE_MESSAGE_TYPE, kill_spawned: bool = True):
+        self.device = device
+        self.sink = sink
+        self.done_type = done_type
+        self.kill_spawned = kill_spawned
+        self.runs: list[TargetRun] = []
+        self.condition = threading.Condition()
+
+
+    # ==== LIFECYCLE ====
+
+    def start(self, targets: list[Target], scripts: list[ScriptFile], max_workers: int = 8) -> list[TargetRun]:
+        '''Spawn or attach to every target at once and load every script into each'''
+        self.runs = [TargetRun(target) for target in targets]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(self.runs)) or 1) as executor:
+            list(executor.map(lambda run: self._start_one(run, scripts), self.runs))
+        return self.runs
+
+
+    def _start_one(self, run: TargetRun, scripts: list[ScriptFile]):
+        '''Instrument one target, recording the error instead of raising so the other targets carry on'''
+        try:
+            if run.target.mode == MODE_SPAWN:
+                run.pid = self.device.spawn([run.target.name])
+                run.spawned = True
+                run.session = self.device.attach(run.pid)
+            else:
+                attach_to = resolve_attach_target(self.device, run.target.name)
+                run.session = self.device.attach(attach_to)
+                run.pid = getattr(run.session, 'pid', attach_to if isinstance(attach_to, int) else None)
+            run.session.on('detached', functools.partial(self._on_detached, run))
+            run.pending = {script_file.name for script_file in scripts}
+            for script_file in scripts:
+                script = run.session.create_script(script_file.source, name=script_file.name)
+                script.on('message', functools.partial(self._on_message, run, script_file.name))
+                script.set_log_handler(functools.partial(self._on_log, run, script_file.name))
+                script.load()
+                run.scripts[script_file.name] = script
+            if run.spawned:
+                # Resume only once every hook is in place, so none of the app's start-up is missed
+                self.device.resume(run.pid)
+        except FRIDA_ERRORS as e:
+            with self.condition:
+                run.error = f'{type(e).__name__}: {e}'
+                self.condition.notify_all()
+
+
+    def wait(self, timeout: float | None = None) -> bool:
+        '''Wait until every target is complete, returning False if the timeout came first'''
+        with self.condition:
+            return self.condition.wait_for(lambda: all(run.complete for run in self.runs), timeout)
+
+
+    def stop(self):
+        '''Unload the scripts, detach, and kill the apps this runner spawned'''
+        for run in self.runs:
+            for script in run.scripts.values():
+                try:
+                    script.unload()
+                except FRIDA_ERRORS:
+                    pass
+            if run.session is not None and run.detached is None:
+                try:
+                    run.session.detach()
+                except FRIDA_ERRORS:
+                    pass
+            if run.spawned and self.kill_spawned and run.pid is not None:
+                try:
+                    self.device.kill(run.pid)
+                except FRIDA_ERRORS:
+                    pass
+
+
+    # ==== CALLBACKS FROM FRIDA THREADS ====
+
+    def _on_message(self, run: TargetRun, script_name: str, message: dict, data: bytes | None):
+        '''Record a send() payload or script error, and note the script's completion message'''
+        kind = message.get('type')
+        if kind == KIND_SEND:
+            payload = message.get('payload')
+        else:
+            payload = {key: value for key, value in message.items() if key != 'type'}
+        self.sink.put(MessageRecord(time.time(), run.target.name, run.pid, script_name, kind, payload,
+                                    data_bytes=len(data) if data else 0))
+        if kind == KIND_SEND and isinstance(payload, dict) and payload.get('type') == self.done_type:
+            with self.condition:
+                run.pending.discard(script_name)
+                self.condition.notify_all()
+
+
+    def _on_log(self, run: TargetRun, script_name: str, level: str, text: str):
+        '''Record a console.log line'''
+        self.sink.put(MessageRecord(time.time(), run.target.name, run.pid, script_name, KIND_LOG, text, level=level))
+
+
+    def _on_detached(self, run: TargetRun, reason: str, crash=None):
+        '''Mark the target complete when its process exits or the connection drops'''
+        with self.condition:
+            run.detached = reason if crash is None else f'{reason}: {getattr(crash, "summary", crash)}'
+            self.condition.notify_all()
+
+
+def resolve_attach_target(device, name: str) -> int | str:
+    '''The PID to attach to for a PID or the bundle ID of a running app, otherwise the process name itself'''
+    if name.isdigit():
+        return int(name)
+    # On iOS the process is named after the executable (Cafe), not the bundle ID (com.corellium.Cafe), so attaching
+    # by bundle ID only works through the PID of the running app
+    for application in device.enumerate_applications():
+        if application.identifier == name and application.pid:
+            return application.pid
+    return name
+
+
+def open_device(device_id: str | None = None, usb: bool = False, host: str | None = None,
+                timeout: float = DEVICE_TIMEOUT_SECONDS):
+    '''Open the one device connection every target shares'''
+    if frida is None:
+        raise FridaRunnerError('frida is not installed. Install it from requirements-pip-frida.txt.')
+    try:
+        if host:
+            return frida.get_device_manager().add_remote_device(host)
+        if usb:
+            return frida.get_usb_device(timeout=timeout)
+        return frida.get_device(device_id, timeout=timeout)
+    except FRIDA_ERRORS as e:
+        raise FridaRunnerError(f'Cannot open Frida device {host or device_id or "over USB"}: {e}') from e
+
+
+def echo_record(record: MessageRecord):
+    '''Print a message as it arrives, the way the frida CLI would'''
+    text = record.payload if isinstance(record.payload, str) else json.dumps(record.payload, default=repr)
+    stream = sys.stderr if record.kind == KIND_ERROR else sys.stdout
+    print(f'[{record.target}/{record.script}] {text}', file=stream, flush=True)
+
+
+def main() -> int:
+    '''Instrument the targets, wait for their scripts to finish, and return non-zero if any did not'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    device_group = parser.add_mutually_exclusive_group(required=True)
+    device_group.add_argument('--device', help='Frida device ID: <services_ip>:5001 for Android or the UDID for iOS')
+    device_group.add_argument('--usb', action='store_true', help='use the first USB device')
+    device_group.add_argument('--host', help='frida-server address for a network device')
+    device_group.add_argument('--fake', action='store_true', help='use the fake device from fake_frida_device.py')
+    parser.add_argument('--spawn', action='append', default=[], help='package or bundle ID to spawn, repeatable')
+    parser.add_argument('--attach', action='append', default=[], help='process name or PID to attach to, repeatable')
+    parser.add_argument('--script', action='append', required=True, help='script to load into every target, repeatable')
+    parser.add_argument('--timeout', type=float, default=None, help='seconds to wait for completion (default: no limit)')
+    parser.add_argument('--messages', default=DEFAULT_MESSAGES_PATH, help='JSON-lines file that receives every message')
+    parser.add_argument('--buffer', type=int, default=DEFAULT_BUFFER_SIZE, help='messages kept in memory')
+    parser.add_argument('--done-type', default=DONE_MESSAGE_TYPE, help="payload type a script sends when it is finished")
+    parser.add_argument('--keep-running', action='store_true', help='leave spawned apps running afterwards')
+    args = parser.parse_args()
+
+    targets = [Target(name, MODE_SPAWN) for name in args.spawn] + [Target(name, MODE_ATTACH) for name in args.attach]
+    if not targets:
+        parser.error('give at least one --spawn or --attach target')
+    scripts = [ScriptFile.load(path) for path in args.script]
+    try:
+        if args.fake:
+            # Imported here so real runs do not load the fake
+            import fake_frida_device  # pylint: disable=import-outside-toplevel
+            device = fake_frida_device.FakeDevice()
+        else:
+            device = open_device(args.device, args.usb, args.host)
+    except FridaRunnerError as e:
+        print(f'ERROR: {e}', file=sys.stderr)
+        return 1
+
+    sink = MessageSink(args.messages, args.buffer, echo=echo_record)
+    runner = FridaRunner(device, sink, args.done_type, kill_spawned=not args.keep_running)
+    status = 0
+    try:
+        runner.start(targets, scripts)
+        if not runner.wait(args.timeout):
+            print(f'ERROR: Scripts did not report {args.done_type} within {args.timeout} seconds.', file=sys.stderr)
+            status = 1
+    except KeyboardInterrupt:
+        status = 130
+    finally:
+        runner.stop()
+        sink.close()
+    for run in runner.runs:
+        if run.error is not None:
+            print(f'ERROR: Could not instrument {run.target.name}: {run.error}', file=sys.stderr)
+            status = status or 1
+        elif run.pending:
+            ending = f'detached ({run.detached})' if run.detached else 'still running'
+            print(f'ERROR: {run.target.name} {ending} before {", ".join(sorted(run.pending))} finished.', file=sys.stderr)
+            status = status or 1
+    if sink.errors:
+        print(f'ERROR: Scripts raised {sink.errors} errors; see {args.messages}.', file=sys.stderr)
+        status = status or 1
+    print(f'Recorded {sink.received} messages from {len(targets)} targets in {args.messages}.')
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,3 +5,6 @@ console.log('---   Demo of a Frida script running in CI   ---');
 console.log('---                                          ---');
 console.log('------------------------------------------------');
 console.log('------------------------------------------------');
+
+// Tell frida_runner.py this script is finished, so the run ends now instead of at its timeout
+send({ type: 'done' });
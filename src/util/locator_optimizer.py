@@ -0,0 +1,762 @@
+"""
+Propose cheaper, unique locators for a recorded Appium journey and drop the finds and waits it repeats.
+
+Appium Inspector recordings look every element up with whatever strategy the Inspector picked, often a class
+chain, class name, or XPath where an ID or accessibility ID would do, and they find the same element more than once. The optimizer reads the recording (raw driver.find_element code,
+AppiumHelper calls, or a flow file) and places each step on one of the page source snapshots taken per screen.
+It then picks the cheapest locator that matches only that step's element on its screen, trying ID, accessibility
+ID, predicate (UiSelector on Android), class name, class chain, and XPath in that order. A wait or find followed by
+an action on the same element becomes one step, and a repeated tap is dropped when the next snapshot no longer
+shows its element.
+
+The result is written as a flow for appium_flow.py, which the Cafe scripts run, or as AppiumHelper calls. With
+--replay, the recorded and optimized steps both run against the fake WebDriver server with a lookup cost per
+locator strategy, and the before and after timings are printed.
+
+Save one page source per screen visit, in journey order, from the Appium Inspector Source tab or driver.page_source,
+and save a screen again when the journey comes back to it. Steps that no snapshot places keep their locators.
+
+Usage:
+    python3 src/util/locator_optimizer.py ios recording.py --snapshots snapshots/ios --replay
+    python3 src/util/locator_optimizer.py android recording.py --snapshots login.xml menu.xml --format script
+    python3 src/util/locator_optimizer.py ios data/config/appium_flow_cafe.json --snapshots snapshots/ios --output appium_flow_cafe.json
+"""
+
+import argparse
+import ast
+import contextlib
+import copy
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import asdict, dataclass, replace
+from appium.webdriver.common.appiumby import AppiumBy
+from selenium.common.exceptions import WebDriverException
+
+import appium_flow
+from appium_flow import DEFAULT_WAITS, ELEMENT_ACTIONS, PLATFORM_NAMES, WAIT_ACTIONS, WAIT_STRENGTH, FlowError, FlowPlan, PlanStep
+from appium_page_index import IndexedNode, PageIndex
+from benchmark_appium_flow import percentile
+from fake_webdriver_server import FakeWebDriverServer, FakeWebDriverState, FaultConfig
+
+STRATEGY_NAMES = {getattr(AppiumBy, name): name for name in dir(AppiumBy)
+                  if name.isupper() and isinstance(getattr(AppiumBy, name), str)}
+# Cheapest first: later strategies make the driver walk or serialise more of the tree per lookup
+STRATEGY_RANK = {
+    AppiumBy.ID: 0,
+    AppiumBy.ACCESSIBILITY_ID: 1,
+    AppiumBy.IOS_PREDICATE: 2,
+    AppiumBy.ANDROID_UIAUTOMATOR: 2,
+    AppiumBy.CLASS_NAME: 3,
+    AppiumBy.IOS_CLASS_CHAIN: 4,
+    AppiumBy.XPATH: 5,
+}
+# Device-side milliseconds per find that the replay charges each strategy, before --lookup-scale
+LOOKUP_COST_MS = {
+    AppiumBy.ID: 15.0,
+    AppiumBy.ACCESSIBILITY_ID: 15.0,
+    AppiumBy.IOS_PREDICATE: 25.0,
+    AppiumBy.ANDROID_UIAUTOMATOR: 25.0,
+    AppiumBy.CLASS_NAME: 30.0,
+    AppiumBy.IOS_CLASS_CHAIN: 40.0,
+    AppiumBy.XPATH: 120.0,
+}
+# iOS attributes to build predicates and class chains from, most stable first; value changes as the user types
+IOS_LOCATOR_ATTRIBUTES = ('name', 'label', 'value')
+ANDROID_XPATH_ATTRIBUTES = ('resource-id', 'content-desc', 'text')
+WAIT_ACTION_FOR = {wait: action for action, wait in WAIT_ACTIONS.items()}
+HELPER_WAITS = {'wait_until_clickable': 'wait_clickable', 'wait_until_visible': 'wait_visible'}
+
+
+class RecordingError(Exception):
+    '''Exception raised when a recording or snapshot cannot be read.'''
+
+
+@dataclass
+class RecordedStep:
+    'One step of the recorded journey, before optimization.'
+    step: PlanStep
+    origin: str
+    flow_index: int | None = None
+
+
+@dataclass
+class Placement:
+    'The snapshot and element a step acts on.'
+    screen: int
+    node: IndexedNode
+
+
+@dataclass
+class Proposal:  # pylint: disable=too-many-instance-attributes
+    'What the optimizer decided for one recorded step.'
+    origin: str
+    name: str
+    action: str
+    before: tuple[str, str] | None = None
+    after: tuple[str, str] | None = None
+    screen: str | None = None
+    note: str = ''
+    removed: bool = False
+
+
+@dataclass
+class ReplayResult:
+    'Timings from replaying one plan against the fake WebDriver server.'
+    steps: int
+    commands: float
+    p50_ms: float
+    p95_ms: float
+    failures: int
+
+
+def locator_of(step: PlanStep) -> tuple[str, str] | None:
+    '''The step's (by, value), or None for steps that do not touch an element'''
+    return (step.by, step.value) if step.by is not None else None
+
+
+def describe(locator: tuple[str, str] | None) -> str:
+    '''AppiumBy name and value of a locator, for the report'''
+    return f'{STRATEGY_NAMES.get(locator[0], locator[0])} {locator[1]}' if locator else '-'
+
+
+def quoted(value: str) -> str:
+    '''Escape double quotes for a predicate, class chain, or UiSelector string'''
+    return value.replace('"', '\\"')
+
+
+# ==== SNAPSHOTS ====
+
+class Snapshot:  # pylint: disable=too-few-public-methods
+    '''One screen's page source, indexed for locator matching.'''
+
+    def __init__(self, path: str, platform: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        try:
+            self.root = ET.parse(path).getroot()
+        except (OSError, ET.ParseError) as e:
+            raise RecordingError(f"Cannot read page source snapshot {path}: {e}") from e
+        self.index = PageIndex.from_tree(self.root, platform)
+        self.order = {id(element): order for order, element in enumerate(self.root.iter())}
+
+
+    def find_all(self, by: str, value: str) -> list[IndexedNode] | None:
+        '''Nodes the locator matches on this screen, or None if it cannot be evaluated offline'''
+        if by == AppiumBy.XPATH:
+            return self._find_xpath(value)
+        return self.index.find_all(by, value)
+
+
+    def _find_xpath(self, xpath: str) -> list[IndexedNode] | None:
+        '''Evaluate the XPath subset ElementTree supports, such as //Type[@attr="value"]'''
+        if xpath.startswith('//'):
+            path = f'.{xpath}'
+        elif xpath.startswith('/'):
+            first, _, rest = xpath[1:].partition('/')
+            if first != self.root.tag:
+                return []
+            path = f'./{rest}' if rest else '.'
+        else:
+            return None
+        try:
+            elements = self.root.findall(path)
+        except (SyntaxError, KeyError):
+            return None
+        return [self.index.nodes[self.order[id(element)]] for element in elements]
+
+
+def load_snapshots(paths: list[str], platform: str) -> list[Snapshot]:
+    '''Read snapshot files in the order given, expanding directories to their sorted XML files'''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.xml'))
+        else:
+            files.append(path)
+    return [Snapshot(path, platform) for path in files]
+
+
+def candidate_locators(node: IndexedNode, platform: str) -> list[tuple[str, str]]:
+    '''Locators that could reach the node, cheapest strategy first'''
+    attributes = node.attributes
+    candidates = []
+    if platform == 'android':
+        tag = attributes['class']
+        if attributes.get('resource-id'):
+            candidates.append((AppiumBy.ID, attributes['resource-id']))
+        if attributes.get('content-desc'):
+            candidates.append((AppiumBy.ACCESSIBILITY_ID, attributes['content-desc']))
+        if attributes.get('text'):
+            text = quoted(attributes['text'])
+            candidates.append((AppiumBy.ANDROID_UIAUTOMATOR, f'new UiSelector().text("{text}")'))
+            candidates.append((AppiumBy.ANDROID_UIAUTOMATOR, f'new UiSelector().className("{tag}").text("{text}")'))
+        candidates.append((AppiumBy.CLASS_NAME, tag))
+        xpath_attributes = ANDROID_XPATH_ATTRIBUTES
+    else:
+        tag = attributes['type']
+        present = [(attribute, quoted(attributes[attribute])) for attribute in IOS_LOCATOR_ATTRIBUTES if attributes.get(attribute)]
+        # XCUITest matches both ID and accessibility ID on name, so only the conventional one is proposed
+        if attributes.get('name'):
+            candidates.append((AppiumBy.ACCESSIBILITY_ID, attributes['name']))
+        for attribute, value in present:
+            candidates.append((AppiumBy.IOS_PREDICATE, f'{attribute} == "{value}"'))
+            candidates.append((AppiumBy.IOS_PREDICATE, f'type == "{tag}" AND {attribute} == "{value}"'))
+        candidates.append((AppiumBy.CLASS_NAME, tag))
+        for attribute, value in present:
+            candidates.append((AppiumBy.IOS_CLASS_CHAIN, f'**/{tag}[`{attribute} == "{value}"`]'))
+        xpath_attributes = IOS_LOCATOR_ATTRIBUTES
+    for attribute in xpath_attributes:
+        if attributes.get(attribute) and '"' not in attributes[attribute]:
+            candidates.append((AppiumBy.XPATH, f'//{tag}[@{attribute}="{attributes[attribute]}"]'))
+    return candidates
+
+
+# ==== RECORDINGS ====
+
+def step_name(position: int, step: PlanStep) -> str:
+    '''Readable name for a step read from a script, such as 03.click.login'''
+    label = step.screenshot if step.action == 'screenshot' else step.value or step.action
+    slug = re.sub(r'[^a-z0-9]+', '_', label.lower()).strip('_')[:32] or 'element'
+    return f'{position:02d}.{step.action}.{slug}'
+
+
+class RecordingReader:
+    '''Turn interact_with_app source or a pasted Inspector recording into plan steps.'''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.steps: list[RecordedStep] = []
+        self.variables: dict[str, RecordedStep] = {}
+        self.warnings: list[str] = []
+
+
+    def read(self) -> list[RecordedStep]:
+        '''Read the interact_with_app body, or the whole file when it is a bare recording'''
+        try:
+            with open(file=self.path, mode='r', encoding='utf-8') as f:
+                tree = ast.parse(f.read(), filename=self.path)
+        except (OSError, SyntaxError) as e:
+            raise RecordingError(f"Cannot read recording {self.path}: {e}") from e
+        function = next((node for node in ast.walk(tree)
+                         if isinstance(node, ast.FunctionDef) and node.name == 'interact_with_app'), None)
+        self.read_body(function.body if function is not None else tree.body)
+        if not any(recorded.step.by is not None for recorded in self.steps):
+            raise RecordingError(f"No element steps found in {self.path}.")
+        for position, recorded in enumerate(self.steps, start=1):
+            recorded.step.name = step_name(position, recorded.step)
+        return self.steps
+
+
+    def read_body(self, statements: list[ast.stmt]):
+        '''Read statements in order, descending into with and try blocks'''
+        for statement in statements:
+            if isinstance(statement, (ast.With, ast.Try)):
+                self.read_body(statement.body)
+            elif isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Call):
+                self.read_call(statement.value, statement.lineno)
+            elif (isinstance(statement, ast.Assign) and isinstance(statement.value, ast.Call)
+                  and len(statement.targets) == 1 and isinstance(statement.targets[0], ast.Name)):
+                self.read_call(statement.value, statement.lineno, target=statement.targets[0].id)
+            elif not isinstance(statement, (ast.Pass, ast.Expr, ast.Import, ast.ImportFrom)):
+                self.warn(statement.lineno, f'skipped {type(statement).__name__.lower()} statement')
+
+
+    def read_call(self, call: ast.Call, line: int, target: str | None = None):  # pylint: disable=too-many-branches
+        '''Turn one driver, element, or helper call into a step'''
+        func = call.func
+        method = func.attr if isinstance(func, ast.Attribute) else getattr(func, 'id', None)
+        owner = func.value if isinstance(func, ast.Attribute) else None
+        if method in ('click', 'send_keys') and isinstance(owner, ast.Name) and owner.id in self.variables:
+            self.element_action(self.variables[owner.id], method, call, line)
+        elif method in ('click', 'send_keys') and isinstance(owner, ast.Call):
+            # driver.find_element(...).click() in one expression
+            found = self.read_find(owner, line, 'find')
+            if found is not None:
+                self.element_action(found, method, call, line)
+        elif method == 'find_element':
+            condition = self.keyword(call, 'condition') or 'present'
+            found = self.read_find(call, line, WAIT_ACTION_FOR.get(condition, 'find'))
+            if found is not None and target is not None:
+                self.variables[target] = found
+        elif method in HELPER_WAITS:
+            found = self.read_find(call, line, HELPER_WAITS[method])
+            if found is not None and target is not None:
+                self.variables[target] = found
+        elif method in ('click', 'click_when_ready', 'type_text', 'set_element_value'):
+            self.read_helper_action(method, call, line)
+        elif method == 'save_screenshot':
+            key = self.keyword(call, 'filename', node=True)
+            if isinstance(key, ast.Subscript) and isinstance(key.slice, ast.Constant):
+                self.add(PlanStep(name='', action='screenshot', screenshot=key.slice.value), line)
+            else:
+                self.warn(line, "save_screenshot needs filename=screenshots['<key>']")
+        elif method == 'sleep':
+            self.warn(line, 'dropped a fixed sleep; the flow waits adapt to each element instead')
+        elif method == 'log_stdout' and call.args and isinstance(call.args[0], ast.Constant):
+            self.add(PlanStep(name='', action='log', message=call.args[0].value), line)
+        else:
+            self.warn(line, f'skipped call to {method}()')
+
+
+    def read_find(self, call: ast.Call, line: int, action: str) -> RecordedStep | None:
+        '''Add a find or wait step for the call's locator'''
+        locator = self.locator(call, line)
+        if locator is None:
+            return None
+        return self.add(PlanStep(name='', action=action, by=locator[0], value=locator[1], wait=WAIT_ACTIONS[action]), line)
+
+
+    def element_action(self, found: RecordedStep, method: str, call: ast.Call, line: int):
+        '''Click or type into an element found earlier, folding the find in when nothing ran in between'''
+        action = 'click' if method == 'click' else 'set_value'
+        text = self.literal(call.args[0]) if call.args else None
+        if action == 'set_value' and not isinstance(text, str):
+            self.warn(line, 'send_keys needs a string literal')
+            return
+        if self.steps and self.steps[-1] is found and found.step.action in WAIT_ACTIONS:
+            # The recording's find and the action on its result are one lookup on the device
+            found.step.action = action
+            found.step.text = text
+            found.step.verify = False
+            return
+        self.add(PlanStep(name='', action=action, by=found.step.by, value=found.step.value, wait='present',
+                          text=text, verify=False), line)
+
+
+    def read_helper_action(self, method: str, call: ast.Call, line: int):
+        '''Add a step for an AppiumHelper click or type call'''
+        locator = self.locator(call, line)
+        if locator is None:
+            return
+        by, value = locator
+        if method in ('click', 'click_when_ready'):
+            condition = 'clickable' if method == 'click_when_ready' else self.keyword(call, 'condition') or 'present'
+            navigates = self.keyword(call, 'navigates')
+            self.add(PlanStep(name='', action='click', by=by, value=value, wait=condition,
+                              navigates=navigates is not False), line)
+            return
+        text = self.keyword(call, 'desired_value' if method == 'set_element_value' else 'text', position=2)
+        if not isinstance(text, str):
+            self.warn(line, f'{method} needs a string literal to type')
+            return
+        self.add(PlanStep(name='', action='set_value', by=by, value=value, text=text,
+                          wait=self.keyword(call, 'condition') or 'present', verify=method == 'set_element_value'), line)
+
+
+    def locator(self, call: ast.Call, line: int) -> tuple[str, str] | None:
+        '''Read the (by, value) arguments, positional or keyword'''
+        by_node = self.keyword(call, 'by', position=0, node=True)
+        value = self.keyword(call, 'value', position=1)
+        if isinstance(by_node, ast.Attribute):
+            by = getattr(AppiumBy, by_node.attr, None)
+        else:
+            by = self.literal(by_node)
+        if by not in STRATEGY_NAMES or not isinstance(value, str):
+            self.warn(line, 'skipped a locator that is not a literal AppiumBy strategy and value')
+            return None
+        return by, value
+
+
+    def keyword(self, call: ast.Call, name: str, position: int | None = None, node: bool = False):
+        '''A keyword or positional argument, as a literal or as its AST node'''
+        argument = next((keyword.value for keyword in call.keywords if keyword.arg == name), None)
+        if argument is None and position is not None and position < len(call.args):
+            argument = call.args[position]
+        return argument if node else self.literal(argument)
+
+
+    @staticmethod
+    def literal(node: ast.AST | None):
+        '''Evaluate a literal argument, or None if it is computed at run time'''
+        if node is None:
+            return None
+        try:
+            return ast.literal_eval(node)
+        except ValueError:
+            return None
+
+
+    def add(self, step: PlanStep, line: int) -> RecordedStep:
+        '''Append a step read from the given source line'''
+        recorded = RecordedStep(step=step, origin=f'{os.path.basename(self.path)}:{line}')
+        self.steps.append(recorded)
+        return recorded
+
+
+    def warn(self, line: int, message: str):
+        '''Note a statement the reader could not turn into a step'''
+        self.warnings.append(f'{os.path.basename(self.path)}:{line}: {message}')
+
+
+def read_flow(flow: dict, platform: str, path: str) -> list[RecordedStep]:
+    '''Compile each flow step for the platform without merging, keeping its position in the file'''
+    defaults = flow.get('platform_defaults', {}).get(platform, {})
+    recorded = []
+    for index, raw in enumerate(flow.get('steps', [])):
+        step = appium_flow.compile_step(raw, index, platform, defaults)
+        if step is not None:
+            recorded.append(RecordedStep(step=step, origin=f'{os.path.basename(path)}#{index + 1}', flow_index=index))
+    return recorded
+
+
+# ==== OPTIMIZER ====
+
+class LocatorOptimizer:
+    '''Choose locators from the snapshots and remove repeated lookups.'''
+
+    def __init__(self, platform: str, snapshots: list[Snapshot]):
+        self.platform = platform
+        self.snapshots = snapshots
+
+
+    def optimize(self, recorded: list[RecordedStep]) -> tuple[list[RecordedStep], list[Proposal]]:
+        '''Return the surviving steps with their new locators, and what happened to every recorded step'''
+        steps = [replace(item, step=replace(item.step, merged=list(item.step.merged))) for item in recorded]
+        proposals = [Proposal(origin=item.origin, name=item.step.name, action=item.step.action,
+                              before=locator_of(item.step)) for item in steps]
+        placements = self.place(steps, proposals)
+        for item, proposal, placement in zip(steps, proposals, placements):
+            if placement is not None and not proposal.removed:
+                self.choose_locator(item.step, placement, proposal)
+        self.fold_waits(steps, proposals, placements)
+        for item, proposal in zip(steps, proposals):
+            proposal.after = None if proposal.removed else locator_of(item.step)
+        return [item for item, proposal in zip(steps, proposals) if not proposal.removed], proposals
+
+
+    def locate(self, step: PlanStep, start: int, stop: int | None = None) -> Placement | None:
+        '''First snapshot in start..stop whose elements the step's locator matches'''
+        for screen in range(start, len(self.snapshots) if stop is None else min(stop, len(self.snapshots))):
+            matches = self.snapshots[screen].find_all(step.by, step.value)
+            if matches:
+                return Placement(screen=screen, node=matches[0])
+        return None
+
+
+    def place(self, steps: list[RecordedStep], proposals: list[Proposal]) -> list[Placement | None]:
+        '''Follow the journey forward through the snapshots, dropping taps that repeat on a screen already left'''
+        placements: list[Placement | None] = [None] * len(steps)
+        cursor = 0
+        navigated = True
+        previous_tap = None
+        for position, (item, proposal) in enumerate(zip(steps, proposals)):
+            step = item.step
+            if step.action not in ELEMENT_ACTIONS:
+                continue
+            # Only a navigating tap can move the journey to a later screen
+            placement = self.locate(step, cursor, None if navigated else cursor + 1)
+            if placement is not None and previous_tap == (placement.screen, placement.node.order):
+                # The same element right after a navigating tap is only a new target if the next screen has it
+                placement = self.locate(step, placement.screen + 1, placement.screen + 2) or placement
+                if (placement.screen, placement.node.order) == previous_tap and step.action == 'click':
+                    proposal.removed = True
+                    proposal.note = 'repeats the previous tap; the next snapshot does not show its element'
+                    continue
+            if placement is None:
+                proposal.note = ('not on the current or a later snapshot; locator kept' if self.snapshots
+                                 else 'no snapshots; locator kept')
+                navigated = navigated or (step.action == 'click' and step.navigates)
+                previous_tap = None
+                continue
+            cursor = placement.screen
+            placements[position] = placement
+            proposal.screen = self.snapshots[placement.screen].name
+            navigated = step.action == 'click' and step.navigates
+            previous_tap = (placement.screen, placement.node.order) if navigated else None
+        return placements
+
+
+    def choose_locator(self, step: PlanStep, placement: Placement, proposal: Proposal):
+        '''Switch to the cheapest locator that matches only the step's element on its screen'''
+        snapshot = self.snapshots[placement.screen]
+        original = snapshot.find_all(step.by, step.value) or []
+        best = None
+        for by, value in candidate_locators(placement.node, self.platform):
+            if [node.order for node in snapshot.find_all(by, value) or []] == [placement.node.order]:
+                best = (by, value)
+                break
+        if best is None:
+            if len(original) > 1:
+                proposal.note = f'no unique locator; the recorded one matches {len(original)} elements'
+            return
+        unique = len(original) == 1
+        if best == (step.by, step.value) or (unique and STRATEGY_RANK.get(best[0], 6) >= STRATEGY_RANK.get(step.by, 6)):
+            return
+        proposal.note = (f'recorded locator matches {len(original)} elements' if not unique
+                         else f'{STRATEGY_NAMES[best[0]]} is cheaper than {STRATEGY_NAMES.get(step.by, step.by)}')
+        step.by, step.value = best
+
+
+    def fold_waits(self, steps: list[RecordedStep], proposals: list[Proposal], placements: list[Placement | None]):
+        '''Fold a wait or find into the next element step on the same element, keeping the stricter wait'''
+        pending = pending_proposal = pending_target = None
+        for item, proposal, placement in zip(steps, proposals, placements):
+            step = item.step
+            if proposal.removed or step.action == 'log':
+                continue
+            target = ((placement.screen, placement.node.order) if placement is not None
+                      else locator_of(step))
+            if pending is not None and step.action in ELEMENT_ACTIONS and pending_target == target:
+                pending_proposal.removed = True
+                pending_proposal.note = f'folded into {step.name}'
+                step.merged = [*pending.merged, pending.name]
+                if WAIT_STRENGTH[pending.wait] > WAIT_STRENGTH[step.wait]:
+                    step.wait = pending.wait
+                    if step.action in WAIT_ACTIONS:
+                        step.action = WAIT_ACTION_FOR[step.wait]
+                step.wait_profile = step.wait_profile or pending.wait_profile
+            if step.action in WAIT_ACTIONS:
+                pending, pending_proposal, pending_target = step, proposal, target
+            else:
+                pending = None
+
+
+# ==== OUTPUT ====
+
+def flow_locator(step: PlanStep) -> dict:
+    '''Platform block with the step's locator and any wait that differs from the action's default'''
+    block = {'by': STRATEGY_NAMES[step.by], 'value': step.value}
+    if step.action in DEFAULT_WAITS and step.action not in WAIT_ACTIONS and step.wait != DEFAULT_WAITS[step.action]:
+        block['wait'] = step.wait
+    if step.wait_profile:
+        block['wait_profile'] = step.wait_profile
+    return block
+
+
+def flow_step(step: PlanStep, platform: str) -> dict:
+    '''One flow file step for a single platform'''
+    if step.action == 'log':
+        return {'action': 'log', 'message': step.message}
+    entry = {'name': step.name, 'action': step.action}
+    if step.action == 'screenshot':
+        entry['screenshot'] = step.screenshot
+        entry['platforms'] = [platform]
+        return entry
+    if step.text is not None:
+        entry['text'] = step.text
+    if step.action == 'set_value' and not step.verify:
+        entry['verify'] = False
+    if step.action == 'click' and not step.navigates:
+        entry['navigates'] = False
+    entry[platform] = flow_locator(step)
+    return entry
+
+
+def build_flow(name: str, platform: str, steps: list[RecordedStep]) -> dict:
+    '''A single-platform flow from steps read out of a script'''
+    return {
+        'name': f'{name}_optimized',
+        'description': f'{name} for {platform} with locators chosen by locator_optimizer.py.',
+        'steps': [flow_step(item.step, platform) for item in steps],
+    }
+
+
+def without_platform(raw: dict, platform: str) -> dict | None:
+    '''A flow step that no longer runs on the platform, or None when no platform is left'''
+    if platform in raw:
+        del raw[platform]
+        return raw if any(key in raw for key in PLATFORM_NAMES) else None
+    platforms = [name for name in raw.get('platforms', PLATFORM_NAMES) if name != platform]
+    if not platforms:
+        return None
+    raw['platforms'] = platforms
+    return raw
+
+
+def rewrite_flow(flow: dict, platform: str, recorded: list[RecordedStep], steps: list[RecordedStep],
+                 proposals: list[Proposal]) -> dict:
+    '''The input flow with this platform's locators replaced and its redundant steps removed'''
+    rewritten = copy.deepcopy(flow)
+    raw_steps: list[dict | None] = rewritten.get('steps', [])
+    originals = {item.flow_index: item.step for item in recorded}
+    for item, proposal in zip(recorded, proposals):
+        if proposal.removed:
+            raw_steps[item.flow_index] = without_platform(raw_steps[item.flow_index], platform)
+    for item in steps:
+        step, original = item.step, originals[item.flow_index]
+        if step.by is None or (step.action, step.by, step.value, step.wait) == (original.action, original.by, original.value, original.wait):
+            continue
+        raw = raw_steps[item.flow_index]
+        if platform not in raw and any(key in raw for key in ('by', 'value')):
+            # Give the other platforms their own copy of the shared locator before overriding it here
+            for other in raw.get('platforms', PLATFORM_NAMES):
+                if other != platform:
+                    raw[other] = {'by': raw['by'], 'value': raw['value']}
+            raw.pop('by')
+            raw.pop('value')
+        block = raw.setdefault(platform, {})
+        block.update({'by': STRATEGY_NAMES[step.by], 'value': step.value})
+        if step.action != original.action:
+            block['action'] = step.action
+        if step.wait != original.wait and step.action not in WAIT_ACTIONS:
+            block['wait'] = step.wait
+    rewritten['steps'] = [raw for raw in raw_steps if raw is not None]
+    return rewritten
+
+
+def script_lines(step: PlanStep) -> list[str]:  # pylint: disable=too-many-return-statements
+    '''AppiumHelper calls for one step, in the style of the Cafe interact_with_app'''
+    if step.action == 'log':
+        return [f'log_stdout({json.dumps(step.message, ensure_ascii=False)})']
+    if step.action == 'screenshot':
+        return [f"helper.save_screenshot(filename=screenshots['{step.screenshot}'])"]
+    locator = f'by=AppiumBy.{STRATEGY_NAMES[step.by]}, value={json.dumps(step.value, ensure_ascii=False)}'
+    condition = f", condition='{step.wait}'" if step.wait != 'present' else ''
+    match step.action:
+        case 'click':
+            navigates = ', navigates=False' if not step.navigates else ''
+            return [f'helper.click({locator}{condition}{navigates})']
+        case 'set_value':
+            text = json.dumps(step.text, ensure_ascii=False)
+            lines = [f'helper.type_text({locator}, text={text}{condition})']
+            if step.verify:
+                lines.append(f'helper.wait_until_element_value({locator}, desired_value={text})')
+            return lines
+        case 'wait_clickable':
+            return [f'helper.wait_until_clickable({locator})']
+        case 'wait_visible':
+            return [f'helper.wait_until_visible({locator})']
+    return [f'helper.find_element({locator})']
+
+
+def build_script(steps: list[RecordedStep]) -> str:
+    '''An interact_with_app body to paste over the recorded one'''
+    lines = [
+        'def interact_with_app(helper: AppiumHelper, screenshots: dict):',
+        "    '''Interact with the target app using Appium commands.'''",
+        '',
+    ]
+    lines.extend(f'    {line}' for item in steps for line in script_lines(item.step))
+    return '\n'.join(lines) + '\n'
+
+
+def print_proposals(proposals: list[Proposal], warnings: list[str]):
+    '''Print what happened to each element step, then the totals'''
+    for warning in warnings:
+        print(f"WARNING: {warning}", file=sys.stderr)
+    for proposal in proposals:
+        if proposal.action in ('log', 'screenshot'):
+            continue
+        status = 'removed' if proposal.removed else 'changed' if proposal.after != proposal.before else 'kept'
+        print(f"{proposal.origin:<40} {proposal.action:<14} {status:<8} {proposal.screen or ''}")
+        if status == 'changed':
+            print(f"    {describe(proposal.before)} -> {describe(proposal.after)}")
+        elif proposal.before:
+            print(f"    {describe(proposal.before)}")
+        if proposal.note:
+            print(f"    {proposal.note}")
+    changed = sum(not p.removed and p.after != p.before for p in proposals)
+    removed = sum(p.removed for p in proposals)
+    print(f"{changed} locators changed, {removed} steps removed.")
+
+
+# ==== REPLAY ====
+
+def replay(platform: str, plan: FlowPlan, faults: FaultConfig, runs: int) -> ReplayResult:
+    '''Run the plan against fresh fake servers that serve an element for each of its locators'''
+    # Imported here so optimizing a recording does not need the per-platform scripts
+    import appium_fanout  # pylint: disable=import-outside-toplevel
+    config = appium_fanout.load_config(platform)
+    durations, commands, failures = [], [], 0
+    for _ in range(runs):
+        state = FakeWebDriverState(platform, faults=faults)
+        for step in plan.steps:
+            if step.by is not None:
+                state.add_element(step.by, step.value)
+        with (tempfile.TemporaryDirectory(prefix='locator-replay-') as workdir, FakeWebDriverServer(state) as server,
+              contextlib.chdir(workdir), contextlib.redirect_stdout(io.StringIO())):
+            run_config = replace(config, appium_server={'ip': server.host, 'port': str(server.port)})
+            start = time.perf_counter_ns()
+            try:
+                appium_flow.run_flow(platform, run_config, appium_fanout.get_udid(platform, run_config, '127.0.0.1'), plan)
+            except (SystemExit, WebDriverException):
+                failures += 1
+            durations.append((time.perf_counter_ns() - start) / 1_000_000)
+        commands.append(state.commands)
+    return ReplayResult(steps=sum(step.action != 'log' for step in plan.steps), commands=sum(commands) / len(commands),
+                        p50_ms=round(percentile(durations, 0.50), 1), p95_ms=round(percentile(durations, 0.95), 1),
+                        failures=failures)
+
+
+def print_replay(before: ReplayResult, after: ReplayResult):
+    '''Print recorded and optimized replay numbers side by side'''
+    print(f"{'replay':<12}{'recorded':>12}{'optimized':>12}{'change':>10}")
+    for metric in ('steps', 'commands', 'p50_ms', 'p95_ms', 'failures'):
+        earlier, current = getattr(before, metric), getattr(after, metric)
+        change = f"{(current - earlier) / earlier:+.1%}" if earlier else ''
+        print(f"{metric:<12}{earlier:>12g}{current:>12g}{change:>10}")
+
+
+def main() -> int:  # pylint: disable=too-many-branches
+    '''Optimize a recording, write the flow or script, and optionally replay both versions'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('platform', choices=PLATFORM_NAMES)
+    parser.add_argument('source', help='interact_with_app script, pasted Inspector recording, or flow JSON')
+    parser.add_argument('--snapshots', nargs='*', default=[], help='page source XML files or directories, one per screen in journey order')
+    parser.add_argument('--format', choices=('flow', 'script'), default='flow', help='write a flow definition or helper calls')
+    parser.add_argument('--output', default=None, help='where to write the result (default: locator_optimized_<platform>.json or .py)')
+    parser.add_argument('--report', default=None, help='also write the proposals and replay timings as JSON')
+    parser.add_argument('--replay', action='store_true', help='time the recorded and optimized steps against the fake WebDriver server')
+    parser.add_argument('--runs', type=int, default=3, help='replay runs per version')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='fixed delay added to every replayed command')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='uniform +/- jitter added to the latency')
+    parser.add_argument('--lookup-scale', type=float, default=1.0, help='multiplier for the per-strategy lookup costs')
+    parser.add_argument('--seed', type=int, default=None, help='random seed for jitter')
+    args = parser.parse_args()
+
+    warnings = []
+    flow = None
+    try:
+        if args.source.endswith('.json'):
+            flow = appium_flow.load_flow(args.source)
+            recorded = read_flow(flow, args.platform, args.source)
+        else:
+            reader = RecordingReader(args.source)
+            recorded = reader.read()
+            warnings = reader.warnings
+        snapshots = load_snapshots(args.snapshots, args.platform)
+    except (RecordingError, FlowError, OSError, json.JSONDecodeError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+    steps, proposals = LocatorOptimizer(args.platform, snapshots).optimize(recorded)
+    print_proposals(proposals, warnings)
+
+    output = args.output or f"locator_optimized_{args.platform}.{'json' if args.format == 'flow' else 'py'}"
+    with open(file=output, mode='w', encoding='utf-8') as f:
+        if args.format == 'script':
+            f.write(build_script(steps))
+        elif flow is not None:
+            json.dump(rewrite_flow(flow, args.platform, recorded, steps, proposals), f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        else:
+            name = os.path.splitext(os.path.basename(args.source))[0]
+            json.dump(build_flow(name, args.platform, steps), f, indent=2, ensure_ascii=False)
+            f.write('\n')
+    print(f"Wrote optimized {args.format} to {output}.")
+
+    report = {'source': args.source, 'platform': args.platform, 'proposals': [asdict(p) for p in proposals]}
+    if args.replay:
+        faults = FaultConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, seed=args.seed,
+                             lookup_ms={by: cost * args.lookup_scale for by, cost in LOOKUP_COST_MS.items()})
+        name = os.path.splitext(os.path.basename(args.source))[0]
+        before = replay(args.platform, FlowPlan(name=name, platform=args.platform, steps=[item.step for item in recorded]),
+                        faults, args.runs)
+        after = replay(args.platform, FlowPlan(name=f'{name}_optimized', platform=args.platform,
+                                               steps=[item.step for item in steps]), faults, args.runs)
+        print_replay(before, after)
+        report['replay'] = {'recorded': asdict(before), 'optimized': asdict(after)}
+    if args.report:
+        with open(file=args.report, mode='w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
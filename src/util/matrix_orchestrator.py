@@ -0,0 +1,489 @@
+"""
+Run several workloads against one device inside a single MATRIX monitoring window.
+
+run_full_matrix_assessment spends a whole create, monitor, test, and report cycle on one Appium run. This
+orchestrator fills the monitoring window instead. It runs a plan of workloads against the same device: Appium flows,
+gesture replays from data/user_input, and Frida scripts, each as its own subprocess, so one assessment's evidence
+covers all of them. Workloads are grouped into lanes. The workloads in a lane run one after another in plan order,
+since they need the screen to themselves, and the lanes run at the same time, so a Frida script in the frida lane
+instruments the app while the ui lane drives it. Appium flows run with noReset, so before each screen-driving
+workload after the first in its lane the app is killed and relaunched, and the workload starts from the launch screen
+instead of wherever the previous one left it; set "relaunch_app": false on a workload to skip that. A relaunch also
+detaches a Frida script attached in another lane. Every workload has a deadline, after which it is interrupted and
+recorded as timed out, and monitoring stops as soon as the last lane is done.
+
+A plan can hold several windows, each its own assessment. MATRIX allows one open assessment per instance, so the
+windows run in turn, but the reports for a finished assessment download while the next one is monitoring. Each
+window's workload logs, Appium timings, and Frida messages land in evidence/<window>/, the reports in the reports
+directory, and evidence.json ties every workload result and report to its assessment.
+
+Usage:
+    python3 src/util/matrix_orchestrator.py <instance_id> com.corellium.cafe --wordlist <image_id>
+    python3 src/util/matrix_orchestrator.py <instance_id> com.corellium.cafe --wordlist <image_id> \\
+        --plan data/config/matrix_workloads_cafe.json --evidence-dir matrix_evidence --reports-dir .
+    python3 src/util/matrix_orchestrator.py <instance_id> com.corellium.cafe --compile-only
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from asyncio.subprocess import Process
+from collections.abc import Awaitable, Callable
+from dataclasses import asdict, dataclass, field
+
+import run_metrics
+from corellium_client import CorelliumApiError, CorelliumClient, ReportCache, ReportFetcher
+from corellium_client.reports import DEFAULT_CACHE_DIR, REPORT_FORMATS
+from corellium_client.watcher import StatusWatcher, WatchFailedError
+
+DEFAULT_PLAN_PATH = 'data/config/matrix_workloads_cafe.json'
+DEFAULT_EVIDENCE_DIR = 'matrix_evidence'
+KIND_APPIUM = 'appium'
+KIND_REPLAY = 'replay'
+KIND_FRIDA = 'frida'
+# Workloads that drive the screen share a lane unless the plan says otherwise
+DEFAULT_LANES = {KIND_APPIUM: 'ui', KIND_REPLAY: 'ui', KIND_FRIDA: 'frida'}
+SCREEN_KINDS = {KIND_APPIUM, KIND_REPLAY}
+SCRIPTS = {
+    KIND_APPIUM: 'src/util/appium_flow.py',
+    KIND_REPLAY: 'src/util/touch_replay.py',
+    KIND_FRIDA: 'src/util/frida_runner.py',
+}
+DEFAULT_DEADLINE_SECONDS = 600
+# Seconds between interrupting a workload at its deadline and killing it
+INTERRUPT_GRACE_SECONDS = 10
+# Frida gets its own timeout this much before the deadline, so it detaches cleanly instead of being interrupted
+FRIDA_DEADLINE_MARGIN_SECONDS = 5
+FRIDA_PORT = 5001
+STATUS_PASSED = 'passed'
+STATUS_FAILED = 'failed'
+STATUS_TIMED_OUT = 'timed_out'
+OPEN_ASSESSMENT_STATUS_TESTING = 'testing'
+CLOSED_ASSESSMENT_STATUSES = {'complete', 'failed'}
+
+
+class PlanError(Exception):
+    '''Exception raised when the workload plan is invalid.'''
+
+
+# ==== PLAN ====
+
+
+@dataclass
+class Workload:
+    'One program run against the device during a monitoring window.'
+    name: str
+    kind: str
+    lane: str
+    deadline: float
+    options: dict = field(default_factory=dict)
+
+
+@dataclass
+class Window:
+    'The workloads that share one assessment.'
+    name: str
+    workloads: list[Workload]
+
+    def lanes(self) -> dict[str, list[Workload]]:
+        '''Workloads grouped by lane, each lane in plan order'''
+        lanes = {}
+        for workload in self.workloads:
+            lanes.setdefault(workload.lane, []).append(workload)
+        return lanes
+
+
+@dataclass
+class Device:
+    'Where the workloads reach the device under assessment.'
+    instance_id: str
+    bundle_id: str
+    platform: str
+    # Android services IP or iOS UDID, as appium_flow.py and touch_replay.py take it
+    target: str
+    frida_device: str
+
+
+def parse_workload(data: dict, default_deadline: float) -> Workload:
+    '''Validate one workload definition from the plan'''
+    name = data.get('name')
+    kind = data.get('kind')
+    if not name:
+        raise PlanError(f'Workload {data} has no name.')
+    if kind not in SCRIPTS:
+        raise PlanError(f"Workload '{name}' has unknown kind '{kind}'; use one of {', '.join(SCRIPTS)}.")
+    if kind == KIND_FRIDA and not data.get('scripts'):
+        raise PlanError(f"Frida workload '{name}' has no scripts.")
+    deadline = float(data.get('deadline_seconds', default_deadline))
+    if deadline <= 0:
+        raise PlanError(f"Workload '{name}' needs a positive deadline_seconds.")
+    options = {key: value for key, value in data.items() if key not in ('name', 'kind', 'lane', 'deadline_seconds')}
+    return Workload(name, kind, data.get('lane', DEFAULT_LANES[kind]), deadline, options)
+
+
+def needs_relaunch(workload: Workload, position: int) -> bool:
+    '''True if the app should be relaunched before this workload, given its position in its lane'''
+    return position > 0 and workload.kind in SCREEN_KINDS and workload.options.get('relaunch_app', True)
+
+
+def load_plan(path: str) -> list[Window]:
+    '''Read the windows and their workloads from a plan file'''
+    try:
+        with open(file=path, mode='r', encoding='utf-8') as f:
+            plan = json.load(f)
+    except (OSError, ValueError) as e:
+        raise PlanError(f'Cannot read workload plan {path}: {e}') from e
+    default_deadline = float(plan.get('deadline_seconds', DEFAULT_DEADLINE_SECONDS))
+    windows = []
+    for index, window in enumerate(plan.get('windows', [])):
+        workloads = [parse_workload(workload, default_deadline) for workload in window.get('workloads', [])]
+        if not workloads:
+            raise PlanError(f'Window {index} of {path} has no workloads.')
+        names = [workload.name for workload in workloads]
+        if len(set(names)) != len(names):
+            raise PlanError(f'Window {index} of {path} repeats a workload name.')
+        windows.append(Window(window.get('name', f'window{index + 1}'), workloads))
+    if not windows:
+        raise PlanError(f'Workload plan {path} has no windows.')
+    return windows
+
+
+def build_command(workload: Workload, device: Device, evidence_dir: str) -> list[str]:
+    '''Command line that runs the workload against the device, writing its artifacts into evidence_dir'''
+    options = workload.options
+    command = [sys.executable, SCRIPTS[workload.kind]]
+    match workload.kind:
+        case 'appium':
+            command += [device.platform, device.target,
+                        '--timings', os.path.join(evidence_dir, f'{workload.name}_timings.json')]
+            if options.get('flow'):
+                command += ['--flow', options['flow']]
+        case 'replay':
+            command += [device.platform, device.target, *options.get('files', [])]
+            if options.get('idle'):
+                command.append('--idle')
+        case 'frida':
+            # Attach by default, since spawning would restart the app MATRIX is monitoring. frida_runner attaches to the
+            # PID of the app with this bundle ID, since on iOS the process name is not the bundle ID
+            mode = '--spawn' if options.get('spawn') else '--attach'
+            command += ['--device', device.frida_device, mode, device.bundle_id, '--keep-running',
+                        '--messages', os.path.join(evidence_dir, f'{workload.name}_messages.jsonl'),
+                        '--timeout', f'{max(1.0, workload.deadline - FRIDA_DEADLINE_MARGIN_SECONDS):g}']
+            for script in options['scripts']:
+                command += ['--script', script]
+    return command
+
+
+# ==== WORKLOADS ====
+
+
+@dataclass
+class WorkloadResult:  # pylint: disable=too-many-instance-attributes
+    'How one workload ended.'
+    name: str
+    kind: str
+    lane: str
+    status: str
+    exit_code: int | None
+    started_at: float
+    duration: float
+    log: str
+    command: list[str]
+
+
+async def run_workload(workload: Workload, device: Device, evidence_dir: str, window_start: float) -> WorkloadResult:
+    '''Run one workload to completion or its deadline, with its output in evidence_dir/<name>.log'''
+    command = build_command(workload, device, evidence_dir)
+    log_path = os.path.join(evidence_dir, f'{workload.name}.log')
+    started = time.monotonic()
+    print(f'Starting {workload.kind} workload {workload.name} in the {workload.lane} lane.', flush=True)
+    with open(file=log_path, mode='wb') as log:
+        process = await asyncio.create_subprocess_exec(*command, stdout=log, stderr=asyncio.subprocess.STDOUT,
+                                                       env={**os.environ, 'PYTHONUNBUFFERED': '1'})
+        try:
+            exit_code = await asyncio.wait_for(process.wait(), workload.deadline)
+            status = STATUS_PASSED if exit_code == 0 else STATUS_FAILED
+        except asyncio.TimeoutError:
+            status = STATUS_TIMED_OUT
+            exit_code = await stop_process(process)
+    duration = time.monotonic() - started
+    print(f'Workload {workload.name} {status.replace("_", " ")} after {duration:.1f} seconds.', flush=True)
+    return WorkloadResult(workload.name, workload.kind, workload.lane, status, exit_code,
+                          round(started - window_start, 3), round(duration, 3), log_path, command)
+
+
+async def stop_process(process: Process) -> int:
+    '''Interrupt a workload so it can close its Appium session or Frida session, then kill it if it lingers'''
+    process.send_signal(signal.SIGINT)
+    try:
+        return await asyncio.wait_for(process.wait(), INTERRUPT_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        process.kill()
+        return await process.wait()
+
+
+async def run_lane(workloads: list[Workload], device: Device, evidence_dir: str, window_start: float,  # pylint: disable=too-many-arguments
+                   relaunch_app: Callable[[], Awaitable] | None = None) -> list[WorkloadResult]:
+    '''Run a lane's workloads one after another, carrying on past failures so the window still covers the rest'''
+    results = []
+    for position, workload in enumerate(workloads):
+        if relaunch_app is not None and needs_relaunch(workload, position):
+            print(f'Relaunching {device.bundle_id} before workload {workload.name}.', flush=True)
+            await relaunch_app()
+        results.append(await run_workload(workload, device, evidence_dir, window_start))
+    return results
+
+
+async def run_lanes(window: Window, device: Device, evidence_dir: str,
+                    relaunch_app: Callable[[], Awaitable] | None = None) -> list[WorkloadResult]:
+    '''Run every lane of the window at the same time and return the results in plan order'''
+    os.makedirs(evidence_dir, exist_ok=True)
+    window_start = time.monotonic()
+    lanes = await asyncio.gather(*(run_lane(workloads, device, evidence_dir, window_start, relaunch_app)
+                                   for workloads in window.lanes().values()))
+    results = {result.name: result for lane in lanes for result in lane}
+    return [results[workload.name] for workload in window.workloads]
+
+
+# ==== ASSESSMENTS ====
+
+
+@dataclass
+class WindowEvidence:  # pylint: disable=too-many-instance-attributes
+    'Everything one monitoring window produced.'
+    name: str
+    assessment_id: str | None = None
+    status: str = 'pending'
+    monitoring_seconds: float = 0.0
+    total_seconds: float = 0.0
+    workloads: list[WorkloadResult] = field(default_factory=list)
+    reports: list[str] = field(default_factory=list)
+    error: str | None = None
+
+
+class MatrixOrchestrator:  # pylint: disable=too-many-instance-attributes
+    '''Run each window of a plan as one assessment, downloading reports in the background'''
+
+    def __init__(self, client: CorelliumClient, watcher: StatusWatcher, fetcher: ReportFetcher, device: Device, *,  # pylint: disable=too-many-arguments
+                 wordlist_id: str | None = None, evidence_dir: str = DEFAULT_EVIDENCE_DIR, reports_dir: str = '.',
+                 report_formats: tuple[str, ...] = REPORT_FORMATS, status_timeout: float | None = None):
+        self.client = client
+        self.watcher = watcher
+        self.fetcher = fetcher
+        self.device = device
+        self.wordlist_id = wordlist_id
+        self.evidence_dir = evidence_dir
+        self.reports_dir = reports_dir
+        self.report_formats = report_formats
+        self.status_timeout = status_timeout
+        self.evidence: list[WindowEvidence] = []
+
+
+    async def run(self, windows: list[Window]) -> list[WindowEvidence]:
+        '''Run the windows in turn, fetching each one's reports while the next one monitors'''
+        download = None
+        for window in windows:
+            evidence = WindowEvidence(window.name)
+            self.evidence.append(evidence)
+            started = time.monotonic()
+            try:
+                with run_metrics.phase('matrix_test'):
+                    await self.run_window(window, evidence)
+            except (CorelliumApiError, LookupError, TimeoutError, WatchFailedError) as e:
+                evidence.status = 'failed'
+                evidence.error = str(e)
+                print(f'ERROR: Window {window.name} failed: {e}', file=sys.stderr)
+            evidence.total_seconds = round(time.monotonic() - started, 3)
+            if download is not None:
+                # One download at a time, so the next one starts only when this window's evidence is ready
+                await download
+                download = None
+            if evidence.status == 'complete':
+                download = asyncio.create_task(self.download_reports(evidence))
+        if download is not None:
+            await download
+        return self.evidence
+
+
+    async def run_window(self, window: Window, evidence: WindowEvidence):
+        '''Create an assessment, run the window's workloads while it monitors, and test the evidence'''
+        instance_id = self.device.instance_id
+        await self.close_open_assessments()
+        assessment = await self.client.create_assessment(instance_id, self.device.bundle_id, self.wordlist_id)
+        evidence.assessment_id = assessment.id
+        print(f'Created MATRIX assessment {assessment.id} for window {window.name}.', flush=True)
+        await self.client.start_assessment_monitoring(instance_id, assessment.id)
+        await self.watcher.wait_for_assessment_status(instance_id, assessment.id, 'monitoring', self.status_timeout)
+        monitoring_started = time.monotonic()
+        try:
+            await self.watcher.wait_for_app_running(instance_id, self.device.bundle_id, self.status_timeout)
+            evidence.workloads = await run_lanes(window, self.device, os.path.join(self.evidence_dir, window.name),
+                                                 self.relaunch_app)
+        finally:
+            await self.client.stop_assessment_monitoring(instance_id, assessment.id)
+            evidence.monitoring_seconds = round(time.monotonic() - monitoring_started, 3)
+        await self.watcher.wait_for_assessment_status(instance_id, assessment.id, 'readyForTesting', self.status_timeout)
+        print(f'Testing MATRIX assessment {assessment.id}.', flush=True)
+        await self.client.test_assessment(instance_id, assessment.id)
+        await self.watcher.wait_for_assessment_status(instance_id, assessment.id, 'complete', self.status_timeout)
+        evidence.status = 'complete'
+        print(f'Completed MATRIX assessment {assessment.id}.', flush=True)
+        # Restart the app fresh for the next window, as run_full_matrix_assessment does
+        await self.client.kill_app(instance_id, self.device.bundle_id)
+
+
+    async def relaunch_app(self):
+        '''Kill and relaunch the app so the next ui workload starts from the launch screen'''
+        instance_id = self.device.instance_id
+        await self.client.kill_app(instance_id, self.device.bundle_id)
+        await self.client.run_app(instance_id, self.device.bundle_id)
+        await self.watcher.wait_for_app_running(instance_id, self.device.bundle_id, self.status_timeout)
+
+
+    async def close_open_assessments(self):
+        '''Let a testing assessment finish and delete any other open one, as handle_open_matrix_assessment does'''
+        instance_id = self.device.instance_id
+        for assessment in await self.client.list_assessments(instance_id):
+            if assessment.status in CLOSED_ASSESSMENT_STATUSES:
+                continue
+            print(f'WARNING: Assessment {assessment.id} is currently {assessment.status}.', file=sys.stderr)
+            if assessment.status == OPEN_ASSESSMENT_STATUS_TESTING:
+                await self.watcher.wait_for_assessment_status(instance_id, assessment.id, 'complete', self.status_timeout)
+            else:
+                await self.client.delete_assessment(instance_id, assessment.id)
+
+
+    async def download_reports(self, evidence: WindowEvidence):
+        '''Fetch a completed window's reports into the reports directory'''
+        try:
+            os.makedirs(self.reports_dir, exist_ok=True)
+            with run_metrics.phase('report_download'):
+                reports = await self.fetcher.fetch(self.device.instance_id, evidence.assessment_id,
+                                                   self.report_formats, self.reports_dir)
+        except (CorelliumApiError, LookupError, OSError) as e:
+            evidence.error = f'Report download failed: {e}'
+            print(f'ERROR: Could not fetch reports for assessment {evidence.assessment_id}: {e}', file=sys.stderr)
+            return
+        evidence.reports = [report.path for report in reports]
+        print(f'Fetched {len(reports)} reports for assessment {evidence.assessment_id}.', flush=True)
+
+
+async def resolve_device(client: CorelliumClient, instance_id: str, bundle_id: str, frida_device: str | None) -> Device:
+    '''Look up how the workload scripts reach the instance, like get_instance_services_ip and get_frida_device_id'''
+    instance = await client.get_instance(instance_id)
+    if instance.is_ranchu:
+        if not instance.service_ip:
+            raise LookupError(f'Instance {instance_id} has no services IP.')
+        return Device(instance_id, bundle_id, 'android', instance.service_ip,
+                      frida_device or f'{instance.service_ip}:{FRIDA_PORT}')
+    if not instance.udid:
+        raise LookupError(f'Instance {instance_id} has no UDID.')
+    return Device(instance_id, bundle_id, 'ios', instance.udid, frida_device or instance.udid)
+
+
+# ==== EVIDENCE ====
+
+
+def write_evidence(path: str, device: Device, evidence: list[WindowEvidence]):
+    '''Write the combined evidence manifest for every window'''
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    manifest = {
+        'instance_id': device.instance_id,
+        'bundle_id': device.bundle_id,
+        'platform': device.platform,
+        'windows': [asdict(window) for window in evidence],
+    }
+    with open(file=path, mode='w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def print_summary(evidence: list[WindowEvidence]):
+    '''Print one line per workload and the workloads covered per monitored minute'''
+    print(f"{'window':<16} {'workload':<24} {'lane':<8} {'status':<10} {'start_s':>8} {'seconds':>8}")
+    for window in evidence:
+        for result in window.workloads:
+            print(f'{window.name:<16} {result.name:<24} {result.lane:<8} {result.status:<10} '
+                  f'{result.started_at:>8.1f} {result.duration:>8.1f}')
+    workloads = sum(len(window.workloads) for window in evidence)
+    total_seconds = sum(window.total_seconds for window in evidence)
+    if total_seconds:
+        print(f'{workloads} workloads in {len(evidence)} assessments over {total_seconds:.0f} seconds '
+              f'({workloads * 60 / total_seconds:.2f} per device-minute).')
+
+
+def print_compiled(windows: list[Window], device: Device, evidence_dir: str):
+    '''Print each window's lanes and the commands their workloads would run'''
+    for window in windows:
+        print(f'Window {window.name}:')
+        for lane, workloads in window.lanes().items():
+            print(f'  Lane {lane}:')
+            for position, workload in enumerate(workloads):
+                if needs_relaunch(workload, position):
+                    print(f'    (relaunch {device.bundle_id})')
+                command = build_command(workload, device, os.path.join(evidence_dir, window.name))
+                print(f"    {workload.name} (deadline {workload.deadline:g}s): {' '.join(command[1:])}")
+
+
+async def run(args: argparse.Namespace, windows: list[Window]) -> int:
+    '''Connect to Corellium, run every window, and write the evidence manifest'''
+    async with CorelliumClient.from_env() as client:
+        device = await resolve_device(client, args.instance_id, args.bundle_id, args.frida_device)
+        fetcher = ReportFetcher(client, ReportCache(args.cache_dir))
+        async with StatusWatcher(client) as watcher:
+            orchestrator = MatrixOrchestrator(client, watcher, fetcher, device, wordlist_id=args.wordlist,
+                                              evidence_dir=args.evidence_dir, reports_dir=args.reports_dir,
+                                              report_formats=tuple(args.formats or REPORT_FORMATS),
+                                              status_timeout=args.status_timeout)
+            evidence = await orchestrator.run(windows)
+    manifest_path = os.path.join(args.evidence_dir, 'evidence.json')
+    write_evidence(manifest_path, device, evidence)
+    print_summary(evidence)
+    print(f'Wrote evidence manifest {manifest_path}.')
+    failed_windows = [window.name for window in evidence if window.status != 'complete' or window.error]
+    failed_workloads = [result.name for window in evidence for result in window.workloads if result.status != STATUS_PASSED]
+    if failed_windows:
+        print(f"ERROR: Windows without complete evidence: {', '.join(failed_windows)}.", file=sys.stderr)
+    if failed_workloads:
+        print(f"ERROR: Workloads that did not pass: {', '.join(failed_workloads)}.", file=sys.stderr)
+    return 1 if failed_windows or failed_workloads else 0
+
+
+def main() -> int:
+    '''Load the plan and run it, or print what it would run'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('instance_id')
+    parser.add_argument('bundle_id')
+    parser.add_argument('--wordlist', default=None, help='wordlist image ID for each assessment')
+    parser.add_argument('--plan', default=DEFAULT_PLAN_PATH, help='windows and workloads to run')
+    parser.add_argument('--evidence-dir', default=DEFAULT_EVIDENCE_DIR, help='where workload logs and evidence.json go')
+    parser.add_argument('--reports-dir', default='.', help='where reports go, as matrix_report_<assessment_id>.<format>')
+    parser.add_argument('--format', dest='formats', action='append', choices=REPORT_FORMATS, help='report format, repeatable (default: all)')
+    parser.add_argument('--frida-device', default=os.environ.get('CORELLIUM_FRIDA_DEVICE_ID'),
+                        help='Frida device ID (default: <services_ip>:5001 for Android or the UDID for iOS)')
+    parser.add_argument('--status-timeout', type=float, default=None, help='seconds to wait for each assessment status')
+    parser.add_argument('--cache-dir', default=os.environ.get('MATRIX_REPORT_CACHE_DIR', DEFAULT_CACHE_DIR))
+    parser.add_argument('--compile-only', action='store_true', help='print the lanes and commands without running them')
+    args = parser.parse_args()
+
+    try:
+        windows = load_plan(args.plan)
+    except PlanError as e:
+        print(f'ERROR: {e}', file=sys.stderr)
+        return 1
+    if args.compile_only:
+        device = Device(args.instance_id, args.bundle_id, 'android', '<services_ip>', args.frida_device or '<frida_device>')
+        print_compiled(windows, device, args.evidence_dir)
+        return 0
+    try:
+        return asyncio.run(run(args, windows))
+    except (CorelliumApiError, LookupError, RuntimeError) as e:
+        print(f'ERROR: {e}', file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
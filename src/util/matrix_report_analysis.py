@@ -0,0 +1,283 @@
+"""
+Analyze Corellium MATRIX JSON reports in one pass and keep a SQLite history of check outcomes.
+
+Each report is parsed once. A single walk over its results builds an index by check ID and by outcome,
+evaluates the expected outcomes from data/config/matrix_expectations.json, and collects errored checks.
+Reports can also be ingested into a SQLite history keyed by the report's SHA-256, so ingesting the same
+file twice is a no-op. Comparing outcomes across many scheduled runs, firmware versions, and runners is
+then one query instead of re-parsing every report.
+
+Usage:
+    python3 src/util/matrix_report_analysis.py analyze matrix_report_<id>.json
+    python3 src/util/matrix_report_analysis.py analyze matrix_report_*.json --history matrix_history.sqlite --meta runner=ubuntu-latest
+    python3 src/util/matrix_report_analysis.py changes --history matrix_history.sqlite --runner ubuntu-latest
+    python3 src/util/matrix_report_analysis.py flaky --history matrix_history.sqlite --last 50
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+DEFAULT_EXPECTATIONS_PATH = 'data/config/matrix_expectations.json'
+OUTCOME_ERROR = 'error'
+REPORT_FILENAME = re.compile(r'matrix_report_(?P<assessment_id>[^.]+)\.json')
+# Report metadata read from the environment on GitHub Actions runners when not given with --meta
+ENVIRONMENT_METADATA = {'run_id': 'GITHUB_RUN_ID', 'runner': 'RUNNER_OS', 'commit': 'GITHUB_SHA'}
+HISTORY_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS reports (
+    report_id INTEGER PRIMARY KEY,
+    sha256 TEXT NOT NULL UNIQUE,
+    path TEXT NOT NULL,
+    assessment_id TEXT,
+    run_id TEXT,
+    runner TEXT,
+    firmware TEXT,
+    commit_sha TEXT,
+    recorded_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    report_id INTEGER NOT NULL REFERENCES reports(report_id) ON DELETE CASCADE,
+    check_id TEXT NOT NULL,
+    name TEXT,
+    outcome TEXT NOT NULL,
+    PRIMARY KEY (report_id, check_id)
+);
+CREATE INDEX IF NOT EXISTS results_by_check ON results(check_id, outcome);
+CREATE INDEX IF NOT EXISTS reports_by_time ON reports(recorded_at);
+'''
+# Checks whose outcome in the latest matching report differs from the report before it
+CHANGES_QUERY = '''
+WITH ranked AS (
+    SELECT results.check_id, results.name, results.outcome, reports.assessment_id, reports.recorded_at,
+           ROW_NUMBER() OVER (PARTITION BY results.check_id ORDER BY reports.recorded_at DESC, reports.report_id DESC) AS position
+    FROM results JOIN reports USING (report_id)
+    WHERE (:runner IS NULL OR reports.runner = :runner) AND (:firmware IS NULL OR reports.firmware = :firmware)
+)
+SELECT latest.check_id, latest.name, previous.outcome, latest.outcome, previous.assessment_id, latest.assessment_id
+FROM ranked AS latest JOIN ranked AS previous ON previous.check_id = latest.check_id AND previous.position = 2
+WHERE latest.position = 1 AND latest.outcome != previous.outcome
+ORDER BY latest.check_id
+'''
+# Checks that reported more than one outcome across the most recent matching reports
+FLAKY_QUERY = '''
+WITH recent AS (
+    SELECT report_id FROM reports
+    WHERE (:runner IS NULL OR runner = :runner) AND (:firmware IS NULL OR firmware = :firmware)
+    ORDER BY recorded_at DESC, report_id DESC LIMIT :last
+)
+SELECT check_id, MAX(name), GROUP_CONCAT(outcome || '=' || runs, ', ')
+FROM (SELECT check_id, name, outcome, COUNT(*) AS runs FROM results WHERE report_id IN (SELECT report_id FROM recent)
+      GROUP BY check_id, outcome)
+GROUP BY check_id HAVING COUNT(*) > 1
+ORDER BY check_id
+'''
+
+
+class ReportError(Exception):
+    '''Raised when a MATRIX report cannot be read or has no results.'''
+
+
+@dataclass
+class CheckResult:
+    'One check from a MATRIX report.'
+    check_id: str
+    name: str
+    outcome: str
+
+
+@dataclass
+class ReportAnalysis:  # pylint: disable=too-many-instance-attributes
+    'Everything learned from one pass over a report.'
+    path: str
+    sha256: str
+    assessment_id: str | None
+    by_id: dict[str, CheckResult] = field(default_factory=dict)
+    by_outcome: dict[str, list[CheckResult]] = field(default_factory=dict)
+    unmet: list[str] = field(default_factory=list)
+
+    def matching(self, outcome: str) -> list[CheckResult]:
+        '''Checks with the outcome, sorted the way the report listing prints them'''
+        return sorted(self.by_outcome.get(outcome, []), key=lambda result: (result.name, result.check_id))
+
+
+    @property
+    def errors(self) -> list[CheckResult]:
+        '''Checks that errored instead of passing or failing'''
+        return self.matching(OUTCOME_ERROR)
+
+
+def load_expectations(path: str) -> dict:
+    '''Read expected outcomes per check ID, each a single outcome or a list of accepted outcomes'''
+    with open(file=path, mode='r', encoding='utf-8') as f:
+        expectations = json.load(f)
+    checks = expectations.get('checks', {})
+    expectations['checks'] = {check_id: [outcome] if isinstance(outcome, str) else list(outcome)
+                              for check_id, outcome in checks.items()}
+    return expectations
+
+
+def analyze_report(path: str, expected: dict[str, list[str]] | None = None) -> ReportAnalysis:
+    '''Parse a report once, index its results, and evaluate expected outcomes in the same pass'''
+    try:
+        with open(file=path, mode='rb') as f:
+            raw = f.read()
+        report = json.loads(raw)
+    except (OSError, ValueError) as e:
+        raise ReportError(f"Failed to parse {path}: {e}") from e
+    if not isinstance(report, dict) or not isinstance(report.get('results'), list):
+        raise ReportError(f"{path} has no results list.")
+    match = REPORT_FILENAME.fullmatch(os.path.basename(path))
+    analysis = ReportAnalysis(path=path, sha256=hashlib.sha256(raw).hexdigest(),
+                              assessment_id=report.get('assessmentId') or (match['assessment_id'] if match else None))
+    expected = expected or {}
+    seen = set()
+    for entry in report['results']:
+        result = CheckResult(check_id=str(entry.get('id')), name=str(entry.get('name', '')), outcome=str(entry.get('outcome')))
+        analysis.by_id[result.check_id] = result
+        analysis.by_outcome.setdefault(result.outcome, []).append(result)
+        if result.check_id in expected:
+            seen.add(result.check_id)
+            if result.outcome not in expected[result.check_id]:
+                analysis.unmet.append(f"MATRIX check {result.check_id} is {result.outcome}, "
+                                      f"expected {' or '.join(expected[result.check_id])}.")
+    for check_id in expected.keys() - seen:
+        analysis.unmet.append(f"MATRIX check {check_id} is missing from the report.")
+    return analysis
+
+
+class ReportHistory:
+    '''SQLite store of report check outcomes, one row per check per report.'''
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(HISTORY_SCHEMA)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+
+    def close(self):
+        '''Close the database'''
+        self.connection.close()
+
+
+    def ingest(self, analysis: ReportAnalysis, metadata: dict) -> bool:
+        '''Store a report's outcomes, returning False if the same report was already ingested'''
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT OR IGNORE INTO reports (sha256, path, assessment_id, run_id, runner, firmware, commit_sha, recorded_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (analysis.sha256, analysis.path, analysis.assessment_id, metadata.get('run_id'), metadata.get('runner'),
+                 metadata.get('firmware'), metadata.get('commit'),
+                 metadata.get('recorded_at') or datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")))
+            if cursor.rowcount == 0:
+                return False
+            self.connection.executemany(
+                'INSERT INTO results (report_id, check_id, name, outcome) VALUES (?, ?, ?, ?)',
+                [(cursor.lastrowid, result.check_id, result.name, result.outcome) for result in analysis.by_id.values()])
+        return True
+
+
+    def changes(self, runner: str | None = None, firmware: str | None = None) -> list[tuple]:
+        '''Checks whose latest outcome differs from the previous report'''
+        return self.connection.execute(CHANGES_QUERY, {'runner': runner, 'firmware': firmware}).fetchall()
+
+
+    def flaky(self, last: int = 50, runner: str | None = None, firmware: str | None = None) -> list[tuple]:
+        '''Checks with more than one outcome across the last reports, with a count per outcome'''
+        return self.connection.execute(FLAKY_QUERY, {'last': last, 'runner': runner, 'firmware': firmware}).fetchall()
+
+
+def parse_metadata(pairs: list[str]) -> dict:
+    '''Combine key=value pairs with metadata from the GitHub Actions environment'''
+    metadata = {key: os.environ[variable] for key, variable in ENVIRONMENT_METADATA.items() if os.environ.get(variable)}
+    for pair in pairs:
+        key, separator, value = pair.partition('=')
+        if not separator:
+            raise argparse.ArgumentTypeError(f"expected key=value, got '{pair}'")
+        metadata[key] = value
+    return metadata
+
+
+def run_analyze(args: argparse.Namespace) -> int:
+    '''Analyze each report, print the listing and any problems, and optionally record it in the history'''
+    expectations = load_expectations(args.expectations)
+    list_outcome = args.list_outcome or expectations.get('list_outcome', 'fail')
+    metadata = parse_metadata(args.meta)
+    history = ReportHistory(args.history) if args.history else None
+    status = 0
+    try:
+        for path in args.reports:
+            try:
+                analysis = analyze_report(path, expectations['checks'])
+            except ReportError as e:
+                print(f"ERROR: {e}", file=sys.stderr)
+                status = 1
+                continue
+            print(f"Checks in {path} with outcome {list_outcome}:")
+            for result in analysis.matching(list_outcome):
+                print(f"{result.name} [{result.check_id}]")
+            if analysis.errors:
+                print(f"ERROR: {path} contains {len(analysis.errors)} errored checks: "
+                      f"{', '.join(result.check_id for result in analysis.errors)}", file=sys.stderr)
+                if expectations.get('allow_errors', True):
+                    print('WARNING: Ignoring intermittent check errors.', file=sys.stderr)
+                else:
+                    status = 1
+            for problem in analysis.unmet:
+                print(f"ERROR: {problem}", file=sys.stderr)
+                status = 1
+            if history is not None and not history.ingest(analysis, metadata):
+                print(f"{path} is already in {args.history}.")
+    finally:
+        if history is not None:
+            history.close()
+    return status
+
+
+def main() -> int:
+    '''Run one analysis or history subcommand'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    analyze = subparsers.add_parser('analyze', help='check reports against the expectations')
+    analyze.add_argument('reports', nargs='+')
+    analyze.add_argument('--expectations', default=DEFAULT_EXPECTATIONS_PATH)
+    analyze.add_argument('--list-outcome', default=None, help='outcome of the checks to list (default: from the expectations)')
+    analyze.add_argument('--history', default=None, help='SQLite history to ingest the reports into')
+    analyze.add_argument('--meta', action='append', default=[], metavar='KEY=VALUE', help='run_id, runner, firmware, commit, or recorded_at')
+    for name, help_text in (('changes', 'list checks whose outcome changed in the latest report'),
+                            ('flaky', 'list checks with more than one outcome in recent reports')):
+        query = subparsers.add_parser(name, help=help_text)
+        query.add_argument('--history', required=True)
+        query.add_argument('--runner', default=None)
+        query.add_argument('--firmware', default=None)
+        if name == 'flaky':
+            query.add_argument('--last', type=int, default=50, help='number of recent reports to compare')
+    args = parser.parse_args()
+
+    if args.command == 'analyze':
+        return run_analyze(args)
+    with ReportHistory(args.history) as history:
+        if args.command == 'changes':
+            for check_id, name, previous, latest, previous_assessment, latest_assessment in history.changes(args.runner, args.firmware):
+                print(f"{name} [{check_id}]: {previous} ({previous_assessment}) -> {latest} ({latest_assessment})")
+        else:
+            for check_id, name, outcomes in history.flaky(args.last, args.runner, args.firmware):
+                print(f"{name} [{check_id}]: {outcomes}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""
+Run shell commands on devices over one persistent adb or ssh shell per device.
+
+Each device gets a single long-lived root shell, `adb shell -T su root sh` or a multiplexed ssh connection running sh,
+instead of a new adb or ssh process per command. Commands are written to the shell with a marker line after them on
+stdout and stderr, so output is framed per command and carries its exit status. A batch of commands goes out in one
+write and its frames come back in order, and the same batch can fan out to many devices at once.
+
+Usage:
+    python3 remote_executor.py adb <services_ip>[,<services_ip>...] '<command>' ['<command>'...]
+    python3 remote_executor.py ssh <services_ip> '<command>' ['<command>'...] [--timeout 60] [--keep-going]
+    python3 remote_executor.py local . 'uname -a' 'id'
+"""
+
+import argparse
+import os
+import queue
+import re
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+ADB_PORT = 5001
+DEFAULT_TIMEOUT = 60.0
+SSH_CONTROL_PERSIST_SECONDS = 60
+TRANSPORTS = ('adb', 'ssh', 'local')
+# Exit status reported for commands skipped after an earlier failure in a stop_on_error batch
+SKIPPED_EXIT_CODE = -1
+
+
+class RemoteCommandError(Exception):
+    '''A remote command failed, timed out, or its shell went away'''
+
+
+@dataclass
+class CommandResult:
+    'Framed output of one command.'
+    command: str
+    exit_code: int
+    stdout: bytes
+    stderr: bytes
+    duration: float
+
+    @property
+    def ok(self) -> bool:
+        '''Whether the command exited with status 0'''
+        return self.exit_code == 0
+
+
+def shell_argv(transport: str, target: str) -> list[str]:
+    '''Local command line that opens a persistent root shell on the device'''
+    if transport == 'adb':
+        # -T skips the terminal so output stays byte for byte and stderr stays separate
+        return ['adb', '-s', f'{target}:{ADB_PORT}', 'shell', '-T', 'su root sh']
+    if transport == 'ssh':
+        control_path = os.path.join(tempfile.gettempdir(), 'ssh-mux-%C')
+        return ['ssh', '-T', '-o', 'ControlMaster=auto', '-o', f'ControlPath={control_path}',
+                '-o', f'ControlPersist={SSH_CONTROL_PERSIST_SECONDS}', f'root@{target}', 'sh']
+    return ['sh']
+
+
+def adb_connected_targets() -> set[str]:
+    '''Services IPs with an adb connection, from a single adb devices call'''
+    output = subprocess.run(['adb', 'devices'], capture_output=True, text=True, check=True).stdout
+    return {line.split(':')[0] for line in output.splitlines()[1:] if line.endswith('\tdevice')}
+
+
+class FrameReader(threading.Thread):
+    '''Split a shell pipe into per-command frames at marker lines'''
+
+    def __init__(self, pipe, marker: bytes):
+        super().__init__(daemon=True)
+        self.pipe = pipe
+        self.frames = queue.Queue()
+        self._pattern = re.compile(b'\n' + re.escape(marker) + b'(?: (-?\\d+))?\n')
+
+
+    def run(self):
+        buffer = b''
+        while chunk := os.read(self.pipe.fileno(), 65536):
+            buffer += chunk
+            while match := self._pattern.search(buffer):
+                exit_code = int(match.group(1)) if match.group(1) is not None else None
+                self.frames.put((buffer[:match.start()], exit_code))
+                buffer = buffer[match.end():]
+        # A None frame tells waiters the shell has exited
+        self.frames.put(None)
+
+
+class PersistentShell:  # pylint: disable=too-many-instance-attributes
+    '''One long-lived shell on a device that runs commands and batches of commands'''
+
+    def __init__(self, transport: str, target: str):
+        self.transport = transport
+        self.target = target
+        self.lock = threading.Lock()
+        self.commands_run = 0
+        self.round_trips = 0
+        self._process = None
+        self._marker = b''
+        self._readers: tuple[FrameReader, FrameReader] | None = None
+
+
+    @property
+    def alive(self) -> bool:
+        '''Whether the shell process is still running'''
+        return self._process is not None and self._process.poll() is None
+
+
+    def start(self):
+        '''Open the shell, or reopen it after it exited'''
+        self.close()
+        self._marker = f'__remote_executor_{secrets.token_hex(8)}__'.encode('ascii')
+        self._process = subprocess.Popen(shell_argv(self.transport, self.target),  # pylint: disable=consider-using-with
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._readers = (FrameReader(self._process.stdout, self._marker),
+                         FrameReader(self._process.stderr, self._marker))
+        for reader in self._readers:
+            reader.start()
+
+
+    def close(self, kill: bool = False):
+        '''End the shell, killing it outright when it is stuck in a command'''
+        if self._process is None:
+            return
+        try:
+            if kill:
+                raise OSError('shell is stuck')
+            self._process.stdin.write(b'exit\n')
+            self._process.stdin.close()
+            self._process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self._process.kill()
+            self._process.wait()
+        self._process = None
+
+
+    def frame(self, command: str, stop_on_error: bool) -> bytes:
+        '''Shell text that runs a command and follows its output with marker lines'''
+        marker = self._marker.decode('ascii')
+        # The subshell keeps an exit in the command from ending the persistent shell, and
+        # /dev/null keeps the command from reading the following commands as its input
+        run = f'( {command}\n) </dev/null; __status=$?'
+        if stop_on_error:
+            run = (f'if [ -n "$__batch_failed" ]; then __status={SKIPPED_EXIT_CODE}; else {run}; fi; '
+                   '[ "$__status" -eq 0 ] || __batch_failed=1')
+        return (f"{run}; printf '\\n%s %d\\n' '{marker}' \"$__status\"; printf '\\n%s\\n' '{marker}' >&2\n").encode()
+
+
+    def run_batch(self, commands: list[str], timeout: float = DEFAULT_TIMEOUT,
+                  stop_on_error: bool = False) -> list[CommandResult]:
+        '''Send every command in one write and collect each command's framed output'''
+        with self.lock:
+            if not self.alive:
+                self.start()
+            started = time.monotonic()
+            deadline = started + timeout
+            try:
+                self._process.stdin.write(b'__batch_failed=\n' + b''.join(self.frame(command, stop_on_error)
+                                                                            for command in commands))
+                self._process.stdin.flush()
+            except OSError as e:
+                self.close()
+                raise RemoteCommandError(f'Shell on {self.target} is gone: {e}') from e
+            self.round_trips += 1
+            results = []
+            for command in commands:
+                stdout, exit_code = self._next_frame(0, deadline, command)
+                stderr, _ = self._next_frame(1, deadline, command)
+                now = time.monotonic()
+                results.append(CommandResult(command, exit_code, stdout, stderr, now - started))
+                started = now
+            self.commands_run += len(commands)
+            return results
+
+
+    def run(self, command: str, timeout: float = DEFAULT_TIMEOUT) -> CommandResult:
+        '''Run one command'''
+        return self.run_batch([command], timeout)[0]
+
+
+    def _next_frame(self, stream: int, deadline: float, command: str) -> tuple[bytes, int | None]:
+        '''Wait for the next frame on stdout or stderr, restarting the shell if it never comes'''
+        try:
+            frame = self._readers[stream].frames.get(timeout=max(deadline - time.monotonic(), 0))
+        except queue.Empty:
+            # The shell is stuck inside the command, so the only way out is a new shell
+            self.close(kill=True)
+            raise RemoteCommandError(f'Timed out running {command} on {self.target}.') from None
+        if frame is None:
+            self.close()
+            raise RemoteCommandError(f'Shell on {self.target} exited while running {command}.')
+        return frame
+
+
+class RemoteExecutorPool:
+    '''Persistent shells keyed by device, shared by every caller in the process'''
+
+    def __init__(self, transport: str):
+        self.transport = transport
+        self.shells: dict[str, PersistentShell] = {}
+        self._lock = threading.Lock()
+
+
+    def shell(self, target: str) -> PersistentShell:
+        '''The shell for a device, created on first use'''
+        with self._lock:
+            if target not in self.shells:
+                self.shells[target] = PersistentShell(self.transport, target)
+            return self.shells[target]
+
+
+    def run_batch(self, target: str, commands: list[str], timeout: float = DEFAULT_TIMEOUT,
+                  stop_on_error: bool = False) -> list[CommandResult]:
+        '''Run a batch on one device'''
+        return self.shell(target).run_batch(commands, timeout, stop_on_error)
+
+
+    def fan_out(self, targets: list[str], commands: list[str], timeout: float = DEFAULT_TIMEOUT,
+                stop_on_error: bool = False, max_workers: int = 8) -> dict[str, list[CommandResult] | RemoteCommandError]:
+        '''Run the same batch on every device at once, keeping each device's results or error'''
+        def run_one(target: str) -> list[CommandResult] | RemoteCommandError:
+            try:
+                return self.run_batch(target, commands, timeout, stop_on_error)
+            except RemoteCommandError as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(targets)) or 1) as executor:
+            return dict(zip(targets, executor.map(run_one, targets)))
+
+
+    def close(self):
+        '''End every shell'''
+        with self._lock:
+            for shell in self.shells.values():
+                shell.close()
+            self.shells.clear()
+
+
+def main() -> int:
+    '''Run the commands on every target and return non-zero if any failed'''
+    parser = argparse.ArgumentParser(description='Run commands over one persistent shell per device.')
+    parser.add_argument('transport', choices=TRANSPORTS, help='Channel that runs the device shell')
+    parser.add_argument('targets', help='Comma-separated services IPs, or any value for local')
+    parser.add_argument('commands', nargs='+', help='Commands to run in order')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='Seconds allowed for the whole batch')
+    parser.add_argument('--keep-going', action='store_true', help='Run every command even after one fails')
+    args = parser.parse_args()
+
+    targets = [target for target in args.targets.split(',') if target]
+    if args.transport == 'adb':
+        missing = set(targets) - adb_connected_targets()
+        if missing:
+            print(f'ERROR: Cannot find adb connection to {", ".join(sorted(missing))}.', file=sys.stderr)
+            return 1
+    pool = RemoteExecutorPool(args.transport)
+    status = 0
+    try:
+        for target, results in pool.fan_out(targets, args.commands, args.timeout, not args.keep_going).items():
+            if isinstance(results, RemoteCommandError):
+                print(f'ERROR: {results}', file=sys.stderr)
+                status = 1
+                continue
+            for result in results:
+                if result.exit_code == SKIPPED_EXIT_CODE:
+                    continue
+                if len(targets) > 1:
+                    print(f'[{target}] $ {result.command}')
+                sys.stdout.buffer.write(result.stdout)
+                sys.stdout.flush()
+                sys.stderr.buffer.write(result.stderr)
+                if not result.ok:
+                    print(f'ERROR: {result.command} exited with status {result.exit_code} on {target}.', file=sys.stderr)
+                    status = result.exit_code
+    finally:
+        pool.close()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
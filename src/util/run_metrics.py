@@ -0,0 +1,329 @@
+"""
+Phase timings for CI runs: record them from the shell or Python, keep them in SQLite, and export them for Prometheus.
+
+Shell functions and Python modules append one tab-separated line per phase start and end to the events file named by
+RUN_METRICS_EVENTS (nothing is recorded when it is unset), which keeps recording to a single cheap append. After the
+run, `ingest` pairs the events into phase durations in an append-only SQLite history, tagged with labels such as the
+firmware and appliance. `report` prints per-phase percentiles and flags phases whose recent median regressed against
+the runs before them, and `export` writes a Prometheus textfile or OpenMetrics summary per phase.
+
+Usage:
+    python3 run_metrics.py start <phase>
+    python3 run_metrics.py end <phase> [--status error]
+    python3 run_metrics.py ingest <events.tsv> --db <history.db> [--label firmware=14.0.0 ...]
+    python3 run_metrics.py report --db <history.db> [--label firmware=14.0.0] [--window 10] [--fail-on-regression]
+    python3 run_metrics.py export --db <history.db> --output <metrics.prom> [--format openmetrics]
+
+In Python:
+    with run_metrics.phase('appium_session'):
+        ...
+"""
+
+import argparse
+import json
+import math
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+EVENTS_ENV_VAR = 'RUN_METRICS_EVENTS'
+RUN_ID_ENV_VAR = 'RUN_METRICS_RUN_ID'
+EVENT_START = 'start'
+EVENT_END = 'end'
+STATUS_OK = 'ok'
+STATUS_ERROR = 'error'
+STATUS_INCOMPLETE = 'incomplete'
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+METRIC_NAME = 'corellium_run_phase_duration_seconds'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    ingested_at REAL NOT NULL,
+    labels TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS phases (
+    run_id TEXT NOT NULL REFERENCES runs(run_id),
+    phase TEXT NOT NULL,
+    attempt INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    duration REAL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (run_id, phase, attempt)
+);
+CREATE INDEX IF NOT EXISTS phases_by_phase ON phases (phase, started_at);
+'''
+
+
+# ==== RECORDING ====
+
+
+def default_run_id() -> str:
+    '''Run ID from the environment, falling back to the GitHub run and attempt'''
+    return os.environ.get(RUN_ID_ENV_VAR) or '-'.join(
+        filter(None, [os.environ.get('GITHUB_RUN_ID'), os.environ.get('GITHUB_RUN_ATTEMPT'), os.environ.get('GITHUB_JOB')])
+    ) or 'local'
+
+
+def record_event(phase_name: str, event: str, status: str = '', path: str | None = None):
+    '''Append one phase event to the events file, doing nothing when no file is configured'''
+    path = path or os.environ.get(EVENTS_ENV_VAR)
+    if not path:
+        return
+    line = f'{time.time():.6f}\t{default_run_id()}\t{phase_name}\t{event}\t{status}\n'
+    # One small O_APPEND write per event, so shell and Python writers can share the file
+    descriptor = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descriptor, line.encode('utf-8'))
+    finally:
+        os.close(descriptor)
+
+
+@contextmanager
+def phase(phase_name: str, path: str | None = None):
+    '''Record the start and end of a phase around a block, marking it as an error if the block raises'''
+    record_event(phase_name, EVENT_START, path=path)
+    status = STATUS_ERROR
+    try:
+        yield
+        status = STATUS_OK
+    finally:
+        record_event(phase_name, EVENT_END, status, path=path)
+
+
+# ==== HISTORY ====
+
+
+@dataclass
+class PhaseTiming:
+    'One completed or abandoned phase of a run.'
+    run_id: str
+    phase: str
+    attempt: int
+    started_at: float
+    duration: float | None
+    status: str
+
+
+def read_events(path: str) -> list[tuple[float, str, str, str, str]]:
+    '''Read the events file, skipping lines a crashed writer left incomplete'''
+    events = []
+    with open(file=path, mode='r', encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 5:
+                continue
+            try:
+                events.append((float(fields[0]), *fields[1:]))
+            except ValueError:
+                continue
+    return sorted(events)
+
+
+def pair_events(events: list[tuple[float, str, str, str, str]]) -> list[PhaseTiming]:
+    '''Match each start with the next end of the same run and phase; a start with no end is incomplete'''
+    open_phases: dict[tuple[str, str], list[float]] = {}
+    attempts: dict[tuple[str, str], int] = {}
+    timings = []
+    for timestamp, run_id, phase_name, event, status in events:
+        key = (run_id, phase_name)
+        if event == EVENT_START:
+            open_phases.setdefault(key, []).append(timestamp)
+        elif event == EVENT_END and open_phases.get(key):
+            started_at = open_phases[key].pop()
+            attempts[key] = attempts.get(key, 0) + 1
+            timings.append(PhaseTiming(run_id, phase_name, attempts[key], started_at, timestamp - started_at, status or STATUS_OK))
+    for key, starts in open_phases.items():
+        for started_at in starts:
+            attempts[key] = attempts.get(key, 0) + 1
+            timings.append(PhaseTiming(*key, attempts[key], started_at, None, STATUS_INCOMPLETE))
+    return timings
+
+
+def percentile(values: list[float], quantile: float) -> float:
+    '''Linearly interpolated percentile of sorted values'''
+    position = (len(values) - 1) * quantile
+    lower = math.floor(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class MetricsHistory:
+    '''SQLite history of phase timings across runs.'''
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+
+    def close(self):
+        '''Close the database'''
+        self.connection.close()
+
+
+    def ingest(self, timings: list[PhaseTiming], labels: dict[str, str]) -> int:
+        '''Store a run's timings once, ignoring phases that are already recorded, and return how many were new'''
+        with self.connection:
+            for run_id in sorted({timing.run_id for timing in timings}):
+                self.connection.execute('INSERT OR IGNORE INTO runs VALUES (?, ?, ?)',
+                                        (run_id, time.time(), json.dumps(labels, sort_keys=True)))
+            before = self.connection.total_changes
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO phases VALUES (?, ?, ?, ?, ?, ?)',
+                [(t.run_id, t.phase, t.attempt, t.started_at, t.duration, t.status) for t in timings])
+            return self.connection.total_changes - before
+
+
+    def durations(self, labels: dict[str, str] | None = None) -> dict[str, list[tuple[float, float]]]:
+        '''Successful phase durations with their start times, oldest first, for runs matching every label'''
+        rows = self.connection.execute(
+            'SELECT phases.phase, phases.started_at, phases.duration, runs.labels FROM phases '
+            'JOIN runs USING (run_id) WHERE phases.status = ? ORDER BY phases.started_at', (STATUS_OK,))
+        durations: dict[str, list[tuple[float, float]]] = {}
+        for phase_name, started_at, duration, run_labels in rows:
+            run_labels = json.loads(run_labels)
+            if labels and any(run_labels.get(key) != value for key, value in labels.items()):
+                continue
+            durations.setdefault(phase_name, []).append((started_at, duration))
+        return durations
+
+
+    def summary(self, labels: dict[str, str] | None = None, window: int = 10, threshold: float = 0.2) -> list[dict]:
+        '''Percentiles per phase, plus the change of the last window's median against the window before it'''
+        rows = []
+        for phase_name, samples in sorted(self.durations(labels).items()):
+            values = sorted(duration for _, duration in samples)
+            ordered = [duration for _, duration in samples]
+            recent, previous = ordered[-window:], ordered[-2 * window:-window]
+            change = None
+            if previous:
+                change = statistics.median(recent) / statistics.median(previous) - 1 if statistics.median(previous) else None
+            rows.append({
+                'phase': phase_name,
+                'count': len(values),
+                'sum': sum(values),
+                'quantiles': {quantile: percentile(values, quantile) for quantile in QUANTILES},
+                'max': values[-1],
+                'last': ordered[-1],
+                'change': change,
+                'regressed': change is not None and change > threshold,
+            })
+        return rows
+
+
+# ==== EXPORT ====
+
+
+def escape_label(value: str) -> str:
+    '''Escape a label value for the Prometheus text formats'''
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render_metrics(rows: list[dict], labels: dict[str, str], openmetrics: bool = False) -> str:
+    '''Render per-phase summaries in the Prometheus textfile or OpenMetrics format'''
+    base_labels = ''.join(f',{key}="{escape_label(value)}"' for key, value in sorted(labels.items()))
+    lines = [f'# HELP {METRIC_NAME} Duration of each CI run phase across recorded runs.',
+             f'# TYPE {METRIC_NAME} summary']
+    if openmetrics:
+        lines.append(f'# UNIT {METRIC_NAME} seconds')
+    for row in rows:
+        phase_labels = f'phase="{escape_label(row["phase"])}"{base_labels}'
+        for quantile, value in row['quantiles'].items():
+            lines.append(f'{METRIC_NAME}{{{phase_labels},quantile="{quantile}"}} {value:.3f}')
+        lines.append(f'{METRIC_NAME}_sum{{{phase_labels}}} {row["sum"]:.3f}')
+        lines.append(f'{METRIC_NAME}_count{{{phase_labels}}} {row["count"]}')
+    last_name = 'corellium_run_phase_last_duration_seconds'
+    lines += [f'# HELP {last_name} Duration of each phase in the most recent run.', f'# TYPE {last_name} gauge']
+    if openmetrics:
+        lines.append(f'# UNIT {last_name} seconds')
+    lines += [f'{last_name}{{phase="{escape_label(row["phase"])}"{base_labels}}} {row["last"]:.3f}' for row in rows]
+    if openmetrics:
+        lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def write_atomically(path: str, text: str):
+    '''Write through a rename, as the node exporter textfile collector requires'''
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.run_metrics-')
+    with os.fdopen(descriptor, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.chmod(temporary_path, 0o644)
+    os.replace(temporary_path, path)
+
+
+def parse_labels(pairs: list[str]) -> dict[str, str]:
+    '''Turn key=value arguments into a dict'''
+    labels = {}
+    for pair in pairs:
+        key, separator, value = pair.partition('=')
+        if not separator:
+            raise ValueError(f'Label {pair} is not key=value.')
+        labels[key] = value
+    return labels
+
+
+def print_report(rows: list[dict], window: int):
+    '''Print per-phase percentiles and trend'''
+    print(f"{'phase':<20}{'count':>7}{'p50 (s)':>10}{'p90 (s)':>10}{'p95 (s)':>10}{'max (s)':>10}  trend over last {window}")
+    for row in rows:
+        quantiles = row['quantiles']
+        trend = '' if row['change'] is None else f"{row['change']:+.0%}"
+        if row['regressed']:
+            trend += ' REGRESSED'
+        print(f"{row['phase']:<20}{row['count']:>7}{quantiles[0.5]:>10.1f}{quantiles[0.9]:>10.1f}"
+              f"{quantiles[0.95]:>10.1f}{row['max']:>10.1f}  {trend}")
+
+
+def main() -> int:
+    '''Record, ingest, report, or export phase timings'''
+    parser = argparse.ArgumentParser(description='Record and summarize CI run phase timings.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for event in (EVENT_START, EVENT_END):
+        event_parser = subparsers.add_parser(event)
+        event_parser.add_argument('phase')
+        event_parser.add_argument('--status', default=STATUS_OK if event == EVENT_END else '')
+    ingest_parser = subparsers.add_parser('ingest')
+    ingest_parser.add_argument('events_path')
+    for command_parser in (ingest_parser, subparsers.add_parser('report'), subparsers.add_parser('export')):
+        command_parser.add_argument('--db', required=True, help='SQLite history path')
+        command_parser.add_argument('--label', action='append', default=[], help='key=value, repeatable')
+    for command_parser in (subparsers.choices['report'], subparsers.choices['export']):
+        command_parser.add_argument('--window', type=int, default=10, help='runs compared for the trend')
+        command_parser.add_argument('--threshold', type=float, default=0.2, help='median increase flagged as a regression')
+    subparsers.choices['report'].add_argument('--fail-on-regression', action='store_true')
+    subparsers.choices['export'].add_argument('--output', required=True)
+    subparsers.choices['export'].add_argument('--format', choices=['prometheus', 'openmetrics'], default='prometheus')
+    args = parser.parse_args()
+
+    if args.command in (EVENT_START, EVENT_END):
+        record_event(args.phase, args.command, args.status)
+        return 0
+    try:
+        labels = parse_labels(args.label)
+    except ValueError as e:
+        print(f'ERROR: {e}', file=sys.stderr)
+        return 1
+    history = MetricsHistory(args.db)
+    try:
+        if args.command == 'ingest':
+            timings = pair_events(read_events(args.events_path))
+            print(f'Stored {history.ingest(timings, labels)} new phase timings from {args.events_path}.')
+            return 0
+        rows = history.summary(labels, args.window, args.threshold)
+        if args.command == 'report':
+            print_report(rows, args.window)
+            return 1 if args.fail_on_regression and any(row['regressed'] for row in rows) else 0
+        write_atomically(args.output, render_metrics(rows, labels, args.format == 'openmetrics'))
+        print(f'Wrote {len(rows)} phase summaries to {args.output}.')
+        return 0
+    finally:
+        history.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,330 @@
+"""
+Compile the recorded gesture files in data/user_input into batched W3C touch actions and replay them
+through Appium.
+
+The files use the Corellium input format: a list of steps that press the finger at one or more positions,
+release it, or type text, each optionally followed by a wait in milliseconds. Every file is validated and
+compiled into one sequence, and the sequences are merged into a program. Each sequence is sent as a single
+W3C actions request with the waits as pauses, instead of one command per tap. Coordinates are scaled from
+the screen the gestures were recorded on to the target device's window size.
+
+With --idle, release waits of at least --idle-threshold-ms end the request instead. The replayer then
+polls the page source until it stops changing, moving on as soon as the screen has changed and settled.
+If the screen never changes, the recorded wait caps the wait.
+
+Usage:
+    python3 src/util/touch_replay.py android 10.11.1.1
+    python3 src/util/touch_replay.py android 10.11.1.1 --idle data/user_input/signIn.json data/user_input/order.json
+    python3 src/util/touch_replay.py android 10.11.1.1 --compile-only --target-size 720x1600
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.remote.command import Command
+
+import appium_session_broker
+from appium_helper import log_stdout
+
+USER_INPUT_DIR = 'data/user_input'
+# Order the Cafe purchase gestures were recorded to be replayed in
+CAFE_PURCHASE_SEQUENCES = ('signIn', 'order', 'checkout', 'placeOrder', 'dismiss')
+# Screen the data/user_input gestures were recorded on, in pixels
+RECORDED_SCREEN_SIZE = (1080, 2400)
+DEFAULT_IDLE_THRESHOLD_MS = 250
+STEP_KEYS = {'buttons', 'position', 'wait', 'text'}
+TEXT_KEYS = {'\n': Keys.ENTER, '\t': Keys.TAB}
+
+
+class TouchSequenceError(Exception):
+    '''Raised when a gesture file is not valid Corellium input.'''
+
+
+@dataclass
+class Segment:
+    'Ticks sent as one W3C actions request, optionally followed by an idle wait.'
+    ticks: list[tuple[dict, dict]] = field(default_factory=list)
+    idle_wait_ms: int = 0
+
+    def actions(self) -> dict:
+        '''W3C actions payload with one touch pointer and one keyboard kept in step'''
+        return {'actions': [
+            {'type': 'pointer', 'id': 'finger', 'parameters': {'pointerType': 'touch'},
+             'actions': [pointer for pointer, _ in self.ticks]},
+            {'type': 'key', 'id': 'keyboard', 'actions': [key for _, key in self.ticks]},
+        ]}
+
+
+@dataclass
+class Sequence:
+    'One gesture file compiled into requests.'
+    name: str
+    segments: list[Segment]
+    taps: int = 0
+    characters: int = 0
+    recorded_wait_ms: int = 0
+
+
+@dataclass
+class GestureProgram:
+    'Sequences merged in replay order, scaled to one target screen.'
+    sequences: list[Sequence]
+    source_size: tuple[int, int]
+    target_size: tuple[int, int]
+    idle: bool = False
+
+    @property
+    def requests(self) -> int:
+        '''W3C actions requests needed to replay the program'''
+        return sum(len(sequence.segments) for sequence in self.sequences)
+
+
+@dataclass
+class SequenceTiming:
+    'How long one sequence took to replay.'
+    name: str
+    requests: int
+    duration_ms: float
+    idle_wait_ms: float = 0.0
+    recorded_wait_ms: int = 0
+
+
+def default_sequence_paths() -> list[str]:
+    '''Paths of the Cafe purchase gesture files in replay order'''
+    return [os.path.join(USER_INPUT_DIR, f'{name}.json') for name in CAFE_PURCHASE_SEQUENCES]
+
+
+def validate_step(step, where: str, source_size: tuple[int, int]):
+    '''Check one step of a gesture file'''
+    if not isinstance(step, dict) or not step.keys() <= STEP_KEYS:
+        raise TouchSequenceError(f"{where}: expected an object with keys from {sorted(STEP_KEYS)}.")
+    wait = step.get('wait', 0)
+    if not isinstance(wait, int) or wait < 0:
+        raise TouchSequenceError(f"{where}: wait must be a non-negative number of milliseconds.")
+    if 'text' in step:
+        if not isinstance(step['text'], str) or step.keys() - {'text', 'wait'}:
+            raise TouchSequenceError(f"{where}: a text step takes a string and an optional wait.")
+        return
+    if step.get('buttons') not in ([], ['finger']):
+        raise TouchSequenceError(f"{where}: expected text, or buttons of [] or [\"finger\"].")
+    if not step['buttons']:
+        return
+    positions = step.get('position')
+    if not isinstance(positions, list) or not positions:
+        raise TouchSequenceError(f"{where}: a finger press needs at least one position.")
+    for point in positions:
+        if (not isinstance(point, list) or len(point) != 2 or not all(isinstance(value, int) for value in point)
+                or not (0 <= point[0] < source_size[0] and 0 <= point[1] < source_size[1])):
+            raise TouchSequenceError(f"{where}: position {point} is not on the {source_size[0]}x{source_size[1]} screen.")
+
+
+def load_sequence(path: str, source_size: tuple[int, int] = RECORDED_SCREEN_SIZE) -> list[dict]:
+    '''Read a gesture file and check every step before anything is sent to a device'''
+    with open(file=path, mode='r', encoding='utf-8') as f:
+        try:
+            steps = json.load(f)
+        except json.JSONDecodeError as e:
+            raise TouchSequenceError(f"{path}: not valid JSON: {e}") from e
+    if not isinstance(steps, list):
+        raise TouchSequenceError(f"{path}: expected a list of steps.")
+    pressed = False
+    for index, step in enumerate(steps):
+        validate_step(step, f"{path} step {index}", source_size)
+        if 'buttons' in step:
+            pressed = bool(step['buttons'])
+    if pressed:
+        raise TouchSequenceError(f"{path}: ends with the finger still pressed.")
+    return steps
+
+
+def scale_point(point: list[int], source_size: tuple[int, int], target_size: tuple[int, int]) -> tuple[int, int]:
+    '''Map a recorded position onto the target screen'''
+    return (round(point[0] * target_size[0] / source_size[0]),
+            round(point[1] * target_size[1] / source_size[1]))
+
+
+def compile_sequence(name: str, steps: list[dict], source_size: tuple[int, int], target_size: tuple[int, int],
+                     idle_threshold_ms: int | None = None) -> Sequence:
+    '''Turn validated steps into pointer and key ticks, split at idle waits when idle_threshold_ms is set'''
+    sequence = Sequence(name=name, segments=[Segment()])
+    pointer_pause = {'type': 'pause', 'duration': 0}
+    key_pause = {'type': 'pause', 'duration': 0}
+    pressed = False
+    for step in steps:
+        ticks = sequence.segments[-1].ticks
+        if 'text' in step:
+            for character in step['text']:
+                character = TEXT_KEYS.get(character, character)
+                ticks.append((pointer_pause, {'type': 'keyDown', 'value': character}))
+                ticks.append((pointer_pause, {'type': 'keyUp', 'value': character}))
+            sequence.characters += len(step['text'])
+        elif step['buttons']:
+            for position_index, point in enumerate(step['position']):
+                x, y = scale_point(point, source_size, target_size)
+                ticks.append(({'type': 'pointerMove', 'duration': 0, 'origin': 'viewport', 'x': x, 'y': y}, key_pause))
+                if position_index == 0 and not pressed:
+                    ticks.append(({'type': 'pointerDown', 'button': 0}, key_pause))
+                    sequence.taps += 1
+            pressed = True
+        elif pressed:
+            ticks.append(({'type': 'pointerUp', 'button': 0}, key_pause))
+            pressed = False
+        wait = step.get('wait', 0)
+        sequence.recorded_wait_ms += wait
+        if idle_threshold_ms is not None and not pressed and wait >= idle_threshold_ms:
+            sequence.segments[-1].idle_wait_ms = wait
+            sequence.segments.append(Segment())
+        elif wait:
+            ticks.append(({'type': 'pause', 'duration': wait}, key_pause))
+    sequence.segments = [segment for segment in sequence.segments if segment.ticks]
+    return sequence
+
+
+def compile_program(paths: list[str], target_size: tuple[int, int], source_size: tuple[int, int] = RECORDED_SCREEN_SIZE,
+                    idle_threshold_ms: int | None = None) -> GestureProgram:
+    '''Validate and compile gesture files into one program in the given order'''
+    sequences = []
+    for path in paths:
+        steps = load_sequence(path, source_size)
+        name = os.path.splitext(os.path.basename(path))[0]
+        sequences.append(compile_sequence(name, steps, source_size, target_size, idle_threshold_ms))
+    return GestureProgram(sequences=sequences, source_size=source_size, target_size=target_size,
+                          idle=idle_threshold_ms is not None)
+
+
+class TouchReplayer:
+    '''Send a compiled program to an Appium session and time every sequence.'''
+
+    def __init__(self, driver, idle_timeout: float = 10.0, poll_interval: float = 0.1):
+        self.driver = driver
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.timings: list[SequenceTiming] = []
+        self._source_hash: str | None = None
+
+
+    def run(self, program: GestureProgram) -> list[SequenceTiming]:
+        '''Replay every sequence in order'''
+        if program.idle:
+            self._source_hash = self.source_hash()
+        for sequence in program.sequences:
+            start = time.perf_counter_ns()
+            idle_wait_ms = 0.0
+            for segment in sequence.segments:
+                self.driver.execute(Command.W3C_ACTIONS, segment.actions())
+                if segment.idle_wait_ms:
+                    idle_wait_ms += self.wait_for_idle(max_quiet_ms=segment.idle_wait_ms)
+            self.timings.append(SequenceTiming(name=sequence.name, requests=len(sequence.segments),
+                                               duration_ms=round((time.perf_counter_ns() - start) / 1_000_000, 3),
+                                               idle_wait_ms=round(idle_wait_ms, 3), recorded_wait_ms=sequence.recorded_wait_ms))
+        return self.timings
+
+
+    def source_hash(self) -> str:
+        '''Fingerprint of the current page source'''
+        return hashlib.sha256(self.driver.page_source.encode('utf-8')).hexdigest()
+
+
+    def wait_for_idle(self, max_quiet_ms: int) -> float:
+        '''Poll the page source until it has changed and then held still, and return the milliseconds waited
+
+        A screen that does not change at all is treated as idle once max_quiet_ms has passed, so taps that
+        only move focus never wait longer than the recorded pause.
+        '''
+        start = time.monotonic()
+        previous = None
+        while True:
+            current = self.source_hash()
+            elapsed = time.monotonic() - start
+            if current == previous and (current != self._source_hash or elapsed * 1000 >= max_quiet_ms):
+                break
+            if elapsed >= self.idle_timeout:
+                log_stdout(f"Screen still changing after {self.idle_timeout} seconds; continuing.")
+                break
+            previous = current
+            time.sleep(self.poll_interval)
+        self._source_hash = current
+        return (time.monotonic() - start) * 1000
+
+
+def parse_size(value: str) -> tuple[int, int]:
+    '''Parse WIDTHxHEIGHT'''
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got '{value}'") from e
+    return width, height
+
+
+def print_timings(timings: list[SequenceTiming]):
+    '''Print per-sequence durations followed by the total'''
+    for timing in timings:
+        print(f"{timing.name:<16} {timing.requests:>3} requests {timing.duration_ms:>10.1f} ms "
+              f"(idle waits {timing.idle_wait_ms:.1f} ms, recorded waits {timing.recorded_wait_ms} ms)")
+    print(f"{'total':<16} {sum(timing.requests for timing in timings):>3} requests "
+          f"{sum(timing.duration_ms for timing in timings):>10.1f} ms")
+
+
+def main() -> int:
+    '''Compile the gesture files and replay them on one device'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('platform', choices=('android', 'ios'))
+    parser.add_argument('target', help='Android services IP or iOS UDID')
+    parser.add_argument('files', nargs='*', help='gesture files in replay order (default: the Cafe purchase)')
+    parser.add_argument('--source-size', type=parse_size, default=RECORDED_SCREEN_SIZE, help='screen the gestures were recorded on')
+    parser.add_argument('--target-size', type=parse_size, default=None, help='target screen (default: ask the device)')
+    parser.add_argument('--idle', action='store_true', help='replace recorded waits with waits for the screen to settle')
+    parser.add_argument('--idle-threshold-ms', type=int, default=DEFAULT_IDLE_THRESHOLD_MS, help='shortest recorded wait to replace')
+    parser.add_argument('--idle-timeout', type=float, default=10.0, help='longest wait for the screen to settle, in seconds')
+    parser.add_argument('--compile-only', action='store_true', help='print the compiled program without opening a session')
+    args = parser.parse_args()
+
+    paths = args.files or default_sequence_paths()
+    idle_threshold_ms = args.idle_threshold_ms if args.idle else None
+    if args.compile_only:
+        try:
+            program = compile_program(paths, args.target_size or args.source_size, args.source_size, idle_threshold_ms)
+        except (OSError, TouchSequenceError) as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+            return 1
+        print(json.dumps(asdict(program), indent=2))
+        return 0
+
+    # Imported here so compiling does not need the per-platform scripts
+    import appium_fanout  # pylint: disable=import-outside-toplevel
+    module, _ = appium_fanout.PLATFORMS[args.platform]
+    config = appium_fanout.load_config(args.platform)
+    udid = appium_fanout.get_udid(args.platform, config, args.target)
+    driver = None
+    try:
+        # Validate the files before spending time on a session
+        compile_program(paths, args.source_size, args.source_size, idle_threshold_ms)
+        log_stdout("Loading target app in Appium session.")
+        driver = appium_session_broker.open_driver(module.get_appium_server_socket(config),
+                                                   options=module.build_options(config=config, udid=udid))
+        window = driver.get_window_size()
+        program = compile_program(paths, args.target_size or (window['width'], window['height']), args.source_size, idle_threshold_ms)
+        log_stdout(f"Replaying {len(program.sequences)} gesture sequences in {program.requests} requests.")
+        timings = TouchReplayer(driver, idle_timeout=args.idle_timeout).run(program)
+    except (OSError, TouchSequenceError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    except WebDriverException as e:
+        print(f"Touch replay failed: {type(e).__name__}: {e.msg if e.msg else e}", file=sys.stderr)
+        return 1
+    finally:
+        if driver is not None:
+            log_stdout("Closing appium session.")
+            driver.quit()
+    print_timings(timings)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())